@@ -105,6 +105,14 @@ cache_group = parser.add_mutually_exclusive_group()
 cache_group.add_argument("--cache-classic", action="store_true", help="Use the old style (aggressive) caching.")
 cache_group.add_argument("--cache-lru", type=int, default=0, help="Use LRU caching with a maximum of N node results cached. May use more RAM/VRAM.")
 cache_group.add_argument("--cache-none", action="store_true", help="Reduced RAM/VRAM usage at the expense of executing every node for each run.")
+cache_group.add_argument("--cache-ram", type=float, default=0, metavar="GB", help="Cache node results up to GB gigabytes of tensors in RAM, evicting the cheapest to recompute per byte first.")
+parser.add_argument("--cache-vram", type=float, default=None, metavar="GB", help="With --cache-ram, also limit cached node results in VRAM to GB gigabytes. Unlimited by default.")
+parser.add_argument("--cache-disk", type=str, default=None, metavar="PATH", help="Also store node outputs (conditioning, latents, images...) in this directory so they are reused after a restart.")
+parser.add_argument("--cache-disk-size", type=float, default=10.0, metavar="GB", help="Size budget of the --cache-disk directory in GB, least recently used outputs are evicted first.")
+
+parser.add_argument("--prompt-workers", type=int, default=1, metavar="N", help="Execute up to N queued prompts in parallel, each on its own worker with its own caches. Workers are spread over the available GPUs, or run on the CPU.")
+parser.add_argument("--prompt-worker-devices", type=str, default=None, metavar="DEVICES", help="Comma separated devices of the prompt workers, one per worker, for example: cuda:0,cuda:1,cpu. Implies --prompt-workers with their count.")
+parser.add_argument("--parallel-nodes", type=int, default=0, metavar="N", help="Execute independent branches of a prompt concurrently: one node at a time on the GPU, up to N CPU only nodes (loading, scaling images...) and any number of API nodes. By default nodes execute one at a time.")
 
 attn_group = parser.add_mutually_exclusive_group()
 attn_group.add_argument("--use-split-cross-attention", action="store_true", help="Use the split cross attention optimization. Ignored when xformers is used.")
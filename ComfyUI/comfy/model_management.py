@@ -25,6 +25,8 @@ import sys
 import platform
 import weakref
 import gc
+import threading
+import contextvars
 
 class VRAMState(Enum):
     DISABLED = 0    #No vram present: no need to move models to vram
@@ -165,9 +167,23 @@ def is_ixuca():
         return True
     return False
 
+# Device of the prompt worker running in this thread, see set_thread_device
+thread_device = contextvars.ContextVar("thread_device", default=None)
+
+def set_thread_device(device):
+    """Pin the calling (prompt worker) thread to a device: get_torch_device() returns it from this thread."""
+    device = torch.device(device)
+    if device.index is not None and device.type in ("cuda", "xpu", "npu", "mlu"):
+        # Also the current device of the thread, for code using it implicitly
+        getattr(torch, device.type).set_device(device)
+    thread_device.set(device)
+
 def get_torch_device():
     global directml_enabled
     global cpu_state
+    device = thread_device.get()
+    if device is not None:
+        return device
     if directml_enabled:
         global directml_device
         return directml_device
@@ -185,6 +201,19 @@ def get_torch_device():
         else:
             return torch.device(torch.cuda.current_device())
 
+def get_all_torch_devices():
+    """Every device of the type of the default one, e.g. all visible GPUs."""
+    if directml_enabled or cpu_state != CPUState.GPU:
+        return [get_torch_device()]
+    if is_intel_xpu():
+        return [torch.device("xpu", i) for i in range(torch.xpu.device_count())]
+    elif is_ascend_npu():
+        return [torch.device("npu", i) for i in range(torch.npu.device_count())]
+    elif is_mlu():
+        return [torch.device("mlu", i) for i in range(torch.mlu.device_count())]
+    else:
+        return [torch.device("cuda", i) for i in range(torch.cuda.device_count())]
+
 def get_total_memory(dev=None, torch_total_too=False):
     global directml_enabled
     if dev is None:
@@ -415,6 +444,36 @@ except:
 
 
 current_loaded_models = []
+# Prompt workers load and unload models from several threads
+loaded_models_mutex = threading.RLock()
+
+# Models loaded by the prompt each prompt worker is running. Workers sharing a
+# device must not unload or offload them from under each other, see free_memory.
+class ModelsInUse:
+    def __init__(self):
+        self.models = []
+
+worker_models_in_use = []
+thread_models_in_use = contextvars.ContextVar("thread_models_in_use", default=None)
+
+def track_thread_models_in_use():
+    """Record the models loaded from this (prompt worker) thread until release_thread_models."""
+    in_use = ModelsInUse()
+    with loaded_models_mutex:
+        worker_models_in_use.append(in_use)
+    thread_models_in_use.set(in_use)
+
+def release_thread_models():
+    """The prompt of this worker finished, other workers may unload its models again."""
+    in_use = thread_models_in_use.get()
+    if in_use is not None:
+        with loaded_models_mutex:
+            in_use.models = []
+
+def models_used_by_other_workers():
+    own = thread_models_in_use.get()
+    with loaded_models_mutex:
+        return [m for in_use in worker_models_in_use if in_use is not own for m in in_use.models]
 
 def module_size(module):
     module_mem = 0
@@ -546,123 +605,134 @@ def minimum_inference_memory():
     return (1024 * 1024 * 1024) * 0.8 + extra_reserved_memory()
 
 def free_memory(memory_required, device, keep_loaded=[]):
-    cleanup_models_gc()
-    unloaded_model = []
-    can_unload = []
-    unloaded_models = []
-
-    for i in range(len(current_loaded_models) -1, -1, -1):
-        shift_model = current_loaded_models[i]
-        if shift_model.device == device:
-            if shift_model not in keep_loaded and not shift_model.is_dead():
-                can_unload.append((-shift_model.model_offloaded_memory(), sys.getrefcount(shift_model.model), shift_model.model_memory(), i))
-                shift_model.currently_used = False
-
-    for x in sorted(can_unload):
-        i = x[-1]
-        memory_to_free = None
-        if not DISABLE_SMART_MEMORY:
-            free_mem = get_free_memory(device)
-            if free_mem > memory_required:
-                break
-            memory_to_free = memory_required - free_mem
-        logging.debug(f"Unloading {current_loaded_models[i].model.model.__class__.__name__}")
-        if current_loaded_models[i].model_unload(memory_to_free):
-            unloaded_model.append(i)
+    with loaded_models_mutex:
+        cleanup_models_gc()
+        keep_loaded = list(keep_loaded) + models_used_by_other_workers()
+        unloaded_model = []
+        can_unload = []
+        unloaded_models = []
+
+        for i in range(len(current_loaded_models) -1, -1, -1):
+            shift_model = current_loaded_models[i]
+            if shift_model.device == device:
+                if shift_model not in keep_loaded and not shift_model.is_dead():
+                    can_unload.append((-shift_model.model_offloaded_memory(), sys.getrefcount(shift_model.model), shift_model.model_memory(), i))
+                    shift_model.currently_used = False
+
+        for x in sorted(can_unload):
+            i = x[-1]
+            memory_to_free = None
+            if not DISABLE_SMART_MEMORY:
+                free_mem = get_free_memory(device)
+                if free_mem > memory_required:
+                    break
+                memory_to_free = memory_required - free_mem
+            logging.debug(f"Unloading {current_loaded_models[i].model.model.__class__.__name__}")
+            if current_loaded_models[i].model_unload(memory_to_free):
+                unloaded_model.append(i)
+
+        for i in sorted(unloaded_model, reverse=True):
+            unloaded_models.append(current_loaded_models.pop(i))
+
+        if len(unloaded_model) > 0:
+            soft_empty_cache()
+        else:
+            if vram_state != VRAMState.HIGH_VRAM:
+                mem_free_total, mem_free_torch = get_free_memory(device, torch_free_too=True)
+                if mem_free_torch > mem_free_total * 0.25:
+                    soft_empty_cache()
+        return unloaded_models
 
-    for i in sorted(unloaded_model, reverse=True):
-        unloaded_models.append(current_loaded_models.pop(i))
-
-    if len(unloaded_model) > 0:
-        soft_empty_cache()
-    else:
-        if vram_state != VRAMState.HIGH_VRAM:
-            mem_free_total, mem_free_torch = get_free_memory(device, torch_free_too=True)
-            if mem_free_torch > mem_free_total * 0.25:
-                soft_empty_cache()
-    return unloaded_models
 
 def load_models_gpu(models, memory_required=0, force_patch_weights=False, minimum_memory_required=None, force_full_load=False):
-    cleanup_models_gc()
-    global vram_state
-
-    inference_memory = minimum_inference_memory()
-    extra_mem = max(inference_memory, memory_required + extra_reserved_memory())
-    if minimum_memory_required is None:
-        minimum_memory_required = extra_mem
-    else:
-        minimum_memory_required = max(inference_memory, minimum_memory_required + extra_reserved_memory())
+    with loaded_models_mutex:
+        cleanup_models_gc()
+        global vram_state
+
+        inference_memory = minimum_inference_memory()
+        extra_mem = max(inference_memory, memory_required + extra_reserved_memory())
+        if minimum_memory_required is None:
+            minimum_memory_required = extra_mem
+        else:
+            minimum_memory_required = max(inference_memory, minimum_memory_required + extra_reserved_memory())
 
-    models_temp = set()
-    for m in models:
-        models_temp.add(m)
-        for mm in m.model_patches_models():
-            models_temp.add(mm)
+        models_temp = set()
+        for m in models:
+            models_temp.add(m)
+            for mm in m.model_patches_models():
+                models_temp.add(mm)
 
-    models = models_temp
+        models = models_temp
 
-    models_to_load = []
+        models_to_load = []
 
-    for x in models:
-        loaded_model = LoadedModel(x)
-        try:
-            loaded_model_index = current_loaded_models.index(loaded_model)
-        except:
-            loaded_model_index = None
+        for x in models:
+            loaded_model = LoadedModel(x)
+            try:
+                loaded_model_index = current_loaded_models.index(loaded_model)
+            except:
+                loaded_model_index = None
 
-        if loaded_model_index is not None:
-            loaded = current_loaded_models[loaded_model_index]
-            loaded.currently_used = True
-            models_to_load.append(loaded)
-        else:
-            if hasattr(x, "model"):
-                logging.info(f"Requested to load {x.model.__class__.__name__}")
-            models_to_load.append(loaded_model)
+            if loaded_model_index is not None:
+                loaded = current_loaded_models[loaded_model_index]
+                loaded.currently_used = True
+                models_to_load.append(loaded)
+            else:
+                if hasattr(x, "model"):
+                    logging.info(f"Requested to load {x.model.__class__.__name__}")
+                models_to_load.append(loaded_model)
+
+        for loaded_model in models_to_load:
+            to_unload = []
+            for i in range(len(current_loaded_models)):
+                if loaded_model.model.is_clone(current_loaded_models[i].model):
+                    to_unload = [i] + to_unload
+            for i in to_unload:
+                current_loaded_models.pop(i).model.detach(unpatch_all=False)
+
+        in_use = thread_models_in_use.get()
+        if in_use is not None:
+            for loaded_model in models_to_load:
+                if loaded_model not in in_use.models:
+                    in_use.models.append(loaded_model)
+
+        total_memory_required = {}
+        for loaded_model in models_to_load:
+            total_memory_required[loaded_model.device] = total_memory_required.get(loaded_model.device, 0) + loaded_model.model_memory_required(loaded_model.device)
+
+        for device in total_memory_required:
+            if device != torch.device("cpu"):
+                free_memory(total_memory_required[device] * 1.1 + extra_mem, device)
+
+        for device in total_memory_required:
+            if device != torch.device("cpu"):
+                free_mem = get_free_memory(device)
+                if free_mem < minimum_memory_required:
+                    models_l = free_memory(minimum_memory_required, device)
+                    logging.info("{} models unloaded.".format(len(models_l)))
+
+        for loaded_model in models_to_load:
+            model = loaded_model.model
+            torch_dev = model.load_device
+            if is_device_cpu(torch_dev):
+                vram_set_state = VRAMState.DISABLED
+            else:
+                vram_set_state = vram_state
+            lowvram_model_memory = 0
+            if lowvram_available and (vram_set_state == VRAMState.LOW_VRAM or vram_set_state == VRAMState.NORMAL_VRAM) and not force_full_load:
+                loaded_memory = loaded_model.model_loaded_memory()
+                current_free_mem = get_free_memory(torch_dev) + loaded_memory
 
-    for loaded_model in models_to_load:
-        to_unload = []
-        for i in range(len(current_loaded_models)):
-            if loaded_model.model.is_clone(current_loaded_models[i].model):
-                to_unload = [i] + to_unload
-        for i in to_unload:
-            current_loaded_models.pop(i).model.detach(unpatch_all=False)
-
-    total_memory_required = {}
-    for loaded_model in models_to_load:
-        total_memory_required[loaded_model.device] = total_memory_required.get(loaded_model.device, 0) + loaded_model.model_memory_required(loaded_model.device)
-
-    for device in total_memory_required:
-        if device != torch.device("cpu"):
-            free_memory(total_memory_required[device] * 1.1 + extra_mem, device)
-
-    for device in total_memory_required:
-        if device != torch.device("cpu"):
-            free_mem = get_free_memory(device)
-            if free_mem < minimum_memory_required:
-                models_l = free_memory(minimum_memory_required, device)
-                logging.info("{} models unloaded.".format(len(models_l)))
-
-    for loaded_model in models_to_load:
-        model = loaded_model.model
-        torch_dev = model.load_device
-        if is_device_cpu(torch_dev):
-            vram_set_state = VRAMState.DISABLED
-        else:
-            vram_set_state = vram_state
-        lowvram_model_memory = 0
-        if lowvram_available and (vram_set_state == VRAMState.LOW_VRAM or vram_set_state == VRAMState.NORMAL_VRAM) and not force_full_load:
-            loaded_memory = loaded_model.model_loaded_memory()
-            current_free_mem = get_free_memory(torch_dev) + loaded_memory
+                lowvram_model_memory = max(128 * 1024 * 1024, (current_free_mem - minimum_memory_required), min(current_free_mem * MIN_WEIGHT_MEMORY_RATIO, current_free_mem - minimum_inference_memory()))
+                lowvram_model_memory = max(0.1, lowvram_model_memory - loaded_memory)
 
-            lowvram_model_memory = max(128 * 1024 * 1024, (current_free_mem - minimum_memory_required), min(current_free_mem * MIN_WEIGHT_MEMORY_RATIO, current_free_mem - minimum_inference_memory()))
-            lowvram_model_memory = max(0.1, lowvram_model_memory - loaded_memory)
+            if vram_set_state == VRAMState.NO_VRAM:
+                lowvram_model_memory = 0.1
 
-        if vram_set_state == VRAMState.NO_VRAM:
-            lowvram_model_memory = 0.1
+            loaded_model.model_load(lowvram_model_memory, force_patch_weights=force_patch_weights)
+            current_loaded_models.insert(0, loaded_model)
+        return
 
-        loaded_model.model_load(lowvram_model_memory, force_patch_weights=force_patch_weights)
-        current_loaded_models.insert(0, loaded_model)
-    return
 
 def load_model_gpu(model):
     return load_models_gpu([model])
@@ -699,14 +769,16 @@ def cleanup_models_gc():
 
 
 def cleanup_models():
-    to_delete = []
-    for i in range(len(current_loaded_models)):
-        if current_loaded_models[i].real_model() is None:
-            to_delete = [i] + to_delete
+    with loaded_models_mutex:
+        to_delete = []
+        for i in range(len(current_loaded_models)):
+            if current_loaded_models[i].real_model() is None:
+                to_delete = [i] + to_delete
+
+        for i in to_delete:
+            x = current_loaded_models.pop(i)
+            del x
 
-    for i in to_delete:
-        x = current_loaded_models.pop(i)
-        del x
 
 def dtype_size(dtype):
     dtype_size = 4
@@ -1387,22 +1459,61 @@ class InterruptProcessingException(Exception):
 interrupt_processing_mutex = threading.RLock()
 
 interrupt_processing = False
+
+class InterruptFlag:
+    def __init__(self):
+        self.value = False
+
+# Prompt workers running in parallel each have their own flag: an interrupt
+# from another thread sets all of them unless it targets one worker (the
+# /interrupt route with a prompt or client id), a worker only clears its own.
+worker_interrupt_flags = []
+thread_interrupt_flag = contextvars.ContextVar("thread_interrupt_flag", default=None)
+
+def use_thread_interrupt_flag():
+    flag = InterruptFlag()
+    with interrupt_processing_mutex:
+        worker_interrupt_flags.append(flag)
+    thread_interrupt_flag.set(flag)
+    return flag
+
+def interrupt_worker_processing(flag, value=True):
+    """Interrupt only the prompt worker owning flag, see use_thread_interrupt_flag."""
+    with interrupt_processing_mutex:
+        flag.value = value
+
 def interrupt_current_processing(value=True):
     global interrupt_processing
     global interrupt_processing_mutex
     with interrupt_processing_mutex:
-        interrupt_processing = value
+        flag = thread_interrupt_flag.get()
+        if flag is not None:
+            flag.value = value
+        elif len(worker_interrupt_flags) > 0:
+            for flag in worker_interrupt_flags:
+                flag.value = value
+        else:
+            interrupt_processing = value
 
 def processing_interrupted():
     global interrupt_processing
     global interrupt_processing_mutex
     with interrupt_processing_mutex:
+        flag = thread_interrupt_flag.get()
+        if flag is not None:
+            return flag.value
         return interrupt_processing
 
 def throw_exception_if_processing_interrupted():
     global interrupt_processing
     global interrupt_processing_mutex
     with interrupt_processing_mutex:
+        flag = thread_interrupt_flag.get()
+        if flag is not None:
+            if flag.value:
+                flag.value = False
+                raise InterruptProcessingException()
+            return
         if interrupt_processing:
             interrupt_processing = False
             raise InterruptProcessingException()
@@ -1,8 +1,14 @@
+import hashlib
 import itertools
+import json
+import threading
+from collections import OrderedDict
 from typing import Sequence, Mapping, Dict
 from comfy_execution.graph import DynamicPrompt
 from abc import ABC, abstractmethod
 
+import torch
+
 import nodes
 
 from comfy_execution.graph_utils import is_link
@@ -58,6 +64,36 @@ def to_hashable(obj):
         # TODO - Support other objects like tensors?
         return Unhashable()
 
+def output_storages(value, storages=None):
+    """
+    The tensor storages held by a cached output, looking into lists, tuples and
+    dicts: (device, data pointer) -> bytes. Views of one tensor share a storage.
+    """
+    if storages is None:
+        storages = {}
+    if isinstance(value, torch.Tensor):
+        if value.device.type != "meta" and not value.is_sparse:
+            storage = value.untyped_storage()
+            storages[(str(value.device), storage.data_ptr())] = storage.nbytes()
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            output_storages(v, storages)
+    elif isinstance(value, dict):
+        for v in value.values():
+            output_storages(v, storages)
+    return storages
+
+def storage_bytes(storages):
+    """(RAM bytes, device memory bytes) of output_storages"""
+    ram = 0
+    vram = 0
+    for (device, _), nbytes in storages.items():
+        if device == "cpu":
+            ram += nbytes
+        else:
+            vram += nbytes
+    return ram, vram
+
 class CacheKeySetID(CacheKeySet):
     def __init__(self, dynprompt, node_ids, is_changed_cache):
         super().__init__(dynprompt, node_ids, is_changed_cache)
@@ -74,10 +110,26 @@ class CacheKeySetID(CacheKeySet):
             self.subcache_keys[node_id] = (node_id, node["class_type"])
 
 class CacheKeySetInputSignature(CacheKeySet):
+    """
+    Keys nodes by a digest of their class, inputs and IS_CHANGED result, with
+    linked inputs standing for the digest of the linked node. Digests are
+    computed once per node, parents first, so a node's key covers its whole
+    ancestry without walking it again. Nodes whose inputs can't be digested,
+    and their descendants, get an Unhashable key that never matches.
+    """
+
+    # (key set class, node id, class type) -> (inputs, is_changed, parent digests, digest)
+    # of nodes signed before, so unchanged nodes of the next prompt are not digested again.
+    # Shared by the prompt workers, least recently used entries are evicted first.
+    signature_memo: OrderedDict = OrderedDict()
+    signature_memo_lock = threading.Lock()
+    MAX_SIGNATURE_MEMO = 65536
+
     def __init__(self, dynprompt, node_ids, is_changed_cache):
         super().__init__(dynprompt, node_ids, is_changed_cache)
         self.dynprompt = dynprompt
         self.is_changed_cache = is_changed_cache
+        self.signatures = {}
 
     def include_node_id_in_input(self) -> bool:
         return False
@@ -93,62 +145,89 @@ class CacheKeySetInputSignature(CacheKeySet):
             self.subcache_keys[node_id] = (node_id, node["class_type"])
 
     async def get_node_signature(self, dynprompt, node_id):
-        signature = []
-        ancestors, order_mapping = self.get_ordered_ancestry(dynprompt, node_id)
-        signature.append(await self.get_immediate_node_signature(dynprompt, node_id, order_mapping))
-        for ancestor_id in ancestors:
-            signature.append(await self.get_immediate_node_signature(dynprompt, ancestor_id, order_mapping))
-        return to_hashable(signature)
-
-    async def get_immediate_node_signature(self, dynprompt, node_id, ancestor_order_mapping):
+        for ancestor_id in self.get_ordered_ancestry(dynprompt, node_id):
+            self.signatures[ancestor_id] = await self.get_immediate_node_signature(dynprompt, ancestor_id)
+        return self.signatures[node_id]
+
+    async def get_immediate_node_signature(self, dynprompt, node_id):
         if not dynprompt.has_node(node_id):
             # This node doesn't exist -- we can't cache it.
-            return [float("NaN")]
+            return Unhashable()
         node = dynprompt.get_node(node_id)
         class_type = node["class_type"]
         class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
-        signature = [class_type, await self.is_changed_cache.get(node_id)]
-        if self.include_node_id_in_input() or (hasattr(class_def, "NOT_IDEMPOTENT") and class_def.NOT_IDEMPOTENT) or include_unique_id_in_input(class_type):
-            signature.append(node_id)
+        is_changed = await self.is_changed_cache.get(node_id)
+        include_node_id = self.include_node_id_in_input() or (hasattr(class_def, "NOT_IDEMPOTENT") and class_def.NOT_IDEMPOTENT) or include_unique_id_in_input(class_type)
         inputs = node["inputs"]
+        widgets = []
+        links = []
         for key in sorted(inputs.keys()):
             if is_link(inputs[key]):
                 (ancestor_id, ancestor_socket) = inputs[key]
-                ancestor_index = ancestor_order_mapping[ancestor_id]
-                signature.append((key,("ANCESTOR", ancestor_index, ancestor_socket)))
+                ancestor_signature = self.signatures.get(ancestor_id)
+                if not isinstance(ancestor_signature, str):
+                    return Unhashable()
+                links.append([key, ancestor_signature, ancestor_socket])
             else:
-                signature.append((key, inputs[key]))
-        return signature
-
-    # This function returns a list of all ancestors of the given node. The order of the list is
-    # deterministic based on which specific inputs the ancestor is connected by.
+                widgets.append([key, inputs[key]])
+        parent_signatures = tuple(link[1] for link in links)
+
+        memo_key = (type(self), node_id, class_type)
+        with self.signature_memo_lock:
+            memo = self.signature_memo.get(memo_key)
+            if memo is not None:
+                self.signature_memo.move_to_end(memo_key)
+        if memo is not None and memo[0] == inputs and memo[1] == is_changed and memo[2] == parent_signatures:
+            return memo[3]
+
+        try:
+            signature = json.dumps([class_type, is_changed, node_id if include_node_id else None, widgets, links], sort_keys=True, allow_nan=False)
+        except (TypeError, ValueError):
+            # Objects, or NaN which means "always changed"
+            return Unhashable()
+        digest = hashlib.sha256(signature.encode("utf-8")).hexdigest()
+        with self.signature_memo_lock:
+            self.signature_memo[memo_key] = (dict(inputs), is_changed, parent_signatures, digest)
+            self.signature_memo.move_to_end(memo_key)
+            while len(self.signature_memo) > self.MAX_SIGNATURE_MEMO:
+                self.signature_memo.popitem(last=False)
+        return digest
+
+    # This function returns the node and those of its ancestors that have no signature yet,
+    # each after the nodes it links to.
     def get_ordered_ancestry(self, dynprompt, node_id):
-        ancestors = []
-        order_mapping = {}
-        self.get_ordered_ancestry_internal(dynprompt, node_id, ancestors, order_mapping)
-        return ancestors, order_mapping
-
-    def get_ordered_ancestry_internal(self, dynprompt, node_id, ancestors, order_mapping):
-        if not dynprompt.has_node(node_id):
-            return
-        inputs = dynprompt.get_node(node_id)["inputs"]
-        input_keys = sorted(inputs.keys())
-        for key in input_keys:
-            if is_link(inputs[key]):
-                ancestor_id = inputs[key][0]
-                if ancestor_id not in order_mapping:
-                    ancestors.append(ancestor_id)
-                    order_mapping[ancestor_id] = len(ancestors) - 1
-                    self.get_ordered_ancestry_internal(dynprompt, ancestor_id, ancestors, order_mapping)
+        order = []
+        visited = set()
+        stack = [(node_id, False)]
+        while len(stack) > 0:
+            current_id, ancestors_done = stack.pop()
+            if ancestors_done:
+                order.append(current_id)
+                continue
+            if current_id in visited or current_id in self.signatures:
+                continue
+            visited.add(current_id)
+            stack.append((current_id, True))
+            if not dynprompt.has_node(current_id):
+                continue
+            inputs = dynprompt.get_node(current_id)["inputs"]
+            for key in sorted(inputs.keys(), reverse=True):
+                if is_link(inputs[key]):
+                    ancestor_id = inputs[key][0]
+                    if ancestor_id not in visited and ancestor_id not in self.signatures:
+                        stack.append((ancestor_id, False))
+        return order
 
 class BasicCache:
-    def __init__(self, key_class):
+    def __init__(self, key_class, disk_cache=None):
         self.key_class = key_class
         self.initialized = False
         self.dynprompt: DynamicPrompt
         self.cache_key_set: CacheKeySet
         self.cache = {}
         self.subcaches = {}
+        # Optional DiskCache the outputs are also stored in
+        self.disk_cache = disk_cache
 
     async def set_prompt(self, dynprompt, node_ids, is_changed_cache):
         self.dynprompt = dynprompt
@@ -188,10 +267,20 @@ class BasicCache:
         self._clean_cache()
         self._clean_subcaches()
 
+    def _on_disk(self, node_id, cache_key):
+        if self.disk_cache is None or cache_key is None or not self.dynprompt.has_node(node_id):
+            return False
+        class_def = nodes.NODE_CLASS_MAPPINGS[self.dynprompt.get_node(node_id)["class_type"]]
+        # Output nodes have to run for their side effects
+        return not (hasattr(class_def, 'OUTPUT_NODE') and class_def.OUTPUT_NODE == True)
+
     def _set_immediate(self, node_id, value):
         assert self.initialized
         cache_key = self.cache_key_set.get_data_key(node_id)
         self.cache[cache_key] = value
+        if self._on_disk(node_id, cache_key):
+            # Written in the background, execution doesn't wait on the disk
+            self.disk_cache.store(cache_key, value)
 
     def _get_immediate(self, node_id):
         if not self.initialized:
@@ -199,6 +288,11 @@ class BasicCache:
         cache_key = self.cache_key_set.get_data_key(node_id)
         if cache_key in self.cache:
             return self.cache[cache_key]
+        elif self._on_disk(node_id, cache_key):
+            value = self.disk_cache.get(cache_key)
+            if value is not None:
+                self.cache[cache_key] = value
+            return value
         else:
             return None
 
@@ -206,7 +300,7 @@ class BasicCache:
         subcache_key = self.cache_key_set.get_subcache_key(node_id)
         subcache = self.subcaches.get(subcache_key, None)
         if subcache is None:
-            subcache = BasicCache(self.key_class)
+            subcache = BasicCache(self.key_class, disk_cache=self.disk_cache)
             self.subcaches[subcache_key] = subcache
         await subcache.set_prompt(self.dynprompt, children_ids, self.is_changed_cache)
         return subcache
@@ -219,6 +313,20 @@ class BasicCache:
         else:
             return None
 
+    def memory_usage(self, storages=None):
+        """The tensor storages of all cached outputs, see output_storages."""
+        if storages is None:
+            storages = {}
+        for value in list(self.cache.values()):
+            output_storages(value, storages)
+        for subcache in list(self.subcaches.values()):
+            subcache.memory_usage(storages)
+        return storages
+
+    def set_cost(self, node_id, seconds):
+        # How long the node's output took to compute; only used by caches weighing it
+        pass
+
     def recursive_debug_dump(self):
         result = []
         for key in self.cache:
@@ -228,8 +336,8 @@ class BasicCache:
         return result
 
 class HierarchicalCache(BasicCache):
-    def __init__(self, key_class):
-        super().__init__(key_class)
+    def __init__(self, key_class, disk_cache=None):
+        super().__init__(key_class, disk_cache=disk_cache)
 
     def _get_cache_for(self, node_id):
         assert self.dynprompt is not None
@@ -266,8 +374,8 @@ class HierarchicalCache(BasicCache):
         return await cache._ensure_subcache(node_id, children_ids)
 
 class LRUCache(BasicCache):
-    def __init__(self, key_class, max_size=100):
-        super().__init__(key_class)
+    def __init__(self, key_class, max_size=100, disk_cache=None):
+        super().__init__(key_class, disk_cache=disk_cache)
         self.max_size = max_size
         self.min_generation = 0
         self.generation = 0
@@ -318,6 +426,169 @@ class LRUCache(BasicCache):
         return self
 
 
+class MemoryBudgetCache(LRUCache):
+    """
+    An LRUCache limited by the memory its outputs hold instead of their count.
+
+    The tensors of each output are measured by storage, so views and tensors
+    shared between outputs are counted once, in RAM or device memory. When a
+    budget is exceeded, entries not used by the current prompt are evicted
+    GreedyDual-Size style: the cheapest to recompute per byte first, with
+    entries aging as others get evicted, so unused entries go eventually too.
+    """
+
+    # Counted for every entry, for the objects besides tensors
+    ENTRY_BYTES = 1024
+
+    def __init__(self, key_class, ram_budget=None, vram_budget=None, disk_cache=None):
+        super().__init__(key_class, max_size=0, disk_cache=disk_cache)
+        self.ram_budget = ram_budget
+        self.vram_budget = vram_budget
+        self.entries = {}
+        self.storages = {}
+        self.ram_bytes = 0
+        self.vram_bytes = 0
+        self.inflation = 0.0
+        # Caches with entries for the same keys that are only worth keeping along with these (ui)
+        self.linked_caches = []
+        self.hits = 0
+        self.misses = 0
+        # Nodes of the current prompt already counted as a hit or miss; outputs are
+        # looked up several times per prompt (to execute the node, for each child...)
+        self.looked_up = set()
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    async def set_prompt(self, dynprompt, node_ids, is_changed_cache):
+        await super().set_prompt(dynprompt, node_ids, is_changed_cache)
+        self.looked_up.clear()
+
+    def _priority(self, entry):
+        return self.inflation + entry["cost"] / (entry["ram_bytes"] + entry["vram_bytes"] + self.ENTRY_BYTES)
+
+    def _account(self, cache_key, node_id, value):
+        self._release(cache_key)
+        storages = output_storages(value)
+        ram, vram = storage_bytes(storages)
+        entry = {
+            "class_type": self.dynprompt.get_node(node_id)["class_type"] if self.dynprompt.has_node(node_id) else None,
+            "storages": list(storages.keys()),
+            "ram_bytes": ram,
+            "vram_bytes": vram,
+            "cost": 0.0,
+        }
+        entry["priority"] = self._priority(entry)
+        self.entries[cache_key] = entry
+        self.ram_bytes += self.ENTRY_BYTES
+        for storage, nbytes in storages.items():
+            reference = self.storages.get(storage)
+            if reference is None:
+                reference = self.storages[storage] = [nbytes, 0]
+                if storage[0] == "cpu":
+                    self.ram_bytes += nbytes
+                else:
+                    self.vram_bytes += nbytes
+            reference[1] += 1
+
+    def _release(self, cache_key):
+        entry = self.entries.pop(cache_key, None)
+        if entry is None:
+            return
+        self.ram_bytes -= self.ENTRY_BYTES
+        for storage in entry["storages"]:
+            reference = self.storages[storage]
+            reference[1] -= 1
+            if reference[1] == 0:
+                del self.storages[storage]
+                if storage[0] == "cpu":
+                    self.ram_bytes -= reference[0]
+                else:
+                    self.vram_bytes -= reference[0]
+
+    def _drop(self, cache_key):
+        if cache_key in self.cache:
+            del self.cache[cache_key]
+        self.used_generation.pop(cache_key, None)
+        self.children.pop(cache_key, None)
+        self._release(cache_key)
+
+    def _evict_over_budget(self):
+        while True:
+            over_ram = self.ram_budget is not None and self.ram_bytes > self.ram_budget
+            over_vram = self.vram_budget is not None and self.vram_bytes > self.vram_budget
+            if not (over_ram or over_vram):
+                return
+            # Outputs the current prompt uses stay
+            candidates = [(entry["priority"], key) for key, entry in self.entries.items()
+                          if self.used_generation.get(key, 0) < self.generation and (over_ram or entry["vram_bytes"] > 0)]
+            if len(candidates) == 0:
+                return
+            priority, cache_key = min(candidates, key=lambda c: c[0])
+            entry = self.entries[cache_key]
+            self.inflation = priority
+            self.evictions += 1
+            self.evicted_bytes += entry["ram_bytes"] + entry["vram_bytes"]
+            self._drop(cache_key)
+            for cache in self.linked_caches:
+                cache._drop(cache_key)
+
+    def clean_unused(self):
+        self._evict_over_budget()
+        self._clean_subcaches()
+
+    def get(self, node_id):
+        value = super().get(node_id)
+        cache_key = self.cache_key_set.get_data_key(node_id)
+        counted = node_id in self.looked_up
+        self.looked_up.add(node_id)
+        if value is None:
+            if not counted:
+                self.misses += 1
+        else:
+            if not counted:
+                self.hits += 1
+            entry = self.entries.get(cache_key)
+            if entry is None:
+                # Loaded from the disk cache
+                self._account(cache_key, node_id, value)
+                self._evict_over_budget()
+            else:
+                entry["priority"] = self._priority(entry)
+        return value
+
+    def set(self, node_id, value):
+        super().set(node_id, value)
+        self._account(self.cache_key_set.get_data_key(node_id), node_id, value)
+        self._evict_over_budget()
+
+    def set_cost(self, node_id, seconds):
+        entry = self.entries.get(self.cache_key_set.get_data_key(node_id))
+        if entry is not None:
+            entry["cost"] = seconds
+            entry["priority"] = self._priority(entry)
+
+    def stats(self):
+        entries = list(self.entries.values())
+        largest = sorted(entries, key=lambda e: e["ram_bytes"] + e["vram_bytes"], reverse=True)[:10]
+        return {
+            "entries": len(entries),
+            "ram_bytes": self.ram_bytes,
+            "vram_bytes": self.vram_bytes,
+            "ram_budget": self.ram_budget,
+            "vram_budget": self.vram_budget,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "evicted_bytes": self.evicted_bytes,
+            "largest": [{
+                "class_type": e["class_type"],
+                "ram_bytes": e["ram_bytes"],
+                "vram_bytes": e["vram_bytes"],
+                "cost_seconds": e["cost"],
+            } for e in largest],
+        }
+
+
 class DependencyAwareCache(BasicCache):
     """
     A cache implementation that tracks dependencies between nodes and manages
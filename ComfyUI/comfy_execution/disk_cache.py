@@ -0,0 +1,318 @@
+"""
+Disk tier of the node output cache.
+
+Node outputs are stored under a digest of their input signature (see
+CacheKeySetInputSignature), so after a restart or a cache mode switch, nodes
+whose inputs did not change load their outputs instead of executing again.
+
+Only outputs made of tensors and plain values (numbers, strings, and lists,
+tuples and dicts of them) are stored: conditioning, latents, images, masks...
+Models and other objects stay in the memory caches. Outputs of output nodes are
+never stored, since they have to run for their side effects (saving files,
+previews).
+
+Each entry is one safetensors file holding the output's tensors, with the
+output's structure and a checksum of structure and tensor data in its metadata.
+The checksum is verified on load and entries failing it are deleted. Entries are
+evicted least recently used first to keep the directory under its size budget.
+
+Outputs of executing nodes are written by a background thread (store), so
+execution never waits on the disk or the checksum of large outputs. When the
+writer falls behind, outputs are skipped rather than queued without bound.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+import queue
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import safetensors
+import safetensors.torch
+import torch
+
+FORMAT_VERSION = "1"
+EXTENSION = ".safetensors"
+
+
+class NotStorable(Exception):
+    pass
+
+
+def _canonical(obj) -> str:
+    # A representation of the signature that is stable across processes:
+    # frozensets are sorted, since their iteration order depends on str hashing.
+    if obj is None or type(obj) in (bool, int, str):
+        return json.dumps(obj)
+    elif type(obj) is float:
+        if math.isnan(obj):
+            # NaN signatures never match, not even themselves
+            raise NotStorable("NaN in signature")
+        return repr(obj)
+    elif isinstance(obj, frozenset):
+        return "{" + ",".join(sorted(_canonical(i) for i in obj)) + "}"
+    elif isinstance(obj, tuple):
+        return "(" + ",".join(_canonical(i) for i in obj) + ")"
+    else:
+        raise NotStorable("{} in signature".format(type(obj).__name__))
+
+
+def signature_digest(signature) -> Optional[str]:
+    """Digest of a cache key from CacheKeySetInputSignature, or None if it can't be stored."""
+    try:
+        canonical = _canonical(signature)
+    except NotStorable:
+        return None
+    return hashlib.sha256("{}:{}".format(FORMAT_VERSION, canonical).encode("utf-8")).hexdigest()
+
+
+def _pack(value, tensors: Dict[str, torch.Tensor], names: Dict[int, str]):
+    if type(value) is torch.Tensor:
+        name = names.get(id(value))
+        if name is None:
+            name = names[id(value)] = str(len(tensors))
+            tensors[name] = value
+        return {"t": name}
+    elif value is None or type(value) in (bool, int, float, str):
+        return {"v": value}
+    elif type(value) is list:
+        return {"l": [_pack(v, tensors, names) for v in value]}
+    elif type(value) is tuple:
+        return {"u": [_pack(v, tensors, names) for v in value]}
+    elif type(value) is dict and all(type(k) is str for k in value):
+        return {"d": {k: _pack(v, tensors, names) for k, v in value.items()}}
+    else:
+        raise NotStorable(type(value).__name__)
+
+
+def _unpack(packed, tensors: Dict[str, torch.Tensor]):
+    if "t" in packed:
+        return tensors[packed["t"]]
+    elif "v" in packed:
+        return packed["v"]
+    elif "l" in packed:
+        return [_unpack(v, tensors) for v in packed["l"]]
+    elif "u" in packed:
+        return tuple(_unpack(v, tensors) for v in packed["u"])
+    else:
+        return {k: _unpack(v, tensors) for k, v in packed["d"].items()}
+
+
+def _prepare_tensors(tensors: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+    # safetensors wants contiguous cpu tensors that don't share memory
+    prepared = {}
+    storages = set()
+    for name, tensor in tensors.items():
+        tensor = tensor.detach().to("cpu").contiguous()
+        storage = tensor.untyped_storage().data_ptr()
+        if storage in storages:
+            tensor = tensor.clone()
+        else:
+            storages.add(storage)
+        prepared[name] = tensor
+    return prepared
+
+
+def _checksum(structure: str, tensors: Dict[str, torch.Tensor]) -> str:
+    h = hashlib.sha256(structure.encode("utf-8"))
+    for name in sorted(tensors):
+        tensor = tensors[name]
+        h.update("{}:{}:{}".format(name, tensor.dtype, list(tensor.shape)).encode("utf-8"))
+        if tensor.numel() > 0:
+            h.update(tensor.reshape(-1).view(torch.uint8).numpy())
+    return h.hexdigest()
+
+
+class DiskCache:
+    """
+    Content-addressed store of node outputs in a directory, shared by the
+    output caches of every PromptExecutor in the process.
+    """
+
+    # Digests of recently seen cache keys, so lookups don't re-hash signatures
+    MAX_KNOWN_DIGESTS = 16384
+    # Outputs queued for the writer thread; they hold on to their tensors until written
+    MAX_PENDING_WRITES = 8
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # digest -> file size, least recently used first
+        self.entries: OrderedDict[str, int] = OrderedDict()
+        self.total_bytes = 0
+        self.digests: Dict[Any, Optional[str]] = {}
+        # Digests queued or being written by the writer thread
+        self.writing = set()
+        self.pending: queue.Queue = queue.Queue()
+        self.writer: Optional[threading.Thread] = None
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest + EXTENSION)
+
+    def _scan(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(".tmp"):
+                # Left over from an interrupted write
+                self._remove(entry.path)
+            elif entry.name.endswith(EXTENSION):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name[:-len(EXTENSION)], stat.st_size))
+        # File modification times are the last use, see get()
+        for _, digest, size in sorted(files):
+            self.entries[digest] = size
+            self.total_bytes += size
+        self._evict()
+        logging.info("Disk cache: {} entries, {:.1f} MB in {}".format(len(self.entries), self.total_bytes / (1024 * 1024), self.directory))
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning("Disk cache: could not remove {}: {}".format(path, e))
+
+    def _evict(self):
+        # Called with the lock held
+        while self.total_bytes > self.max_bytes and len(self.entries) > 0:
+            digest, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            self._remove(self._path(digest))
+
+    def _discard(self, digest: str):
+        with self.lock:
+            size = self.entries.pop(digest, None)
+            if size is not None:
+                self.total_bytes -= size
+        self._remove(self._path(digest))
+
+    def digest(self, cache_key) -> Optional[str]:
+        if cache_key in self.digests:
+            return self.digests[cache_key]
+        digest = signature_digest(cache_key)
+        if len(self.digests) >= self.MAX_KNOWN_DIGESTS:
+            self.digests.clear()
+        self.digests[cache_key] = digest
+        return digest
+
+    def get(self, cache_key):
+        digest = self.digest(cache_key)
+        if digest is None:
+            return None
+        with self.lock:
+            if digest not in self.entries:
+                return None
+            self.entries.move_to_end(digest)
+
+        path = self._path(digest)
+        try:
+            value = self._read(path)
+        except FileNotFoundError:
+            # Evicted meanwhile
+            self._discard(digest)
+            return None
+        except Exception as e:
+            logging.warning("Disk cache: discarding unreadable entry {}: {}".format(path, e))
+            self._discard(digest)
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def _read(self, path: str):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        with safetensors.safe_open(path, framework="pt", device="cpu") as f:
+            metadata = f.metadata() or {}
+            if metadata.get("format") != FORMAT_VERSION:
+                raise ValueError("unknown format {}".format(metadata.get("format")))
+            tensors = {name: f.get_tensor(name) for name in f.keys()}
+        structure = metadata["structure"]
+        if _checksum(structure, tensors) != metadata["checksum"]:
+            raise ValueError("checksum mismatch")
+        return _unpack(json.loads(structure), tensors)
+
+    def set(self, cache_key, value) -> bool:
+        """Store the value unless it is already stored; returns whether it is stored now."""
+        digest = self.digest(cache_key)
+        if digest is None:
+            return False
+        with self.lock:
+            if digest in self.entries:
+                self.entries.move_to_end(digest)
+                return True
+
+        tensors = {}
+        try:
+            structure = json.dumps(_pack(value, tensors, {}))
+        except NotStorable:
+            return False
+        if sum(t.numel() * t.element_size() for t in tensors.values()) > self.max_bytes:
+            return False
+
+        path = self._path(digest)
+        temp_path = "{}.{}.tmp".format(path, threading.get_ident())
+        try:
+            tensors = _prepare_tensors(tensors)
+            metadata = {"format": FORMAT_VERSION, "structure": structure, "checksum": _checksum(structure, tensors)}
+            safetensors.torch.save_file(tensors, temp_path, metadata=metadata)
+            os.replace(temp_path, path)
+            size = os.path.getsize(path)
+        except Exception as e:
+            logging.warning("Disk cache: could not store {}: {}".format(path, e))
+            self._remove(temp_path)
+            return False
+
+        with self.lock:
+            # Another executor may have stored the same output meanwhile
+            self.total_bytes += size - self.entries.pop(digest, 0)
+            self.entries[digest] = size
+            self._evict()
+            return digest in self.entries
+
+    def store(self, cache_key, value) -> bool:
+        """Queue the value to be stored by the writer thread; returns whether it was queued."""
+        digest = self.digest(cache_key)
+        if digest is None:
+            return False
+        with self.lock:
+            if digest in self.entries or digest in self.writing:
+                return False
+            if len(self.writing) >= self.MAX_PENDING_WRITES:
+                logging.debug("Disk cache: writer busy, not storing {}".format(digest))
+                return False
+            self.writing.add(digest)
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._write_pending, name="disk_cache_writer", daemon=True)
+                self.writer.start()
+        self.pending.put((cache_key, digest, value))
+        return True
+
+    def _write_pending(self):
+        while True:
+            cache_key, digest, value = self.pending.get()
+            try:
+                self.set(cache_key, value)
+            except Exception as e:
+                logging.warning("Disk cache: could not store {}: {}".format(digest, e))
+            finally:
+                with self.lock:
+                    self.writing.discard(digest)
+                self.pending.task_done()
+
+    def flush(self):
+        """Wait until the queued values are stored."""
+        self.pending.join()
@@ -194,6 +194,8 @@ class ExecutionList(TopologicalSort):
         super().__init__(dynprompt)
         self.output_cache = output_cache
         self.staged_node_id = None
+        # Nodes executing concurrently, see stage_ready_nodes
+        self.staged_node_ids = set()
 
     def is_cached(self, node_id):
         return self.output_cache.get(node_id) is not None
@@ -209,28 +211,47 @@ class ExecutionList(TopologicalSort):
             self.unblockedEvent.clear()
             available = self.get_ready_nodes()
         if len(available) == 0:
-            cycled_nodes = self.get_nodes_in_cycle()
-            # Because cycles composed entirely of static nodes are caught during initial validation,
-            # we will 'blame' the first node in the cycle that is not a static node.
-            blamed_node = cycled_nodes[0]
-            for node_id in cycled_nodes:
-                display_node_id = self.dynprompt.get_display_node_id(node_id)
-                if display_node_id != node_id:
-                    blamed_node = display_node_id
-                    break
-            ex = DependencyCycleError("Dependency cycle detected")
-            error_details = {
-                "node_id": blamed_node,
-                "exception_message": str(ex),
-                "exception_type": "graph.DependencyCycleError",
-                "traceback": [],
-                "current_inputs": []
-            }
+            error_details, ex = self.get_cycle_error()
             return None, error_details, ex
 
         self.staged_node_id = self.ux_friendly_pick_node(available)
         return self.staged_node_id, None, None
 
+    def get_cycle_error(self):
+        cycled_nodes = self.get_nodes_in_cycle()
+        # Because cycles composed entirely of static nodes are caught during initial validation,
+        # we will 'blame' the first node in the cycle that is not a static node.
+        blamed_node = cycled_nodes[0]
+        for node_id in cycled_nodes:
+            display_node_id = self.dynprompt.get_display_node_id(node_id)
+            if display_node_id != node_id:
+                blamed_node = display_node_id
+                break
+        ex = DependencyCycleError("Dependency cycle detected")
+        error_details = {
+            "node_id": blamed_node,
+            "exception_message": str(ex),
+            "exception_type": "graph.DependencyCycleError",
+            "traceback": [],
+            "current_inputs": []
+        }
+        return error_details, ex
+
+    def stage_ready_nodes(self, can_stage):
+        """
+        Stage ready nodes to execute them concurrently, in the order stage_node_execution would pick them.
+        can_stage(node_id) tells whether a node can start now. Returns the newly staged nodes.
+        """
+        available = [node_id for node_id in self.get_ready_nodes() if node_id not in self.staged_node_ids]
+        staged = []
+        while len(available) > 0:
+            node_id = self.ux_friendly_pick_node(available)
+            available.remove(node_id)
+            if can_stage(node_id):
+                self.staged_node_ids.add(node_id)
+                staged.append(node_id)
+        return staged
+
     def ux_friendly_pick_node(self, node_list):
         # If an output node is available, do that first.
         # Technically this has no effect on the overall length of execution, but it feels better as a user
@@ -279,6 +300,13 @@ class ExecutionList(TopologicalSort):
         self.pop_node(node_id)
         self.staged_node_id = None
 
+    def unstage_node(self, node_id):
+        self.staged_node_ids.remove(node_id)
+
+    def complete_node(self, node_id):
+        self.staged_node_ids.remove(node_id)
+        self.pop_node(node_id)
+
     def get_nodes_in_cycle(self):
         # We'll dissolve the graph in reverse topological order to leave only the nodes in the cycle.
         # We're skipping some of the performance optimizations from the original TopologicalSort to keep
@@ -1,3 +1,6 @@
+import threading
+
+
 def is_link(obj):
     if not isinstance(obj, list):
         return False
@@ -9,11 +12,16 @@ def is_link(obj):
         return False
     return True
 
+# Default prefix of the graphs built by the node executing in this thread.
+# Nodes may execute concurrently in several threads, see comfy_execution.lanes
+class _DefaultPrefix(threading.local):
+    root = ""
+    call_index = 0
+    graph_index = 0
+
 # The GraphBuilder is just a utility class that outputs graphs in the form expected by the ComfyUI back-end
 class GraphBuilder:
-    _default_prefix_root = ""
-    _default_prefix_call_index = 0
-    _default_prefix_graph_index = 0
+    _default_prefix = _DefaultPrefix()
 
     def __init__(self, prefix = None):
         if prefix is None:
@@ -25,20 +33,21 @@ class GraphBuilder:
 
     @classmethod
     def set_default_prefix(cls, prefix_root, call_index, graph_index = 0):
-        cls._default_prefix_root = prefix_root
-        cls._default_prefix_call_index = call_index
-        cls._default_prefix_graph_index = graph_index
+        cls._default_prefix.root = prefix_root
+        cls._default_prefix.call_index = call_index
+        cls._default_prefix.graph_index = graph_index
 
     @classmethod
     def alloc_prefix(cls, root=None, call_index=None, graph_index=None):
+        default = GraphBuilder._default_prefix
         if root is None:
-            root = GraphBuilder._default_prefix_root
+            root = default.root
         if call_index is None:
-            call_index = GraphBuilder._default_prefix_call_index
+            call_index = default.call_index
         if graph_index is None:
-            graph_index = GraphBuilder._default_prefix_graph_index
+            graph_index = default.graph_index
         result = f"{root}.{call_index}.{graph_index}."
-        GraphBuilder._default_prefix_graph_index += 1
+        default.graph_index += 1
         return result
 
     def node(self, class_type, id=None, **kwargs):
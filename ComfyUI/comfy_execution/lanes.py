@@ -0,0 +1,84 @@
+"""
+Resource lanes for executing the ready nodes of a prompt concurrently.
+
+With --parallel-nodes, PromptExecutor runs the nodes of independent branches at
+the same time instead of one after the other. Each node runs in the lane of the
+resource it needs:
+
+- "gpu": the default. One node at a time, in a thread of its own, so sampling,
+  model loading, text encoders and VAEs never compete for VRAM.
+- "cpu": nodes declaring EXECUTION_LANE = "cpu" (loading images, resizing...),
+  several at a time in a thread pool. These nodes must not load models or use
+  the global random generators, whose sequence would depend on timing.
+- "io": nodes whose function is a coroutine (API nodes). They run on the event
+  loop as before, without limit, since they mostly wait on the network.
+
+Only the node function runs in the lane threads: inputs, lazy evaluation,
+caches and messages to the client are handled on the event loop of the
+executor. Nodes ready at the same time are picked in the order sequential
+execution would run them.
+"""
+
+import asyncio
+import contextvars
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+import comfy.model_management
+
+LANE_GPU = "gpu"
+LANE_CPU = "cpu"
+LANE_IO = "io"
+
+
+def node_lane(class_def) -> str:
+    if inspect.iscoroutinefunction(getattr(class_def, class_def.FUNCTION)):
+        return LANE_IO
+    lane = getattr(class_def, "EXECUTION_LANE", LANE_GPU)
+    if lane not in (LANE_GPU, LANE_CPU):
+        raise ValueError("Unknown EXECUTION_LANE {} of {}".format(lane, class_def.__name__))
+    return lane
+
+
+class ExecutionLanes:
+    """The lane threads of one PromptExecutor, and the count of nodes running in each lane."""
+
+    def __init__(self, cpu_workers: int):
+        self.capacity = {LANE_GPU: 1, LANE_CPU: cpu_workers}
+        self.running = {LANE_GPU: 0, LANE_CPU: 0, LANE_IO: 0}
+        self.executors = {
+            LANE_GPU: ThreadPoolExecutor(max_workers=1, thread_name_prefix="gpu_lane"),
+            LANE_CPU: ThreadPoolExecutor(max_workers=cpu_workers, thread_name_prefix="cpu_lane"),
+        }
+
+    def has_room(self, lane: str) -> bool:
+        return lane not in self.capacity or self.running[lane] < self.capacity[lane]
+
+    def acquire(self, lane: str):
+        self.running[lane] += 1
+
+    def release(self, lane: str):
+        self.running[lane] -= 1
+
+    def executor(self, lane: str):
+        return self.executors.get(lane)
+
+
+def run_in_lane(executor, func):
+    """
+    Run func in a thread of the lane, with the context variables of the caller:
+    the executing node, and the device, interrupt flag and progress state of
+    the prompt worker.
+    """
+    device = comfy.model_management.thread_device.get()
+
+    def call():
+        if device is not None:
+            # The current CUDA device is per thread
+            comfy.model_management.set_thread_device(device)
+        with torch.inference_mode():
+            return func()
+
+    return asyncio.get_running_loop().run_in_executor(executor, contextvars.copy_context().run, call)
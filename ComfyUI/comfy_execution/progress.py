@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import contextvars
 from typing import TypedDict, Dict, Optional, Tuple
 from typing_extensions import override
 from PIL import Image
@@ -321,9 +322,28 @@ class ProgressRegistry:
 # Global registry instance
 global_progress_registry: ProgressRegistry | None = None
 
+class ProgressScope:
+    """Holds the registry of the prompt executing in one prompt worker."""
+    def __init__(self):
+        self.registry: ProgressRegistry | None = None
+
+# Set by prompt workers executing in parallel (see comfy_execution.prompt_workers)
+progress_scope: contextvars.ContextVar[ProgressScope | None] = contextvars.ContextVar("progress_scope", default=None)
+
+def use_worker_progress_state() -> None:
+    """Keep the progress state of prompts executed from this thread apart from other prompt workers'."""
+    progress_scope.set(ProgressScope())
+
 def reset_progress_state(prompt_id: str, dynprompt: "DynamicPrompt") -> None:
     global global_progress_registry
 
+    scope = progress_scope.get()
+    if scope is not None:
+        if scope.registry is not None:
+            scope.registry.reset_handlers()
+        scope.registry = ProgressRegistry(prompt_id, dynprompt)
+        return
+
     # Reset existing handlers if registry exists
     if global_progress_registry is not None:
         global_progress_registry.reset_handlers()
@@ -340,6 +360,9 @@ def add_progress_handler(handler: ProgressHandler) -> None:
 
 def get_progress_state() -> ProgressRegistry:
     global global_progress_registry
+    scope = progress_scope.get()
+    if scope is not None and scope.registry is not None:
+        return scope.registry
     if global_progress_registry is None:
         from comfy_execution.graph import DynamicPrompt
 
@@ -0,0 +1,233 @@
+"""
+Prompt worker pool: several prompts executing in parallel, one per worker.
+
+With --prompt-workers N, main.py starts N prompt worker threads instead of one.
+Each worker owns a PromptExecutor (and so its own CacheSet) and is pinned to a
+device. Queued prompts are assigned by the PromptScheduler:
+
+* Affinity: a prompt with extra_data["device"] (e.g. "cuda:1") only runs on
+  workers pinned to that device, as long as there is one.
+* Warmth: among the first queued prompts, a worker takes the one sharing the
+  most nodes with the prompts it ran recently, since their models and outputs
+  are likely still in its caches.
+* Fairness: a prompt passed over max_skips times is taken next regardless of
+  warmth.
+
+Execution state the PromptServer keeps for the single worker (client_id,
+last_node_id, last_prompt_id) is kept per worker in a WorkerServer view, so
+messages of parallel prompts reach their own clients.
+"""
+
+import contextvars
+import heapq
+import json
+from collections import deque
+from typing import Any, Deque, Dict, FrozenSet, List, Optional, Sequence
+
+from comfy_execution.graph_utils import is_link
+
+current_worker: contextvars.ContextVar[Optional["PromptWorker"]] = contextvars.ContextVar("current_prompt_worker", default=None)
+
+
+def get_executing_server(default):
+    """The server view of the prompt worker running in this context, or default outside workers."""
+    worker = current_worker.get()
+    if worker is None:
+        return default
+    return worker.server
+
+
+def node_signature(class_type: str, inputs: Dict[str, Any]) -> str:
+    """Identity of a node by its class and widget values, ignoring links."""
+    widgets = {k: v for k, v in inputs.items() if not is_link(v)}
+    return json.dumps([class_type, widgets], sort_keys=True, default=str)
+
+
+def prompt_signatures(prompt: Dict[str, Any]) -> FrozenSet[str]:
+    signatures = set()
+    for node in prompt.values():
+        if isinstance(node, dict) and "class_type" in node:
+            signatures.add(node_signature(node["class_type"], node.get("inputs", {})))
+    return frozenset(signatures)
+
+
+class WorkerServer:
+    """A worker's view of the PromptServer.
+
+    Per-prompt execution state is the worker's own; everything else (sockets,
+    send_sync, ...) is the server's. Assignments are also mirrored to the
+    server for code that reads them there directly.
+    """
+    EXECUTION_STATE = ("client_id", "last_node_id", "last_prompt_id")
+
+    def __init__(self, server):
+        object.__setattr__(self, "_server", server)
+        object.__setattr__(self, "client_id", None)
+        object.__setattr__(self, "last_node_id", None)
+        object.__setattr__(self, "last_prompt_id", None)
+
+    def __getattr__(self, name):
+        return getattr(self._server, name)
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in self.EXECUTION_STATE:
+            setattr(self._server, name, value)
+
+
+class PromptWorker:
+    def __init__(self, index: int, device: str, server, warm_prompts: int = 1):
+        self.index = index
+        self.device = device
+        self.server = WorkerServer(server)
+        self.prompt_id: Optional[str] = None
+        self.prompts_executed = 0
+        self.flags: Dict[str, Any] = {}
+        # Set by the worker thread, see comfy.model_management.use_thread_interrupt_flag
+        self.interrupt_flag = None
+        self._warm: Deque[FrozenSet[str]] = deque(maxlen=max(1, warm_prompts))
+        self._running_signatures: FrozenSet[str] = frozenset()
+
+    @property
+    def running(self) -> bool:
+        return self.prompt_id is not None
+
+    def warmth(self, signatures: FrozenSet[str]) -> int:
+        """Number of the prompt's nodes this worker ran recently."""
+        warm = 0
+        for recent in self._warm:
+            warm = max(warm, len(signatures & recent))
+        return warm
+
+    def start_prompt(self, prompt_id: str, signatures: FrozenSet[str]) -> None:
+        self.prompt_id = prompt_id
+        self._running_signatures = signatures
+
+    def finish_prompt(self) -> None:
+        self._warm.append(self._running_signatures)
+        self._running_signatures = frozenset()
+        self.prompt_id = None
+        self.prompts_executed += 1
+
+    def forget_caches(self) -> None:
+        """The worker's caches were reset; nothing is warm anymore."""
+        self._warm.clear()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "worker": self.index,
+            "device": self.device,
+            "state": "running" if self.running else "idle",
+            "prompt_id": self.prompt_id,
+            "prompts_executed": self.prompts_executed,
+        }
+
+
+class PromptScheduler:
+    """Picks a queued prompt for a free worker. Called with the PromptQueue mutex held."""
+
+    def __init__(self, workers: Sequence[PromptWorker], lookahead: int = 16, max_skips: int = 4):
+        self.workers = list(workers)
+        self.lookahead = max(1, lookahead)
+        self.max_skips = max(0, max_skips)
+        self._skips: Dict[str, int] = {}
+        self._signatures: Dict[str, FrozenSet[str]] = {}
+
+    def _signatures_of(self, item) -> FrozenSet[str]:
+        prompt_id = item[1]
+        signatures = self._signatures.get(prompt_id)
+        if signatures is None:
+            signatures = self._signatures[prompt_id] = prompt_signatures(item[2])
+        return signatures
+
+    def eligible(self, item, worker: PromptWorker) -> bool:
+        device = item[3].get("device") if isinstance(item[3], dict) else None
+        if device is None:
+            return True
+        device = str(device)
+        if worker.device == device:
+            return True
+        # A device no worker is pinned to can't be honoured
+        return all(w.device != device for w in self.workers)
+
+    def select(self, queue: List, worker: PromptWorker) -> Optional[Any]:
+        """Remove and return the queue item the worker should run next, or None if it should wait."""
+        candidates = [item for item in heapq.nsmallest(self.lookahead, queue) if self.eligible(item, worker)]
+        if len(candidates) == 0:
+            return None
+
+        chosen = candidates[0]
+        if self._skips.get(chosen[1], 0) < self.max_skips:
+            best = None
+            for position, item in enumerate(candidates):
+                warmth = self.warmth_for(item, worker)
+                if warmth < 0:
+                    # Left to the warmer idle worker, woken along with this one
+                    continue
+                score = (warmth, -position)
+                if best is None or score > best:
+                    best = score
+                    chosen = item
+            if best is None:
+                # Counted as a skip, so the head of the queue isn't left waiting forever
+                self._skips[chosen[1]] = self._skips.get(chosen[1], 0) + 1
+                return None
+            for item in candidates:
+                if item is chosen:
+                    break
+                self._skips[item[1]] = self._skips.get(item[1], 0) + 1
+
+        queue.remove(chosen)
+        heapq.heapify(queue)
+        self._skips.pop(chosen[1], None)
+        worker.start_prompt(chosen[1], self._signatures.pop(chosen[1], None) or prompt_signatures(chosen[2]))
+        return chosen
+
+    def warmth_for(self, item, worker: PromptWorker) -> int:
+        """How warm the worker is for the item; -1 if an idle worker that could take it is warmer, select leaves it to that worker."""
+        signatures = self._signatures_of(item)
+        warmth = worker.warmth(signatures)
+        for other in self.workers:
+            if other is not worker and not other.running and self.eligible(item, other) and other.warmth(signatures) > warmth:
+                # Rather leave it to that worker
+                return -1
+        return warmth
+
+    def forget(self, queue: List) -> None:
+        """Drop bookkeeping for prompts that left the queue without running."""
+        queued = set(item[1] for item in queue)
+        for prompt_id in list(self._skips):
+            if prompt_id not in queued:
+                del self._skips[prompt_id]
+        for prompt_id in list(self._signatures):
+            if prompt_id not in queued:
+                del self._signatures[prompt_id]
+
+    def set_flag(self, name: str, data) -> None:
+        for worker in self.workers:
+            worker.flags[name] = data
+
+    def take_flags(self, worker: PromptWorker) -> Dict[str, Any]:
+        """The worker's pending flags; unloading models waits until no other worker uses its device."""
+        flags = worker.flags
+        worker.flags = {}
+        unload = flags.get("unload_models", flags.get("free_memory", False))
+        if unload and any(w.running and w.device == worker.device for w in self.workers if w is not worker):
+            flags["unload_models"] = False
+            worker.flags["unload_models"] = unload
+        return flags
+
+    def status(self) -> List[Dict[str, Any]]:
+        return [worker.status() for worker in self.workers]
+
+
+def default_worker_devices(count: int, accelerators: Sequence[str]) -> List[str]:
+    """Spread count workers round-robin over the accelerators, or run them all on the CPU."""
+    if len(accelerators) == 0:
+        return ["cpu"] * count
+    return [accelerators[i % len(accelerators)] for i in range(count)]
+
+
+def create_workers(server, devices: Sequence[str], warm_prompts: int = 1) -> List[PromptWorker]:
+    return [PromptWorker(i, device, server, warm_prompts=warm_prompts) for i, device in enumerate(devices)]
+
@@ -12,6 +12,10 @@ from .utils.globals import LLM_DEFAULT_BASE_URL, LMSTUDIO_DEFAULT_BASE_URL, get_
 from openai import AsyncOpenAI
 
 import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
 
 from agents._config import set_default_openai_api
 from agents.tracing import set_tracing_disabled
@@ -34,6 +38,42 @@ from agents.tracing import set_tracing_disabled
 
 set_default_openai_api("chat_completions")
 set_tracing_disabled(True)
+
+# 复用AsyncOpenAI客户端（及其keep-alive连接池），同一会话的多轮对话和各个agent共用一个客户端
+OPENAI_CLIENT_CACHE_SIZE = 32
+# 超过这个时间未使用的客户端会被移出缓存
+OPENAI_CLIENT_IDLE_SECONDS = 600.0
+
+_openai_clients: "OrderedDict[Tuple, Tuple[AsyncOpenAI, float]]" = OrderedDict()
+_openai_clients_lock = threading.Lock()
+
+
+def get_openai_client(base_url: str, api_key: str, default_headers: Optional[Dict[str, str]] = None) -> AsyncOpenAI:
+    """按(base_url, api_key, headers)获取共享的AsyncOpenAI客户端"""
+    headers = default_headers or {}
+    key = (base_url, api_key, tuple(sorted(headers.items())))
+    now = time.monotonic()
+    with _openai_clients_lock:
+        # 淘汰空闲过久的客户端；被移出的客户端不主动关闭，可能仍有进行中的请求在使用，
+        # 由openai的http客户端在回收时自行关闭连接
+        while _openai_clients:
+            oldest_key, (_, last_used) = next(iter(_openai_clients.items()))
+            if now - last_used <= OPENAI_CLIENT_IDLE_SECONDS:
+                break
+            del _openai_clients[oldest_key]
+
+        cached = _openai_clients.pop(key, None)
+        client = cached[0] if cached else AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            default_headers=headers,
+        )
+        _openai_clients[key] = (client, now)
+        while len(_openai_clients) > OPENAI_CLIENT_CACHE_SIZE:
+            _openai_clients.popitem(last=False)
+        return client
+
+
 def create_agent(**kwargs) -> Agent:
     # 通过用户配置拿/环境变量
     config = kwargs.pop("config") if "config" in kwargs else {}
@@ -59,11 +99,7 @@ def create_agent(**kwargs) -> Agent:
         # LMStudio typically doesn't require an API key, use a placeholder
         api_key = "lmstudio-local"
 
-    client = AsyncOpenAI(
-        api_key=api_key,
-        base_url=base_url,
-        default_headers=default_headers,
-    )
+    client = get_openai_client(base_url, api_key, default_headers)
 
     default_model_name = os.environ.get("OPENAI_MODEL", "gemini-2.5-flash")
     model_name = kwargs.pop("model") or default_model_name
@@ -16,10 +16,13 @@ import base64
 import os
 
 from ..service.debug_agent import debug_workflow_errors
-from ..dao.workflow_table import save_workflow_data, get_workflow_data_by_id, update_workflow_ui_by_id
+from ..dao.workflow_table import save_workflow_data_async, get_workflow_data_by_id_async, update_workflow_ui_by_id_async
 from ..service.mcp_client import comfyui_agent_invoke
 from ..utils.request_context import set_request_context, get_session_id
+from ..utils.chat_stream import STREAM_MODE_DELTA, chat_streams, write_deltas
 from ..utils.logger import log
+from ..utils.session_state import session_states
+from ..utils.run_scheduler import run_scheduler, run_pool
 
 
 # 不再使用内存存储会话消息，改为从前端传递历史消息
@@ -103,11 +106,11 @@ async def upload_to_oss(file_data: bytes, filename: str) -> str:
 async def invoke_chat(request):
     log.info("Received invoke_chat request")
     
-    # Extract and store API key from Authorization header
-    extract_and_store_api_key(request)
-    
     req_json = await request.json()
-    log.info("Request JSON:", req_json)
+    log.info("Request JSON: %s", req_json)
+
+    # Extract and store API key from Authorization header, per session
+    extract_and_store_api_key(request, req_json.get('session_id'))
 
     response = web.StreamResponse(
         status=200,
@@ -126,10 +129,33 @@ async def invoke_chat(request):
     ext = req_json.get('ext')
     historical_messages = req_json.get('messages', [])
     workflow_checkpoint_id = req_json.get('workflow_checkpoint_id')
+    # stream_mode=delta 时只发送新增文本，协议见 utils/chat_stream.py
+    stream_mode = req_json.get('stream_mode')
+    resume = req_json.get('resume')
+
+    if stream_mode == STREAM_MODE_DELTA and resume:
+        # 断线重连：从客户端已收到的offset继续发送，不重新调用agent
+        stream = chat_streams.get(resume.get('stream_id'))
+        if stream is None or stream.session_id != session_id:
+            log.info(f"Chat stream {resume.get('stream_id')} not found for session {session_id}")
+            error_response = ChatResponse(
+                session_id=session_id,
+                text="The response stream has expired, please send the message again.",
+                finished=True,
+                type="message",
+                format="text",
+                ext=None
+            )
+            await response.write(json.dumps(error_response).encode() + b"\n")
+        else:
+            log.info(f"Resuming chat stream {stream.stream_id} at offset {resume.get('offset', 0)}")
+            await write_deltas(response, stream, resume.get('offset', 0), resume.get('revision'))
+        await response.write_eof()
+        return response
     
     # 获取当前语言
     language = request.headers.get('Accept-Language', 'en')
-    set_language(language)
+    set_language(language, session_id)
     
     # 构建配置信息
     config = {
@@ -174,10 +200,25 @@ async def invoke_chat(request):
         previous_text_length = 0
         
         log.info(f"config: {config}")
+
+        if stream_mode == STREAM_MODE_DELTA:
+            # agent在独立任务中运行（继承当前请求上下文），响应只写增量，断线后可续传
+            # 运行槽位由agent任务持有，客户端断开后仍可续传，不随连接取消
+            stream = chat_streams.start(session_id, run_scheduler.run(
+                session_id, comfyui_agent_invoke(openai_messages, None), run_pool(config.get("openai_base_url"))
+            ))
+            bytes_sent = await write_deltas(response, stream)
+            log.info(f"-- Delta stream {stream.stream_id} done: {len(stream.text)} chars, {bytes_sent} bytes sent")
+            await response.write_eof()
+            return response
         
         # Pass messages in OpenAI format (images are now included in messages)
         # Config is now available through request context
-        async for result in comfyui_agent_invoke(openai_messages, None):
+        # 通过调度器限制并发（排队等待运行槽位），客户端断开时取消运行
+        agent_run = run_scheduler.run(
+            session_id, comfyui_agent_invoke(openai_messages, None), run_pool(config.get("openai_base_url")), request
+        )
+        async for result in agent_run:
             # The MCP client now returns tuples (text, ext_with_finished) where ext_with_finished includes finished status
             if isinstance(result, tuple) and len(result) == 2:
                 text, ext_with_finished = result
@@ -281,7 +322,7 @@ async def save_workflow_checkpoint(request):
         else:
             attributes["description"] = f"Workflow checkpoint: {checkpoint_type}"
         
-        version_id = save_workflow_data(
+        version_id = await save_workflow_data_async(
             session_id=session_id,
             workflow_data=workflow_api,
             workflow_data_ui=workflow_ui,
@@ -342,7 +383,7 @@ async def restore_workflow_checkpoint(request):
             })
         
         # Get workflow data by version ID
-        workflow_version = get_workflow_data_by_id(version_id)
+        workflow_version = await get_workflow_data_by_id_async(version_id)
         
         if not workflow_version:
             return web.json_response({
@@ -372,6 +413,28 @@ async def restore_workflow_checkpoint(request):
         })
 
 
+@server.PromptServer.instance.routes.get("/api/run-scheduler/stats")
+async def run_scheduler_stats(request):
+    """
+    Agent run scheduler metrics: running runs, queue depth per pool and waiting times
+    """
+    return web.json_response({
+        "success": True,
+        "data": run_scheduler.stats()
+    })
+
+
+@server.PromptServer.instance.routes.get("/api/session-state/stats")
+async def session_state_stats(request):
+    """
+    Session state cache metrics: session count, memory, hit rate and evictions
+    """
+    return web.json_response({
+        "success": True,
+        "data": session_states.stats()
+    })
+
+
 @server.PromptServer.instance.routes.post("/api/debug-agent")
 async def invoke_debug(request):
     """
@@ -379,10 +442,10 @@ async def invoke_debug(request):
     """
     log.info("Received debug-agent request")
     
-    # Extract and store API key from Authorization header
-    extract_and_store_api_key(request)
-    
     req_json = await request.json()
+
+    # Extract and store API key from Authorization header, per session
+    extract_and_store_api_key(request, req_json.get('session_id'))
     
     response = web.StreamResponse(
         status=200,
@@ -407,7 +470,7 @@ async def invoke_debug(request):
 
     # 获取当前语言
     language = request.headers.get('Accept-Language', 'en')
-    set_language(language)
+    set_language(language, session_id)
     
     # 设置请求上下文 - 为debug请求建立context隔离
     set_request_context(session_id, None, config)
@@ -422,7 +485,11 @@ async def invoke_debug(request):
         final_ext_data = None
         finished = False
         
-        async for result in debug_workflow_errors(workflow_data):
+        # 通过调度器限制并发（排队等待运行槽位），客户端断开时取消运行
+        debug_run = run_scheduler.run(
+            session_id, debug_workflow_errors(workflow_data), run_pool(config.get("openai_base_url")), request
+        )
+        async for result in debug_run:
             # Stream the response
             if isinstance(result, tuple) and len(result) == 2:
                 text, ext = result
@@ -509,7 +576,7 @@ async def invoke_debug(request):
         if workflow_data and accumulated_text:
             try:
                 current_session_id = get_session_id()
-                checkpoint_id = save_workflow_data(
+                checkpoint_id = await save_workflow_data_async(
                     session_id=current_session_id,
                     workflow_data=workflow_data,
                     workflow_data_ui=None,  # UI format not available in debug agent
@@ -591,7 +658,7 @@ async def update_workflow_ui(request):
             })
         
         # Update only the workflow_data_ui field
-        success = update_workflow_ui_by_id(checkpoint_id, workflow_data_ui)
+        success = await update_workflow_ui_by_id_async(checkpoint_id, workflow_data_ui)
         
         if success:
             log.info(f"Successfully updated workflow_data_ui for checkpoint ID: {checkpoint_id}")
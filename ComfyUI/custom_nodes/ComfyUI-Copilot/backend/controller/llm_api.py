@@ -9,13 +9,21 @@ Description: 这是默认设置,请设置`customMade`, 打开koroFileHeader查
 # Copyright (C) 2025 AIDC-AI
 # Licensed under the MIT License.
 
+import asyncio
 import json
 from typing import List, Dict, Any
 from aiohttp import web
 from ..utils.globals import LLM_DEFAULT_BASE_URL, LMSTUDIO_DEFAULT_BASE_URL, is_lmstudio_url
 import server
-import requests
 from ..utils.logger import log
+from ..utils.model_list_client import model_list_client
+
+
+def _describe_error(e: Exception) -> str:
+    # aiohttp timeouts carry no message
+    if isinstance(e, asyncio.TimeoutError):
+        return "request timed out"
+    return str(e)
 
 
 @server.PromptServer.instance.routes.get("/api/model_config")
@@ -36,27 +44,22 @@ async def list_models(request):
         log.info("Received list_models request")
         openai_api_key = request.headers.get('Openai-Api-Key') or ""
         openai_base_url = request.headers.get('Openai-Base-Url') or LLM_DEFAULT_BASE_URL
+        # ?refresh=1 bypasses the cached model list
+        use_cache = request.query.get('refresh', '').lower() not in ('1', 'true')
 
-        request_url = f"{openai_base_url}/models"
-        
         # Check if this is LMStudio and adjust headers accordingly
         is_lmstudio = is_lmstudio_url(openai_base_url)
-        
-        headers = {}
-        if not is_lmstudio or (is_lmstudio and openai_api_key):
-            # Include Authorization header for OpenAI API or LMStudio with API key
-            headers["Authorization"] = f"Bearer {openai_api_key}"
-        
-        response = requests.get(request_url, headers=headers)
+        # Include Authorization header for OpenAI API or LMStudio with API key
+        send_auth = not is_lmstudio or bool(openai_api_key)
+
+        result = await model_list_client.list_models(openai_base_url, openai_api_key, send_auth, use_cache)
         llm_config = []
-        if response.status_code == 200:
-            models = response.json()
-            for model in models['data']:
-                llm_config.append({
-                    "label": model['id'],
-                    "name": model['id'],
-                    "image_enable": True
-                })
+        for model_id in result.models:
+            llm_config.append({
+                "label": model_id,
+                "name": model_id,
+                "image_enable": True
+            })
         
         return web.json_response({
                 "models": llm_config
@@ -64,9 +67,9 @@ async def list_models(request):
         )
         
     except Exception as e:
-        log.error(f"Error in list_models: {str(e)}")
+        log.error(f"Error in list_models: {_describe_error(e)}")
         return web.json_response({
-            "error": f"Failed to list models: {str(e)}"
+            "error": f"Failed to list models: {_describe_error(e)}"
         }, status=500)
 
 
@@ -95,16 +98,15 @@ async def verify_openai_key(req):
         
         # Use a direct HTTP request instead of the OpenAI client
         # This gives us more control over the request method and error handling
-        headers = {}
-        if not is_lmstudio or (is_lmstudio and openai_api_key):
-            # Include Authorization header for OpenAI API or LMStudio with API key
-            headers["Authorization"] = f"Bearer {openai_api_key}"
+        # Include Authorization header for OpenAI API or LMStudio with API key
+        send_auth = not is_lmstudio or bool(openai_api_key)
         
-        # Make a simple GET request to the models endpoint
-        response = requests.get(f"{openai_base_url}/models", headers=headers)
+        # Make a simple GET request to the models endpoint. Verification always asks the
+        # endpoint again, but concurrent checks of the same key share one request
+        result = await model_list_client.list_models(openai_base_url, openai_api_key, send_auth, use_cache=False)
         
         # Check if the request was successful
-        if response.status_code == 200:
+        if result.ok:
             success_message = "API key is valid" if not is_lmstudio else "LMStudio connection successful"
             return web.json_response({
                 "success": True, 
@@ -112,10 +114,10 @@ async def verify_openai_key(req):
                 "message": success_message
             })
         else:
-            log.error(f"API validation failed with status code: {response.status_code}")
-            error_message = f"Invalid API key: HTTP {response.status_code} - {response.text}"
+            log.error(f"API validation failed with status code: {result.status}")
+            error_message = f"Invalid API key: HTTP {result.status} - {result.text}"
             if is_lmstudio:
-                error_message = f"LMStudio connection failed: HTTP {response.status_code} - {response.text}"
+                error_message = f"LMStudio connection failed: HTTP {result.status} - {result.text}"
             return web.json_response({
                 "success": False, 
                 "data": False,
@@ -123,10 +125,10 @@ async def verify_openai_key(req):
             })
             
     except Exception as e:
-        log.error(f"Error verifying API key/connection: {str(e)}")
-        error_message = f"Invalid API key: {str(e)}"
+        log.error(f"Error verifying API key/connection: {_describe_error(e)}")
+        error_message = f"Invalid API key: {_describe_error(e)}"
         if 'base_url' in locals() and is_lmstudio_url(locals().get('openai_base_url', '')):
-            error_message = f"LMStudio connection error: {str(e)}"
+            error_message = f"LMStudio connection error: {_describe_error(e)}"
         return web.json_response({
             "success": False, 
             "data": False, 
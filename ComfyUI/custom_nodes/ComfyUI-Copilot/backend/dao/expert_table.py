@@ -1,11 +1,17 @@
 import os
 import json
-from typing import Dict, Any, Optional, List
+import threading
+from typing import Dict, Any, Optional, List, Callable, NamedTuple
 from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
 
+from ..utils.lexical_index import LexicalIndex
+
+# 检索时各字段的权重：名称 > 描述 > 内容
+EXPERT_FIELD_WEIGHTS = {'name': 3.0, 'description': 2.0, 'content': 1.0}
+
 # 创建数据库基类
 Base = declarative_base()
 
@@ -47,6 +53,52 @@ class RewriteExpert(Base):
             'updateTime': _format_dt(self.update_time),
         }
 
+class ExpertSnapshot(NamedTuple):
+    """某一变更版本下全部专家记录的只读快照"""
+    version: int
+    experts: List[Dict[str, Any]]
+    by_name: Dict[str, List[Dict[str, Any]]]
+    index: LexicalIndex
+
+
+class ExpertCache:
+    """
+    专家记录的内存缓存。每次写入提交后递增变更版本号，读取时版本号不一致才重新加载，
+    因此构建提示词和按名称查询专家时不再访问数据库。
+    """
+
+    def __init__(self, loader: Callable[[], List[Dict[str, Any]]]):
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._version = 0
+        self._snapshot: Optional[ExpertSnapshot] = None
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def invalidate(self) -> None:
+        """写入提交后调用；版本号在提交之后递增，保证并发加载到旧数据的快照会被丢弃"""
+        with self._lock:
+            self._version += 1
+
+    def snapshot(self) -> ExpertSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == self._version:
+            return snapshot
+        with self._lock:
+            version = self._version
+            if self._snapshot is not None and self._snapshot.version == version:
+                return self._snapshot
+            experts = self._loader()
+            by_name: Dict[str, List[Dict[str, Any]]] = {}
+            for expert in experts:
+                by_name.setdefault(expert['name'], []).append(expert)
+            index = LexicalIndex({i: expert for i, expert in enumerate(experts)}, EXPERT_FIELD_WEIGHTS)
+            self._snapshot = ExpertSnapshot(version, experts, by_name, index)
+            return self._snapshot
+
+
 class DatabaseManager:
     """数据库管理器"""
     
@@ -61,6 +113,7 @@ class DatabaseManager:
         self.db_path = db_path
         self.engine = create_engine(f'sqlite:///{db_path}', echo=False)
         self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self._experts = ExpertCache(self._load_rewrite_experts)
 
         # 创建表
         Base.metadata.create_all(bind=self.engine)
@@ -84,6 +137,7 @@ class DatabaseManager:
             )
             session.add(rewrite_expert)
             session.commit()
+            self._experts.invalidate()
             session.refresh(rewrite_expert)
             return rewrite_expert.id
         except Exception as e:
@@ -146,6 +200,7 @@ class DatabaseManager:
                     )
                     session.add(expert)
                 session.commit()
+                self._experts.invalidate()
             except Exception:
                 session.rollback()
                 raise
@@ -164,8 +219,8 @@ class DatabaseManager:
         finally:
             session.close()
 
-    def list_rewrite_experts(self) -> List[Dict[str, Any]]:
-        """获取所有专家记录，按ID倒序"""
+    def _load_rewrite_experts(self) -> List[Dict[str, Any]]:
+        """从数据库加载所有专家记录，按ID正序"""
         session = self.get_session()
         try:
             experts = session.query(RewriteExpert).order_by(RewriteExpert.id.asc()).all()
@@ -173,32 +228,35 @@ class DatabaseManager:
         finally:
             session.close()
     
+    def list_rewrite_experts(self) -> List[Dict[str, Any]]:
+        """获取所有专家记录，按ID正序（读缓存）"""
+        return [dict(e) for e in self._experts.snapshot().experts]
+    
     def list_rewrite_experts_short(self) -> List[Dict[str, Any]]:
-        """获取所有专家记录，按ID倒序"""
-        session = self.get_session()
-        try:
-            experts = session.query(RewriteExpert).order_by(RewriteExpert.id.asc()).all()
-            return [{"name": e.name, "description": e.description} for e in experts]
-        finally:
-            session.close()
+        """获取所有专家的名称和描述，按ID正序（读缓存）"""
+        return [{"name": e['name'], "description": e['description']} for e in self._experts.snapshot().experts]
     
     def get_rewrite_expert_by_name(self, name: str) -> Optional[Dict[str, Any]]:
-        """根据名称获取专家记录"""
-        session = self.get_session()
-        try:
-            expert = session.query(RewriteExpert).filter(RewriteExpert.name == name).first()
-            return expert.to_dict() if expert else None
-        finally:
-            session.close()
+        """根据名称获取专家记录（读缓存）"""
+        experts = self._experts.snapshot().by_name.get(name)
+        return dict(experts[0]) if experts else None
     
     def get_rewrite_expert_by_name_list(self, name_list: List[str]) -> List[Dict[str, Any]]:
-        """根据名称列表获取专家记录"""
-        session = self.get_session()
-        try:
-            experts = session.query(RewriteExpert).filter(RewriteExpert.name.in_(name_list)).all()
-            return [e.to_dict() for e in experts]
-        finally:
-            session.close()
+        """根据名称列表获取专家记录，按ID正序（读缓存）"""
+        names = set(name_list)
+        return [dict(e) for e in self._experts.snapshot().experts if e['name'] in names]
+
+    def count_rewrite_experts(self) -> int:
+        """专家记录总数（读缓存）"""
+        return len(self._experts.snapshot().experts)
+
+    def search_rewrite_experts(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        """按名称、描述和内容的关键词相关度检索专家，返回前top_k条的名称、描述和得分"""
+        snapshot = self._experts.snapshot()
+        return [
+            {"name": snapshot.experts[i]['name'], "description": snapshot.experts[i]['description'], "score": score}
+            for i, score in snapshot.index.search(query, top_k)
+        ]
 
     def update_rewrite_expert(self, expert_id: int, name: Optional[str] = None, description: Optional[Any] = None, content: Optional[Any] = None) -> bool:
         """根据ID更新专家记录的部分或全部字段"""
@@ -216,6 +274,7 @@ class DatabaseManager:
                 expert.content = self._string_field(content)
 
             session.commit()
+            self._experts.invalidate()
             return True
         except Exception as e:
             session.rollback()
@@ -232,6 +291,7 @@ class DatabaseManager:
                 return False
             session.delete(expert)
             session.commit()
+            self._experts.invalidate()
             return True
         except Exception as e:
             session.rollback()
@@ -284,4 +344,10 @@ def get_rewrite_expert_by_name(name: str) -> Optional[Dict[str, Any]]:
     return db_manager.get_rewrite_expert_by_name(name)
 
 def get_rewrite_expert_by_name_list(name_list: List[str]) -> List[Dict[str, Any]]:
-    return db_manager.get_rewrite_expert_by_name_list(name_list)
\ No newline at end of file
+    return db_manager.get_rewrite_expert_by_name_list(name_list)
+
+def count_rewrite_experts() -> int:
+    return db_manager.count_rewrite_experts()
+
+def search_rewrite_experts(query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+    return db_manager.search_rewrite_experts(query, top_k)
\ No newline at end of file
@@ -1,14 +1,37 @@
 import os
 import json
-from typing import Dict, Any, Optional
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text
+import zlib
+import queue
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Any, Optional, Callable, List, Tuple, NamedTuple
+from sqlalchemy import create_engine, event, Column, Integer, String, DateTime, Text, LargeBinary, Index, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 from datetime import datetime
 
+from ..utils.json_patch import make_patch, apply_patch
+from ..utils.session_state import session_states
+from ..utils.logger import log
+
 # 创建数据库基类
 Base = declarative_base()
 
+# 连接池大小，同时也是读线程池的大小
+DB_POOL_SIZE = 5
+# 单次批量提交最多合并的写操作数量
+DB_MAX_WRITE_BATCH = 64
+# 最多缓存最新版本的session数量
+LATEST_VERSION_CACHE_SIZE = 128
+# 每隔多少个版本保存一次完整快照，重建任意版本最多需要应用这么多个增量
+CHECKPOINT_SNAPSHOT_INTERVAL = 16
+# 压缩后的增量超过完整数据的这个比例时，直接保存完整快照
+CHECKPOINT_DELTA_MAX_RATIO = 0.5
+
 # 定义workflow_version表模型
 class WorkflowVersion(Base):
     __tablename__ = 'workflow_version'
@@ -19,6 +42,16 @@ class WorkflowVersion(Base):
     workflow_data_ui = Column(Text, nullable=True)  # JSON字符串 ui格式
     attributes = Column(Text, nullable=True)  # JSON字符串，存储额外属性
     created_at = Column(DateTime, default=datetime.utcnow)
+    # 增量存储：parent_id为空表示完整快照（workflow_data/workflow_data_ui），
+    # 否则workflow_delta保存相对parent_id版本的zlib压缩JSON Patch，workflow_data为空字符串
+    parent_id = Column(Integer, nullable=True)
+    delta_depth = Column(Integer, nullable=True, default=0)
+    workflow_delta = Column(LargeBinary, nullable=True)
+
+    __table_args__ = (
+        # 按session查询最新版本：WHERE session_id = ? ORDER BY id DESC LIMIT 1
+        Index('ix_workflow_version_session_id_id', 'session_id', 'id'),
+    )
     
     def to_dict(self):
         return {
@@ -29,10 +62,171 @@ class WorkflowVersion(Base):
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """每个新连接启用WAL模式：读不阻塞写，写不阻塞读"""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        # WAL模式下NORMAL已能保证数据库一致性，只在断电时可能丢失最后的提交
+        cursor.execute("PRAGMA synchronous=NORMAL")
+    finally:
+        cursor.close()
+
+
+class BatchWriter:
+    """
+    单线程批量写入器。
+
+    SQLite同一时刻只允许一个写事务，所以所有写操作都交给同一个线程执行；
+    排队中的写操作合并到一个事务里提交，减少fsync次数。
+    """
+
+    def __init__(self, session_factory: Callable, max_batch: int = DB_MAX_WRITE_BATCH):
+        self._session_factory = session_factory
+        self._max_batch = max_batch
+        self._queue: "queue.Queue[Tuple[Callable, Future]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+
+    def submit(self, write_fn: Callable) -> Future:
+        """提交写操作，write_fn接收session并返回结果（不要在其中commit）"""
+        future = Future()
+        self._queue.put((write_fn, future))
+        self._ensure_thread()
+        return future
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="copilot-db-writer", daemon=True)
+                self._thread.start()
+
+    def _next_batch(self) -> List[Tuple[Callable, Future]]:
+        batch = [self._queue.get()]
+        while len(batch) < self._max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return [item for item in batch if item[1].set_running_or_notify_cancel()]
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                results = self._commit(batch)
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                    continue
+                # 批量事务失败时逐个重试，避免一个失败的写操作连累其他操作
+                log.warning(f"Batched commit of {len(batch)} writes failed, retrying one by one: {str(e)}")
+                for item in batch:
+                    try:
+                        item[1].set_result(self._commit([item])[0])
+                    except Exception as item_error:
+                        item[1].set_exception(item_error)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def _commit(self, batch: List[Tuple[Callable, Future]]) -> List[Any]:
+        session = self._session_factory()
+        try:
+            results = [write_fn(session) for write_fn, _ in batch]
+            session.commit()
+            return results
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+
+class LatestVersion(NamedTuple):
+    id: int
+    workflow_data: str
+    workflow_data_ui: Optional[str]
+
+
+class CheckpointState(NamedTuple):
+    """重建后的版本内容，作为下一个版本的增量基准（只读）"""
+    id: int
+    depth: int
+    workflow_data: Any
+    workflow_data_ui: Optional[Dict[str, Any]]
+    # 最近一个带UI数据的版本的UI，没有UI的版本之后的UI增量都相对它计算
+    ui_base: Optional[Dict[str, Any]]
+
+
+# 从指定版本沿parent_id回溯到完整快照，按ID顺序返回整条增量链
+CHECKPOINT_CHAIN_SQL = text("""
+    WITH RECURSIVE chain(id, parent_id) AS (
+        SELECT id, parent_id FROM workflow_version WHERE id = :version_id
+        UNION ALL
+        SELECT v.id, v.parent_id FROM workflow_version v JOIN chain c ON v.id = c.parent_id
+    )
+    SELECT v.id, v.parent_id, v.delta_depth, v.workflow_data, v.workflow_data_ui, v.workflow_delta
+    FROM workflow_version v JOIN chain c ON v.id = c.id
+    ORDER BY v.id
+""")
+
+
+class LatestVersionCache:
+    """
+    按session缓存最新版本的JSON文本。
+
+    调用方会直接修改拿到的工作流字典，所以缓存文本、每次命中时重新解析，
+    保证每个调用方拿到独立的副本（json.loads比deepcopy更快）。
+    """
+
+    def __init__(self, max_sessions: int = LATEST_VERSION_CACHE_SIZE):
+        self._max_sessions = max_sessions
+        self._entries: "OrderedDict[str, LatestVersion]" = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self) -> int:
+        """每次失效都会递增，查询前记录，写回时用来丢弃过期的查询结果"""
+        return self._generation
+
+    def get(self, session_id: str) -> Optional[LatestVersion]:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                self._entries.move_to_end(session_id)
+            return entry
+
+    def put(self, session_id: str, entry: LatestVersion, generation: int) -> None:
+        with self._lock:
+            # 查询期间有新的提交，查询结果可能已经过期
+            if generation != self._generation:
+                return
+            self._entries[session_id] = entry
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self._max_sessions:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, session_ids) -> None:
+        with self._lock:
+            self._generation += 1
+            for session_id in session_ids:
+                self._entries.pop(session_id, None)
+
+
 class DatabaseManager:
     """数据库管理器"""
     
-    def __init__(self, db_path: str = None):
+    def __init__(self, db_path: str = None, pool_size: int = DB_POOL_SIZE):
+        if db_path is None:
+            # 可通过环境变量指定数据库文件，例如基准测试使用临时库
+            db_path = os.environ.get('COPILOT_WORKFLOW_DB_PATH') or None
         if db_path is None:
             # 默认数据库路径
             current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -41,65 +235,283 @@ class DatabaseManager:
             db_path = os.path.join(db_dir, 'workflow_debug.db')
         
         self.db_path = db_path
-        self.engine = create_engine(f'sqlite:///{db_path}', echo=False)
-        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        # 连接在读线程池、写线程和调用线程之间复用
+        self.engine = create_engine(
+            f'sqlite:///{db_path}',
+            echo=False,
+            poolclass=QueuePool,
+            pool_size=pool_size,
+            max_overflow=pool_size,
+            connect_args={"check_same_thread": False, "timeout": 30}
+        )
+        event.listen(self.engine, "connect", _set_sqlite_pragmas)
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=self.engine)
         
         # 创建表
         Base.metadata.create_all(bind=self.engine)
+        self._ensure_schema()
+
+        self._latest_versions = LatestVersionCache()
+        # 每个session最新版本的重建结果，只在写入线程中访问，用于计算下一个增量
+        self._checkpoint_states: "OrderedDict[str, CheckpointState]" = OrderedDict()
+        # 事务提交后再让缓存失效，保证之后的读取一定能看到新版本
+        event.listen(self.SessionLocal, "after_commit", self._invalidate_changed_sessions)
+        event.listen(self.SessionLocal, "after_rollback", self._discard_changed_sessions)
+
+        self._writer = BatchWriter(self.get_session)
+        self._read_executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="copilot-db-read")
         
     def get_session(self):
         """获取数据库会话"""
         return self.SessionLocal()
+
+    def _ensure_schema(self) -> None:
+        """为已有的数据库补建增量存储的列和索引（非破坏性升级）。create_all不会修改已存在的表。"""
+        with self.engine.begin() as conn:
+            existing_columns = {row[1] for row in conn.execute(text("PRAGMA table_info(workflow_version)"))}
+            if 'parent_id' not in existing_columns:
+                conn.execute(text("ALTER TABLE workflow_version ADD COLUMN parent_id INTEGER"))
+            if 'delta_depth' not in existing_columns:
+                conn.execute(text("ALTER TABLE workflow_version ADD COLUMN delta_depth INTEGER DEFAULT 0"))
+            if 'workflow_delta' not in existing_columns:
+                conn.execute(text("ALTER TABLE workflow_version ADD COLUMN workflow_delta BLOB"))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_workflow_version_session_id_id "
+                "ON workflow_version (session_id, id)"
+            ))
+
+    @staticmethod
+    def _mark_session_changed(session, session_id: str) -> None:
+        session.info.setdefault('changed_workflow_sessions', set()).add(session_id)
+
+    def _invalidate_changed_sessions(self, session) -> None:
+        changed = session.info.pop('changed_workflow_sessions', None)
+        new_versions = session.info.pop('new_workflow_versions', None)
+        if changed:
+            self._latest_versions.invalidate(changed)
+            # 新版本ID直接写入session状态，工具读取版本时不需要再查询数据库
+            session_states.workflows_committed(changed, new_versions)
+
+    def _discard_changed_sessions(self, session) -> None:
+        session.info.pop('new_workflow_versions', None)
+        if session.info.pop('changed_workflow_sessions', None):
+            # 回滚的写入可能已经更新了增量基准
+            self._checkpoint_states.clear()
+
+    def _load_checkpoint_state(self, session, version_id: int) -> Optional[CheckpointState]:
+        """从最近的完整快照开始依次应用增量，重建指定版本"""
+        rows = session.execute(CHECKPOINT_CHAIN_SQL, {"version_id": version_id}).fetchall()
+        if not rows:
+            return None
+
+        workflow_data = workflow_data_ui = ui_base = None
+        for row in rows:
+            if row.parent_id is None:
+                workflow_data = json.loads(row.workflow_data)
+                workflow_data_ui = json.loads(row.workflow_data_ui) if row.workflow_data_ui else None
+                ui_base = workflow_data_ui
+                continue
+            delta = json.loads(zlib.decompress(row.workflow_delta))
+            workflow_data = apply_patch(workflow_data, delta["api"])
+            if delta.get("ui") is None:
+                workflow_data_ui = None
+            else:
+                workflow_data_ui = ui_base = apply_patch(ui_base, delta["ui"])
+        last = rows[-1]
+        return CheckpointState(last.id, last.delta_depth or 0, workflow_data, workflow_data_ui, ui_base)
+
+    def _encode_version(self, version: WorkflowVersion, workflow_data: Any, workflow_data_ui: Optional[Dict[str, Any]], parent: Optional[CheckpointState]) -> CheckpointState:
+        """把版本内容编码为相对parent的增量；没有父版本、增量链过长或增量过大时保存完整快照"""
+        api_text = json.dumps(workflow_data)
+        ui_text = json.dumps(workflow_data_ui) if workflow_data_ui is not None else None
+        # 重新解析出独立的副本作为后续增量的基准，调用方之后修改传入的字典不会影响它
+        api = json.loads(api_text)
+        ui = json.loads(ui_text) if ui_text is not None else None
+
+        if parent is not None and parent.depth + 1 < CHECKPOINT_SNAPSHOT_INTERVAL:
+            delta = {
+                "api": make_patch(parent.workflow_data, api),
+                "ui": make_patch(parent.ui_base, ui) if ui is not None else None
+            }
+            compressed = zlib.compress(json.dumps(delta, separators=(",", ":")).encode("utf-8"))
+            if len(compressed) <= CHECKPOINT_DELTA_MAX_RATIO * (len(api_text) + len(ui_text or "")):
+                version.parent_id = parent.id
+                version.delta_depth = parent.depth + 1
+                version.workflow_delta = compressed
+                version.workflow_data = ""
+                version.workflow_data_ui = None
+                return CheckpointState(version.id, version.delta_depth, api, ui, ui if ui is not None else parent.ui_base)
+
+        version.parent_id = None
+        version.delta_depth = 0
+        version.workflow_delta = None
+        version.workflow_data = api_text
+        version.workflow_data_ui = ui_text
+        return CheckpointState(version.id, 0, api, ui, ui)
+
+    def _remember_checkpoint_state(self, session_id: str, state: CheckpointState) -> None:
+        self._checkpoint_states[session_id] = state
+        self._checkpoint_states.move_to_end(session_id)
+        while len(self._checkpoint_states) > LATEST_VERSION_CACHE_SIZE:
+            self._checkpoint_states.popitem(last=False)
+
+    def _latest_checkpoint_state(self, session, session_id: str) -> Optional[CheckpointState]:
+        """session最新版本的重建结果，新版本的增量相对它计算"""
+        latest_id = session.query(WorkflowVersion.id)\
+            .filter(WorkflowVersion.session_id == session_id)\
+            .order_by(WorkflowVersion.id.desc())\
+            .limit(1)\
+            .scalar()
+        if latest_id is None:
+            return None
+        state = self._checkpoint_states.get(session_id)
+        if state is not None and state.id == latest_id:
+            return state
+        return self._load_checkpoint_state(session, latest_id)
+
+    def _rewrite_version(self, session, version: WorkflowVersion, workflow_data: Any = None, workflow_data_ui: Optional[Dict[str, Any]] = None) -> None:
+        """修改已有版本的内容，并重新编码依赖它的后续增量（直到下一个完整快照）"""
+        descendants = []
+        for row in session.query(WorkflowVersion)\
+                .filter(WorkflowVersion.session_id == version.session_id, WorkflowVersion.id > version.id)\
+                .order_by(WorkflowVersion.id)\
+                .limit(CHECKPOINT_SNAPSHOT_INTERVAL)\
+                .all():
+            if row.parent_id is None:
+                break
+            descendants.append(row)
+
+        # 先重建所有受影响的版本，再统一重新编码
+        current = self._load_checkpoint_state(session, version.id)
+        parent = self._load_checkpoint_state(session, version.parent_id) if version.parent_id is not None else None
+        contents = [(version,
+                     workflow_data if workflow_data is not None else current.workflow_data,
+                     workflow_data_ui if workflow_data_ui is not None else current.workflow_data_ui)]
+        for row in descendants:
+            state = self._load_checkpoint_state(session, row.id)
+            contents.append((row, state.workflow_data, state.workflow_data_ui))
+
+        for row, row_data, row_data_ui in contents:
+            parent = self._encode_version(row, row_data, row_data_ui, parent)
+        # 同一批次中后续的写操作需要读到重新编码后的内容
+        session.flush()
+        self._checkpoint_states.pop(version.session_id, None)
+        self._mark_session_changed(session, version.session_id)
     
+    def submit_write(self, write_fn: Callable) -> Future:
+        """把写操作交给批量写入线程，返回concurrent.futures.Future"""
+        return self._writer.submit(write_fn)
+
+    async def run_write_async(self, write_fn: Callable) -> Any:
+        """在事件循环中执行写操作，不阻塞事件循环"""
+        return await asyncio.wrap_future(self.submit_write(write_fn))
+
+    async def run_read_async(self, read_fn: Callable, *args) -> Any:
+        """在读线程池中执行读操作，不阻塞事件循环"""
+        return await asyncio.get_running_loop().run_in_executor(self._read_executor, partial(read_fn, *args))
+
+    def _write_workflow_version(self, session, session_id: str, workflow_data: Dict[str, Any], workflow_data_ui: Dict[str, Any] = None, attributes: Optional[Dict[str, Any]] = None) -> int:
+        workflow_version = WorkflowVersion(
+            session_id=session_id,
+            attributes=json.dumps(attributes) if attributes else None
+        )
+        parent = self._latest_checkpoint_state(session, session_id)
+        state = self._encode_version(workflow_version, workflow_data, workflow_data_ui or None, parent)
+        session.add(workflow_version)
+        self._mark_session_changed(session, session_id)
+        # flush后即可拿到自增ID，事务由写入线程统一提交
+        session.flush()
+        self._remember_checkpoint_state(session_id, state._replace(id=workflow_version.id))
+        session.info.setdefault('new_workflow_versions', {})[session_id] = workflow_version.id
+        return workflow_version.id
+
+    def _write_workflow_edit(self, session, session_id: str, edit_fn: Callable[[Dict[str, Any]], Any], attributes: Optional[Dict[str, Any]] = None, checkpoint_attributes: Optional[Dict[str, Any]] = None) -> Optional[Tuple[Optional[int], int, Dict[str, Any], Any]]:
+        parent = self._latest_checkpoint_state(session, session_id)
+        if parent is None:
+            return None
+        # 基准是只读的，在独立副本上修改；edit_fn抛出异常时整个事务回滚，不会写入任何版本
+        workflow_data = json.loads(json.dumps(parent.workflow_data))
+        edit_result = edit_fn(workflow_data)
+
+        checkpoint_id = None
+        if checkpoint_attributes is not None:
+            # 修改前的checkpoint与最新版本内容相同，增量为空
+            checkpoint_id = self._write_workflow_version(
+                session, session_id, parent.workflow_data, parent.workflow_data_ui, checkpoint_attributes
+            )
+        version_id = self._write_workflow_version(session, session_id, workflow_data, None, attributes)
+        return checkpoint_id, version_id, workflow_data, edit_result
+
     def save_workflow_version(self, session_id: str, workflow_data: Dict[str, Any], workflow_data_ui: Dict[str, Any] = None, attributes: Optional[Dict[str, Any]] = None) -> int:
         """保存工作流版本，返回新版本的ID"""
-        session = self.get_session()
-        try:
-            workflow_version = WorkflowVersion(
-                session_id=session_id,
-                workflow_data=json.dumps(workflow_data),
-                workflow_data_ui=json.dumps(workflow_data_ui) if workflow_data_ui else None,
-                attributes=json.dumps(attributes) if attributes else None
-            )
-            session.add(workflow_version)
-            session.commit()
-            session.refresh(workflow_version)
-            return workflow_version.id
-        except Exception as e:
-            session.rollback()
-            raise e
-        finally:
-            session.close()
+        return self.submit_write(partial(
+            self._write_workflow_version, session_id=session_id, workflow_data=workflow_data,
+            workflow_data_ui=workflow_data_ui, attributes=attributes
+        )).result()
+
+    async def save_workflow_version_async(self, session_id: str, workflow_data: Dict[str, Any], workflow_data_ui: Dict[str, Any] = None, attributes: Optional[Dict[str, Any]] = None) -> int:
+        """异步保存工作流版本，与同时到达的其他写操作合并提交"""
+        return await self.run_write_async(partial(
+            self._write_workflow_version, session_id=session_id, workflow_data=workflow_data,
+            workflow_data_ui=workflow_data_ui, attributes=attributes
+        ))
     
-    def get_current_workflow_data(self, session_id: str) -> Optional[Dict[str, Any]]:
-        """获取当前session的最新工作流数据（最大ID版本）"""
+    async def edit_workflow_version_async(self, session_id: str, edit_fn: Callable[[Dict[str, Any]], Any], attributes: Optional[Dict[str, Any]] = None, checkpoint_attributes: Optional[Dict[str, Any]] = None) -> Optional[Tuple[Optional[int], int, Dict[str, Any], Any]]:
+        """
+        在写入线程中对session的最新版本执行edit_fn并保存为新版本，读取、修改和保存之间不会插入其他写操作。
+
+        edit_fn接收最新的API格式工作流（可直接修改），返回值原样返回；抛出异常时不保存。
+        传入checkpoint_attributes时，先在同一事务中保存一个修改前的checkpoint版本。
+        返回(checkpoint_id, version_id, 修改后的工作流, edit_fn返回值)，session没有工作流时返回None。
+        """
+        return await self.run_write_async(partial(
+            self._write_workflow_edit, session_id=session_id, edit_fn=edit_fn,
+            attributes=attributes, checkpoint_attributes=checkpoint_attributes
+        ))
+    
+    def get_latest_version(self, session_id: str) -> Optional[LatestVersion]:
+        """获取session的最新版本（最大ID版本），优先读取缓存"""
+        latest_version = self._latest_versions.get(session_id)
+        if latest_version is not None:
+            return latest_version
+
+        generation = self._latest_versions.generation
         session = self.get_session()
         try:
-            latest_version = session.query(WorkflowVersion)\
+            row = session.query(WorkflowVersion.id, WorkflowVersion.parent_id, WorkflowVersion.workflow_data, WorkflowVersion.workflow_data_ui)\
                 .filter(WorkflowVersion.session_id == session_id)\
                 .order_by(WorkflowVersion.id.desc())\
                 .first()
-            
-            if latest_version:
-                return json.loads(latest_version.workflow_data)
-            return None
+            if row is None:
+                return None
+            if row.parent_id is None:
+                latest_version = LatestVersion(row.id, row.workflow_data, row.workflow_data_ui)
+            else:
+                state = self._load_checkpoint_state(session, row.id)
+                latest_version = LatestVersion(
+                    row.id,
+                    json.dumps(state.workflow_data),
+                    json.dumps(state.workflow_data_ui) if state.workflow_data_ui is not None else None
+                )
         finally:
             session.close()
+
+        self._latest_versions.put(session_id, latest_version, generation)
+        return latest_version
+
+    def get_current_workflow_data(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """获取当前session的最新工作流数据（最大ID版本）"""
+        latest_version = self.get_latest_version(session_id)
+        if latest_version:
+            return json.loads(latest_version.workflow_data)
+        return None
     
     def get_current_workflow_data_ui(self, session_id: str) -> Optional[Dict[str, Any]]:
         """获取当前session的最新工作流数据（最大ID版本）"""
-        session = self.get_session()
-        try:
-            latest_version = session.query(WorkflowVersion)\
-                .filter(WorkflowVersion.session_id == session_id)\
-                .order_by(WorkflowVersion.id.desc())\
-                .first()
-            
-            if latest_version:
-                return json.loads(latest_version.workflow_data_ui)
-            return None
-        finally:
-            session.close() 
+        latest_version = self.get_latest_version(session_id)
+        if latest_version:
+            return json.loads(latest_version.workflow_data_ui)
+        return None
     
     def get_workflow_version_by_id(self, version_id: int) -> Optional[Dict[str, Any]]:
         """根据版本ID获取工作流数据"""
@@ -111,53 +523,53 @@ class DatabaseManager:
             
             if version:
                 result = version.to_dict()
+                if version.parent_id is not None:
+                    # 增量版本：从最近的完整快照重建
+                    state = self._load_checkpoint_state(session, version.id)
+                    result['workflow_data'] = state.workflow_data
+                    if state.workflow_data_ui is not None:
+                        result['workflow_data_ui'] = state.workflow_data_ui
                 # 添加UI格式的工作流数据
-                if version.workflow_data_ui:
+                elif version.workflow_data_ui:
                     result['workflow_data_ui'] = json.loads(version.workflow_data_ui)
                 return result
             return None
         finally:
             session.close()
     
+    def _write_workflow_update(self, session, version_id: int, workflow_data: Dict[str, Any], attributes: Optional[Dict[str, Any]] = None) -> bool:
+        version = session.query(WorkflowVersion)\
+            .filter(WorkflowVersion.id == version_id)\
+            .first()
+
+        if version:
+            self._rewrite_version(session, version, workflow_data=workflow_data)
+            if attributes:
+                version.attributes = json.dumps(attributes)
+            return True
+        return False
+
     def update_workflow_version(self, version_id: int, workflow_data: Dict[str, Any], attributes: Optional[Dict[str, Any]] = None) -> bool:
         """更新指定版本的工作流数据"""
-        session = self.get_session()
-        try:
-            version = session.query(WorkflowVersion)\
-                .filter(WorkflowVersion.id == version_id)\
-                .first()
+        return self.submit_write(partial(self._write_workflow_update, version_id=version_id, workflow_data=workflow_data, attributes=attributes)).result()
             
-            if version:
-                version.workflow_data = json.dumps(workflow_data)
-                if attributes:
-                    version.attributes = json.dumps(attributes)
-                session.commit()
-                return True
-            return False
-        except Exception as e:
-            session.rollback()
-            raise e
-        finally:
-            session.close()
+    def _write_workflow_ui(self, session, version_id: int, workflow_data_ui: Dict[str, Any]) -> bool:
+        version = session.query(WorkflowVersion)\
+            .filter(WorkflowVersion.id == version_id)\
+            .first()
+
+        if version:
+            self._rewrite_version(session, version, workflow_data_ui=workflow_data_ui)
+            return True
+        return False
     
     def update_workflow_ui(self, version_id: int, workflow_data_ui: Dict[str, Any]) -> bool:
         """只更新指定版本的workflow_data_ui字段，不影响其他字段"""
-        session = self.get_session()
-        try:
-            version = session.query(WorkflowVersion)\
-                .filter(WorkflowVersion.id == version_id)\
-                .first()
+        return self.submit_write(partial(self._write_workflow_ui, version_id=version_id, workflow_data_ui=workflow_data_ui)).result()
             
-            if version:
-                version.workflow_data_ui = json.dumps(workflow_data_ui)
-                session.commit()
-                return True
-            return False
-        except Exception as e:
-            session.rollback()
-            raise e
-        finally:
-            session.close()
+    async def update_workflow_ui_async(self, version_id: int, workflow_data_ui: Dict[str, Any]) -> bool:
+        """异步更新指定版本的workflow_data_ui字段"""
+        return await self.run_write_async(partial(self._write_workflow_ui, version_id=version_id, workflow_data_ui=workflow_data_ui))
 
 # 全局数据库管理器实例
 db_manager = DatabaseManager()
@@ -180,4 +592,56 @@ def get_workflow_data_by_id(version_id: int) -> Optional[Dict[str, Any]]:
 
 def update_workflow_ui_by_id(version_id: int, workflow_data_ui: Dict[str, Any]) -> bool:
     """只更新指定版本的workflow_data_ui字段的便捷函数"""
-    return db_manager.update_workflow_ui(version_id, workflow_data_ui) 
\ No newline at end of file
+    return db_manager.update_workflow_ui(version_id, workflow_data_ui)
+
+# 以下异步版本供事件循环中的调用方（aiohttp接口、agent工具）使用，数据库IO不会阻塞事件循环
+
+async def get_workflow_data_async(session_id: str) -> Optional[Dict[str, Any]]:
+    """获取当前session的工作流数据的异步便捷函数，命中缓存时直接解析，不经过读线程池"""
+    latest_version = db_manager._latest_versions.get(session_id)
+    if latest_version is not None:
+        return json.loads(latest_version.workflow_data)
+    return await db_manager.run_read_async(db_manager.get_current_workflow_data, session_id)
+
+async def get_workflow_data_ui_async(session_id: str) -> Optional[Dict[str, Any]]:
+    """获取当前session的UI格式工作流数据的异步便捷函数"""
+    return await db_manager.run_read_async(db_manager.get_current_workflow_data_ui, session_id)
+
+async def get_workflow_version_key_async(session_id: str) -> Optional[Tuple[int, int]]:
+    """
+    获取当前session最新工作流的(版本ID, 修订号)，用作派生缓存的key。
+    修订号在每次提交改动该session的工作流时变化（包括原地改写版本内容）。
+    通常直接从session状态中读取，不访问数据库。
+    """
+    key = session_states.workflow_key(session_id)
+    if key is not None:
+        return key
+    generation = session_states.generation
+    latest_version = db_manager._latest_versions.get(session_id)
+    if latest_version is None:
+        latest_version = await db_manager.run_read_async(db_manager.get_latest_version, session_id)
+    if latest_version is None:
+        return None
+    session_states.load_workflow_version(session_id, latest_version.id, generation)
+    return session_states.workflow_key(session_id) or (latest_version.id, 0)
+
+async def get_workflow_version_id_async(session_id: str) -> Optional[int]:
+    """获取当前session最新版本ID的异步便捷函数，命中缓存时不访问数据库"""
+    key = await get_workflow_version_key_async(session_id)
+    return key[0] if key else None
+
+async def save_workflow_data_async(session_id: str, workflow_data: Dict[str, Any], workflow_data_ui: Dict[str, Any] = None, attributes: Optional[Dict[str, Any]] = None) -> int:
+    """保存工作流数据的异步便捷函数"""
+    return await db_manager.save_workflow_version_async(session_id, workflow_data, workflow_data_ui, attributes)
+
+async def edit_workflow_data_async(session_id: str, edit_fn: Callable[[Dict[str, Any]], Any], attributes: Optional[Dict[str, Any]] = None, checkpoint_attributes: Optional[Dict[str, Any]] = None) -> Optional[Tuple[Optional[int], int, Dict[str, Any], Any]]:
+    """原子地修改当前session最新工作流的异步便捷函数，新版本只保存增量"""
+    return await db_manager.edit_workflow_version_async(session_id, edit_fn, attributes, checkpoint_attributes)
+
+async def get_workflow_data_by_id_async(version_id: int) -> Optional[Dict[str, Any]]:
+    """根据版本ID获取工作流数据的异步便捷函数"""
+    return await db_manager.run_read_async(db_manager.get_workflow_version_by_id, version_id)
+
+async def update_workflow_ui_by_id_async(version_id: int, workflow_data_ui: Dict[str, Any]) -> bool:
+    """只更新指定版本的workflow_data_ui字段的异步便捷函数"""
+    return await db_manager.update_workflow_ui_async(version_id, workflow_data_ui)
@@ -10,7 +10,8 @@ from openai.types.responses import ResponseTextDeltaEvent
 
 from ..service.parameter_tools import *
 from ..service.link_agent_tools import *
-from ..dao.workflow_table import get_workflow_data, save_workflow_data
+from ..service.tool_layer import run_read_only_tools, parallel_tool_model_settings, start_tool_run
+from ..dao.workflow_table import get_workflow_data_async, save_workflow_data_async
 from ..utils.request_context import get_session_id, get_config
 
 # Import ComfyUI internal modules
@@ -27,26 +28,29 @@ async def run_workflow() -> str:
         if not session_id:
             return json.dumps({"error": "No session_id found in context"})
             
-        workflow_data = get_workflow_data(session_id)
+        workflow_data = await get_workflow_data_async(session_id)
         if not workflow_data:
             return json.dumps({"error": "No workflow data found for this session"})
         
-        log.info(f"Run workflow for session {session_id}")
+        log.info(f"Validate workflow for session {session_id}")
         
-        # 使用 ComfyGateway 调用 server.py 的 post_prompt 逻辑
+        # 只做校验（execution.validate_inputs），不会提交到PromptQueue执行；未变化节点的校验结果会被缓存复用
         from ..utils.comfy_gateway import ComfyGateway
         
-        # 简化方法：直接使用 requests 同步调用
         gateway = ComfyGateway()
+        if not gateway.in_process:
+            # 远程ComfyUI没有只校验的接口，沿用 /api/prompt 校验（校验通过会提交执行）
+            request_data = {
+                "prompt": workflow_data,
+                "client_id": f"debug_agent_{session_id}"
+            }
+            result = await gateway.run_prompt(request_data)
+            log.info(result)
+            return json.dumps(result)
 
-        # 准备请求数据格式（与server.py post_prompt接口一致）
-        request_data = {
-            "prompt": workflow_data,
-            "client_id": f"debug_agent_{session_id}"
-        }
-        
-        result = await gateway.run_prompt(request_data)
-        log.info(result)
+        result = await gateway.validate_prompt(workflow_data)
+        log.info(f"Validation result: success={result.get('success')}, errors={len(result.get('errors', []))}, "
+                 f"validated={result.get('validated_nodes', 0)}, cached={result.get('cached_nodes', 0)}")
         
         return json.dumps(result)
         
@@ -164,7 +168,7 @@ def analyze_error_type(error_data: str) -> str:
         })
 
 @function_tool
-def save_current_workflow(workflow_data: str) -> str:
+async def save_current_workflow(workflow_data: str) -> str:
     """保存当前工作流数据到数据库，workflow_data应为JSON字符串"""
     try:
         session_id = get_session_id()
@@ -174,7 +178,7 @@ def save_current_workflow(workflow_data: str) -> str:
         # 解析JSON字符串
         workflow_dict = json.loads(workflow_data) if isinstance(workflow_data, str) else workflow_data
         
-        version_id = save_workflow_data(
+        version_id = await save_workflow_data_async(
             session_id, 
             workflow_dict, 
             attributes={"action": "debug_save", "description": "Workflow saved during debugging"}
@@ -211,7 +215,7 @@ async def debug_workflow_errors(workflow_data: Dict[str, Any]):
         
         # 1. 保存工作流数据到数据库
         log.info(f"Saving workflow data for session {session_id}")
-        save_result = save_workflow_data(
+        save_result = await save_workflow_data_async(
             session_id, 
             workflow_data, 
             attributes={"action": "debug_start", "description": "Initial workflow save for debugging"}
@@ -298,7 +302,8 @@ Start by validating the workflow to see its current state.""",
             
             **Remember**: Focus on making necessary structural changes, then ALWAYS transfer back to let the coordinator verify the workflow.
             """,
-            tools=[get_current_workflow, get_node_info, update_workflow],
+            tools=[get_current_workflow, get_node_info, update_workflow, run_read_only_tools],
+            model_settings=parallel_tool_model_settings(),
             handoffs=[agent],
         )
         
@@ -386,7 +391,8 @@ Start by validating the workflow to see its current state.""",
             **Remember**: You are the specialist for ALL connection-related issues. Make the necessary structural changes efficiently, then ALWAYS transfer back for workflow verification.
             """,
             tools=[analyze_missing_connections, apply_connection_fixes,
-                   get_current_workflow, get_node_info],
+                   get_current_workflow, get_node_info, run_read_only_tools],
+            model_settings=parallel_tool_model_settings(),
             handoffs=[agent],
         )
 
@@ -449,10 +455,10 @@ Start by validating the workflow to see its current state.""",
             **Other Parameter Types** (error_type: "non_enum_parameter"):
             - Provide configuration guidance based on parameter type then TRANSFER back
             
-            3. **For multiple errors**: Process them systematically, one by one
+            3. **For multiple errors**: Look up all of them at once (parallel tool calls or run_read_only_tools()), then fix them systematically, one by one
             
             4. **Smart Fallback Strategy**:
-            - If find_matching_parameter_value() fails, use get_model_files() to check if it's a model issue
+            - If find_matching_parameter_value() fails, use get_model_files() to check if it's a model issue; pass query (the missing model name) to get the closest local models ranked by similarity
             - Apply model system matching logic (SDXL/Flux/wan2.1/wan2.2 systems with categories)
             - If still unclear, use suggest_model_download() as last resort (no transfer back)
             
@@ -477,7 +483,8 @@ Start by validating the workflow to see its current state.""",
             **Key Enhancement**: You can now automatically fix many parameter issues (images, enums, intelligent model matching) without user intervention, but you still need downloads for missing models when no similar models exist. Be proactive in applying fixes when possible. When providing model download suggestions, that is your final action.
             """,
             tools=[find_matching_parameter_value, get_model_files, 
-                suggest_model_download, update_workflow_parameter, get_current_workflow],
+                suggest_model_download, update_workflow_parameter, get_current_workflow, run_read_only_tools],
+            model_settings=parallel_tool_model_settings(),
             handoffs=[agent],
         )
 
@@ -488,6 +495,8 @@ Start by validating the workflow to see its current state.""",
             
         log.info(f"-- Starting workflow validation process for session {session_id}")
 
+        # 本次调试中只读工具的结果按(session, 工作流版本, 参数)缓存，协调者和各专家共享
+        tool_memo = start_tool_run()
         result = Runner.run_streamed(
             agent,
             input=messages,
@@ -625,13 +634,14 @@ Start by validating the workflow to see its current state.""",
                     yield (current_text, None)
 
         log.info("\n=== Debug process complete ===")
+        log.info(f"-- Read-only tool memo: {tool_memo.hits} hits, {tool_memo.misses} misses")
         
         # Save final workflow checkpoint after debugging completion
         debug_completion_checkpoint_id = None
         try:
-            current_workflow = get_workflow_data(session_id)
+            current_workflow = await get_workflow_data_async(session_id)
             if current_workflow:
-                debug_completion_checkpoint_id = save_workflow_data(
+                debug_completion_checkpoint_id = await save_workflow_data_async(
                     session_id, 
                     current_workflow,
                     workflow_data_ui=None,  # UI format not available here
@@ -0,0 +1,345 @@
+"""
+Token-budgeted compaction of the chat history sent to the model.
+
+The frontend sends the whole conversation on every turn, including inline
+base64 images, so prompts grow without bound during a session. Before a run,
+comfyui_agent_invoke passes the history through compact_history, which keeps
+the latest user message untouched and applies these steps to older messages,
+stopping as soon as the estimated size fits the model's budget:
+
+1. Images in older messages are always shrunk to small JPEG thumbnails (data
+   URLs) or replaced by a text reference (remote URLs, or when Pillow cannot
+   decode them): the full-size images were already seen by the model.
+   Thumbnails are cached by image content, since the same history comes back
+   on every turn.
+2. Tool outputs and long assistant messages outside the most recent turns are
+   cut down to their beginning and end.
+3. Remaining images in older messages become text references.
+4. Tool calls and their outputs outside the most recent turns are dropped.
+5. Tool outputs of the recent turns are cut down as well.
+6. The oldest messages are dropped, leaving a note that history was omitted.
+
+compact_history decodes and encodes images, so callers on the event loop run it
+in a worker thread (asyncio.to_thread).
+
+Tokens are estimated (about 4 ASCII characters or 1 other character per token,
+a fixed cost per image), which is close enough for budgeting across providers
+without a tokenizer dependency.
+
+Budgets are per model: COPILOT_HISTORY_TOKEN_BUDGET sets the default and
+COPILOT_HISTORY_TOKEN_BUDGETS takes a JSON object of model name prefix to
+budget, e.g. {"qwen": 6000, "gpt-4.1": 100000}. LMStudio endpoints default to
+LMSTUDIO_HISTORY_TOKEN_BUDGET since local models usually have small contexts.
+"""
+
+import base64
+import binascii
+import copy
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..utils.globals import is_lmstudio_url
+from ..utils.logger import log
+
+DEFAULT_HISTORY_TOKEN_BUDGET = int(os.environ.get("COPILOT_HISTORY_TOKEN_BUDGET", "32000"))
+LMSTUDIO_HISTORY_TOKEN_BUDGET = int(os.environ.get("COPILOT_LMSTUDIO_HISTORY_TOKEN_BUDGET", "6000"))
+# Longest prefix wins; leaves room for instructions, tool schemas and the answer
+MODEL_HISTORY_TOKEN_BUDGETS: Dict[str, int] = {
+    "gpt-4.1": 100000,
+    "gpt-4o": 64000,
+    "gpt-5": 100000,
+    "o3": 64000,
+    "o4": 64000,
+    "gemini": 100000,
+    "claude": 64000,
+    "us.anthropic.claude": 64000,
+}
+# Messages in the most recent user turns keep their tool outputs and full text
+RECENT_TURNS = 2
+IMAGE_TOKENS_LOW_DETAIL = 85
+IMAGE_TOKENS_HIGH_DETAIL = 1105
+THUMBNAIL_SIZE = 256
+THUMBNAIL_QUALITY = 70
+TRIMMED_TEXT_CHARS = 600
+# Thumbnails of the images seen recently, by sha256 of their data URL
+THUMBNAIL_CACHE_SIZE = 256
+
+_IMAGE_PART_TYPES = ("input_image", "image_url")
+_TOOL_CALL_TYPES = ("function_call", "computer_call", "file_search_call", "web_search_call")
+_TOOL_OUTPUT_TYPES = ("function_call_output", "computer_call_output")
+
+_thumbnails: "OrderedDict[str, Optional[str]]" = OrderedDict()
+_thumbnails_lock = threading.Lock()
+
+
+def _load_budget_overrides() -> Dict[str, int]:
+    raw = os.environ.get("COPILOT_HISTORY_TOKEN_BUDGETS")
+    if not raw:
+        return {}
+    try:
+        return {str(prefix): int(budget) for prefix, budget in json.loads(raw).items()}
+    except (ValueError, TypeError, AttributeError) as e:
+        log.warning(f"Ignoring invalid COPILOT_HISTORY_TOKEN_BUDGETS: {e}")
+        return {}
+
+
+def history_token_budget(model_name: Optional[str], base_url: Optional[str] = None) -> int:
+    """Token budget for the history sent to model_name."""
+    budgets = dict(MODEL_HISTORY_TOKEN_BUDGETS, **_load_budget_overrides())
+    name = (model_name or "").lower()
+    matches = [prefix for prefix in budgets if name.startswith(prefix.lower())]
+    if matches:
+        return budgets[max(matches, key=len)]
+    if base_url and is_lmstudio_url(base_url):
+        return LMSTUDIO_HISTORY_TOKEN_BUDGET
+    return DEFAULT_HISTORY_TOKEN_BUDGET
+
+
+def estimate_text_tokens(text: str) -> int:
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def _image_url(part: Dict[str, Any]) -> str:
+    url = part.get("image_url")
+    if isinstance(url, dict):
+        url = url.get("url")
+    return url or ""
+
+
+def _estimate_tokens(value: Any) -> int:
+    if isinstance(value, str):
+        return estimate_text_tokens(value)
+    if isinstance(value, list):
+        return sum(_estimate_tokens(item) for item in value)
+    if isinstance(value, dict):
+        if value.get("type") in _IMAGE_PART_TYPES:
+            detail = value.get("detail")
+            if isinstance(value.get("image_url"), dict):
+                detail = value["image_url"].get("detail", detail)
+            return IMAGE_TOKENS_LOW_DETAIL if detail == "low" else IMAGE_TOKENS_HIGH_DETAIL
+        # Keys and structure cost a few tokens per field
+        return sum(_estimate_tokens(item) + 2 for key, item in value.items() if key not in ("id", "call_id"))
+    return 1 if value is not None else 0
+
+
+def estimate_tokens(messages: List[Dict[str, Any]]) -> int:
+    """Estimated prompt tokens of a list of input items."""
+    return sum(_estimate_tokens(message) + 4 for message in messages)
+
+
+def _trim_text(text: str, limit: int = TRIMMED_TEXT_CHARS) -> str:
+    if len(text) <= limit:
+        return text
+    head = limit * 2 // 3
+    tail = limit - head
+    return f"{text[:head]}\n[... {len(text) - limit} characters omitted from earlier history ...]\n{text[-tail:]}"
+
+
+def _image_reference(url: str) -> str:
+    if url.startswith("data:"):
+        mime_type = url[5:].split(";", 1)[0] or "image"
+        size_kb = len(url) * 3 // 4 // 1024
+        return f"[Earlier image omitted ({mime_type}, {size_kb} KB)]"
+    return f"[Earlier image omitted: {url}]"
+
+
+def _thumbnail(url: str) -> Optional[str]:
+    """JPEG thumbnail of a data URL image, or None when it cannot be decoded."""
+    if not url.startswith("data:") or "," not in url:
+        return None
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    with _thumbnails_lock:
+        if key in _thumbnails:
+            _thumbnails.move_to_end(key)
+            return _thumbnails[key]
+    thumbnail = _make_thumbnail(url)
+    with _thumbnails_lock:
+        _thumbnails[key] = thumbnail
+        while len(_thumbnails) > THUMBNAIL_CACHE_SIZE:
+            _thumbnails.popitem(last=False)
+    return thumbnail
+
+
+def _make_thumbnail(url: str) -> Optional[str]:
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    try:
+        image = Image.open(io.BytesIO(base64.b64decode(url.split(",", 1)[1])))
+        if max(image.size) <= THUMBNAIL_SIZE and url.startswith("data:image/jpeg"):
+            return url
+        image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        buffer = io.BytesIO()
+        image.convert("RGB").save(buffer, format="JPEG", quality=THUMBNAIL_QUALITY)
+    except (OSError, ValueError, binascii.Error) as e:
+        log.debug(f"Could not thumbnail history image: {e}")
+        return None
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def _text_part(part: Dict[str, Any], text: str) -> Dict[str, Any]:
+    # Chat Completions style parts use "text", Responses style parts use "input_text"
+    return {"type": "text" if part.get("type") == "image_url" else "input_text", "text": text}
+
+
+def _map_images(message: Dict[str, Any], replace) -> bool:
+    content = message.get("content")
+    if not isinstance(content, list):
+        return False
+    changed = False
+    new_content = []
+    for part in content:
+        if isinstance(part, dict) and part.get("type") in _IMAGE_PART_TYPES:
+            replacement = replace(part)
+            if replacement is not part:
+                changed = True
+            new_content.append(replacement)
+        else:
+            new_content.append(part)
+    if changed:
+        message["content"] = new_content
+    return changed
+
+
+def _map_all_images(messages: List[Dict[str, Any]], replace) -> bool:
+    changed = [_map_images(message, replace) for message in messages]
+    return any(changed)
+
+
+def _shrink_image(part: Dict[str, Any]) -> Dict[str, Any]:
+    url = _image_url(part)
+    if part.get("_thumbnail"):
+        return part
+    thumbnail = _thumbnail(url)
+    if thumbnail is None:
+        return _text_part(part, _image_reference(url))
+    # The thumbnail may become a text reference later on, which describes the original image
+    if part.get("type") == "image_url":
+        return {"type": "image_url", "image_url": {"url": thumbnail, "detail": "low"}, "_thumbnail": _image_reference(url)}
+    return {"type": "input_image", "image_url": thumbnail, "detail": "low", "_thumbnail": _image_reference(url)}
+
+
+def _reference_image(part: Dict[str, Any]) -> Dict[str, Any]:
+    return _text_part(part, part.get("_thumbnail") or _image_reference(_image_url(part)))
+
+
+def _is_tool_output(message: Dict[str, Any]) -> bool:
+    return message.get("type") in _TOOL_OUTPUT_TYPES or message.get("role") == "tool"
+
+
+def _is_tool_call(message: Dict[str, Any]) -> bool:
+    return message.get("type") in _TOOL_CALL_TYPES or bool(message.get("tool_calls"))
+
+
+def _trim_message_text(message: Dict[str, Any]) -> bool:
+    key = "output" if message.get("type") in _TOOL_OUTPUT_TYPES else "content"
+    value = message.get(key)
+    if isinstance(value, str):
+        trimmed = _trim_text(value)
+        if trimmed != value:
+            message[key] = trimmed
+            return True
+    elif isinstance(value, list):
+        changed = False
+        for part in value:
+            if isinstance(part, dict) and isinstance(part.get("text"), str):
+                trimmed = _trim_text(part["text"])
+                if trimmed != part["text"]:
+                    part["text"] = trimmed
+                    changed = True
+        return changed
+    return False
+
+
+def _recent_start(messages: List[Dict[str, Any]]) -> int:
+    """Index of the first message of the most recent RECENT_TURNS user turns."""
+    seen = 0
+    for index in range(len(messages) - 1, -1, -1):
+        if messages[index].get("role") == "user" and not _is_tool_output(messages[index]):
+            seen += 1
+            if seen == RECENT_TURNS:
+                return index
+    return 0
+
+
+def _strip_markers(messages: List[Dict[str, Any]]) -> None:
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            for part in content:
+                if isinstance(part, dict):
+                    part.pop("_thumbnail", None)
+
+
+def compact_history(messages: List[Dict[str, Any]], budget: int) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Return a copy of messages that fits the token budget, plus statistics.
+
+    The last message is never modified.
+    """
+    if not messages:
+        return messages, {"tokens_before": 0, "tokens_after": 0, "steps": []}
+
+    messages = copy.deepcopy(messages)
+    tokens_before = estimate_tokens(messages)
+    steps: List[str] = []
+    older = messages[:-1]
+    recent_start = _recent_start(messages)
+
+    # 1. Old full-size images are never needed again; thumbnails keep the visual context
+    if _map_all_images(older, _shrink_image):
+        steps.append("thumbnails")
+
+    def fits() -> bool:
+        return estimate_tokens(messages) <= budget
+
+    # 2. Trim stale tool outputs and long assistant answers
+    if not fits():
+        trimmed = False
+        for message in messages[:recent_start]:
+            if _is_tool_output(message) or message.get("role") == "assistant":
+                trimmed = _trim_message_text(message) or trimmed
+        if trimmed:
+            steps.append("trim_tool_outputs")
+
+    # 3. Thumbnails become text references
+    if not fits() and _map_all_images(older, _reference_image):
+        steps.append("image_references")
+
+    # 4. Drop stale tool calls together with their outputs, so calls and outputs stay paired
+    if not fits():
+        kept = [message for message in messages[:recent_start] if not (_is_tool_call(message) or _is_tool_output(message))]
+        if len(kept) < recent_start:
+            messages = kept + messages[recent_start:]
+            steps.append("drop_tool_outputs")
+
+    # 5. Trim tool outputs of the recent turns too, before losing whole messages
+    if not fits() and any([_trim_message_text(message) for message in older if _is_tool_output(message)]):
+        steps.append("trim_recent_tool_outputs")
+
+    # 6. Drop the oldest messages, keeping whole user turns
+    if not fits():
+        dropped = 0
+        while len(messages) > 1 and not fits():
+            messages.pop(0)
+            dropped += 1
+            # Do not start the history with an orphaned tool output or assistant reply
+            while len(messages) > 1 and messages[0].get("role") != "user":
+                messages.pop(0)
+                dropped += 1
+        if dropped:
+            messages.insert(0, {
+                "role": "user",
+                "content": f"[{dropped} earlier messages of this conversation were omitted to fit the context window]"
+            })
+            steps.append(f"drop_{dropped}_messages")
+
+    _strip_markers(messages)
+    stats = {"tokens_before": tokens_before, "tokens_after": estimate_tokens(messages), "steps": steps}
+    return messages, stats
@@ -6,11 +6,14 @@ from typing import Dict, Optional, List
 
 from agents.tool import function_tool
 from ..utils.request_context import get_session_id
-from ..dao.workflow_table import get_workflow_data, save_workflow_data
-from ..utils.comfy_gateway import get_object_info
+from ..dao.workflow_table import get_workflow_data_async, save_workflow_data_async
+from ..utils.object_info_cache import ObjectInfoIndex, get_object_info_index
+from .link_analysis import get_workflow_link_index
+from .tool_layer import read_only_tool
 from ..utils.logger import log
 
 @function_tool
+@read_only_tool(uses_workflow=True)
 async def analyze_missing_connections() -> str:
     """
     分析工作流中缺失的连接，枚举所有可能的连接选项和所需的新节点。
@@ -29,11 +32,13 @@ async def analyze_missing_connections() -> str:
             log.error("analyze_missing_connections: No session_id found in context")
             return json.dumps({"error": "No session_id found in context"})
         
-        workflow_data = get_workflow_data(session_id)
+        workflow_data = await get_workflow_data_async(session_id)
         if not workflow_data:
             return json.dumps({"error": "No workflow data found for this session"})
         
-        object_info = await get_object_info()
+        object_info_index = await get_object_info_index()
+        # 按类型索引的连接分析引擎，工作流只有部分节点变化时增量更新
+        link_index = get_workflow_link_index(session_id, workflow_data, object_info_index)
         
         analysis_result = {
             "missing_connections": [],
@@ -50,160 +55,100 @@ async def analyze_missing_connections() -> str:
             }
         }
         
-        # 构建现有节点的输出映射
-        available_outputs = {}
-        for node_id, node_data in workflow_data.items():
-            node_class = node_data.get("class_type")
-            if node_class in object_info and "output" in object_info[node_class]:
-                outputs = object_info[node_class]["output"]
-                available_outputs[node_id] = {
-                    "class_type": node_class,
-                    "outputs": [(i, output_type) for i, output_type in enumerate(outputs)]
+        # 检查每个节点缺失的required input
+        for node_id, node_class, input_name, input_config, expected_types in link_index.missing_required_inputs():
+            # 发现缺失的连接
+            missing_connection = {
+                "node_id": node_id,
+                "node_class": node_class,
+                "input_name": input_name,
+                "input_config": input_config,
+                "required": True,
+                "expected_types": expected_types
+            }
+            
+            # 检查是否是通用输入（可以接受任意类型）
+            is_universal_input = "*" in expected_types
+            
+            if is_universal_input:
+                # 这是一个通用输入端口，可以连接任意输出
+                universal_input = {
+                    "node_id": node_id,
+                    "node_class": node_class,
+                    "input_name": input_name,
+                    "input_config": input_config,
+                    "can_connect_any_output": True
                 }
-        
-        # 分析每个节点的缺失连接
-        for node_id, node_data in workflow_data.items():
-            node_class = node_data.get("class_type")
-            if node_class not in object_info:
-                continue
+                analysis_result["universal_inputs"].append(universal_input)
+                analysis_result["connection_summary"]["universal_inputs_count"] += 1
+                analysis_result["connection_summary"]["auto_fixable"] += 1
                 
-            node_info = object_info[node_class]
-            if "input" not in node_info:
-                continue
+                # 对于通用输入，我们不列出所有可能的连接，而是标记为通用
+                missing_connection["possible_matches"] = "universal"
+                missing_connection["is_universal"] = True
+            else:
+                # 通过输出类型索引查找具体类型匹配的连接
+                possible_matches = link_index.find_matches(expected_types, exclude_node_id=node_id)
                 
-            required_inputs = node_info["input"].get("required", {})
-            current_inputs = node_data.get("inputs", {})
-            
-            # 检查每个required input
-            for input_name, input_config in required_inputs.items():
-                if input_name not in current_inputs:
-                    # 发现缺失的连接
-                    missing_connection = {
-                        "node_id": node_id,
-                        "node_class": node_class,
-                        "input_name": input_name,
-                        "input_config": input_config,
-                        "required": True
-                    }
-                    
-                    # 分析输入类型
-                    if isinstance(input_config, (list, tuple)) and len(input_config) > 0:
-                        expected_types = input_config[0] if isinstance(input_config[0], list) else [input_config[0]]
-                    
-                    missing_connection["expected_types"] = expected_types
-                    
-                    # 检查是否是通用输入（可以接受任意类型）
-                    is_universal_input = "*" in expected_types
-                    
-                    if is_universal_input:
-                        # 这是一个通用输入端口，可以连接任意输出
-                        universal_input = {
-                            "node_id": node_id,
-                            "node_class": node_class,
-                            "input_name": input_name,
-                            "input_config": input_config,
-                            "can_connect_any_output": True
-                        }
-                        analysis_result["universal_inputs"].append(universal_input)
-                        analysis_result["connection_summary"]["universal_inputs_count"] += 1
-                        analysis_result["connection_summary"]["auto_fixable"] += 1
-                        
-                        # 对于通用输入，我们不列出所有可能的连接，而是标记为通用
-                        missing_connection["possible_matches"] = "universal"
-                        missing_connection["is_universal"] = True
-                    else:
-                        # 查找具体类型匹配的连接
-                        possible_matches = []
-                        for source_node_id, source_info in available_outputs.items():
-                            if source_node_id == node_id:  # 不能连接自己
-                                continue
-                                
-                            for output_index, output_type in source_info["outputs"]:
-                                # 检查类型匹配（排除通用类型的情况）
-                                type_match = (output_type in expected_types or output_type == "*")
-                                
-                                if type_match:
-                                    possible_matches.append({
-                                        "source_node_id": source_node_id,
-                                        "source_class": source_info["class_type"],
-                                        "output_index": output_index,
-                                        "output_type": output_type,
-                                        "match_confidence": "high" if output_type in expected_types else "medium"
-                                    })
-                        
-                        missing_connection["possible_matches"] = possible_matches
-                        missing_connection["is_universal"] = False
-                        
-                        # 如果有可能的匹配，添加到possible_connections
-                        if possible_matches:
-                            analysis_result["possible_connections"].extend([
-                                {
-                                    "target_node_id": node_id,
-                                    "target_input": input_name,
-                                    "source_node_id": match["source_node_id"],
-                                    "source_output_index": match["output_index"],
-                                    "connection": [match["source_node_id"], match["output_index"]],
-                                    "confidence": match["match_confidence"],
-                                    "types": {
-                                        "expected": expected_types,
-                                        "provided": match["output_type"]
-                                    }
-                                } for match in possible_matches
-                            ])
-                            analysis_result["connection_summary"]["auto_fixable"] += 1
-                        else:
-                            # 没有匹配的输出，需要新节点
-                            analysis_result["connection_summary"]["requires_new_nodes"] += 1
-                            
-                            # 分析需要什么类型的节点
-                            required_node_types = analyze_required_node_types(expected_types, object_info)
-                            analysis_result["required_new_nodes"].extend([{
-                                "for_node": node_id,
-                                "for_input": input_name,
-                                "expected_types": expected_types,
-                                "suggested_node_types": required_node_types
-                            }])
+                missing_connection["possible_matches"] = possible_matches
+                missing_connection["is_universal"] = False
+                
+                # 如果有可能的匹配，添加到possible_connections
+                if possible_matches:
+                    analysis_result["possible_connections"].extend([
+                        {
+                            "target_node_id": node_id,
+                            "target_input": input_name,
+                            "source_node_id": match["source_node_id"],
+                            "source_output_index": match["output_index"],
+                            "connection": [match["source_node_id"], match["output_index"]],
+                            "confidence": match["match_confidence"],
+                            "types": {
+                                "expected": expected_types,
+                                "provided": match["output_type"]
+                            }
+                        } for match in possible_matches
+                    ])
+                    analysis_result["connection_summary"]["auto_fixable"] += 1
+                else:
+                    # 没有匹配的输出，需要新节点
+                    analysis_result["connection_summary"]["requires_new_nodes"] += 1
                     
-                    analysis_result["missing_connections"].append(missing_connection)
+                    # 分析需要什么类型的节点
+                    required_node_types = analyze_required_node_types(expected_types, object_info_index)
+                    analysis_result["required_new_nodes"].append({
+                        "for_node": node_id,
+                        "for_input": input_name,
+                        "expected_types": expected_types,
+                        "suggested_node_types": required_node_types
+                    })
             
-            # 检查optional inputs (未连接的可选输入)
-            optional_inputs = node_info["input"].get("optional", {})
-            for input_name, input_config in optional_inputs.items():
-                if input_name not in current_inputs:
-                    # 发现未连接的optional输入
-                    optional_unconnected = {
-                        "node_id": node_id,
-                        "node_class": node_class,
-                        "input_name": input_name,
-                        "input_config": input_config,
-                        "required": False
-                    }
-                    
-                    # 分析输入类型
-                    if isinstance(input_config, (list, tuple)) and len(input_config) > 0:
-                        expected_types = input_config[0] if isinstance(input_config[0], list) else [input_config[0]]
-                    else:
-                        expected_types = ["*"]  # 默认为通用类型
-                    
-                    optional_unconnected["expected_types"] = expected_types
-                    
-                    # 检查是否是通用输入（可以接受任意类型）
-                    is_universal_input = "*" in expected_types
-                    optional_unconnected["is_universal"] = is_universal_input
-                    
-                    analysis_result["optional_unconnected_inputs"].append(optional_unconnected)
+            analysis_result["missing_connections"].append(missing_connection)
+        
+        # 检查optional inputs (未连接的可选输入)
+        for node_id, node_class, input_name, input_config, expected_types in link_index.unconnected_optional_inputs():
+            analysis_result["optional_unconnected_inputs"].append({
+                "node_id": node_id,
+                "node_class": node_class,
+                "input_name": input_name,
+                "input_config": input_config,
+                "required": False,
+                "expected_types": expected_types,
+                # 检查是否是通用输入（可以接受任意类型）
+                "is_universal": "*" in expected_types
+            })
         
         # 更新统计信息
         analysis_result["connection_summary"]["total_missing"] = len(analysis_result["missing_connections"])
         analysis_result["connection_summary"]["optional_unconnected_count"] = len(analysis_result["optional_unconnected_inputs"])
         
-        log.info(f"analysis_result: {json.dumps(analysis_result, ensure_ascii=False)}")
+        log.info("analysis_result: %s", analysis_result)
         return json.dumps(analysis_result)
         
     except Exception as e:
         return json.dumps({"error": f"Failed to analyze missing connections: {str(e)}"})
 
-def analyze_required_node_types(expected_types: List[str], object_info: Dict) -> List[Dict]:
+def analyze_required_node_types(expected_types: List[str], object_info_index: ObjectInfoIndex) -> List[Dict]:
     """分析需要什么类型的节点来提供指定的输出类型"""
     suggested_nodes = []
     
@@ -224,7 +169,7 @@ def analyze_required_node_types(expected_types: List[str], object_info: Dict) ->
     for expected_type in expected_types:
         if expected_type in type_to_nodes:
             for node_class in type_to_nodes[expected_type]:
-                if node_class in object_info:
+                if node_class in object_info_index:
                     suggested_nodes.append({
                         "node_class": node_class,
                         "output_type": expected_type,
@@ -232,17 +177,14 @@ def analyze_required_node_types(expected_types: List[str], object_info: Dict) ->
                         "description": f"{node_class} can provide {expected_type}"
                     })
         else:
-            # 搜索所有能提供该类型输出的节点
-            for node_class, node_info in object_info.items():
-                if "output" in node_info:
-                    outputs = node_info["output"]
-                    if expected_type in outputs:
-                        suggested_nodes.append({
-                            "node_class": node_class,
-                            "output_type": expected_type,
-                            "confidence": "medium",
-                            "description": f"{node_class} can provide {expected_type}"
-                        })
+            # 通过输出类型索引查找所有能提供该类型输出的节点
+            for node_class, _ in object_info_index.classes_with_output(expected_type):
+                suggested_nodes.append({
+                    "node_class": node_class,
+                    "output_type": expected_type,
+                    "confidence": "medium",
+                    "description": f"{node_class} can provide {expected_type}"
+                })
     
     # 去重并排序
     unique_nodes = {}
@@ -253,14 +195,14 @@ def analyze_required_node_types(expected_types: List[str], object_info: Dict) ->
     
     return list(unique_nodes.values())
 
-def save_checkpoint_before_link_modification(session_id: str, action_description: str) -> Optional[int]:
+async def save_checkpoint_before_link_modification(session_id: str, action_description: str) -> Optional[int]:
     """在连接修改前保存checkpoint"""
     try:
-        current_workflow = get_workflow_data(session_id)
+        current_workflow = await get_workflow_data_async(session_id)
         if not current_workflow:
             return None
             
-        checkpoint_id = save_workflow_data(
+        checkpoint_id = await save_workflow_data_async(
             session_id,
             current_workflow,
             workflow_data_ui=None,
@@ -278,7 +220,7 @@ def save_checkpoint_before_link_modification(session_id: str, action_description
         return None 
 
 @function_tool
-def apply_connection_fixes(fixes_json: str) -> str:
+async def apply_connection_fixes(fixes_json: str) -> str:
     """批量应用连接修复，fixes_json应为包含修复指令的JSON字符串"""
     try:
         session_id = get_session_id()
@@ -287,12 +229,12 @@ def apply_connection_fixes(fixes_json: str) -> str:
             return json.dumps({"error": "No session_id found in context"})
         
         # 在修改前保存checkpoint
-        checkpoint_id = save_checkpoint_before_link_modification(session_id, "batch connection fixes")
+        checkpoint_id = await save_checkpoint_before_link_modification(session_id, "batch connection fixes")
         
         # 解析修复指令
         fixes = json.loads(fixes_json) if isinstance(fixes_json, str) else fixes_json
         
-        workflow_data = get_workflow_data(session_id)
+        workflow_data = await get_workflow_data_async(session_id)
         if not workflow_data:
             return json.dumps({"error": "No workflow data found for this session"})
         
@@ -406,7 +348,7 @@ def apply_connection_fixes(fixes_json: str) -> str:
                 })
         
         # 保存更新的工作流
-        version_id = save_workflow_data(
+        version_id = await save_workflow_data_async(
             session_id,
             workflow_data,
             attributes={
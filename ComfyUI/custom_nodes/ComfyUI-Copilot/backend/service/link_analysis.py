@@ -0,0 +1,155 @@
+# Type-indexed connection analysis engine for the Link Agent
+
+import copy
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Tuple
+
+from ..utils.object_info_cache import ObjectInfoIndex
+
+# 每个进程最多保留的session索引数量
+MAX_CACHED_WORKFLOW_INDEXES = 32
+
+
+def get_expected_types(input_config: Any) -> List[str]:
+    """从object_info的输入配置中提取期望的类型列表（combo输入返回其选项列表）"""
+    if isinstance(input_config, (list, tuple)) and len(input_config) > 0:
+        return input_config[0] if isinstance(input_config[0], list) else [input_config[0]]
+    return ["*"]
+
+
+class WorkflowLinkIndex:
+    """
+    工作流连接索引：按输出类型索引现有节点的输出，并记录每个节点未连接的输入。
+
+    索引绑定到一个object_info版本，节点变化时只重新计算变化的节点，
+    匹配查询只遍历类型相同的输出，耗时与匹配数量成正比。
+    """
+
+    def __init__(self, object_info_index: ObjectInfoIndex):
+        self.object_info_index = object_info_index
+        self.object_info_version = object_info_index.version
+        self.order: List[str] = []
+        # node_id -> 在工作流中的位置，匹配结果按工作流顺序返回
+        self._positions: Dict[str, int] = {}
+        self._nodes: Dict[str, Dict[str, Any]] = {}
+        # output_type -> {node_id: [output_index, ...]}，"*"类型的输出也保存在这里
+        self._outputs_by_type: Dict[str, Dict[str, List[int]]] = {}
+        self._node_output_types: Dict[str, List[str]] = {}
+        # node_id -> [(input_name, input_config, expected_types)]
+        self._missing_required: Dict[str, List[Tuple[str, Any, List[str]]]] = {}
+        self._unconnected_optional: Dict[str, List[Tuple[str, Any, List[str]]]] = {}
+
+    def sync(self, workflow_data: Dict[str, Any]) -> int:
+        """与最新的工作流同步，只更新发生变化的节点，返回变化的节点数"""
+        changed = 0
+        for node_id in [n for n in self._nodes if n not in workflow_data]:
+            self.remove_node(node_id)
+            changed += 1
+        for node_id, node_data in workflow_data.items():
+            if self._nodes.get(node_id) != node_data:
+                self.update_node(node_id, node_data)
+                changed += 1
+        self.order = list(workflow_data.keys())
+        self._positions = {node_id: position for position, node_id in enumerate(self.order)}
+        return changed
+
+    def remove_node(self, node_id: str) -> None:
+        """从索引中移除节点"""
+        self._nodes.pop(node_id, None)
+        for output_type in self._node_output_types.pop(node_id, []):
+            by_node = self._outputs_by_type.get(output_type)
+            if by_node is not None:
+                by_node.pop(node_id, None)
+                if not by_node:
+                    del self._outputs_by_type[output_type]
+        self._missing_required.pop(node_id, None)
+        self._unconnected_optional.pop(node_id, None)
+
+    def update_node(self, node_id: str, node_data: Dict[str, Any]) -> None:
+        """重新索引单个节点的输出和未连接输入"""
+        self.remove_node(node_id)
+        self._nodes[node_id] = copy.deepcopy(node_data)
+        if node_id not in self._positions:
+            self._positions[node_id] = len(self.order)
+            self.order.append(node_id)
+
+        node_info = self.object_info_index.get(node_data.get("class_type"))
+        if node_info is None:
+            return
+
+        output_types = []
+        for output_index, output_type in enumerate(node_info.get("output") or []):
+            if not isinstance(output_type, str):
+                continue
+            self._outputs_by_type.setdefault(output_type, {}).setdefault(node_id, []).append(output_index)
+            if output_type not in output_types:
+                output_types.append(output_type)
+        self._node_output_types[node_id] = output_types
+
+        if "input" not in node_info:
+            return
+        current_inputs = node_data.get("inputs", {})
+        self._missing_required[node_id] = [
+            (input_name, input_config, get_expected_types(input_config))
+            for input_name, input_config in (node_info["input"].get("required") or {}).items()
+            if input_name not in current_inputs
+        ]
+        self._unconnected_optional[node_id] = [
+            (input_name, input_config, get_expected_types(input_config))
+            for input_name, input_config in (node_info["input"].get("optional") or {}).items()
+            if input_name not in current_inputs
+        ]
+
+    def class_type(self, node_id: str) -> Optional[str]:
+        node_data = self._nodes.get(node_id)
+        return node_data.get("class_type") if node_data else None
+
+    def missing_required_inputs(self):
+        """按工作流顺序枚举(node_id, node_class, input_name, input_config, expected_types)"""
+        for node_id in self.order:
+            for input_name, input_config, expected_types in self._missing_required.get(node_id, []):
+                yield node_id, self.class_type(node_id), input_name, input_config, expected_types
+
+    def unconnected_optional_inputs(self):
+        """按工作流顺序枚举未连接的optional输入"""
+        for node_id in self.order:
+            for input_name, input_config, expected_types in self._unconnected_optional.get(node_id, []):
+                yield node_id, self.class_type(node_id), input_name, input_config, expected_types
+
+    def find_matches(self, expected_types: List[str], exclude_node_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """查找能提供期望类型的现有输出，"*"类型的输出作为中等置信度的匹配，按工作流中节点和输出的顺序返回"""
+        matches = []
+        lookup_types = [t for t in expected_types if isinstance(t, str) and t != "*"] + ["*"]
+        for output_type in lookup_types:
+            for source_node_id, output_indexes in self._outputs_by_type.get(output_type, {}).items():
+                if source_node_id == exclude_node_id:  # 不能连接自己
+                    continue
+                for output_index in output_indexes:
+                    matches.append({
+                        "source_node_id": source_node_id,
+                        "source_class": self.class_type(source_node_id),
+                        "output_index": output_index,
+                        "output_type": output_type,
+                        "match_confidence": "high" if output_type in expected_types else "medium"
+                    })
+        # 索引按类型分组且更新过的节点排在后面，排序后结果与编辑历史无关
+        matches.sort(key=lambda m: (self._positions.get(m["source_node_id"], len(self._positions)), m["output_index"]))
+        return matches
+
+
+_workflow_indexes: "OrderedDict[str, WorkflowLinkIndex]" = OrderedDict()
+_workflow_indexes_lock = threading.Lock()
+
+
+def get_workflow_link_index(session_id: str, workflow_data: Dict[str, Any], object_info_index: ObjectInfoIndex) -> WorkflowLinkIndex:
+    """获取session对应的连接索引，object_info版本不变时增量同步工作流的变化"""
+    with _workflow_indexes_lock:
+        link_index = _workflow_indexes.pop(session_id, None)
+        if link_index is None or link_index.object_info_version != object_info_index.version:
+            link_index = WorkflowLinkIndex(object_info_index)
+        link_index.sync(workflow_data)
+        _workflow_indexes[session_id] = link_index
+        while len(_workflow_indexes) > MAX_CACHED_WORKFLOW_INDEXES:
+            _workflow_indexes.popitem(last=False)
+        return link_index
@@ -6,22 +6,24 @@ LastEditTime: 2025-08-20 11:57:58
 FilePath: /comfyui_copilot/backend/service/mcp-client.py
 Description: 这是默认设置,请设置`customMade`, 打开koroFileHeader查看配置 进行设置: https://github.com/OBKoro1/koro1FileHeader/wiki/%E9%85%8D%E7%BD%AE
 '''
-from ..utils.globals import BACKEND_BASE_URL
 from .. import core
 import asyncio
 import os
+import time
 import traceback
 from typing import List, Dict, Any, Optional
 
 from agents._config import set_default_openai_api
 from agents.agent import Agent
 from agents.items import ItemHelpers
-from agents.mcp import MCPServerSse
 from agents.run import Runner
 from agents.tracing import set_tracing_disabled
 
 from ..agent_factory import create_agent
-from ..service.workflow_rewrite_agent import create_workflow_rewrite_agent
+from ..service.workflow_rewrite_agent import create_workflow_rewrite_agent, expert_query_from_messages
+from ..service.mcp_pool import mcp_server_session, MCP_POOL_SIZE
+from ..service.history_compaction import compact_history, history_token_budget
+from ..service.tool_layer import start_tool_run
 from ..utils.request_context import get_session_id, get_config
 from ..utils.logger import log
 from openai.types.responses import ResponseTextDeltaEvent
@@ -49,6 +51,7 @@ async def comfyui_agent_invoke(messages: List[Dict[str, Any]], images: List[Imag
     Yields:
         tuple: (text, ext) where text is accumulated text and ext is structured data
     """
+    invoke_started_at = time.perf_counter()
     try:
         # Get session_id and config from request context
         session_id = get_session_id()
@@ -58,14 +61,8 @@ async def comfyui_agent_invoke(messages: List[Dict[str, Any]], images: List[Imag
             raise ValueError("No session_id found in request context")
         if not config:
             raise ValueError("No config found in request context")
-        async with MCPServerSse(
-            params= {
-                "url": BACKEND_BASE_URL + "/mcp-server/mcp",
-                "timeout": 300.0,
-            },
-            cache_tools_list=True,
-            client_session_timeout_seconds=300.0
-        ) as server:
+        async with mcp_server_session() as server:
+            log.info(f"-- MCP server ready in {(time.perf_counter() - invoke_started_at) * 1000:.0f} ms (pool {'on' if MCP_POOL_SIZE > 0 else 'off'})")
             # tools = await server.list_tools()
             
             # Get model from environment or use default
@@ -73,8 +70,8 @@ async def comfyui_agent_invoke(messages: List[Dict[str, Any]], images: List[Imag
             if config and config.get("model_select") and config.get("model_select") != "":
                 model_name = config.get("model_select")
             
-            # 创建workflow_rewrite_agent实例 (session_id通过context获取)
-            workflow_rewrite_agent_instance = create_workflow_rewrite_agent()
+            # 创建workflow_rewrite_agent实例 (session_id通过context获取)，提示词中只放入与用户问题相关的专家经验
+            workflow_rewrite_agent_instance = create_workflow_rewrite_agent(expert_query_from_messages(messages))
             
             agent = create_agent(
                 name="ComfyUI-Copilot",
@@ -125,11 +122,17 @@ You must adhere to the following constraints to complete the task:
                 config=config
             )
 
-            # Use messages directly as agent input since they're already in OpenAI format
-            # The caller has already handled image formatting within messages
-            agent_input = messages
-            log.info(f"-- Processing {len(messages)} messages")
+            # messages已是OpenAI格式(图片已由调用方处理)，按模型的token预算压缩历史：
+            # 旧图片转缩略图/引用，旧工具输出截断或丢弃，必要时丢弃最早的消息；
+            # 图片解码/编码较慢，放到线程中执行，避免阻塞事件循环
+            agent_input, compaction = await asyncio.to_thread(
+                compact_history, messages, history_token_budget(model_name, config.get("openai_base_url"))
+            )
+            log.info(f"-- Processing {len(agent_input)} of {len(messages)} messages, "
+                     f"~{compaction['tokens_before']} -> ~{compaction['tokens_after']} tokens {compaction['steps']}")
 
+            # 只读工具的结果在本轮对话内按(session, 工作流版本, 参数)缓存
+            tool_memo = start_tool_run()
             result = Runner.run_streamed(
                 agent,
                 input=agent_input,
@@ -149,6 +152,7 @@ You must adhere to the following constraints to complete the task:
             workflow_update_ext = None
             # Track if we've seen any handoffs to avoid showing initial handoff
             handoff_occurred = False
+            first_token_logged = False
             
             # Enhanced retry mechanism for OpenAI streaming errors
             max_retries = 3
@@ -156,7 +160,7 @@ You must adhere to the following constraints to complete the task:
             
             async def process_stream_events(stream_result):
                 """Process stream events with enhanced error handling"""
-                nonlocal current_text, last_yield_length, tool_call_queue, workflow_update_ext, tool_results, workflow_tools_called, handoff_occurred
+                nonlocal current_text, last_yield_length, tool_call_queue, workflow_update_ext, tool_results, workflow_tools_called, handoff_occurred, first_token_logged
                 
                 try:
                     async for event in stream_result.stream_events():
@@ -165,6 +169,9 @@ You must adhere to the following constraints to complete the task:
                             # Stream text deltas for real-time response
                             delta_text = event.data.delta
                             if delta_text:
+                                if not first_token_logged:
+                                    first_token_logged = True
+                                    log.info(f"-- Time to first token: {(time.perf_counter() - invoke_started_at) * 1000:.0f} ms (MCP pool {'on' if MCP_POOL_SIZE > 0 else 'off'})")
                                 current_text += delta_text
                                 # Yield tuple (accumulated_text, None) for streaming - similar to facade.py
                                 # Only yield if we have new content to avoid duplicate yields
@@ -204,7 +211,7 @@ You must adhere to the following constraints to complete the task:
                                 if tool_name in ["recall_workflow", "gen_workflow"]:
                                     workflow_tools_called.add(tool_name)
                             elif event.item.type == "tool_call_output_item":
-                                log.info(f"-- Tool output: {event.item.output}")
+                                log.info("-- Tool output: %s", event.item.output)
                                 # Store tool output for potential ext data processing
                                 tool_output_data_str = str(event.item.output)
                                 
@@ -465,6 +472,7 @@ You must adhere to the following constraints to complete the task:
                     # Backward compatibility: if it's a single item, wrap it
                     final_ext = [workflow_update_ext] + (ext if ext else [])
                 log.info(f"-- Including workflow_update ext in final response: {len(workflow_update_ext) if isinstance(workflow_update_ext, list) else 1} items")
+            log.info(f"-- Read-only tool memo: {tool_memo.hits} hits, {tool_memo.misses} misses")
             
             # Final yield with complete text, ext data, and finished status
             # Return as tuple (text, ext_with_finished) where ext_with_finished includes finished info
@@ -0,0 +1,260 @@
+"""
+Process-wide pool of MCP SSE connections for the chat agent.
+
+Opening an MCPServerSse costs an SSE handshake, an MCP initialize round trip
+and a tools/list call before the model sees the first token. The pool keeps a
+few initialized connections around and hands them out exclusively: a chat
+request leases a connection for the whole agent run and returns it afterwards,
+so concurrent sessions never share in-flight state. A connection that was in
+use when a run failed is closed rather than returned.
+
+Idle connections are pinged before reuse when they have not been checked for a
+while, and new connections are retried with exponential backoff. The tools list
+is fetched once and shared by every pooled connection.
+
+Set COPILOT_MCP_POOL_SIZE=0 to open a fresh connection per request instead.
+"""
+
+import asyncio
+import contextvars
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, List, Optional
+
+from agents.mcp import MCPServerSse
+
+from ..utils.globals import BACKEND_BASE_URL
+from ..utils.logger import log
+
+MCP_SERVER_URL = BACKEND_BASE_URL + "/mcp-server/mcp"
+MCP_TIMEOUT_SECONDS = 300.0
+# Idle connections kept per process; 0 disables pooling
+MCP_POOL_SIZE = int(os.environ.get("COPILOT_MCP_POOL_SIZE", "4"))
+# Idle connections are pinged before reuse if they were not checked for this long
+MCP_HEALTH_CHECK_INTERVAL = 30.0
+MCP_HEALTH_CHECK_TIMEOUT = 5.0
+# Idle connections older than this are closed instead of reused
+MCP_MAX_IDLE_SECONDS = 600.0
+MCP_TOOLS_CACHE_TTL = 600.0
+MCP_CONNECT_ATTEMPTS = 3
+MCP_RECONNECT_BACKOFF_BASE = 0.5
+MCP_RECONNECT_BACKOFF_MAX = 8.0
+
+
+def create_mcp_server(url: str = MCP_SERVER_URL) -> MCPServerSse:
+    """Create an unconnected MCP server with the settings used by the chat agent."""
+    return MCPServerSse(
+        params={
+            "url": url,
+            "timeout": MCP_TIMEOUT_SECONDS,
+        },
+        cache_tools_list=True,
+        client_session_timeout_seconds=MCP_TIMEOUT_SECONDS
+    )
+
+
+class _PooledMCPServerSse(MCPServerSse):
+    """MCPServerSse that serves its tools list from the pool-wide cache."""
+
+    def __init__(self, pool: "MCPConnectionPool", url: str):
+        super().__init__(
+            params={
+                "url": url,
+                "timeout": MCP_TIMEOUT_SECONDS,
+            },
+            cache_tools_list=True,
+            client_session_timeout_seconds=MCP_TIMEOUT_SECONDS
+        )
+        self._pool = pool
+
+    async def list_tools(self, *args, **kwargs):
+        tools = self._pool.get_cached_tools()
+        if tools is None:
+            tools = await super().list_tools(*args, **kwargs)
+            self._pool.set_cached_tools(tools)
+        return tools
+
+
+class _PooledConnection:
+    """A connected MCP server owned by its own task.
+
+    The SSE client runs inside anyio task groups that must be exited by the task
+    that entered them, so connect() and cleanup() both run in the owner task and
+    request tasks only ever use the connected session.
+    """
+
+    def __init__(self, server: MCPServerSse):
+        self.server = server
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.last_checked = self.created_at
+        self.uses = 0
+        self._close_requested = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def open(self) -> None:
+        ready = asyncio.get_running_loop().create_future()
+        # Run the owner task in an empty context so it does not keep the request context alive
+        self._task = contextvars.Context().run(asyncio.ensure_future, self._own(ready))
+        try:
+            await ready
+        except BaseException:
+            # Also covers the request being cancelled while the handshake is still running
+            self._close_requested.set()
+            raise
+
+    async def _own(self, ready: asyncio.Future) -> None:
+        try:
+            await self.server.connect()
+        except BaseException as e:
+            if not ready.done():
+                ready.set_exception(e)
+            await self._cleanup()
+            return
+        ready.set_result(None)
+        try:
+            await self._close_requested.wait()
+        finally:
+            await self._cleanup()
+
+    async def _cleanup(self) -> None:
+        try:
+            await self.server.cleanup()
+        except Exception as e:
+            log.warning(f"Error while closing MCP connection: {e}")
+
+    async def ping(self) -> bool:
+        session = self.server.session
+        if session is None or self._task is None or self._task.done():
+            return False
+        try:
+            await asyncio.wait_for(session.send_ping(), MCP_HEALTH_CHECK_TIMEOUT)
+        except Exception as e:
+            log.info(f"MCP connection failed health check: {e}")
+            return False
+        self.last_checked = time.monotonic()
+        return True
+
+    async def close(self) -> None:
+        self._close_requested.set()
+        if self._task is not None:
+            try:
+                await self._task
+            except BaseException:
+                pass
+
+
+class MCPConnectionPool:
+    """Leases initialized MCP connections to agent runs, one run per connection at a time."""
+
+    def __init__(self, url: str = MCP_SERVER_URL, max_idle: int = MCP_POOL_SIZE):
+        self.url = url
+        self.max_idle = max_idle
+        self._idle: Deque[_PooledConnection] = deque()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tools: Optional[List[Any]] = None
+        self._tools_fetched_at = 0.0
+        self._consecutive_failures = 0
+        self._stats = {"leases": 0, "reused": 0, "connects": 0, "connect_failures": 0, "health_check_failures": 0, "discarded": 0}
+
+    def get_cached_tools(self) -> Optional[List[Any]]:
+        if self._tools is not None and time.monotonic() - self._tools_fetched_at < MCP_TOOLS_CACHE_TTL:
+            return self._tools
+        return None
+
+    def set_cached_tools(self, tools: List[Any]) -> None:
+        self._tools = tools
+        self._tools_fetched_at = time.monotonic()
+
+    def invalidate_tools_cache(self) -> None:
+        self._tools = None
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._stats, idle=len(self._idle))
+
+    def _check_loop(self) -> None:
+        # Connections are bound to the loop that opened them
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._idle.clear()
+            self._loop = loop
+
+    @asynccontextmanager
+    async def lease(self):
+        """Borrow a connected MCPServerSse for the duration of one agent run."""
+        self._check_loop()
+        connection = await self._acquire()
+        self._stats["leases"] += 1
+        healthy = False
+        try:
+            yield connection.server
+            healthy = True
+        finally:
+            await self._release(connection, healthy)
+
+    async def _acquire(self) -> _PooledConnection:
+        while self._idle:
+            # Most recently used first: it is the least likely to have gone stale
+            connection = self._idle.pop()
+            now = time.monotonic()
+            if now - connection.last_used > MCP_MAX_IDLE_SECONDS:
+                await connection.close()
+                continue
+            if now - connection.last_checked > MCP_HEALTH_CHECK_INTERVAL and not await connection.ping():
+                self._stats["health_check_failures"] += 1
+                await connection.close()
+                continue
+            self._stats["reused"] += 1
+            return connection
+        return await self._connect()
+
+    async def _connect(self) -> _PooledConnection:
+        for attempt in range(1, MCP_CONNECT_ATTEMPTS + 1):
+            connection = _PooledConnection(_PooledMCPServerSse(self, self.url))
+            try:
+                await connection.open()
+            except Exception as e:
+                self._stats["connect_failures"] += 1
+                self._consecutive_failures += 1
+                if attempt == MCP_CONNECT_ATTEMPTS:
+                    raise
+                delay = min(MCP_RECONNECT_BACKOFF_BASE * 2 ** (self._consecutive_failures - 1), MCP_RECONNECT_BACKOFF_MAX)
+                log.warning(f"MCP connection attempt {attempt}/{MCP_CONNECT_ATTEMPTS} failed: {e}, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            self._consecutive_failures = 0
+            self._stats["connects"] += 1
+            return connection
+        raise RuntimeError("unreachable")
+
+    async def _release(self, connection: _PooledConnection, healthy: bool) -> None:
+        connection.last_used = time.monotonic()
+        connection.uses += 1
+        if healthy and len(self._idle) < self.max_idle and asyncio.get_running_loop() is self._loop:
+            self._idle.append(connection)
+            return
+        if not healthy:
+            # The run may have left the session in an unknown state
+            self._stats["discarded"] += 1
+        await connection.close()
+
+    async def close(self) -> None:
+        """Close all idle connections."""
+        while self._idle:
+            await self._idle.pop().close()
+
+
+mcp_connection_pool = MCPConnectionPool()
+
+
+@asynccontextmanager
+async def mcp_server_session():
+    """Connected MCP server for one agent run, pooled unless COPILOT_MCP_POOL_SIZE=0."""
+    if MCP_POOL_SIZE <= 0:
+        async with create_mcp_server() as server:
+            yield server
+        return
+    async with mcp_connection_pool.lease() as server:
+        yield server
@@ -3,18 +3,31 @@ import json
 from agents.tool import function_tool
 from ..utils.request_context import get_session_id
 
-from ..utils.comfy_gateway import get_object_info_by_class
-from ..dao.workflow_table import get_workflow_data, save_workflow_data
+from ..utils.object_info_cache import get_object_info_index
+from ..utils.fuzzy_index import fuzzy_indexes
+from .tool_layer import read_only_tool
+from ..dao.workflow_table import get_workflow_data_async, save_workflow_data_async
 from ..utils.logger import log
 
+# 模型近似匹配分数达到该值时直接推荐替换
+MODEL_MATCH_THRESHOLD = 0.8
+# 枚举值近似匹配分数达到该值时视为部分匹配
+ENUM_MATCH_THRESHOLD = 0.5
+# 选项超过该数量时不再完整返回，改为返回最接近的候选
+MAX_LISTED_OPTIONS = 50
+MAX_LISTED_MODELS = 200
+IMAGE_EXTENSIONS = [".png", ".jpg", ".jpeg", ".bmp", ".tiff", ".webp"]
+
+def _ranked(matches) -> list:
+    return [{"value": value, "score": score} for value, score in matches]
+
 async def get_node_parameters(node_name: str, param_name: str = "") -> str:
     """获取节点的参数信息，如果param_name为空则返回所有参数"""
     try:
-        node_info_dict = await get_object_info_by_class(node_name)
-        if not node_info_dict or node_name not in node_info_dict:
+        node_info = (await get_object_info_index()).get(node_name)
+        if not node_info:
             return json.dumps({"error": f"Node '{node_name}' not found"})
         
-        node_info = node_info_dict[node_name]
         if 'input' not in node_info:
             return json.dumps({"error": f"Node '{node_name}' has no input parameters"})
         
@@ -49,6 +62,7 @@ async def get_node_parameters(node_name: str, param_name: str = "") -> str:
         return json.dumps({"error": f"Failed to get node parameters: {str(e)}"})
 
 @function_tool
+@read_only_tool()
 async def find_matching_parameter_value(node_name: str, param_name: str, current_value: str, error_info: str = "") -> str:
     """根据错误信息找到匹配的参数值，支持多种参数类型的智能处理"""
     try:
@@ -61,6 +75,8 @@ async def find_matching_parameter_value(node_name: str, param_name: str, current
         
         param_config = param_info.get("config", [])
         error_lower = error_info.lower()
+        # 枚举参数（文件列表等）的选项建有近似匹配索引，选项列表变化时增量更新
+        value_index = await fuzzy_indexes.combo(await get_object_info_index(), node_name, param_name)
         
         # 检查错误类型并提供相应处理策略
         error_analysis = {
@@ -79,12 +95,15 @@ async def find_matching_parameter_value(node_name: str, param_name: str, current
             
             # 如果参数配置是列表，查找其他可用的图片
             if isinstance(param_config, list) and len(param_config) > 0 and param_config[0]:
-                available_images = [img for img in param_config[0] if any(ext in str(img).lower() for ext in [".png", ".jpg", ".jpeg", ".bmp", ".tiff", ".webp"])]
+                available_images = [img for img in param_config[0] if any(ext in str(img).lower() for ext in IMAGE_EXTENSIONS)]
                 
                 if available_images:
-                    # 随机选择一张可用图片
-                    import random
-                    recommended_image = random.choice(available_images)
+                    # 优先选择文件名最接近的图片，没有相近的则使用第一张
+                    closest_images = [
+                        value for value, _ in (value_index.search(current_value, 10) if value_index else [])
+                        if any(ext in value.lower() for ext in IMAGE_EXTENSIONS)
+                    ]
+                    recommended_image = closest_images[0] if closest_images else available_images[0]
                     return json.dumps({
                         "found_match": True,
                         "error_type": "image_file_missing",
@@ -116,6 +135,23 @@ async def find_matching_parameter_value(node_name: str, param_name: str, current
             error_analysis["error_type"] = "model_missing"
             error_analysis["is_model_related"] = True
             
+            closest_models = value_index.search(current_value, 5) if value_index else []
+            if closest_models and closest_models[0][1] >= MODEL_MATCH_THRESHOLD:
+                # 同一个模型只是大小写、子目录或扩展名不同，或名称非常接近
+                return json.dumps({
+                    "found_match": True,
+                    "error_type": "model_missing",
+                    "solution_type": "auto_replace",
+                    "recommended_value": closest_models[0][0],
+                    "match_type": "fuzzy",
+                    "match_score": closest_models[0][1],
+                    "message": f"Found close local model: '{current_value}' -> '{closest_models[0][0]}' (score: {closest_models[0][1]})",
+                    "can_auto_fix": True,
+                    "next_action": "update_parameter",
+                    "closest_matches": _ranked(closest_models)
+                })
+            
+            available_count = len(value_index) if value_index else None
             return json.dumps({
                 "found_match": False,
                 "error_type": "model_missing",
@@ -127,68 +163,52 @@ async def find_matching_parameter_value(node_name: str, param_name: str, current
                     "param_name": param_name,
                     "missing_file": current_value,
                     "is_model_related": True,
-                    "param_config": param_config
+                    # 本地模型很多时只返回最接近的候选，完整列表可通过get_model_files(model_type, query)检索
+                    "param_config": param_config if available_count is None or available_count <= MAX_LISTED_OPTIONS else None,
+                    "available_count": available_count,
+                    "closest_matches": _ranked(closest_models)
                 }
             })
         
         # 处理枚举类型的参数（原有逻辑，但增强）
         elif isinstance(param_config, list) and len(param_config) > 0:
-            available_values = param_config
+            # 枚举参数的配置为 [选项列表, {...}]
+            available_values = param_config[0] if isinstance(param_config[0], list) else param_config
             error_analysis["error_type"] = "enum_value_mismatch"
             error_analysis["can_auto_fix"] = True
             
-            # 改进的匹配算法
-            current_lower = current_value.lower().replace("_", " ").replace("-", " ")
-            
             # 1. 完全匹配
-            for value in available_values:
-                if current_value == value:
-                    return json.dumps({
-                        "found_match": True,
-                        "recommended_value": value,
-                        "match_type": "exact",
-                        "error_type": "enum_value_mismatch",
-                        "solution_type": "exact_match",
-                        "can_auto_fix": True,
-                        "all_available": available_values
-                    })
+            if current_value in available_values:
+                return json.dumps({
+                    "found_match": True,
+                    "recommended_value": current_value,
+                    "match_type": "exact",
+                    "error_type": "enum_value_mismatch",
+                    "solution_type": "exact_match",
+                    "can_auto_fix": True,
+                    "all_available": available_values[:MAX_LISTED_OPTIONS]
+                })
             
             # 2. 忽略大小写和符号的匹配
-            for value in available_values:
-                value_lower = str(value).lower().replace("_", " ").replace("-", " ")
-                if current_lower == value_lower:
-                    return json.dumps({
-                        "found_match": True,
-                        "recommended_value": value,
-                        "match_type": "case_insensitive",
-                        "error_type": "enum_value_mismatch",
-                        "solution_type": "auto_replace",
-                        "message": f"Found case-insensitive match: '{current_value}' -> '{value}'",
-                        "can_auto_fix": True,
-                        "next_action": "update_parameter",
-                        "all_available": available_values
-                    })
-            
-            # 3. 包含关系匹配
-            best_match = None
-            best_score = 0
-            
-            for value in available_values:
-                value_lower = str(value).lower()
-                value_parts = value_lower.replace("_", " ").replace("-", " ").split()
-                current_parts = current_lower.split()
-                
-                # 计算匹配分数
-                score = 0
-                for part in current_parts:
-                    if any(part in vp or vp in part for vp in value_parts):
-                        score += 1
-                
-                if score > best_score:
-                    best_score = score
-                    best_match = value
+            equivalent_values = value_index.equivalent(current_value) if value_index else []
+            if equivalent_values:
+                value = equivalent_values[0]
+                return json.dumps({
+                    "found_match": True,
+                    "recommended_value": value,
+                    "match_type": "case_insensitive",
+                    "error_type": "enum_value_mismatch",
+                    "solution_type": "auto_replace",
+                    "message": f"Found case-insensitive match: '{current_value}' -> '{value}'",
+                    "can_auto_fix": True,
+                    "next_action": "update_parameter",
+                    "all_available": available_values[:MAX_LISTED_OPTIONS]
+                })
             
-            if best_match and best_score > 0:
+            # 3. 近似匹配（字符三元组 + 编辑相似度排序）
+            closest_values = value_index.search(current_value, 5) if value_index else []
+            if closest_values and closest_values[0][1] >= ENUM_MATCH_THRESHOLD:
+                best_match, best_score = closest_values[0]
                 return json.dumps({
                     "found_match": True,
                     "recommended_value": best_match,
@@ -199,6 +219,7 @@ async def find_matching_parameter_value(node_name: str, param_name: str, current
                     "message": f"Found partial match: '{current_value}' -> '{best_match}' (score: {best_score})",
                     "can_auto_fix": True,
                     "next_action": "update_parameter",
+                    "closest_matches": _ranked(closest_values),
                     "all_available": available_values[:10],
                     "original_value": current_value
                 })
@@ -243,8 +264,9 @@ async def find_matching_parameter_value(node_name: str, param_name: str, current
         })
 
 @function_tool
-async def get_model_files(model_type: str = "checkpoints") -> str:
-    """获取可用的模型文件列表"""
+@read_only_tool()
+async def get_model_files(model_type: str = "checkpoints", query: str = "") -> str:
+    """获取可用的模型文件列表。传入query（如缺失的模型名）时只返回按相似度排序的最接近的模型"""
     try:
         # 定义模型类型到节点的映射
         model_type_mapping = {
@@ -259,19 +281,11 @@ async def get_model_files(model_type: str = "checkpoints") -> str:
         
         # 查找对应的节点
         model_files = {}
+        object_info_index = await get_object_info_index()
         for node_name in model_type_mapping.get(model_type.lower(), []):
             try:
-                # 使用 get_object_info_by_class 获取单个节点信息，减少数据量
-                node_data = await get_object_info_by_class(node_name)
-                
-                # 处理不同的返回格式
-                node_info = None
-                if node_name in node_data:
-                    # 格式：{"NodeName": {...}}
-                    node_info = node_data[node_name]
-                elif 'input' in node_data:
-                    # 格式：直接返回节点信息 {...}
-                    node_info = node_data
+                # 从共享的object_info缓存中读取单个节点信息
+                node_info = object_info_index.get(node_name)
                 
                 if node_info and 'input' in node_info:
                     # 查找包含文件列表的参数
@@ -284,18 +298,40 @@ async def get_model_files(model_type: str = "checkpoints") -> str:
                                         # 检查是否为文件列表（包含文件扩展名或路径）
                                         file_list = param_config[0]
                                         if any(isinstance(item, str) and ('.' in item or '/' in item) for item in file_list):
-                                            model_files[f"{node_name}.{param_name}"] = file_list
+                                            model_files[f"{node_name}.{param_name}"] = await fuzzy_indexes.combo(object_info_index, node_name, param_name)
                             
             except Exception as e:
                 # 单个节点查询失败，继续处理其他节点
                 log.error(f"Failed to get info for node {node_name}: {e}")
                 continue
         
+        if not model_files:
+            # 没有对应的加载节点时，直接检索models下同名的模型目录
+            folder_index = await fuzzy_indexes.folder(model_type.lower())
+            if folder_index is not None and len(folder_index):
+                model_files[f"folder.{model_type.lower()}"] = folder_index
+        
         if model_files:
-            return json.dumps({
+            if query:
+                return json.dumps({
+                    "model_type": model_type,
+                    "query": query,
+                    "closest_models": {key: _ranked(index.search(query, 10)) for key, index in model_files.items()}
+                })
+            available_models = {}
+            truncated = False
+            for key, index in model_files.items():
+                files = sorted(index.values())
+                truncated = truncated or len(files) > MAX_LISTED_MODELS
+                available_models[key] = files[:MAX_LISTED_MODELS]
+            result = {
                 "model_type": model_type,
-                "available_models": model_files
-            })
+                "available_models": available_models
+            }
+            if truncated:
+                result["total_counts"] = {key: len(index) for key, index in model_files.items()}
+                result["message"] = f"Only the first {MAX_LISTED_MODELS} files are listed. Call get_model_files with query set to the wanted model name to get the closest matches."
+            return json.dumps(result)
         else:
             return json.dumps({
                 "model_type": model_type,
@@ -460,7 +496,7 @@ def suggest_model_download(model_type: str, missing_model: str) -> str:
         return json.dumps({"error": f"Failed to suggest model download: {str(e)}"})
 
 @function_tool
-def update_workflow_parameter(node_id: str, param_name: str, new_value: str) -> str:
+async def update_workflow_parameter(node_id: str, param_name: str, new_value: str) -> str:
     """更新工作流中的特定参数"""
     try:
         session_id = get_session_id()
@@ -469,7 +505,7 @@ def update_workflow_parameter(node_id: str, param_name: str, new_value: str) ->
             return json.dumps({"error": "No session_id found in context"})
         
         # 获取当前工作流
-        workflow_data = get_workflow_data(session_id)
+        workflow_data = await get_workflow_data_async(session_id)
         if not workflow_data:
             return json.dumps({"error": "No workflow data found for this session"})
         
@@ -485,7 +521,7 @@ def update_workflow_parameter(node_id: str, param_name: str, new_value: str) ->
         workflow_data[node_id]["inputs"][param_name] = new_value
         
         # 保存更新的工作流到数据库
-        save_workflow_data(
+        await save_workflow_data_async(
             session_id,
             workflow_data,
             workflow_data_ui=None,  # UI format not available here
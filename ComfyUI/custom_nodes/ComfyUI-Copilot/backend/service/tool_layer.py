@@ -0,0 +1,197 @@
+"""
+Read-only tool layer for agent runs.
+
+The debug and rewrite agents look up the same node definitions, model lists and
+parameter candidates many times during one run: the coordinator and each
+specialist ask again after every handoff. Tools decorated with read_only_tool
+are memoized for the duration of a run (see start_tool_run) by
+
+    (tool, session, workflow version, object_info version, arguments)
+
+so a repeated call is answered from memory, and identical calls that are in
+flight at the same time share one execution. The workflow version is only part
+of the key for tools that read the session's workflow; every write creates a
+new version, so results never outlive the data they were computed from.
+
+Independent read-only calls can run concurrently in two ways: agents created
+with parallel_tool_model_settings() may emit several tool calls in one turn,
+which the Agents SDK executes concurrently, and run_read_only_tools executes a
+batch of calls in one tool invocation for models that do not emit parallel
+calls.
+"""
+
+import asyncio
+import functools
+import inspect
+import json
+import os
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from agents import ModelSettings
+from agents.tool import function_tool
+
+from ..dao.workflow_table import get_workflow_version_key_async
+from ..utils.object_info_cache import get_object_info_index
+from ..utils.request_context import get_session_id
+from ..utils.session_state import session_states
+from ..utils.logger import log
+
+# Set COPILOT_PARALLEL_TOOL_CALLS=0 for endpoints that reject parallel_tool_calls
+PARALLEL_TOOL_CALLS = os.environ.get("COPILOT_PARALLEL_TOOL_CALLS", "1") != "0"
+TOOL_MEMO_MAX_ENTRIES = 512
+MAX_BATCH_TOOL_CALLS = 8
+
+_read_only_tools: Dict[str, Callable[..., Awaitable[str]]] = {}
+_current_memo: ContextVar[Optional["ToolRunMemo"]] = ContextVar("copilot_tool_run_memo", default=None)
+
+
+class ToolRunMemo:
+    """Results of read-only tool calls made during one agent run."""
+
+    def __init__(self, max_entries: int = TOOL_MEMO_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._results: "OrderedDict[Tuple, str]" = OrderedDict()
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+
+    async def call(self, key: Tuple, compute: Callable[[], Awaitable[str]]) -> str:
+        if key in self._results:
+            self.hits += 1
+            self._results.move_to_end(key)
+            return self._results[key]
+
+        future = self._inflight.get(key)
+        if future is None:
+            self.misses += 1
+            future = asyncio.ensure_future(compute())
+            self._inflight[key] = future
+            future.add_done_callback(lambda f, key=key: self._finish(key, f))
+        else:
+            self.hits += 1
+        # Shield the shared call so one caller being cancelled does not cancel it for the others
+        return await asyncio.shield(future)
+
+    def _finish(self, key: Tuple, future: asyncio.Future) -> None:
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if future.cancelled() or future.exception() is not None:
+            return
+        self._results[key] = future.result()
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+
+
+def start_tool_run() -> ToolRunMemo:
+    """Start memoizing read-only tool calls in the current request context.
+
+    Call it before Runner.run_streamed so the tool tasks the SDK starts inherit
+    the memo. Like the other request context variables it lives as long as the
+    request's context.
+    """
+    memo = ToolRunMemo()
+    _current_memo.set(memo)
+    return memo
+
+
+def get_tool_run_memo() -> Optional[ToolRunMemo]:
+    """The memo of the current run, if one was started."""
+    return _current_memo.get()
+
+
+def _arguments_key(signature: inspect.Signature, args: tuple, kwargs: dict) -> str:
+    bound = signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+    return json.dumps(bound.arguments, sort_keys=True, ensure_ascii=False, default=str)
+
+
+async def _version_key(uses_workflow: bool) -> Tuple:
+    session_id = get_session_id()
+    object_info_version = (await get_object_info_index()).version
+    if session_states.get(session_id, "object_info_version") != object_info_version:
+        session_states.update(session_id, object_info_version=object_info_version)
+    workflow_version = None
+    if uses_workflow and session_id:
+        # (version id, revision) from the session state; only the first call of a session reads the database
+        workflow_version = await get_workflow_version_key_async(session_id)
+    return (session_id, workflow_version, object_info_version)
+
+
+def read_only_tool(uses_workflow: bool = False):
+    """Mark an async tool function as side-effect free so its results can be memoized.
+
+    Apply it below @function_tool. Set uses_workflow for tools that read the
+    session's current workflow.
+    """
+    def decorator(func: Callable[..., Awaitable[str]]) -> Callable[..., Awaitable[str]]:
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs) -> str:
+            memo = _current_memo.get()
+            if memo is None:
+                return await func(*args, **kwargs)
+            try:
+                key = (func.__name__,) + await _version_key(uses_workflow) + (_arguments_key(signature, args, kwargs),)
+            except Exception as e:
+                log.warning(f"Calling {func.__name__} without memoization: {e}")
+                return await func(*args, **kwargs)
+            return await memo.call(key, lambda: func(*args, **kwargs))
+
+        _read_only_tools[func.__name__] = wrapper
+        return wrapper
+
+    return decorator
+
+
+def parallel_tool_model_settings() -> ModelSettings:
+    """Model settings that let an agent request several tool calls in one turn."""
+    if PARALLEL_TOOL_CALLS:
+        return ModelSettings(parallel_tool_calls=True)
+    return ModelSettings()
+
+
+@function_tool
+async def run_read_only_tools(calls_json: str) -> str:
+    """
+    并发执行多个互不依赖的只读查询工具，一次返回全部结果。需要查询多个节点、多种模型类型或多个参数时优先使用。
+
+    calls_json: JSON数组，每一项为 {"tool": 工具名, "arguments": {参数名: 参数值}}，最多8项。
+    可用工具：get_current_workflow, get_node_info(node_class), get_node_infos(node_class_list),
+    get_model_files(model_type, query), find_matching_parameter_value(node_name, param_name, current_value, error_info),
+    analyze_missing_connections
+    """
+    try:
+        calls = json.loads(calls_json)
+    except json.JSONDecodeError as e:
+        return json.dumps({"error": f"Invalid calls_json: {str(e)}"})
+    if not isinstance(calls, list) or not calls:
+        return json.dumps({"error": "calls_json must be a non-empty JSON array"})
+    if len(calls) > MAX_BATCH_TOOL_CALLS:
+        return json.dumps({"error": f"At most {MAX_BATCH_TOOL_CALLS} calls are allowed per batch"})
+
+    async def run_one(call: Any) -> Any:
+        if not isinstance(call, dict):
+            return {"error": "Each call must be an object with 'tool' and 'arguments'"}
+        tool = _read_only_tools.get(call.get("tool"))
+        if tool is None:
+            return {"error": f"Unknown read-only tool: {call.get('tool')}", "available_tools": sorted(_read_only_tools)}
+        try:
+            output = await tool(**(call.get("arguments") or {}))
+        except TypeError as e:
+            return {"error": f"Invalid arguments for {call.get('tool')}: {str(e)}"}
+        try:
+            return json.loads(output)
+        except (json.JSONDecodeError, TypeError):
+            return output
+
+    results = await asyncio.gather(*[run_one(call) for call in calls], return_exceptions=True)
+    return json.dumps([
+        {
+            "tool": call.get("tool") if isinstance(call, dict) else None,
+            "result": {"error": str(result)} if isinstance(result, Exception) else result
+        }
+        for call, result in zip(calls, results)
+    ], ensure_ascii=False)
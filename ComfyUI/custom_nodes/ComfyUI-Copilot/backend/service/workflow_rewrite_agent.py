@@ -13,15 +13,21 @@ import time
 import uuid
 from agents.tool import function_tool
 import os
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 
-from ..dao.expert_table import list_rewrite_experts_short, get_rewrite_expert_by_name_list
+from ..dao.expert_table import (
+    list_rewrite_experts_short,
+    get_rewrite_expert_by_name_list,
+    count_rewrite_experts,
+    search_rewrite_experts as search_rewrite_experts_by_query,
+)
 
 from ..agent_factory import create_agent
 from ..utils.globals import WORKFLOW_MODEL_NAME, get_language
 from ..utils.request_context import get_session_id
 
 from ..service.workflow_rewrite_tools import *
+from ..service.tool_layer import run_read_only_tools, parallel_tool_model_settings
 
 
 @function_tool
@@ -32,16 +38,58 @@ def get_rewrite_expert_by_name(name_list: list[str]) -> str:
     log.info(f"get_rewrite_expert_by_name, name_list: {name_list}, result: {temp}")
     return temp
 
-def get_rewrite_export_schema() -> dict:
-    """获取工作流改写专家经验schema"""
-    return list_rewrite_experts_short()
+# 专家总数不超过该值时全部放入提示词，否则只放入与用户问题最相关的前EXPERT_PROMPT_TOP_K条
+EXPERT_PROMPT_LIMIT = int(os.environ.get("COPILOT_EXPERT_PROMPT_LIMIT", "16"))
+EXPERT_PROMPT_TOP_K = int(os.environ.get("COPILOT_EXPERT_PROMPT_TOP_K", "8"))
+EXPERT_SEARCH_MAX_K = 20
 
 
-def create_workflow_rewrite_agent():
-    """创建workflow_rewrite_agent实例"""
+@function_tool
+def search_rewrite_experts(query: str, top_k: int = 5) -> str:
+    """
+    按关键词检索工作流改写专家经验，返回最相关经验的名称、描述和相关度得分。
+    提示词中列出的经验都不适用时使用；query可以是中文或英文的功能关键词，例如"扩图 outpaint"。
+    检索到合适的经验后，用get_rewrite_expert_by_name获取经验内容。
+    """
+    top_k = max(1, min(int(top_k or 5), EXPERT_SEARCH_MAX_K))
+    result = search_rewrite_experts_by_query(query, top_k)
+    log.info(f"search_rewrite_experts, query: {query}, result: {[e['name'] for e in result]}")
+    return json.dumps(result, ensure_ascii=False)
+
+
+def expert_query_from_messages(messages: Optional[List[Dict[str, Any]]]) -> str:
+    """用户最新一条消息的文本，用于检索相关的专家经验"""
+    for message in reversed(messages or []):
+        if message.get("role") != "user":
+            continue
+        content = message.get("content")
+        if isinstance(content, str):
+            return content
+        if isinstance(content, list):
+            return " ".join(part.get("text", "") for part in content if isinstance(part, dict) and isinstance(part.get("text"), str))
+        return ""
+    return ""
+
+
+def get_rewrite_export_schema(query: str = "") -> List[Dict[str, Any]]:
+    """获取放入提示词的工作流改写专家经验（名称和描述）；专家较多时只返回与query相关的部分"""
+    if count_rewrite_experts() <= EXPERT_PROMPT_LIMIT:
+        return list_rewrite_experts_short()
+    if not query:
+        return []
+    return [
+        {"name": expert["name"], "description": expert["description"]}
+        for expert in search_rewrite_experts_by_query(query, EXPERT_PROMPT_TOP_K)
+    ]
+
+
+def create_workflow_rewrite_agent(query: str = ""):
+    """创建workflow_rewrite_agent实例，query为用户问题，用于挑选放入提示词的专家经验"""
     
     language = get_language()
     session_id = get_session_id() or "unknown_session"
+    experts = get_rewrite_export_schema(query)
+    expert_total = count_rewrite_experts()
     
     return create_agent(
         name="Workflow Rewrite Agent",
@@ -57,9 +105,11 @@ def create_workflow_rewrite_agent():
 
         ## 主要处理场景
         {}
-        """.format(json.dumps(get_rewrite_export_schema())) + """
+        """.format(json.dumps(experts)) + """
 
         你可以根据用户的需求，从上面的专家经验中选择一个或多个经验，并根据经验内容进行工作流改写。
+        """ + ("""上面只列出了与用户问题最相关的{}条专家经验（共{}条），如果都不适用，请用search_rewrite_experts按关键词检索其他经验。
+        """.format(len(experts), expert_total) if len(experts) < expert_total else "") + """
         
         ## 复杂工作流处理原则
         复杂工作流实际上是多个简单工作流的组合。例如：文生图→抠图取主体→图生图生成背景。
@@ -85,8 +135,9 @@ def create_workflow_rewrite_agent():
       
         **Tool Usage Guidelines:**
             - get_current_workflow(): Get current workflow from checkpoint or session
+            - patch_workflow(): PREFERRED way to save changes. Pass only the edit operations (add_node / remove_node / set_input / connect / remove_input) as `operations_json`; they are applied atomically to the current workflow, so never resend unchanged nodes. Use refs ("$name") to wire nodes added in the same call.
             - remove_node(): Use for incompatible or problematic nodes
-            - update_workflow(): Use to save your changes (ALWAYS call this after you have made changes), you MUST pass argument `workflow_data` containing the FULL workflow JSON (as a JSON object or a JSON string). Never call `update_workflow` without `workflow_data`.
+            - update_workflow(): Only when the workflow has to be rebuilt from scratch. You MUST pass argument `workflow_data` containing the FULL workflow JSON (as a JSON object or a JSON string). Never call `update_workflow` without `workflow_data`.
             - get_node_info(): Get detailed node information and verify input/output types before connecting
 
       
@@ -103,7 +154,8 @@ def create_workflow_rewrite_agent():
 
         始终以用户的实际需求为导向，提供专业、准确、高效的工作流改写服务。
         """,
-        tools=[get_rewrite_expert_by_name, get_current_workflow, get_node_info, update_workflow, remove_node],
+        tools=[get_rewrite_expert_by_name, search_rewrite_experts, get_current_workflow, get_node_info, patch_workflow, update_workflow, remove_node, run_read_only_tools],
+        model_settings=parallel_tool_model_settings(),
     )
 
 # 注意：工作流改写代理现在需要在有session context的环境中创建
@@ -7,8 +7,13 @@ from typing import Dict, Any, Optional
 from agents import RunContextWrapper
 from agents.tool import function_tool
 
-from ..dao.workflow_table import get_workflow_data, save_workflow_data, get_workflow_data_ui, get_workflow_data_by_id
-from ..utils.comfy_gateway import get_object_info
+from ..dao.workflow_table import (
+    get_workflow_data, get_workflow_data_ui, get_workflow_data_by_id,
+    get_workflow_data_async, get_workflow_data_ui_async, save_workflow_data_async, edit_workflow_data_async
+)
+from ..utils.object_info_cache import get_object_info_index
+from ..utils.workflow_patch import apply_operations, WorkflowPatchError
+from .tool_layer import read_only_tool
 from ..utils.request_context import get_session_id
 from ..utils.logger import log
 
@@ -49,27 +54,30 @@ def get_workflow_data_ui_from_config(config: Dict[str, Any]) -> Optional[Dict[st
     return None
 
 @function_tool
-def get_current_workflow() -> str:
+@read_only_tool(uses_workflow=True)
+async def get_current_workflow() -> str:
     """获取当前session的工作流数据"""
     session_id = get_session_id()
     if not session_id:
         return json.dumps({"error": "No session_id found in context"})
     
-    workflow_data = get_workflow_data(session_id)
+    workflow_data = await get_workflow_data_async(session_id)
     if not workflow_data:
         return json.dumps({"error": "No workflow data found for this session"})
     return json.dumps(workflow_data)
 
 @function_tool
+@read_only_tool()
 async def get_node_info(node_class: str) -> str:
     """获取节点的详细信息，包括输入输出参数"""
     try:
-        object_info = await get_object_info()
-        if node_class in object_info:
-            return json.dumps(object_info[node_class])
+        object_info_index = await get_object_info_index()
+        node_info = object_info_index.get(node_class)
+        if node_info is not None:
+            return json.dumps(node_info)
         else:
             # 搜索类似的节点类
-            similar_nodes = [k for k in object_info.keys() if node_class.lower() in k.lower()]
+            similar_nodes = object_info_index.search(node_class)
             if similar_nodes:
                 return json.dumps({
                     "error": f"Node class '{node_class}' not found",
@@ -80,30 +88,28 @@ async def get_node_info(node_class: str) -> str:
         return json.dumps({"error": f"Failed to get node info: {str(e)}"})
 
 @function_tool
+@read_only_tool()
 async def get_node_infos(node_class_list: list[str]) -> str:
     """获取多个节点的详细信息，包括输入输出参数。只做最小化有必要的查询，不要查询所有节点。尽量不要超过5个"""
     try:
-        object_info = await get_object_info()
-        node_infos = {}
-        for node_class in node_class_list:
-            if node_class in object_info:
-                node_infos[node_class] = object_info[node_class]
+        object_info_index = await get_object_info_index()
+        node_infos = object_info_index.get_many(node_class_list)
         return json.dumps(node_infos)
     except Exception as e:
         return json.dumps({"error": f"Failed to get node infos of {','.join(node_class_list)}: {str(e)}"})
     
 
-def save_checkpoint_before_modification(session_id: str, action_description: str) -> Optional[int]:
+async def save_checkpoint_before_modification(session_id: str, action_description: str) -> Optional[int]:
     """在修改工作流前保存checkpoint，返回checkpoint_id"""
     try:
-        current_workflow = get_workflow_data(session_id)
+        current_workflow = await get_workflow_data_async(session_id)
         if not current_workflow:
             return None
             
-        checkpoint_id = save_workflow_data(
+        checkpoint_id = await save_workflow_data_async(
             session_id,
             current_workflow,
-            workflow_data_ui=get_workflow_data_ui(session_id),
+            workflow_data_ui=await get_workflow_data_ui_async(session_id),
             attributes={
                 "checkpoint_type": "workflow_rewrite_start",
                 "description": f"Checkpoint before {action_description}",
@@ -124,7 +130,7 @@ def tool_error_function(ctx: RunContextWrapper[Any], error: Exception) -> str:
 
 # def update_workflow(session_id: str, workflow_data: Union[Dict[str, Any], str]) -> str:
 @function_tool
-def update_workflow(workflow_data: str = "") -> str:
+async def update_workflow(workflow_data: str = "") -> str:
     """
     更新当前session的工作流数据
 
@@ -147,12 +153,12 @@ def update_workflow(workflow_data: str = "") -> str:
         
         log.info(f"[update_workflow] workflow_data: {workflow_data}")
         # 在修改前保存checkpoint
-        checkpoint_id = save_checkpoint_before_modification(session_id, "workflow update")
+        checkpoint_id = await save_checkpoint_before_modification(session_id, "workflow update")
         
         # 解析JSON字符串
         workflow_dict = json.loads(workflow_data) if isinstance(workflow_data, str) else workflow_data
         
-        version_id = save_workflow_data(
+        version_id = await save_workflow_data_async(
             session_id,
             workflow_dict,
             attributes={"action": "workflow_rewrite", "description": "Workflow structure fixed by rewrite agent"}
@@ -195,88 +201,132 @@ def update_workflow(workflow_data: str = "") -> str:
         log.error(f"Failed to update workflow: {str(e)}")
         return json.dumps({"error": f"Failed to update workflow: {str(e)}. Please try regenerating the workflow and then update again."})
 
+def _rewrite_ext(workflow_data: Dict[str, Any], changes: Any, checkpoint_id: Optional[int], version_id: int) -> list:
+    """构建返回给前端的ext数据：更新画布、修改前的checkpoint（给用户消息）和修改后的版本（给AI响应）"""
+    ext_data = [{
+        "type": "workflow_update",
+        "data": {
+            "workflow_data": workflow_data,
+            "changes": changes
+        }
+    }]
+    if checkpoint_id:
+        ext_data.append({
+            "type": "workflow_rewrite_checkpoint",
+            "data": {
+                "checkpoint_id": checkpoint_id,
+                "checkpoint_type": "workflow_rewrite_start"
+            }
+        })
+    ext_data.append({
+        "type": "workflow_rewrite_complete",
+        "data": {
+            "version_id": version_id,
+            "checkpoint_type": "workflow_rewrite_complete"
+        }
+    })
+    return ext_data
+
+def _checkpoint_attributes(action_description: str) -> Dict[str, Any]:
+    return {
+        "checkpoint_type": "workflow_rewrite_start",
+        "description": f"Checkpoint before {action_description}",
+        "action": "workflow_rewrite_checkpoint",
+        "timestamp": time.time()
+    }
+
+@function_tool
+async def patch_workflow(operations_json: str) -> str:
+    """
+    以增量操作修改当前工作流，所有操作要么全部生效要么全部不生效。局部修改时优先使用本工具，不需要重新生成完整的工作流。
+
+    operations_json: JSON数组，按顺序执行，每一项为以下操作之一：
+    - {"op": "add_node", "class_type": 节点类型, "inputs": {输入名: 值或[节点ID, 输出序号]}, "ref": 可选的引用名, "id": 可选的节点ID, "title": 可选标题}
+    - {"op": "remove_node", "node_id": 节点ID}  同时移除指向该节点的所有连线
+    - {"op": "set_input", "node_id": 节点ID, "input": 输入名, "value": 值}
+    - {"op": "connect", "from_node": 源节点ID, "from_output": 输出序号, "to_node": 目标节点ID, "input": 输入名}
+    - {"op": "remove_input", "node_id": 节点ID, "input": 输入名}
+    通过add_node的ref添加的新节点，在后续操作中可以用"$引用名"代替节点ID，例如 ["$lora", 0]。
+    """
+    try:
+        session_id = get_session_id()
+        if not session_id:
+            return json.dumps({"error": "No session_id found in context"})
+        try:
+            operations = json.loads(operations_json)
+        except json.JSONDecodeError as e:
+            return json.dumps({"error": f"Invalid operations_json: {str(e)}"})
+        log.info("[patch_workflow] operations: %s", operations_json)
+
+        object_info_index = await get_object_info_index()
+        # 有节点定义时才校验节点类型、输出序号和连线类型
+        node_info = object_info_index.get if len(object_info_index) else None
+        result = await edit_workflow_data_async(
+            session_id,
+            lambda workflow_data: apply_operations(workflow_data, operations, node_info),
+            attributes={"action": "workflow_patch", "description": "Workflow patched by rewrite agent", "operations": operations},
+            checkpoint_attributes=_checkpoint_attributes("workflow patch")
+        )
+        if result is None:
+            return json.dumps({"error": "No workflow data found for this session"})
+        checkpoint_id, version_id, workflow_data, summary = result
+
+        return json.dumps({
+            "success": True,
+            "version_id": version_id,
+            "message": f"Applied {len(operations)} operations, saved as version {version_id}",
+            "added_nodes": summary["added_nodes"],
+            "removed_nodes": summary["removed_nodes"],
+            "warnings": summary["warnings"],
+            "ext": _rewrite_ext(workflow_data, summary["changes"], checkpoint_id, version_id)
+        }, ensure_ascii=False)
+    except WorkflowPatchError as e:
+        return json.dumps({
+            "error": str(e),
+            "failed_operation": e.index,
+            "hint": "No operation was applied. Fix the failing operation and send the whole list again."
+        }, ensure_ascii=False)
+    except Exception as e:
+        log.error(f"Failed to patch workflow: {str(e)}")
+        return json.dumps({"error": f"Failed to patch workflow: {str(e)}"})
+
 @function_tool
-def remove_node(node_id: str) -> str:
+async def remove_node(node_id: str) -> str:
     """从工作流中移除节点"""
     try:
         session_id = get_session_id()
         if not session_id:
             return json.dumps({"error": "No session_id found in context"})
         
-        # 在修改前保存checkpoint
-        checkpoint_id = save_checkpoint_before_modification(session_id, f"remove node {node_id}")
-        
-        workflow_data = get_workflow_data(session_id)
-        if not workflow_data:
-            return json.dumps({"error": "No workflow data found"})
-        
-        if node_id not in workflow_data:
-            return json.dumps({"error": f"Node {node_id} not found"})
-        
-        # 移除节点
-        removed_node = workflow_data.pop(node_id)
-        
-        # 移除所有指向该节点的连接
-        for other_node_id, node_data in workflow_data.items():
-            inputs = node_data.get("inputs", {})
-            for input_name, input_value in list(inputs.items()):
-                if isinstance(input_value, list) and len(input_value) == 2:
-                    if str(input_value[0]) == node_id:
-                        # 移除这个连接
-                        del inputs[input_name]
-        
-        # 保存更新
-        version_id = save_workflow_data(
+        # 读取、移除节点及其连线、保存（含修改前的checkpoint）在同一个写事务中完成
+        result = await edit_workflow_data_async(
             session_id,
-            workflow_data,
+            lambda workflow_data: apply_operations(workflow_data, [{"op": "remove_node", "node_id": node_id}]),
             attributes={
                 "action": "remove_node",
                 "description": f"Removed node {node_id}",
-                "changes": {
-                    "node_id": node_id,
-                    "removed_node": removed_node
-                }
-            }
+                "changes": {"node_id": node_id}
+            },
+            checkpoint_attributes=_checkpoint_attributes(f"remove node {node_id}")
         )
+        if result is None:
+            return json.dumps({"error": "No workflow data found"})
+        checkpoint_id, version_id, workflow_data, summary = result
         
-        # 构建返回数据，包含checkpoint信息
-        ext_data = [{
-            "type": "workflow_update",
-            "data": {
-                "workflow_data": workflow_data,
-                "changes": {
-                    "action": "remove_node",
-                    "node_id": node_id,
-                    "removed_node": removed_node
-                }
-            }
-        }]
-        
-        # 如果成功保存了checkpoint，添加修改前的checkpoint信息（给用户消息）
-        if checkpoint_id:
-            ext_data.append({
-                "type": "workflow_rewrite_checkpoint",
-                "data": {
-                    "checkpoint_id": checkpoint_id,
-                    "checkpoint_type": "workflow_rewrite_start"
-                }
-            })
-        
-        # 添加修改后的版本信息（给AI响应）
-        ext_data.append({
-            "type": "workflow_rewrite_complete",
-            "data": {
-                "version_id": version_id,
-                "checkpoint_type": "workflow_rewrite_complete"
-            }
-        })
-        
+        changes = {
+            "action": "remove_node",
+            "node_id": node_id,
+            "class_type": summary["changes"][0]["class_type"],
+            "disconnected": summary["changes"][0]["disconnected"]
+        }
         return json.dumps({
             "success": True,
             "version_id": version_id,
             "message": f"Removed node {node_id} and cleaned up connections",
-            "ext": ext_data
+            "ext": _rewrite_ext(workflow_data, changes, checkpoint_id, version_id)
         })
         
+    except WorkflowPatchError:
+        return json.dumps({"error": f"Node {node_id} not found"})
     except Exception as e:
         return json.dumps({"error": f"Failed to remove node: {str(e)}"})
@@ -8,13 +8,15 @@ Authentication utilities for ComfyUI Copilot
 from typing import Optional
 from .globals import set_comfyui_copilot_api_key, get_comfyui_copilot_api_key
 from .logger import log
+from .session_state import session_states
 
-def extract_and_store_api_key(request) -> Optional[str]:
+def extract_and_store_api_key(request, session_id: Optional[str] = None) -> Optional[str]:
     """
-    Extract Bearer token from Authorization header and store it in globals
+    Extract Bearer token from Authorization header and store it in the session state
     
     Args:
         request: The aiohttp request object
+        session_id: The session the key belongs to; without one it is stored globally
         
     Returns:
         The extracted API key if successful, None otherwise
@@ -23,11 +25,11 @@ def extract_and_store_api_key(request) -> Optional[str]:
         auth_header = request.headers.get('Authorization')
         if auth_header and auth_header.startswith('Bearer '):
             api_key = auth_header[7:]  # Remove 'Bearer ' prefix
-            set_comfyui_copilot_api_key(api_key)
+            set_comfyui_copilot_api_key(api_key, session_id)
             log.info(f"ComfyUI Copilot API key extracted and stored: {api_key[:12]}...")
             
             # Verify it's stored correctly
-            stored_key = get_comfyui_copilot_api_key()
+            stored_key = session_states.get(session_id, 'copilot_api_key') if session_id else get_comfyui_copilot_api_key()
             if stored_key == api_key:
                 log.info("API key verification: ✓ Successfully stored in globals")
             else:
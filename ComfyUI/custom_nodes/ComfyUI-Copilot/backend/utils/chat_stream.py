@@ -0,0 +1,229 @@
+"""
+Incremental delta streaming for chat responses.
+
+The default /api/chat/invoke protocol sends the whole accumulated answer as a
+JSON line on every chunk, so an answer of N characters costs O(N^2) bytes on the
+wire and a full re-render in the browser per chunk. Clients can opt in to the
+delta protocol by sending "stream_mode": "delta" in the request body. Every line
+then carries only the text that was added since the previous line:
+
+    {"session_id": ..., "stream_id": ..., "seq": 3, "offset": 120, "delta": "...",
+     "length": 184, "revision": 0, "reset": false, "final": false, "finished": false,
+     "type": "message", "format": "markdown", "ext": null}
+
+* seq counts the lines of one HTTP response, starting at 1.
+* offset is the position of delta in the full answer, length the size of the
+  full answer after applying it. A line with reset=true replaces the answer
+  (offset is 0), which happens when the agent rewrites its text, e.g. on errors.
+  revision counts these replacements.
+* final=true marks the last line; it carries ext and the agent's finished flag.
+
+Text produced while a line is being written is coalesced into the next line,
+which is flushed at most every DELTA_FLUSH_INTERVAL seconds.
+
+The agent run is decoupled from the HTTP response. If the connection drops the
+client can reconnect with "resume": {"stream_id": ..., "offset": ..., "revision": ...}
+and gets the rest of the answer from that offset. If the answer was replaced
+since (or the revision is missing) the first line resets it instead. A run without any connected client is
+cancelled after DELTA_DETACHED_TIMEOUT seconds, and finished answers are kept
+for DELTA_RETAIN_SECONDS so late resumes still succeed.
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Optional
+
+from .logger import log
+
+STREAM_MODE_DELTA = "delta"
+DELTA_FLUSH_INTERVAL = 0.05
+DELTA_DETACHED_TIMEOUT = 30.0
+DELTA_RETAIN_SECONDS = 120.0
+DELTA_MAX_STREAMS = 256
+
+
+class ChatStream:
+    """The answer of one agent run, shared by the producer task and any number of readers."""
+
+    def __init__(self, session_id: str):
+        self.stream_id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.text = ""
+        # Bumped whenever the text is replaced instead of extended
+        self.revision = 0
+        self.done = False
+        self.finished = True
+        self.ext: Optional[Any] = None
+        self.format = "markdown"
+        self.finished_at: Optional[float] = None
+        self.readers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Condition()
+        self._orphan_timer: Optional[asyncio.TimerHandle] = None
+
+    async def _notify(self) -> None:
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def update(self, text: str) -> None:
+        if text == self.text:
+            return
+        if not text.startswith(self.text):
+            self.revision += 1
+        self.text = text
+        await self._notify()
+
+    async def finish(self, text: str, ext: Optional[Any], finished: bool, format: str = "markdown") -> None:
+        if not text.startswith(self.text):
+            self.revision += 1
+        self.text = text
+        self.ext = ext
+        self.finished = finished
+        self.format = format
+        self.done = True
+        self.finished_at = time.monotonic()
+        await self._notify()
+
+    async def wait_for_change(self, offset: int, revision: int) -> None:
+        async with self._changed:
+            await self._changed.wait_for(
+                lambda: self.done or self.revision != revision or len(self.text) > offset
+            )
+
+    def attach(self) -> None:
+        self.readers += 1
+        if self._orphan_timer is not None:
+            self._orphan_timer.cancel()
+            self._orphan_timer = None
+
+    def detach(self) -> None:
+        self.readers -= 1
+        if self.readers == 0 and not self.done and self.task is not None:
+            self._orphan_timer = asyncio.get_running_loop().call_later(DELTA_DETACHED_TIMEOUT, self._cancel_orphaned)
+
+    def _cancel_orphaned(self) -> None:
+        self._orphan_timer = None
+        if self.readers == 0 and self.task is not None and not self.task.done():
+            log.info(f"Cancelling chat stream {self.stream_id}: no client reconnected")
+            self.task.cancel()
+
+
+class ChatStreamRegistry:
+    """Running and recently finished chat streams, for resuming dropped connections."""
+
+    def __init__(self, max_streams: int = DELTA_MAX_STREAMS, retain_seconds: float = DELTA_RETAIN_SECONDS):
+        self.max_streams = max_streams
+        self.retain_seconds = retain_seconds
+        self._streams: "OrderedDict[str, ChatStream]" = OrderedDict()
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        for stream_id in list(self._streams):
+            stream = self._streams[stream_id]
+            if stream.done and now - stream.finished_at > self.retain_seconds:
+                del self._streams[stream_id]
+        # Over the limit, drop the oldest finished streams; running ones are never dropped
+        for stream_id in list(self._streams):
+            if len(self._streams) <= self.max_streams:
+                break
+            if self._streams[stream_id].done:
+                del self._streams[stream_id]
+
+    def start(self, session_id: str, producer: AsyncIterator) -> ChatStream:
+        """Run the producer in its own task, feeding a new stream.
+
+        The producer yields (text, ext_with_finished) tuples with the accumulated
+        text, like comfyui_agent_invoke.
+        """
+        self._prune()
+        stream = ChatStream(session_id)
+        self._streams[stream.stream_id] = stream
+        stream.task = asyncio.ensure_future(_run_producer(stream, producer))
+        return stream
+
+    def get(self, stream_id: str) -> Optional[ChatStream]:
+        self._prune()
+        return self._streams.get(stream_id)
+
+
+async def _run_producer(stream: ChatStream, producer: AsyncIterator) -> None:
+    text = ""
+    ext_data = None
+    finished = True
+    try:
+        async for result in producer:
+            if isinstance(result, tuple) and len(result) == 2:
+                chunk, ext_with_finished = result
+                if chunk:
+                    text = chunk  # already accumulated
+                if ext_with_finished:
+                    ext_data = ext_with_finished.get("data")
+                    finished = ext_with_finished.get("finished", True)
+            elif result:
+                text += result
+            await stream.update(text)
+        await stream.finish(text, ext_data, finished)
+    except asyncio.CancelledError:
+        await stream.finish(text, ext_data, True)
+        raise
+    except Exception as e:
+        log.error(f"Error in chat stream {stream.stream_id}: {str(e)}")
+        await stream.finish(f"I apologize, but an error occurred: {str(e)}", None, True, format="text")
+
+
+async def write_deltas(response, stream: ChatStream, offset: int = 0, resume_revision: Optional[int] = None) -> int:
+    """Write the stream to an aiohttp StreamResponse as delta lines, starting at offset.
+
+    When resuming, resume_revision is the revision the client's offset was taken from.
+    Returns the number of bytes written.
+    """
+    stream.attach()
+    try:
+        # A resume offset only applies to the text it was taken from
+        reset_pending = offset > 0 and resume_revision != stream.revision
+        offset = 0 if reset_pending else min(max(offset, 0), len(stream.text))
+        revision = stream.revision
+        seq = 0
+        bytes_sent = 0
+        while True:
+            if not reset_pending:
+                await stream.wait_for_change(offset, revision)
+                if not stream.done:
+                    # Let more text accumulate so one line carries several model chunks
+                    await asyncio.sleep(DELTA_FLUSH_INTERVAL)
+            text, done = stream.text, stream.done
+            reset = reset_pending or stream.revision != revision
+            reset_pending = False
+            if reset:
+                revision = stream.revision
+                offset = 0
+            seq += 1
+            line = {
+                "session_id": stream.session_id,
+                "stream_id": stream.stream_id,
+                "seq": seq,
+                "offset": offset,
+                "delta": text[offset:],
+                "length": len(text),
+                "revision": revision,
+                "reset": reset,
+                "final": done,
+                "finished": stream.finished if done else False,
+                "type": "message",
+                "format": stream.format if done else "markdown",
+                "ext": stream.ext if done else None,
+            }
+            data = json.dumps(line).encode() + b"\n"
+            await response.write(data)
+            bytes_sent += len(data)
+            offset = len(text)
+            if done:
+                return bytes_sent
+    finally:
+        stream.detach()
+
+
+chat_streams = ChatStreamRegistry()
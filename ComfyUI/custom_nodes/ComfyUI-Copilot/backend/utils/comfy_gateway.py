@@ -1,10 +1,13 @@
 """
 ComfyUI Gateway Utilities
 
-This module provides Python implementations of ComfyUI API functions,
-using HTTP requests to the ComfyUI server for consistency.
+This module provides Python implementations of ComfyUI API functions.
+When running inside the ComfyUI process the gateway calls the server's
+validation, queue and node-info code directly; for remote ComfyUI hosts it
+falls back to HTTP requests against the REST API.
 """
 
+import copy
 import json
 import os
 import uuid
@@ -23,15 +26,20 @@ import aiohttp
 class ComfyGateway:
     """ComfyUI API Gateway for Python backend - uses internal functions instead of HTTP requests"""
     
-    def __init__(self, base_url: Optional[str] = None):
+    def __init__(self, base_url: Optional[str] = None, in_process: Optional[bool] = None):
         """
         Initialize ComfyUI Gateway
         
         Args:
             base_url: Optional base URL for ComfyUI server. If not provided, will auto-detect.
+            in_process: Call the local PromptServer directly instead of going through HTTP.
+                Defaults to True when no base_url is given (i.e. the local server), False otherwise.
         """
         # Get server instance for operations that need it
         self.server_instance = server.PromptServer.instance
+        if in_process is None:
+            in_process = base_url is None
+        self.in_process = in_process and self.server_instance is not None
         
         # Auto-detect server URL if not provided
         if base_url:
@@ -49,14 +57,14 @@ class ComfyGateway:
                 # Fallback to default
                 self.base_url = "http://127.0.0.1:8188"
         
-        logging.info(f"ComfyGateway initialized with base_url: {self.base_url}")
+        logging.debug(f"ComfyGateway initialized with base_url: {self.base_url}, in_process: {self.in_process}")
 
     async def run_prompt(self, json_data: Dict[str, Any]) -> Dict[str, Any]:
         """
-        Run a prompt - HTTP call to ComfyUI /api/prompt endpoint
+        Run a prompt - ComfyUI /api/prompt endpoint
         
-        This method sends an HTTP POST request to the ComfyUI server's /api/prompt endpoint
-        to ensure consistent behavior and avoid code duplication.
+        In-process the server's own /api/prompt logic is called directly, otherwise an
+        HTTP POST request is sent to the endpoint, so both behave the same.
         
         Args:
             json_data: The prompt/workflow data in the same format as HTTP API
@@ -64,6 +72,9 @@ class ComfyGateway:
         Returns:
             Dict containing the validation result, similar to HTTP API response
         """
+        if self.in_process and hasattr(self.server_instance, 'queue_prompt'):
+            return await self._run_prompt_in_process(json_data)
+
         try:
             # Create a timeout configuration
             timeout = aiohttp.ClientTimeout(total=30)  # 30 second timeout
@@ -129,9 +140,54 @@ class ComfyGateway:
                 "node_errors": {}
             }
 
+    async def validate_prompt(self, prompt: Dict[str, Any], partial_execution_targets: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Validate a prompt the way /api/prompt does, without queueing it for execution
+
+        Per-node results are cached, so unchanged parts of the workflow are not
+        validated again. Only available in-process: the REST API has no
+        validate-only endpoint, and /api/prompt would execute a valid workflow.
+
+        Args:
+            prompt: The workflow in API format
+            partial_execution_targets: Optional output node ids to restrict validation to
+
+        Returns:
+            Dict with success, error, node_errors (same shape as /api/prompt), a flat
+            per-node errors list and the validated output node ids
+        """
+        if not self.in_process:
+            return {
+                "success": False,
+                "error": {
+                    "type": "validation_unavailable",
+                    "message": "Validate-only checks need the Copilot to run inside the ComfyUI server",
+                    "details": f"Remote ComfyUI server: {self.base_url}",
+                    "extra_info": {}
+                },
+                "node_errors": {},
+                "errors": []
+            }
+
+        from .prompt_validation import prompt_validator
+        try:
+            return await prompt_validator.validate(prompt, partial_execution_targets)
+        except Exception as e:
+            logging.error(f"Error in validate_prompt: {e}")
+            return {
+                "success": False,
+                "error": {
+                    "type": "internal_error",
+                    "message": f"Internal error: {str(e)}",
+                    "details": str(e)
+                },
+                "node_errors": {},
+                "errors": []
+            }
+
     async def get_object_info(self, node_class: Optional[str] = None) -> Dict[str, Any]:
         """
-        Get ComfyUI node definitions - HTTP call to ComfyUI /api/object_info endpoint
+        Get ComfyUI node definitions - ComfyUI /api/object_info endpoint
         
         Args:
             node_class: Optional specific node class to get info for
@@ -139,6 +195,9 @@ class ComfyGateway:
         Returns:
             Dict containing node definitions and their parameters
         """
+        if self.in_process and hasattr(self.server_instance, 'node_info'):
+            return self._get_object_info_in_process(node_class)
+
         try:
             # Create a timeout configuration
             timeout = aiohttp.ClientTimeout(total=30)  # 30 second timeout
@@ -168,9 +227,60 @@ class ComfyGateway:
             logging.error(f"Error getting object info: {e}")
             return {}
 
+    async def _run_prompt_in_process(self, json_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Queue the prompt through the server's own /api/prompt logic (PromptServer.queue_prompt).
+
+        The HTTP handler always works on a freshly decoded request body, so the
+        payload is deep-copied here to keep the queue isolated from the caller's dict.
+        """
+        try:
+            response, status = await self.server_instance.queue_prompt(copy.deepcopy(json_data))
+            return {
+                "success": status == 200,
+                **response
+            }
+        except Exception as e:
+            logging.error(f"Error in run_prompt: {e}")
+            return {
+                "success": False,
+                "error": {
+                    "type": "internal_error",
+                    "message": f"Internal error: {str(e)}",
+                    "details": str(e)
+                },
+                "node_errors": {}
+            }
+
+    def _get_object_info_in_process(self, node_class: Optional[str] = None) -> Dict[str, Any]:
+        """
+        In-process equivalent of the /api/object_info handlers in server.py.
+
+        The returned definitions are built by the server's own node_info() and are
+        not copied, so callers must treat them as read-only.
+        """
+        node_info = self.server_instance.node_info
+        out = {}
+        try:
+            if node_class:
+                if node_class in nodes.NODE_CLASS_MAPPINGS:
+                    out[node_class] = node_info(node_class)
+                return out
+
+            with folder_paths.cache_helper:
+                for x in nodes.NODE_CLASS_MAPPINGS:
+                    try:
+                        out[x] = node_info(x)
+                    except Exception as e:
+                        logging.error(f"Error getting object info for node {x}: {e}")
+            return out
+        except Exception as e:
+            logging.error(f"Error getting object info: {e}")
+            return out
+
     async def get_installed_nodes(self) -> List[str]:
         """
-        Get list of installed node types - HTTP call to ComfyUI /api/object_info endpoint
+        Get list of installed node types - ComfyUI /api/object_info endpoint
         
         Returns:
             List of installed node type names
@@ -184,7 +294,7 @@ class ComfyGateway:
 
     async def manage_queue(self, clear: bool = False, delete: Optional[List[str]] = None) -> Dict[str, Any]:
         """
-        Clear the prompt queue or delete specific queue items - HTTP call to ComfyUI /api/queue endpoint
+        Clear the prompt queue or delete specific queue items - ComfyUI /api/queue endpoint
         
         Args:
             clear: If True, clears the entire queue
@@ -193,6 +303,14 @@ class ComfyGateway:
         Returns:
             Dict with the response from the queue management operation
         """
+        if self.in_process:
+            prompt_queue = self.server_instance.prompt_queue
+            if clear:
+                prompt_queue.wipe_queue()
+            for id_to_delete in delete or []:
+                prompt_queue.delete_queue_item(lambda a, id_to_delete=id_to_delete: a[1] == id_to_delete)
+            return {"success": True}
+
         try:
             # Create a timeout configuration
             timeout = aiohttp.ClientTimeout(total=30)  # 30 second timeout
@@ -230,11 +348,15 @@ class ComfyGateway:
 
     async def interrupt_processing(self) -> Dict[str, Any]:
         """
-        Interrupt the current processing/generation - HTTP call to ComfyUI /api/interrupt endpoint
+        Interrupt the current processing/generation - ComfyUI /api/interrupt endpoint
         
         Returns:
             Dict with the response from the interrupt operation
         """
+        if self.in_process:
+            nodes.interrupt_processing()
+            return {"success": True}
+
         try:
             # Create a timeout configuration
             timeout = aiohttp.ClientTimeout(total=30)  # 30 second timeout
@@ -265,7 +387,7 @@ class ComfyGateway:
 
     async def get_history(self, prompt_id: str) -> Dict[str, Any]:
         """
-        Get execution history for a specific prompt - HTTP call to ComfyUI /api/history/{prompt_id} endpoint
+        Get execution history for a specific prompt - ComfyUI /api/history/{prompt_id} endpoint
         
         Args:
             prompt_id: The ID of the prompt to get history for
@@ -273,6 +395,13 @@ class ComfyGateway:
         Returns:
             Dict containing the execution history and results
         """
+        if self.in_process:
+            try:
+                return self.server_instance.prompt_queue.get_history(prompt_id=prompt_id)
+            except Exception as e:
+                logging.error(f"Error fetching history for prompt {prompt_id}: {e}")
+                return {"error": f"Failed to get history: {str(e)}"}
+
         try:
             # Create a timeout configuration
             timeout = aiohttp.ClientTimeout(total=30)  # 30 second timeout
@@ -300,11 +429,19 @@ class ComfyGateway:
 
     async def get_queue_status(self) -> Dict[str, Any]:
         """
-        Get current queue status - HTTP call to ComfyUI /api/queue endpoint
+        Get current queue status - ComfyUI /api/queue endpoint
         
         Returns:
             Dict containing current queue information
         """
+        if self.in_process:
+            try:
+                queue_running, queue_pending = self.server_instance.prompt_queue.get_current_queue_volatile()
+                return {"queue_running": queue_running, "queue_pending": queue_pending}
+            except Exception as e:
+                logging.error(f"Error getting queue status: {e}")
+                return {"error": f"Failed to get queue status: {str(e)}"}
+
         try:
             # Create a timeout configuration
             timeout = aiohttp.ClientTimeout(total=30)  # 30 second timeout
@@ -334,7 +471,7 @@ class ComfyGateway:
 # Convenience functions for backward compatibility and easy importing
 async def run_prompt(json_data: Dict[str, Any], base_url: Optional[str] = None) -> Dict[str, Any]:
     """
-    Standalone function to run a prompt - HTTP call to ComfyUI /api/prompt endpoint
+    Standalone function to run a prompt - ComfyUI /api/prompt endpoint
     
     Args:
         json_data: The prompt/workflow data to execute
@@ -348,37 +485,37 @@ async def run_prompt(json_data: Dict[str, Any], base_url: Optional[str] = None)
 
 
 async def get_object_info(base_url: Optional[str] = None) -> Dict[str, Any]:
-    """Standalone function to get object info - HTTP call to ComfyUI /api/object_info endpoint"""
+    """Standalone function to get object info - ComfyUI /api/object_info endpoint"""
     gateway = ComfyGateway(base_url)
     return await gateway.get_object_info()
 
 async def get_object_info_by_class(node_class: str, base_url: Optional[str] = None) -> Dict[str, Any]:
-    """Standalone function to get object info for specific node class - HTTP call to ComfyUI /api/object_info/{node_class} endpoint"""
+    """Standalone function to get object info for specific node class - ComfyUI /api/object_info/{node_class} endpoint"""
     gateway = ComfyGateway(base_url)
     return await gateway.get_object_info(node_class)
 
 
 async def get_installed_nodes(base_url: Optional[str] = None) -> List[str]:
-    """Standalone function to get installed nodes - HTTP call to ComfyUI /api/object_info endpoint"""
+    """Standalone function to get installed nodes - ComfyUI /api/object_info endpoint"""
     gateway = ComfyGateway(base_url)
     return await gateway.get_installed_nodes()
 
 async def manage_queue(clear: bool = False, delete: Optional[List[str]] = None, base_url: Optional[str] = None) -> Dict[str, Any]:
-    """Standalone function to manage queue - HTTP call to ComfyUI /api/queue endpoint"""
+    """Standalone function to manage queue - ComfyUI /api/queue endpoint"""
     gateway = ComfyGateway(base_url)
     return await gateway.manage_queue(clear, delete)
 
 async def interrupt_processing(base_url: Optional[str] = None) -> Dict[str, Any]:
-    """Standalone function to interrupt processing - HTTP call to ComfyUI /api/interrupt endpoint"""
+    """Standalone function to interrupt processing - ComfyUI /api/interrupt endpoint"""
     gateway = ComfyGateway(base_url)
     return await gateway.interrupt_processing()
 
 async def get_history(prompt_id: str, base_url: Optional[str] = None) -> Dict[str, Any]:
-    """Standalone function to get history - HTTP call to ComfyUI /api/history/{prompt_id} endpoint"""
+    """Standalone function to get history - ComfyUI /api/history/{prompt_id} endpoint"""
     gateway = ComfyGateway(base_url)
     return await gateway.get_history(prompt_id)
 
 async def get_queue_status(base_url: Optional[str] = None) -> Dict[str, Any]:
-    """Standalone function to get queue status - HTTP call to ComfyUI /api/queue endpoint"""
+    """Standalone function to get queue status - ComfyUI /api/queue endpoint"""
     gateway = ComfyGateway(base_url)
     return await gateway.get_queue_status()
@@ -0,0 +1,272 @@
+"""
+Fuzzy "closest valid value" search over combo values and model filenames.
+
+Parameter repair needs to map a value that does not exist (a model renamed or
+moved to a sub-folder, a typo, a file from someone else's machine) to the
+closest value that does. Scanning every candidate with substring checks is slow
+and ranks poorly on model folders with thousands of files, so each value list
+gets a FuzzyIndex:
+
+* values are normalized (case, separators, file extension) and split into
+  character trigrams, with an inverted index from trigram to values;
+* a query shortlists the values sharing its rarest trigrams, scores them by
+  trigram overlap (Dice coefficient) and re-ranks the best few by edit
+  similarity of the file names.
+
+The indexes are kept in an IndexRegistry keyed by object_info combo inputs
+(node class, input name) and folder_paths folders. When the underlying list
+changes only the added and removed values are re-indexed.
+"""
+
+import asyncio
+import difflib
+import heapq
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import folder_paths
+
+from .object_info_cache import ObjectInfoIndex
+
+# Values considered for edit-distance re-ranking after trigram scoring
+RERANK_CANDIDATES = 24
+# Posting entries counted per query; rarer trigrams are counted first since they discriminate best
+MAX_POSTING_WORK = 2048
+MAX_INDEXES = 256
+
+_SEPARATORS = re.compile(r"[\s_\-.\\/()\[\]]+")
+_KNOWN_EXTENSIONS = {
+    ".safetensors", ".ckpt", ".pt", ".pth", ".bin", ".pkl", ".sft", ".gguf", ".onnx",
+    ".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tiff", ".gif",
+}
+
+
+def normalize_value(value: str) -> str:
+    """Lower-case value without its file extension, with separators collapsed to single spaces."""
+    value = str(value).lower()
+    root, extension = os.path.splitext(value)
+    if extension in _KNOWN_EXTENSIONS:
+        value = root
+    return _SEPARATORS.sub(" ", value).strip()
+
+
+def _base_name(normalized: str, value: str) -> str:
+    # The file name without sub-folders, normalized; folders often differ between machines
+    return normalize_value(re.split(r"[\\/]", str(value))[-1]) or normalized
+
+
+def _trigrams(normalized: str) -> Set[str]:
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FuzzyIndex:
+    """Trigram index over a list of string values, updated incrementally.
+
+    Searches and updates may run on different threads and are serialized.
+    """
+
+    def __init__(self, values: Iterable = ()):
+        self._lock = threading.Lock()
+        # value -> (normalized, base name, trigrams)
+        self._entries: Dict[str, Tuple[str, str, Set[str]]] = {}
+        self._by_normalized: Dict[str, List[str]] = {}
+        self._postings: Dict[str, Set[str]] = {}
+        self.update(values)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, value: str) -> bool:
+        return value in self._entries
+
+    def values(self) -> List[str]:
+        with self._lock:
+            return list(self._entries)
+
+    @staticmethod
+    def _analyze(value: str) -> Tuple[str, str, Set[str]]:
+        normalized = normalize_value(value)
+        return normalized, _base_name(normalized, value), _trigrams(normalized)
+
+    def _add(self, value: str, entry: Tuple[str, str, Set[str]]) -> None:
+        normalized, _, grams = entry
+        self._entries[value] = entry
+        self._by_normalized.setdefault(normalized, []).append(value)
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(value)
+
+    def _remove(self, value: str) -> None:
+        normalized, _, grams = self._entries.pop(value)
+        same = self._by_normalized[normalized]
+        same.remove(value)
+        if not same:
+            del self._by_normalized[normalized]
+        for gram in grams:
+            posting = self._postings[gram]
+            posting.discard(value)
+            if not posting:
+                del self._postings[gram]
+
+    def update(self, values: Iterable) -> Tuple[int, int]:
+        """Make the index contain exactly values; returns (added, removed) counts."""
+        wanted = {value for value in values if isinstance(value, str)}
+        with self._lock:
+            known = set(self._entries)
+        # Normalizing is the costly part, done without blocking searches
+        analyzed = {value: self._analyze(value) for value in wanted - known}
+        with self._lock:
+            removed = [value for value in self._entries if value not in wanted]
+            added = [value for value in wanted if value not in self._entries]
+            for value in removed:
+                self._remove(value)
+            for value in added:
+                entry = analyzed.get(value)
+                self._add(value, entry if entry is not None else self._analyze(value))
+        return len(added), len(removed)
+
+    def equivalent(self, query: str) -> List[str]:
+        """Values equal to query after normalization (case, separators, extension)."""
+        with self._lock:
+            return list(self._by_normalized.get(normalize_value(query), []))
+
+    def search(self, query: str, limit: int = 5, min_score: float = 0.0) -> List[Tuple[str, float]]:
+        """Values closest to query as (value, score) pairs, best first; scores are in [0, 1]."""
+        with self._lock:
+            return self._search(query, limit, min_score)
+
+    def _search(self, query: str, limit: int, min_score: float) -> List[Tuple[str, float]]:
+        if not self._entries:
+            return []
+        if query in self._entries:
+            exact = [(query, 1.0)]
+            if limit <= 1:
+                return exact
+        else:
+            exact = []
+
+        normalized = normalize_value(query)
+        query_grams = _trigrams(normalized)
+        postings = sorted(
+            (self._postings[gram] for gram in query_grams if gram in self._postings), key=len
+        )
+        counts: Counter = Counter()
+        work = 0
+        for posting in postings:
+            # The rarest trigram is always counted, so queries made only of common grams still match
+            if work and work + len(posting) > MAX_POSTING_WORK:
+                break
+            counts.update(posting)
+            work += len(posting)
+        if not counts:
+            return exact
+
+        # Shortlist by the counted trigrams, then score the shortlist on all of its trigrams
+        scored = (
+            (2.0 * len(query_grams & self._entries[value][2]) / (len(query_grams) + len(self._entries[value][2])), value)
+            for value, _ in counts.most_common(RERANK_CANDIDATES * 4)
+        )
+        candidates = heapq.nlargest(RERANK_CANDIDATES, scored)
+
+        # SequenceMatcher caches its analysis of the second sequence, so the query goes there
+        matcher = difflib.SequenceMatcher(None, "", _base_name(normalized, query), autojunk=False)
+        results: List[Tuple[str, float]] = []
+        for dice, value in candidates:
+            if value == query:
+                continue
+            cutoff = results[limit - 1][1] if len(results) >= limit else min_score
+            # Even a perfect edit similarity cannot lift this or any later candidate into the results
+            if len(results) >= limit and 0.4 * dice + 0.6 < cutoff:
+                break
+            value_normalized, value_base, _ = self._entries[value]
+            if value_normalized == normalized:
+                score = 0.99
+            else:
+                matcher.set_seq1(value_base)
+                if 0.4 * dice + 0.6 * matcher.quick_ratio() < cutoff:
+                    continue
+                score = round(0.4 * dice + 0.6 * matcher.ratio(), 4)
+            if score >= min_score:
+                results.append((value, score))
+                results.sort(key=lambda item: (-item[1], item[0]))
+        return (exact + results)[:limit]
+
+
+class IndexRegistry:
+    """FuzzyIndexes for object_info combo inputs and folder_paths folders."""
+
+    def __init__(self, max_indexes: int = MAX_INDEXES):
+        self.max_indexes = max_indexes
+        # key -> (source list the index was built from, index)
+        self._indexes: "OrderedDict[tuple, Tuple[list, FuzzyIndex]]" = OrderedDict()
+        # Only held briefly, lookups take it on the event loop
+        self._lock = threading.Lock()
+        # Serialize builds of the same key, in worker threads
+        self._build_locks: Dict[tuple, threading.Lock] = {}
+
+    def _current(self, key: tuple, values: list) -> Optional[FuzzyIndex]:
+        with self._lock:
+            entry = self._indexes.get(key)
+            if entry is not None and entry[0] is values:
+                self._indexes.move_to_end(key)
+                return entry[1]
+            return None
+
+    async def _get(self, key: tuple, values: list) -> FuzzyIndex:
+        index = self._current(key, values)
+        if index is not None:
+            return index
+        # Building an index over thousands of files takes a while, keep it off the event loop
+        return await asyncio.to_thread(self._build, key, values)
+
+    def _build(self, key: tuple, values: list) -> FuzzyIndex:
+        with self._lock:
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+        with build_lock:
+            with self._lock:
+                entry = self._indexes.get(key)
+            if entry is not None:
+                source, index = entry
+                # object_info snapshots and folder_paths caches are replaced, not mutated,
+                # so an unchanged list is the very same object
+                if source is not values:
+                    index.update(values)
+            else:
+                index = FuzzyIndex(values)
+            with self._lock:
+                self._indexes[key] = (values, index)
+                self._indexes.move_to_end(key)
+                while len(self._indexes) > self.max_indexes:
+                    evicted, _ = self._indexes.popitem(last=False)
+                    self._build_locks.pop(evicted, None)
+            return index
+
+    async def combo(self, object_info_index: ObjectInfoIndex, node_class: str, input_name: str) -> Optional[FuzzyIndex]:
+        """Index of the options of a combo input, or None if the input is not a combo."""
+        node_info = object_info_index.get(node_class) or {}
+        node_inputs = node_info.get("input") or {}
+        for section in ("required", "optional"):
+            config = (node_inputs.get(section) or {}).get(input_name)
+            if isinstance(config, (list, tuple)) and config and isinstance(config[0], list):
+                return await self._get(("combo", node_class, input_name), config[0])
+        return None
+
+    async def folder(self, folder_name: str) -> Optional[FuzzyIndex]:
+        """Index of the files in a folder_paths folder (e.g. "loras"), or None for unknown folders."""
+        folder_name = folder_paths.map_legacy(folder_name)
+        if folder_name not in folder_paths.folder_names_and_paths:
+            return None
+        cached = folder_paths.cached_filename_list_(folder_name)
+        if cached is None:
+            # Lists the folder on disk and fills folder_paths' cache
+            await asyncio.to_thread(folder_paths.get_filename_list, folder_name)
+            cached = folder_paths.cached_filename_list_(folder_name)
+        if cached is None:
+            return None
+        return await self._get(("folder", folder_name), cached[0])
+
+
+fuzzy_indexes = IndexRegistry()
@@ -9,11 +9,19 @@ Description: 这是默认设置,请设置`customMade`, 打开koroFileHeader查
 
 """
 Global utilities for managing application-wide state and configuration.
+
+Language and the Copilot API key are per session: they are kept in the
+session state cache and only fall back to the global defaults when no
+session is known.
 """
 
+import os
 import threading
 from typing import Optional, Dict, Any
 
+from .request_context import get_session_id
+from .session_state import session_states
+
 class GlobalState:
     """Thread-safe global state manager for application-wide configuration."""
     
@@ -64,15 +72,19 @@ def set_global(key: str, value: Any) -> None:
     _global_state.set(key, value)
 
 def get_language() -> str:
-    """Get the current language setting."""
-    language = _global_state.get_language()
+    """Get the language of the current session, or the default language."""
+    language = session_states.get(get_session_id(), 'language') or _global_state.get_language()
     if not language:
         language = 'en'
     return language
 
-def set_language(language: str) -> None:
-    """Set the current language setting."""
-    _global_state.set_language(language)
+def set_language(language: str, session_id: Optional[str] = None) -> None:
+    """Set the language of the session (the current one by default), or the default language without a session."""
+    session_id = session_id or get_session_id()
+    if session_id:
+        session_states.update(session_id, language=language)
+    else:
+        _global_state.set_language(language)
 
 def update_globals(**kwargs) -> None:
     """Update multiple global values at once."""
@@ -83,15 +95,20 @@ def get_all_globals() -> Dict[str, Any]:
     return _global_state.get_all()
 
 def get_comfyui_copilot_api_key() -> Optional[str]:
-    """Get the ComfyUI Copilot API key."""
-    return _global_state.get('comfyui_copilot_api_key')
+    """Get the ComfyUI Copilot API key of the current session, or the last key stored without a session."""
+    return session_states.get(get_session_id(), 'copilot_api_key') or _global_state.get('comfyui_copilot_api_key')
 
-def set_comfyui_copilot_api_key(api_key: str) -> None:
-    """Set the ComfyUI Copilot API key."""
-    _global_state.set('comfyui_copilot_api_key', api_key)
+def set_comfyui_copilot_api_key(api_key: str, session_id: Optional[str] = None) -> None:
+    """Set the ComfyUI Copilot API key of the session (the current one by default)."""
+    session_id = session_id or get_session_id()
+    if session_id:
+        session_states.update(session_id, copilot_api_key=api_key)
+    else:
+        _global_state.set('comfyui_copilot_api_key', api_key)
 
 
-BACKEND_BASE_URL = "https://comfyui-copilot-server.onrender.com"
+# Copilot backend (LLM proxy and MCP server); overridable e.g. to point at local stubs
+BACKEND_BASE_URL = os.environ.get("COPILOT_BACKEND_BASE_URL", "https://comfyui-copilot-server.onrender.com")
 LMSTUDIO_DEFAULT_BASE_URL = "http://localhost:1234/v1"
 WORKFLOW_MODEL_NAME = "us.anthropic.claude-sonnet-4-20250514-v1:0"
 # WORKFLOW_MODEL_NAME = "gpt-5-2025-08-07-GlobalStandard"
@@ -0,0 +1,100 @@
+"""
+Minimal JSON Patch (RFC 6902) support for workflow checkpoints.
+
+Only the operations needed to describe the difference between two JSON
+documents are produced and applied: add, remove and replace. Paths are JSON
+Pointers (RFC 6901). Lists are compared element by element with additions and
+removals at the tail, which matches how workflow edits change node and link
+lists closely enough to keep deltas small.
+"""
+
+from typing import Any, Dict, List
+
+
+def _escape(token: Any) -> str:
+    return str(token).replace("~", "~0").replace("/", "~1")
+
+
+def _unescape(token: str) -> str:
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+def make_patch(src: Any, dst: Any) -> List[Dict[str, Any]]:
+    """Return the operations that turn src into dst. Values in the patch reference dst."""
+    patch: List[Dict[str, Any]] = []
+    _diff(src, dst, "", patch)
+    return patch
+
+
+def _keeps_key_order(src: Dict[str, Any], dst: Dict[str, Any]) -> bool:
+    """Whether applying removes and appending adds to src reproduces dst's key order."""
+    kept = [key for key in src if key in dst]
+    added = [key for key in dst if key not in src]
+    return kept + added == list(dst)
+
+
+def _diff(src: Any, dst: Any, path: str, patch: List[Dict[str, Any]]) -> None:
+    if src is dst:
+        return
+    if isinstance(src, dict) and isinstance(dst, dict) and _keeps_key_order(src, dst):
+        for key, value in src.items():
+            if key not in dst:
+                patch.append({"op": "remove", "path": f"{path}/{_escape(key)}"})
+            else:
+                _diff(value, dst[key], f"{path}/{_escape(key)}", patch)
+        for key, value in dst.items():
+            if key not in src:
+                patch.append({"op": "add", "path": f"{path}/{_escape(key)}", "value": value})
+        return
+    if isinstance(src, list) and isinstance(dst, list):
+        common = min(len(src), len(dst))
+        for index in range(common):
+            _diff(src[index], dst[index], f"{path}/{index}", patch)
+        # Remove from the end so the remaining indexes stay valid
+        for index in range(len(src) - 1, common - 1, -1):
+            patch.append({"op": "remove", "path": f"{path}/{index}"})
+        for index in range(common, len(dst)):
+            patch.append({"op": "add", "path": f"{path}/-", "value": dst[index]})
+        return
+    # bool is a subclass of int, so compare types as well as values
+    if type(src) is not type(dst) or src != dst:
+        patch.append({"op": "replace", "path": path, "value": dst})
+
+
+def apply_patch(doc: Any, patch: List[Dict[str, Any]]) -> Any:
+    """Apply a patch in place and return the resulting document (the root may be replaced)."""
+    for operation in patch:
+        op, path = operation["op"], operation["path"]
+        if path == "":
+            if op == "remove":
+                doc = None
+            else:
+                doc = operation["value"]
+            continue
+
+        tokens = [_unescape(token) for token in path.split("/")[1:]]
+        parent = doc
+        for token in tokens[:-1]:
+            parent = parent[int(token)] if isinstance(parent, list) else parent[token]
+        last = tokens[-1]
+
+        if isinstance(parent, list):
+            if op == "add":
+                if last == "-":
+                    parent.append(operation["value"])
+                else:
+                    parent.insert(int(last), operation["value"])
+            elif op == "remove":
+                del parent[int(last)]
+            elif op == "replace":
+                parent[int(last)] = operation["value"]
+            else:
+                raise ValueError(f"Unsupported JSON patch operation: {op}")
+        else:
+            if op in ("add", "replace"):
+                parent[last] = operation["value"]
+            elif op == "remove":
+                del parent[last]
+            else:
+                raise ValueError(f"Unsupported JSON patch operation: {op}")
+    return doc
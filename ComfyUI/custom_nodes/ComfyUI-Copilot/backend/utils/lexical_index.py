@@ -0,0 +1,74 @@
+"""
+Small in-memory lexical search (BM25 over weighted fields) for prompt assets.
+
+Documents are dicts of field name to text. Text is tokenized into lower-case
+ASCII words and CJK character bigrams, so mixed Chinese/English names such as
+"添加LoRA" or "wan2.2图生视频" match queries in either language without a
+segmenter. Field weights multiply term frequencies, so a query term in a
+document's name counts more than the same term in its body.
+
+The index is immutable: build a new one when the documents change.
+"""
+
+import math
+import re
+from collections import Counter
+from typing import Dict, Hashable, List, Mapping, Optional, Tuple
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+|[\u3400-\u9fff\uf900-\ufaff]+")
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """ASCII words and CJK bigrams of text (a lone CJK character is kept as is)."""
+    tokens: List[str] = []
+    for match in _TOKEN_PATTERN.findall(str(text or "").lower()):
+        if match.isascii():
+            tokens.append(match)
+        elif len(match) == 1:
+            tokens.append(match)
+        else:
+            tokens.extend(match[i:i + 2] for i in range(len(match) - 1))
+    return tokens
+
+
+class LexicalIndex:
+    """BM25 index over documents with weighted fields."""
+
+    def __init__(self, documents: Mapping[Hashable, Mapping[str, Optional[str]]], field_weights: Mapping[str, float]):
+        self._term_frequencies: Dict[Hashable, Counter] = {}
+        self._lengths: Dict[Hashable, float] = {}
+        self._postings: Dict[str, List[Hashable]] = {}
+        for key, fields in documents.items():
+            frequencies: Counter = Counter()
+            for field, weight in field_weights.items():
+                for token in tokenize(fields.get(field)):
+                    frequencies[token] += weight
+            self._term_frequencies[key] = frequencies
+            self._lengths[key] = sum(frequencies.values())
+            for token in frequencies:
+                self._postings.setdefault(token, []).append(key)
+        self._average_length = (sum(self._lengths.values()) / len(self._lengths)) if self._lengths else 0.0
+
+    def __len__(self) -> int:
+        return len(self._term_frequencies)
+
+    def _idf(self, token: str) -> float:
+        matching = len(self._postings.get(token, ()))
+        return math.log(1 + (len(self) - matching + 0.5) / (matching + 0.5))
+
+    def search(self, query: str, limit: int = 5) -> List[Tuple[Hashable, float]]:
+        """Best matching document keys as (key, score) pairs, best first; documents sharing no term are omitted."""
+        scores: Counter = Counter()
+        for token, query_count in Counter(tokenize(query)).items():
+            postings = self._postings.get(token)
+            if not postings:
+                continue
+            idf = self._idf(token)
+            for key in postings:
+                frequency = self._term_frequencies[key][token]
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[key] / self._average_length)
+                scores[key] += query_count * idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        return [(key, round(score, 4)) for key, score in scores.most_common(limit)]
@@ -1,14 +1,44 @@
 """
 Logging utility module using Python standard library logging with file location info.
+
+Records are put on a bounded in-memory queue and written to the console and the
+rotating log file by a background thread, so logging never blocks the event
+loop on disk or terminal IO. Messages are formatted lazily on that thread:
+prefer log.info("tool output: %s", output) over f-strings for large values.
+Messages longer than COPILOT_LOG_MAX_MESSAGE_CHARS are truncated.
+
+Environment variables:
+    COPILOT_LOG_LEVEL               minimum level, default DEBUG
+    COPILOT_LOG_MAX_MESSAGE_CHARS   truncate longer messages, 0 disables, default 4000
+    COPILOT_LOG_MAX_BYTES           rotate the log file at this size, default 10MB
+    COPILOT_LOG_BACKUP_COUNT        rotated files to keep, default 7
+    COPILOT_LOG_QUEUE_SIZE          records buffered before new ones are dropped, default 10000
 """
 
+import atexit
 import logging
 import logging.handlers
+import queue
 import sys
 import os
-import inspect
+import threading
 from datetime import datetime
 
+LOG_LEVEL = logging.getLevelName(os.environ.get("COPILOT_LOG_LEVEL", "DEBUG").upper())
+if not isinstance(LOG_LEVEL, int):
+    LOG_LEVEL = logging.DEBUG
+LOG_MAX_MESSAGE_CHARS = int(os.environ.get("COPILOT_LOG_MAX_MESSAGE_CHARS", "4000"))
+LOG_MAX_BYTES = int(os.environ.get("COPILOT_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.environ.get("COPILOT_LOG_BACKUP_COUNT", "7"))
+LOG_QUEUE_SIZE = int(os.environ.get("COPILOT_LOG_QUEUE_SIZE", "10000"))
+
+
+def truncate_message(message: str, limit: int = LOG_MAX_MESSAGE_CHARS) -> str:
+    """Cut a message down to limit characters, noting how much was dropped."""
+    if limit <= 0 or len(message) <= limit:
+        return message
+    return f"{message[:limit]}... [truncated {len(message) - limit} chars]"
+
 
 class LocationFormatter(logging.Formatter):
     """Custom formatter that adds file location information."""
@@ -25,11 +55,82 @@ class LocationFormatter(logging.Formatter):
         return super().format(record)
 
 
+class TruncatingFormatter(LocationFormatter):
+    """Formats the message once, tolerating print-style arguments, and truncates it."""
+
+    def format(self, record):
+        if not getattr(record, 'truncated', False):
+            message = None
+            if not record.args or '%' in str(record.msg):
+                try:
+                    message = record.getMessage()
+                except (TypeError, ValueError):
+                    pass
+            if message is None:
+                # log.info("Request JSON:", data) style calls without placeholders
+                args = record.args if isinstance(record.args, tuple) else (record.args,)
+                message = " ".join(str(part) for part in (record.msg,) + args)
+            record.msg = truncate_message(message)
+            record.args = None
+            record.truncated = True
+        return super().format(record)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking or raising when the queue is full.
+
+    Formatting is left to the listener thread; only tracebacks are rendered
+    here, because they refer to frames of the calling thread.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+            return
+        if self.dropped:
+            with self._dropped_lock:
+                dropped, self.dropped = self.dropped, 0
+            if dropped:
+                notice = logging.LogRecord(
+                    record.name, logging.WARNING, __file__, 0,
+                    f"Log queue full, dropped {dropped} records", None, None, "enqueue"
+                )
+                try:
+                    self.queue.put_nowait(notice)
+                except queue.Full:
+                    pass
+
+
+_listener = None
+
+
+def _stop_listener():
+    if _listener is not None:
+        # Drains the queue before returning
+        _listener.stop()
+
+
 def setup_logger():
-    """Setup the main logger with console and file handlers."""
+    """Setup the main logger with console and file handlers behind a background queue."""
+    global _listener
+
     # Create logger
     logger = logging.getLogger('comfyui_copilot')
-    logger.setLevel(logging.DEBUG)
+    logger.setLevel(LOG_LEVEL)
     
     # Prevent duplicate logs
     if logger.handlers:
@@ -37,11 +138,11 @@ def setup_logger():
     
     # Console handler with color support
     console_handler = logging.StreamHandler(sys.stderr)
-    console_handler.setLevel(logging.DEBUG)
+    console_handler.setLevel(LOG_LEVEL)
     
     # Console formatter with colors (simple format for better compatibility)
     console_format = '%(asctime)s | %(levelname)-8s | %(location)s | %(message)s'
-    console_formatter = LocationFormatter(console_format, datefmt='%Y-%m-%d %H:%M:%S')
+    console_formatter = TruncatingFormatter(console_format, datefmt='%Y-%m-%d %H:%M:%S')
     console_handler.setFormatter(console_formatter)
     
     # File handler
@@ -50,19 +151,27 @@ def setup_logger():
     
     file_handler = logging.handlers.RotatingFileHandler(
         os.path.join(log_dir, "comfyui_copilot.log"),
-        maxBytes=10*1024*1024,  # 10MB
-        backupCount=7
+        maxBytes=LOG_MAX_BYTES,
+        backupCount=LOG_BACKUP_COUNT,
+        encoding="utf-8"
     )
-    file_handler.setLevel(logging.DEBUG)
+    file_handler.setLevel(LOG_LEVEL)
     
     # File formatter
     file_format = '%(asctime)s | %(levelname)-8s | %(location)s | %(message)s'
-    file_formatter = LocationFormatter(file_format, datefmt='%Y-%m-%d %H:%M:%S')
+    file_formatter = TruncatingFormatter(file_format, datefmt='%Y-%m-%d %H:%M:%S')
     file_handler.setFormatter(file_formatter)
     
-    # Add handlers to logger
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
+    # Only the queue handler runs on the caller's thread; the listener thread writes
+    queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    queue_handler.setLevel(LOG_LEVEL)
+    logger.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(
+        queue_handler.queue, console_handler, file_handler, respect_handler_level=True
+    )
+    _listener.start()
+    atexit.register(_stop_listener)
     
     return logger
 
@@ -74,7 +183,7 @@ class Logger:
         self._logger = setup_logger()
         if name:
             self._logger = logging.getLogger(f'comfyui_copilot.{name}')
-            self._logger.setLevel(logging.DEBUG)
+            self._logger.setLevel(LOG_LEVEL)
             # Prevent propagation to parent logger to avoid duplicate messages
             self._logger.propagate = False
             
@@ -86,27 +195,31 @@ class Logger:
     
     def _log_with_location(self, level, message, *args, **kwargs):
         """Log message with automatic location detection."""
-        # Get the caller's frame (2 levels up: _log_with_location -> debug/info/etc -> actual caller)
-        frame = inspect.currentframe().f_back.f_back
-        try:
-            filename = os.path.basename(frame.f_code.co_filename)
-            function_name = frame.f_code.co_name
-            line_number = frame.f_lineno
+        if not self._logger.isEnabledFor(level):
+            return
+        # Direct frame lookup (2 levels up: _log_with_location -> debug/info/etc -> actual caller);
+        # the location string itself is built by the formatter on the listener thread
+        frame = sys._getframe(2)
+        code = frame.f_code
+        line_number = frame.f_lineno
+        del frame
             
-            # Create a log record manually to ensure no duplicate processing
-            if self._logger.isEnabledFor(level):
-                record = self._logger.makeRecord(
-                    self._logger.name, level, frame.f_code.co_filename, line_number,
-                    message, args, None, function_name
-                )
-                record.location = f"{filename}:{function_name}:{line_number}"
+        # Large f-string payloads are cut before they are queued
+        preformatted = not args and isinstance(message, str)
+        if preformatted:
+            message = truncate_message(message)
                 
-                # Process the record through handlers directly to avoid duplication
-                for handler in self._logger.handlers:
-                    if record.levelno >= handler.level:
-                        handler.handle(record)
-        finally:
-            del frame
+        # Create a log record manually to ensure no duplicate processing
+        record = self._logger.makeRecord(
+            self._logger.name, level, code.co_filename, line_number,
+            message, args, kwargs.get('exc_info'), code.co_name
+        )
+        record.truncated = preformatted
+
+        # Process the record through handlers directly to avoid duplication
+        for handler in self._logger.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
     
     def debug(self, message, *args, **kwargs):
         """Log debug message."""
@@ -134,19 +247,9 @@ class Logger:
     
     def exception(self, message, *args, **kwargs):
         """Log exception message with traceback."""
-        # For exceptions, we want to use the standard logger.exception which includes traceback
-        frame = inspect.currentframe().f_back
-        try:
-            filename = os.path.basename(frame.f_code.co_filename)
-            function_name = frame.f_code.co_name
-            line_number = frame.f_lineno
-            
-            # Use the standard exception logging with location info
-            self._logger.exception(message, *args, **kwargs, 
-                                 extra={'location': f"{filename}:{function_name}:{line_number}"},
-                                 stacklevel=2)
-        finally:
-            del frame
+        # For exceptions, we want to use the standard logger.exception which includes traceback;
+        # stacklevel makes the record point at the caller
+        self._logger.exception(message, *args, **kwargs, stacklevel=2)
 
 
 # Create default logger instance
@@ -168,6 +271,6 @@ def get_logger(name=None):
 
 
 __all__ = [
-    'log', 'Logger', 'get_logger',
+    'log', 'Logger', 'get_logger', 'truncate_message',
     'debug', 'info', 'warning', 'warn', 'error', 'critical', 'exception'
-]
\ No newline at end of file
+]
@@ -0,0 +1,134 @@
+"""
+Non-blocking access to the /models endpoint of OpenAI-compatible LLM servers.
+
+The model picker and the API key check both ask the configured endpoint for
+its model list. They run inside aiohttp handlers on the ComfyUI event loop, so
+the request goes through a shared aiohttp session with connect and total
+timeouts instead of a blocking HTTP call. Successful listings are cached per
+(base_url, key fingerprint) for a short while, and concurrent requests for the
+same endpoint and key share a single upstream call.
+
+Only a SHA-256 fingerprint of the API key is kept in cache keys.
+"""
+
+import asyncio
+import hashlib
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import aiohttp
+
+from .logger import log
+
+MODEL_LIST_CONNECT_TIMEOUT = 5.0
+MODEL_LIST_TOTAL_TIMEOUT = 15.0
+# Successful listings are reused for this long
+MODEL_LIST_CACHE_TTL = 300.0
+MODEL_LIST_CACHE_SIZE = 64
+MODEL_LIST_MAX_CONNECTIONS = 16
+
+
+class ModelListResult(NamedTuple):
+    status: int
+    models: List[str]
+    # Response body, only kept for failed requests so callers can report it
+    text: str = ""
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 200
+
+
+def key_fingerprint(api_key: Optional[str]) -> str:
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+
+
+class ModelListClient:
+    """Fetches model lists through one pooled aiohttp session with caching and coalescing."""
+
+    def __init__(self, cache_ttl: float = MODEL_LIST_CACHE_TTL, cache_size: int = MODEL_LIST_CACHE_SIZE):
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._cache: Dict[Tuple[str, str, bool], Tuple[float, ModelListResult]] = {}
+        self._inflight: Dict[Tuple[str, str, bool], asyncio.Future] = {}
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # The session is bound to the loop it was created on
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=MODEL_LIST_TOTAL_TIMEOUT, connect=MODEL_LIST_CONNECT_TIMEOUT),
+                connector=aiohttp.TCPConnector(limit=MODEL_LIST_MAX_CONNECTIONS),
+            )
+            self._loop = loop
+            self._inflight.clear()
+        return self._session
+
+    async def list_models(self, base_url: str, api_key: Optional[str], send_auth: bool = True,
+                          use_cache: bool = True) -> ModelListResult:
+        """Return the model ids served at base_url.
+
+        Errors from the endpoint are returned as a result with the HTTP status;
+        connection errors and timeouts are raised.
+        """
+        base_url = base_url.rstrip("/")
+        key = (base_url, key_fingerprint(api_key), send_auth)
+        if use_cache:
+            cached = self._cache.get(key)
+            if cached is not None and time.monotonic() - cached[0] < self.cache_ttl:
+                return cached[1]
+
+        session = self._get_session()
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch(session, base_url, api_key, send_auth))
+            self._inflight[key] = future
+            future.add_done_callback(lambda f, key=key: self._finish(key, f))
+        # Shield the shared call so one caller going away does not cancel it for the others
+        return await asyncio.shield(future)
+
+    def _finish(self, key: Tuple[str, str, bool], future: asyncio.Future) -> None:
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if future.cancelled() or future.exception() is not None:
+            return
+        result = future.result()
+        if not result.ok:
+            return
+        self._cache.pop(key, None)
+        self._cache[key] = (time.monotonic(), result)
+        while len(self._cache) > self.cache_size:
+            self._cache.pop(next(iter(self._cache)))
+
+    async def _fetch(self, session: aiohttp.ClientSession, base_url: str, api_key: Optional[str],
+                     send_auth: bool) -> ModelListResult:
+        headers = {"Authorization": f"Bearer {api_key}"} if send_auth else {}
+        started_at = time.monotonic()
+        async with session.get(f"{base_url}/models", headers=headers) as response:
+            if response.status != 200:
+                text = await response.text()
+                log.info(f"Model list request to {base_url} failed with HTTP {response.status}")
+                return ModelListResult(response.status, [], text)
+            payload: Any = await response.json(content_type=None)
+        models = [model["id"] for model in (payload or {}).get("data") or [] if "id" in model]
+        log.info(f"Fetched {len(models)} models from {base_url} in {time.monotonic() - started_at:.2f}s")
+        return ModelListResult(200, models)
+
+    def invalidate(self, base_url: Optional[str] = None) -> None:
+        """Drop cached listings, for one endpoint or all of them."""
+        if base_url is None:
+            self._cache.clear()
+            return
+        base_url = base_url.rstrip("/")
+        for key in [key for key in self._cache if key[0] == base_url]:
+            del self._cache[key]
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+model_list_client = ModelListClient()
@@ -0,0 +1,190 @@
+"""
+Shared, versioned object_info cache for the agent tools.
+
+Fetching object_info builds the definition of every registered node, which is
+several MB on installs with many custom nodes. The agent tools usually only
+need one or a few classes, so the definitions are fetched once and kept until
+the node registry or one of the model/input folders changes. Each rebuild bumps
+the index version, which callers can use to key their own derived caches.
+"""
+
+import asyncio
+import os
+import threading
+from typing import Dict, Any, Optional, List, Tuple
+
+import nodes
+import folder_paths
+
+from .comfy_gateway import ComfyGateway
+from .logger import log
+
+
+def input_config_types(input_config: Any) -> List[str]:
+    """Return the socket types accepted by an object_info input config."""
+    if isinstance(input_config, (list, tuple)) and len(input_config) > 0:
+        input_type = input_config[0]
+        if isinstance(input_type, (list, tuple)):
+            # Combo widgets list their options instead of a type name
+            return ["COMBO"]
+        if isinstance(input_type, str):
+            return [t.strip() for t in input_type.split(",")] if "," in input_type else [input_type]
+    return ["*"]
+
+
+class ObjectInfoIndex:
+    """Immutable snapshot of object_info with lookup indexes.
+
+    The node definitions are shared between all callers and must be treated as read-only.
+    """
+
+    def __init__(self, object_info: Dict[str, Any], version: int):
+        self.object_info = object_info
+        self.version = version
+        # type -> [(class_name, output_index)]
+        self.outputs_by_type: Dict[str, List[Tuple[str, int]]] = {}
+        # type -> [(class_name, input_name, required)]
+        self.inputs_by_type: Dict[str, List[Tuple[str, str, bool]]] = {}
+        self._lower_names: List[Tuple[str, str]] = []
+
+        for class_name, info in object_info.items():
+            self._lower_names.append((class_name.lower(), class_name))
+            for index, output_type in enumerate(info.get("output") or []):
+                if isinstance(output_type, (list, tuple)):
+                    output_type = "COMBO"
+                self.outputs_by_type.setdefault(output_type, []).append((class_name, index))
+            node_inputs = info.get("input") or {}
+            for section in ("required", "optional"):
+                for input_name, input_config in (node_inputs.get(section) or {}).items():
+                    for input_type in input_config_types(input_config):
+                        self.inputs_by_type.setdefault(input_type, []).append(
+                            (class_name, input_name, section == "required")
+                        )
+
+    def __contains__(self, class_name: str) -> bool:
+        return class_name in self.object_info
+
+    def __len__(self) -> int:
+        return len(self.object_info)
+
+    def get(self, class_name: str) -> Optional[Dict[str, Any]]:
+        """Get the definition of a single node class."""
+        return self.object_info.get(class_name)
+
+    def get_many(self, class_names: List[str]) -> Dict[str, Any]:
+        """Get the definitions of the given node classes, skipping unknown ones."""
+        return {name: self.object_info[name] for name in class_names if name in self.object_info}
+
+    def classes_with_output(self, output_type: str) -> List[Tuple[str, int]]:
+        """Node classes that produce the given type, as (class_name, output_index)."""
+        return self.outputs_by_type.get(output_type, [])
+
+    def classes_with_input(self, input_type: str) -> List[Tuple[str, str, bool]]:
+        """Node classes that accept the given type, as (class_name, input_name, required)."""
+        return self.inputs_by_type.get(input_type, [])
+
+    def search(self, keyword: str, limit: Optional[int] = None) -> List[str]:
+        """Case-insensitive substring search over class names."""
+        keyword = keyword.lower()
+        matches = [name for lower_name, name in self._lower_names if keyword in lower_name]
+        return matches[:limit] if limit is not None else matches
+
+
+class ObjectInfoCache:
+    """Process-wide object_info cache invalidated by node registry and folder changes."""
+
+    def __init__(self):
+        self._index: Optional[ObjectInfoIndex] = None
+        self._signature = None
+        self._version = 0
+        self._lock = threading.Lock()
+        self._refresh_lock: Optional[asyncio.Lock] = None
+
+    @staticmethod
+    def _compute_signature():
+        """Cheap fingerprint of everything that can change object_info."""
+        registry = nodes.NODE_CLASS_MAPPINGS
+        dirs = set()
+        for paths, _ in folder_paths.folder_names_and_paths.values():
+            dirs.update(paths)
+        # Sub-directories discovered by folder_paths while listing model files
+        for cached in list(folder_paths.filename_list_cache.values()):
+            dirs.update(cached[1].keys())
+        dirs.add(folder_paths.get_input_directory())
+
+        mtimes = []
+        for directory in sorted(dirs):
+            try:
+                mtimes.append(os.path.getmtime(directory))
+            except OSError:
+                mtimes.append(None)
+        return (len(registry), hash(tuple(registry.keys())), hash(tuple(mtimes)))
+
+    @property
+    def version(self) -> int:
+        """Version of the last built index (0 if nothing was built yet)."""
+        return self._version
+
+    def invalidate(self) -> None:
+        """Drop the cached index so the next access rebuilds it."""
+        with self._lock:
+            self._index = None
+            self._signature = None
+
+    def peek(self) -> Optional[ObjectInfoIndex]:
+        """Return the cached index if it is still up to date, without rebuilding."""
+        with self._lock:
+            index, signature = self._index, self._signature
+        if index is not None and signature == self._compute_signature():
+            return index
+        return None
+
+    async def get_index(self) -> ObjectInfoIndex:
+        """Return an up to date index, rebuilding it if the inputs changed."""
+        index = self.peek()
+        if index is not None:
+            return index
+
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+        async with self._refresh_lock:
+            # Another task may have rebuilt the index while we were waiting
+            index = self.peek()
+            if index is not None:
+                return index
+
+            object_info = await ComfyGateway().get_object_info()
+            # Listing the model folders fills folder_paths' caches, so take the
+            # fingerprint afterwards to include their sub-directories.
+            signature = self._compute_signature()
+            with self._lock:
+                self._version += 1
+                index = ObjectInfoIndex(object_info, self._version)
+                if object_info:
+                    self._index = index
+                    self._signature = signature
+            log.info(f"Rebuilt object_info index v{index.version} with {len(index)} node classes")
+            return index
+
+
+object_info_cache = ObjectInfoCache()
+
+
+async def get_object_info_index() -> ObjectInfoIndex:
+    """Get the shared object_info index."""
+    return await object_info_cache.get_index()
+
+
+async def get_cached_object_info() -> Dict[str, Any]:
+    """Get the full object_info dict from the shared cache (read-only)."""
+    return (await object_info_cache.get_index()).object_info
+
+
+def get_object_info_version() -> int:
+    """Version of the shared object_info index."""
+    return object_info_cache.version
+
+
+def get_object_info_signature():
+    """Fingerprint of the node registry and model/input folders, without building the index."""
+    return ObjectInfoCache._compute_signature()
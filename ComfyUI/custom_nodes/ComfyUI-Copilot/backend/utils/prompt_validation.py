@@ -0,0 +1,234 @@
+"""
+Validate-only checks for API format workflows, with per-node result caching.
+
+The debug agent validates the workflow after every fix. Submitting it to
+/api/prompt would also queue it for execution when it is valid, so validation
+runs ComfyUI's own checks (execution.validate_inputs, driven the same way as
+execution.validate_prompt) without ever touching the PromptQueue.
+
+Each node's validation result is cached under a digest of the node and all of
+its upstream nodes, together with the object_info signature (node registry and
+model/input folders). Between debug iterations only the nodes whose subgraph
+changed are validated again; the cached results are fed to validate_inputs
+through its `validated` dict, exactly as if they had been computed in this run.
+"""
+
+import copy
+import hashlib
+import json
+import logging
+import sys
+import traceback
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import execution
+import nodes
+
+from .object_info_cache import get_object_info_signature
+
+PROMPT_VALIDATION_CACHE_SIZE = 4096
+
+
+def _linked_parents(node: Dict[str, Any]) -> List[str]:
+    parents = []
+    for value in (node.get("inputs") or {}).values():
+        if isinstance(value, list) and len(value) == 2:
+            parents.append(str(value[0]))
+    return parents
+
+
+def subgraph_digests(prompt: Dict[str, Any]) -> Dict[str, str]:
+    """Digest of every node together with everything upstream of it.
+
+    Walks the graph iteratively so long chains do not hit the recursion limit;
+    links to missing nodes and back edges of cycles are hashed as markers.
+    """
+    digests: Dict[str, str] = {}
+    for root in prompt:
+        if root in digests:
+            continue
+        stack: List[Tuple[str, bool]] = [(root, False)]
+        on_path = set()
+        while stack:
+            node_id, expanded = stack.pop()
+            if node_id in digests:
+                continue
+            node = prompt[node_id]
+            parents = _linked_parents(node)
+            if expanded:
+                on_path.discard(node_id)
+                digest = hashlib.sha256(json.dumps(
+                    [node_id, node.get("class_type"), node.get("inputs")], sort_keys=True, default=str
+                ).encode())
+                for parent in parents:
+                    if parent not in prompt:
+                        digest.update(b"missing")
+                    else:
+                        digest.update(digests.get(parent, "cycle").encode())
+                digests[node_id] = digest.hexdigest()
+                continue
+            on_path.add(node_id)
+            stack.append((node_id, True))
+            for parent in parents:
+                if parent in prompt and parent not in digests and parent not in on_path:
+                    stack.append((parent, False))
+    return digests
+
+
+def _structured_errors(node_errors: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """One flat entry per error, easier for the agents to act on than the nested node_errors."""
+    errors = []
+    for node_id, node_error in node_errors.items():
+        for error in node_error.get("errors", []):
+            extra_info = error.get("extra_info") or {}
+            errors.append({
+                "node_id": node_id,
+                "class_type": node_error.get("class_type"),
+                "input_name": extra_info.get("input_name"),
+                "type": error.get("type"),
+                "message": error.get("message"),
+                "details": error.get("details"),
+                "received_value": extra_info.get("received_value"),
+            })
+    return errors
+
+
+class PromptValidator:
+    """Validates prompts without queueing them, reusing per-node results across calls."""
+
+    def __init__(self, max_entries: int = PROMPT_VALIDATION_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._results: "OrderedDict[Tuple[str, Any], tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self) -> None:
+        self._results.clear()
+
+    def _result(self, success: bool, error: Optional[Dict[str, Any]], outputs: List[str],
+                node_errors: Dict[str, Any], validated_nodes: int = 0, cached_nodes: int = 0) -> Dict[str, Any]:
+        return {
+            "success": success,
+            "error": error,
+            "outputs": outputs,
+            "node_errors": node_errors,
+            "errors": _structured_errors(node_errors),
+            "validated_nodes": validated_nodes,
+            "cached_nodes": cached_nodes,
+        }
+
+    async def validate(self, prompt: Dict[str, Any], partial_execution_targets: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Validate an API format prompt; never queues it for execution."""
+        # validate_inputs normalizes input values in place
+        prompt = copy.deepcopy(prompt)
+        prompt_id = str(uuid.uuid4())
+
+        outputs = set()
+        for node_id, node in prompt.items():
+            if not isinstance(node, dict) or 'class_type' not in node:
+                error = {
+                    "type": "invalid_prompt",
+                    "message": "Cannot execute because a node is missing the class_type property.",
+                    "details": f"Node ID '#{node_id}'",
+                    "extra_info": {}
+                }
+                return self._result(False, error, [], {node_id: {"errors": [error], "dependent_outputs": [], "class_type": None}})
+
+            class_type = node['class_type']
+            class_ = nodes.NODE_CLASS_MAPPINGS.get(class_type, None)
+            if class_ is None:
+                error = {
+                    "type": "invalid_prompt",
+                    "message": f"Cannot execute because node {class_type} does not exist.",
+                    "details": f"Node ID '#{node_id}'",
+                    "extra_info": {}
+                }
+                return self._result(False, error, [], {node_id: {"errors": [error], "dependent_outputs": [], "class_type": class_type}})
+
+            if getattr(class_, 'OUTPUT_NODE', False) is True:
+                if partial_execution_targets is None or node_id in partial_execution_targets:
+                    outputs.add(node_id)
+
+        if len(outputs) == 0:
+            error = {
+                "type": "prompt_no_outputs",
+                "message": "Prompt has no outputs",
+                "details": "",
+                "extra_info": {}
+            }
+            return self._result(False, error, [], {})
+
+        signature = get_object_info_signature()
+        digests = subgraph_digests(prompt)
+        validated: Dict[str, tuple] = {}
+        for node_id, digest in digests.items():
+            cached = self._results.get((digest, signature))
+            if cached is not None:
+                self._results.move_to_end((digest, signature))
+                validated[node_id] = cached
+        cached_nodes = set(validated)
+
+        good_outputs = set()
+        output_errors = []
+        node_errors: Dict[str, Any] = {}
+        for output in sorted(outputs):
+            try:
+                valid, reasons, _ = await execution.validate_inputs(prompt_id, prompt, output, validated)
+            except Exception as ex:
+                typ, _, tb = sys.exc_info()
+                valid = False
+                reasons = [{
+                    "type": "exception_during_validation",
+                    "message": "Exception when validating node",
+                    "details": str(ex),
+                    "extra_info": {
+                        "exception_type": execution.full_type_name(typ),
+                        "traceback": traceback.format_tb(tb)
+                    }
+                }]
+                validated[output] = (False, reasons, output)
+
+            if valid is True:
+                good_outputs.add(output)
+                continue
+            output_errors.append(reasons)
+            for node_id, (node_valid, node_reasons, _) in validated.items():
+                # Downstream nodes of a failing node are invalid without reasons of their own
+                if node_valid is not True and len(node_reasons) > 0:
+                    if node_id not in node_errors:
+                        node_errors[node_id] = {
+                            "errors": node_reasons,
+                            "dependent_outputs": [],
+                            "class_type": prompt[node_id]['class_type'] if node_id in prompt else None
+                        }
+                    node_errors[node_id]["dependent_outputs"].append(output)
+
+        for node_id, result in validated.items():
+            if node_id in cached_nodes or node_id not in digests:
+                continue
+            self._results[(digests[node_id], signature)] = result
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+
+        self.hits += len(cached_nodes)
+        self.misses += len(validated) - len(cached_nodes)
+        logging.debug(f"Validated prompt: {len(validated)} nodes, {len(cached_nodes)} from cache")
+
+        error = None
+        if len(good_outputs) == 0:
+            errors_list = [f"{reason['message']}: {reason['details']}" for reasons in output_errors for reason in reasons]
+            error = {
+                "type": "prompt_outputs_failed_validation",
+                "message": "Prompt outputs failed validation",
+                "details": "\n".join(errors_list),
+                "extra_info": {}
+            }
+        return self._result(
+            len(good_outputs) > 0 and not node_errors, error, sorted(good_outputs), node_errors,
+            validated_nodes=len(validated) - len(cached_nodes), cached_nodes=len(cached_nodes)
+        )
+
+
+prompt_validator = PromptValidator()
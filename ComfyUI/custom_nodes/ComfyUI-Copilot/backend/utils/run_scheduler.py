@@ -0,0 +1,242 @@
+"""
+Admission control for agent runs.
+
+Every /api/chat/invoke and /api/debug-agent request runs an agent against an
+LLM backend. Without a limit a burst of requests starts all runs at once, and a
+single local backend such as LMStudio thrashes until every run times out. Runs
+therefore take a slot from the RunScheduler first:
+
+* Runs are grouped in pools by backend: runs against an LMStudio endpoint share
+  the "lmstudio" pool (COPILOT_LMSTUDIO_MAX_CONCURRENT_RUNS, default 1), all
+  others the "default" pool (COPILOT_MAX_CONCURRENT_RUNS, default 4).
+* A session runs at most COPILOT_MAX_SESSION_RUNS runs at a time (default 1),
+  across pools; its further requests wait.
+* Waiting runs are queued per session and served round-robin across sessions,
+  so one session sending many requests cannot starve the others.
+* At most COPILOT_MAX_QUEUED_RUNS runs wait in total (default 64); beyond that
+  requests are rejected right away with RunQueueFull.
+* A waiting or running run is cancelled when its task is cancelled, e.g. by
+  cancel_on_disconnect when the client goes away.
+
+The scheduler lives on the event loop and is not thread-safe.
+"""
+
+import asyncio
+import contextlib
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+from .globals import is_lmstudio_url
+from .logger import log
+
+MAX_CONCURRENT_RUNS = int(os.environ.get("COPILOT_MAX_CONCURRENT_RUNS", "4"))
+LMSTUDIO_MAX_CONCURRENT_RUNS = int(os.environ.get("COPILOT_LMSTUDIO_MAX_CONCURRENT_RUNS", "1"))
+MAX_SESSION_RUNS = int(os.environ.get("COPILOT_MAX_SESSION_RUNS", "1"))
+MAX_QUEUED_RUNS = int(os.environ.get("COPILOT_MAX_QUEUED_RUNS", "64"))
+DISCONNECT_POLL_INTERVAL = 1.0
+
+DEFAULT_POOL = "default"
+LMSTUDIO_POOL = "lmstudio"
+
+
+class RunQueueFull(RuntimeError):
+    """Raised when a run cannot even be queued."""
+
+
+def run_pool(base_url: Optional[str]) -> str:
+    """Pool of runs against the given LLM base URL."""
+    return LMSTUDIO_POOL if base_url and is_lmstudio_url(base_url) else DEFAULT_POOL
+
+
+class _Pool:
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.running = 0
+        # session_id -> waiting futures in arrival order; sessions in round-robin order
+        self.waiting: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self.queued = 0
+
+
+class RunScheduler:
+    """Per-session and per-pool concurrency limits with fair queuing."""
+
+    def __init__(self, max_runs: int = MAX_CONCURRENT_RUNS, max_session_runs: int = MAX_SESSION_RUNS,
+                 max_queued: int = MAX_QUEUED_RUNS, lmstudio_max_runs: int = LMSTUDIO_MAX_CONCURRENT_RUNS):
+        self.max_session_runs = max(1, max_session_runs)
+        self.max_queued = max_queued
+        self._limits = {DEFAULT_POOL: max(1, max_runs), LMSTUDIO_POOL: max(1, lmstudio_max_runs)}
+        self._pools: Dict[str, _Pool] = {}
+        self._session_runs: Dict[str, int] = {}
+        self.admitted = 0
+        self.rejected = 0
+        self.cancelled_waiting = 0
+        self.max_queue_depth = 0
+        self._wait_seconds = 0.0
+        self._max_wait_seconds = 0.0
+
+    def _pool(self, name: str) -> _Pool:
+        pool = self._pools.get(name)
+        if pool is None:
+            pool = self._pools[name] = _Pool(name, self._limits.get(name, self._limits[DEFAULT_POOL]))
+        return pool
+
+    @property
+    def queued(self) -> int:
+        return sum(pool.queued for pool in self._pools.values())
+
+    def _can_start(self, pool: _Pool, session_id: str) -> bool:
+        return pool.running < pool.limit and self._session_runs.get(session_id, 0) < self.max_session_runs
+
+    def _start(self, pool: _Pool, session_id: str) -> None:
+        pool.running += 1
+        self._session_runs[session_id] = self._session_runs.get(session_id, 0) + 1
+        self.admitted += 1
+
+    def _dispatch(self) -> None:
+        """Grant free slots to waiting runs, one session at a time in round-robin order."""
+        for pool in self._pools.values():
+            progressed = True
+            while progressed and pool.waiting and pool.running < pool.limit:
+                progressed = False
+                for session_id in list(pool.waiting):
+                    if not self._can_start(pool, session_id):
+                        continue
+                    waiters = pool.waiting.pop(session_id)
+                    waiter = waiters.popleft()
+                    pool.queued -= 1
+                    if waiters:
+                        # Served sessions go to the back of the line
+                        pool.waiting[session_id] = waiters
+                    self._start(pool, session_id)
+                    waiter.set_result(None)
+                    progressed = True
+                    break
+
+    def _release(self, pool: _Pool, session_id: str) -> None:
+        pool.running -= 1
+        remaining = self._session_runs.get(session_id, 1) - 1
+        if remaining:
+            self._session_runs[session_id] = remaining
+        else:
+            self._session_runs.pop(session_id, None)
+        self._dispatch()
+
+    def _unqueue(self, pool: _Pool, session_id: str, waiter: asyncio.Future) -> None:
+        waiters = pool.waiting.get(session_id)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            pool.queued -= 1
+            if not waiters:
+                del pool.waiting[session_id]
+
+    @contextlib.asynccontextmanager
+    async def slot(self, session_id: Optional[str], pool_name: str = DEFAULT_POOL) -> AsyncIterator[None]:
+        """Hold a run slot for the duration of the block, waiting for one if needed."""
+        session_id = session_id or ""
+        pool = self._pool(pool_name)
+        if not pool.waiting and self._can_start(pool, session_id):
+            self._start(pool, session_id)
+        else:
+            if self.queued >= self.max_queued:
+                self.rejected += 1
+                raise RunQueueFull(
+                    f"Copilot is busy: {self.queued} requests are already waiting. Please try again in a moment."
+                )
+            waiter = asyncio.get_running_loop().create_future()
+            pool.waiting.setdefault(session_id, deque()).append(waiter)
+            pool.queued += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queued)
+            # Waiting runs of other sessions may be blocked by their session limit only
+            self._dispatch()
+            log.info(f"Run of session {session_id} queued in pool {pool.name}: {pool.running} running, {pool.queued} waiting")
+            started_waiting = time.monotonic()
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # Granted just before the cancellation arrived
+                    self._release(pool, session_id)
+                else:
+                    self._unqueue(pool, session_id, waiter)
+                    self.cancelled_waiting += 1
+                raise
+            waited = time.monotonic() - started_waiting
+            self._wait_seconds += waited
+            self._max_wait_seconds = max(self._max_wait_seconds, waited)
+            log.info(f"Run of session {session_id} started in pool {pool.name} after waiting {waited * 1000:.0f} ms")
+        try:
+            yield
+        finally:
+            self._release(pool, session_id)
+
+    async def run(self, session_id: Optional[str], producer: AsyncIterator, pool_name: str = DEFAULT_POOL,
+                  request=None) -> AsyncIterator[Any]:
+        """Iterate an agent run's async generator while holding a slot.
+
+        With an aiohttp request, the iterating task is cancelled when its client
+        disconnects; leave it out for runs that outlive their connection.
+        """
+        try:
+            async with contextlib.AsyncExitStack() as stack:
+                if request is not None:
+                    await stack.enter_async_context(cancel_on_disconnect(request))
+                await stack.enter_async_context(self.slot(session_id, pool_name))
+                async for item in producer:
+                    yield item
+        finally:
+            await producer.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and throughput metrics."""
+        return {
+            "running": sum(pool.running for pool in self._pools.values()),
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "max_session_runs": self.max_session_runs,
+            "pools": {
+                name: {
+                    "limit": pool.limit,
+                    "running": pool.running,
+                    "queued": pool.queued,
+                    "waiting_sessions": len(pool.waiting),
+                }
+                for name, pool in self._pools.items()
+            },
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "cancelled_waiting": self.cancelled_waiting,
+            "max_queue_depth": self.max_queue_depth,
+            "avg_wait_ms": round(self._wait_seconds * 1000 / self.admitted, 1) if self.admitted else 0.0,
+            "max_wait_ms": round(self._max_wait_seconds * 1000, 1),
+        }
+
+
+@contextlib.asynccontextmanager
+async def cancel_on_disconnect(request) -> AsyncIterator[None]:
+    """Cancel the current task when the client of an aiohttp request disconnects.
+
+    A run waiting for a slot writes nothing to the response, so the disconnect
+    would otherwise go unnoticed until the run has finished.
+    """
+    task = asyncio.current_task()
+
+    async def watch() -> None:
+        while True:
+            await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+            transport = request.transport
+            if transport is None or transport.is_closing():
+                log.info(f"Client of {request.path} disconnected, cancelling the run")
+                task.cancel()
+                return
+
+    watcher = asyncio.ensure_future(watch())
+    try:
+        yield
+    finally:
+        watcher.cancel()
+
+
+run_scheduler = RunScheduler()
@@ -0,0 +1,215 @@
+"""
+Bounded per-session state shared by the request handlers, agents and tools.
+
+Language and Copilot credentials used to live in process-wide globals that
+every request overwrote, so concurrent users could see each other's values.
+They are now kept per session, together with what the tools need to key their
+caches without going to the database:
+
+* workflow_version: id of the session's latest workflow version. The workflow
+  DAO writes it through when a commit creates a version, so tools read it from
+  memory.
+* workflow_revision: changes on every commit that touches the session's
+  workflows, including in-place rewrites that keep the version id. Revisions
+  are never reused, even after the state was evicted.
+* object_info_version: the object_info index version the session last used.
+
+States are evicted when idle for COPILOT_SESSION_STATE_TTL seconds (default
+2 hours), and least recently used states are evicted beyond
+COPILOT_SESSION_STATE_MAX_SESSIONS states or COPILOT_SESSION_STATE_MAX_BYTES of
+accounted memory. An evicted session simply starts over with defaults and
+reloads its workflow version from the database.
+"""
+
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional
+
+SESSION_STATE_TTL = float(os.environ.get("COPILOT_SESSION_STATE_TTL", str(2 * 60 * 60)))
+SESSION_STATE_MAX_SESSIONS = int(os.environ.get("COPILOT_SESSION_STATE_MAX_SESSIONS", "1024"))
+SESSION_STATE_MAX_BYTES = int(os.environ.get("COPILOT_SESSION_STATE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+_FIELDS = ("language", "copilot_api_key", "workflow_version", "object_info_version")
+_revisions = itertools.count(1)
+
+
+class SessionState:
+    """State of one session. Read it through SessionStateCache; do not modify it directly."""
+
+    __slots__ = ("session_id", "language", "copilot_api_key", "workflow_version",
+                 "workflow_revision", "object_info_version", "created_at", "last_access", "size")
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.language: Optional[str] = None
+        self.copilot_api_key: Optional[str] = None
+        self.workflow_version: Optional[int] = None
+        self.workflow_revision = next(_revisions)
+        self.object_info_version: Optional[int] = None
+        self.created_at = self.last_access = time.monotonic()
+        self.size = 0
+
+    def measure(self) -> int:
+        """Approximate memory held by this state, in bytes."""
+        size = sys.getsizeof(self) + sys.getsizeof(self.session_id)
+        for field in _FIELDS:
+            size += sys.getsizeof(getattr(self, field))
+        return size
+
+
+class SessionStateCache:
+    """LRU + TTL cache of SessionState objects with memory accounting and metrics."""
+
+    def __init__(self, ttl: float = SESSION_STATE_TTL, max_sessions: int = SESSION_STATE_MAX_SESSIONS,
+                 max_bytes: int = SESSION_STATE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self._states: "OrderedDict[str, SessionState]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Bumped on every workflow commit; loads from the database started before are discarded
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def _expire(self, now: float) -> None:
+        # States are kept in access order, so the expired ones are at the front
+        while self._states:
+            state = next(iter(self._states.values()))
+            if now - state.last_access <= self.ttl:
+                break
+            self._drop(state.session_id)
+            self.expired += 1
+
+    def _drop(self, session_id: str) -> None:
+        state = self._states.pop(session_id)
+        self._bytes -= state.size
+
+    def _touch(self, session_id: str, create: bool) -> Optional[SessionState]:
+        now = time.monotonic()
+        self._expire(now)
+        state = self._states.get(session_id)
+        if state is not None:
+            self.hits += 1
+            state.last_access = now
+            self._states.move_to_end(session_id)
+            return state
+        self.misses += 1
+        if not create:
+            return None
+        state = SessionState(session_id)
+        self._states[session_id] = state
+        self._resize(state)
+        return state
+
+    def _resize(self, state: SessionState) -> None:
+        size = state.measure()
+        self._bytes += size - state.size
+        state.size = size
+        while self._states and (len(self._states) > self.max_sessions or self._bytes > self.max_bytes):
+            oldest = next(iter(self._states))
+            if oldest == state.session_id and len(self._states) == 1:
+                break
+            self._drop(oldest)
+            self.evicted += 1
+
+    def get(self, session_id: Optional[str], field: str, default: Any = None) -> Any:
+        """A field of the session's state, or default if unknown or unset."""
+        if not session_id:
+            return default
+        with self._lock:
+            state = self._touch(session_id, create=False)
+            value = getattr(state, field) if state is not None else None
+        return default if value is None else value
+
+    def update(self, session_id: Optional[str], **fields: Any) -> None:
+        """Set fields of the session's state, creating it if needed."""
+        if not session_id:
+            return
+        for field in fields:
+            if field not in _FIELDS:
+                raise AttributeError(f"Unknown session state field: {field}")
+        with self._lock:
+            state = self._touch(session_id, create=True)
+            for field, value in fields.items():
+                setattr(state, field, value)
+            self._resize(state)
+
+    def workflow_key(self, session_id: Optional[str]) -> Optional[tuple]:
+        """(workflow_version, workflow_revision) if the latest version is known, else None."""
+        if not session_id:
+            return None
+        with self._lock:
+            state = self._touch(session_id, create=False)
+            if state is None or state.workflow_version is None:
+                return None
+            return state.workflow_version, state.workflow_revision
+
+    @property
+    def generation(self) -> int:
+        """Read before loading a workflow version from the database, pass to load_workflow_version."""
+        return self._generation
+
+    def load_workflow_version(self, session_id: Optional[str], workflow_version: Optional[int], generation: int) -> None:
+        """Remember a workflow version loaded from the database, unless a commit happened meanwhile."""
+        if not session_id or workflow_version is None:
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            state = self._touch(session_id, create=True)
+            state.workflow_version = workflow_version
+            self._resize(state)
+
+    def workflows_committed(self, session_ids: Iterable[str], new_versions: Optional[Dict[str, int]] = None) -> None:
+        """Record a commit that changed the workflows of session_ids.
+
+        new_versions maps sessions to the id of the latest version the commit
+        created. Other sessions had versions rewritten in place, so their
+        latest version id is reloaded on next use.
+        """
+        new_versions = new_versions or {}
+        with self._lock:
+            self._generation += 1
+            for session_id in session_ids:
+                state = self._states.get(session_id)
+                if state is None:
+                    continue
+                state.workflow_revision = next(_revisions)
+                if session_id in new_versions:
+                    state.workflow_version = new_versions[session_id]
+                else:
+                    state.workflow_version = None
+
+    def discard(self, session_id: str) -> None:
+        with self._lock:
+            if session_id in self._states:
+                self._drop(session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Metrics: session count, accounted bytes, hit/miss counts and evictions."""
+        with self._lock:
+            self._expire(time.monotonic())
+            lookups = self.hits + self.misses
+            return {
+                "sessions": len(self._states),
+                "bytes": self._bytes,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
+
+
+session_states = SessionStateCache()
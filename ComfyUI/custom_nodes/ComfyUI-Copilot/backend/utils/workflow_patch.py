@@ -0,0 +1,225 @@
+"""
+Node-level edit operations on API format workflows.
+
+Agents describe a change as a short list of operations instead of regenerating
+the whole workflow JSON:
+
+    {"op": "add_node", "class_type": "LoraLoader", "ref": "lora", "inputs": {...}, "id": "12", "title": "..."}
+    {"op": "remove_node", "node_id": "5"}
+    {"op": "set_input", "node_id": "3", "input": "steps", "value": 30}
+    {"op": "connect", "from_node": "$lora", "from_output": 0, "to_node": "3", "input": "model"}
+    {"op": "remove_input", "node_id": "3", "input": "denoise"}
+
+"id" and "title" of add_node are optional; without an id the node gets the next
+free numeric id. A node added with a "ref" can be referred to as "$<ref>" by
+the following operations, including in link values ["$lora", 0] of inputs.
+remove_node also removes every link to the removed node.
+
+apply_operations either applies all operations or raises WorkflowPatchError
+and leaves the workflow in an unspecified state, so callers apply it to a copy.
+"""
+
+from typing import Any, Callable, Dict, List, Optional
+
+NodeInfoGetter = Callable[[str], Optional[Dict[str, Any]]]
+
+
+class WorkflowPatchError(ValueError):
+    """An operation cannot be applied; index is the position of the operation."""
+
+    def __init__(self, index: int, message: str):
+        super().__init__(f"Operation {index}: {message}")
+        self.index = index
+
+
+def _is_link(value: Any) -> bool:
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[1], int)
+
+
+def _next_node_id(workflow: Dict[str, Any]) -> str:
+    numeric_ids = [int(node_id) for node_id in workflow if str(node_id).isdigit()]
+    return str(max(numeric_ids, default=0) + 1)
+
+
+def _input_spec(node_info: Optional[Dict[str, Any]], input_name: str) -> Optional[list]:
+    if not node_info:
+        return None
+    inputs = node_info.get("input") or {}
+    for group in ("required", "optional"):
+        spec = (inputs.get(group) or {}).get(input_name)
+        if spec is not None:
+            return spec
+    return None
+
+
+def _types_compatible(output_type: Any, input_type: Any) -> bool:
+    # Combo inputs are lists of values; "*" and comma separated types are ComfyUI wildcards
+    if not isinstance(output_type, str) or not isinstance(input_type, str):
+        return True
+    if "*" in (output_type, input_type):
+        return True
+    return bool(set(output_type.split(",")) & set(input_type.split(",")))
+
+
+class _Patcher:
+    def __init__(self, workflow: Dict[str, Any], node_info: Optional[NodeInfoGetter]):
+        self.workflow = workflow
+        self.node_info = node_info
+        self.refs: Dict[str, str] = {}
+        self.added: Dict[str, str] = {}
+        self.removed: List[str] = []
+        self.changes: List[Dict[str, Any]] = []
+        self.warnings: List[str] = []
+
+    def _resolve(self, index: int, node_id: Any) -> str:
+        node_id = str(node_id)
+        if node_id.startswith("$"):
+            if node_id[1:] not in self.refs:
+                raise WorkflowPatchError(index, f"Unknown node reference '{node_id}'")
+            return self.refs[node_id[1:]]
+        return node_id
+
+    def _existing(self, index: int, node_id: Any) -> str:
+        node_id = self._resolve(index, node_id)
+        if node_id not in self.workflow:
+            raise WorkflowPatchError(index, f"Node {node_id} not found")
+        return node_id
+
+    def _info(self, class_type: str) -> Optional[Dict[str, Any]]:
+        return self.node_info(class_type) if self.node_info else None
+
+    def _resolve_value(self, index: int, value: Any) -> Any:
+        if _is_link(value):
+            return [self._resolve(index, value[0]), value[1]]
+        return value
+
+    def _check_input(self, index: int, node_id: str, input_name: str) -> None:
+        class_type = self.workflow[node_id].get("class_type")
+        node_info = self._info(class_type)
+        if node_info and _input_spec(node_info, input_name) is None:
+            self.warnings.append(f"Operation {index}: {class_type} (node {node_id}) does not declare input '{input_name}'")
+
+    def _check_link(self, index: int, source_id: str, output_index: int, node_id: str, input_name: str) -> None:
+        source_info = self._info(self.workflow[source_id].get("class_type"))
+        if not source_info:
+            return
+        outputs = source_info.get("output") or []
+        if not 0 <= output_index < len(outputs):
+            raise WorkflowPatchError(
+                index, f"Node {source_id} ({self.workflow[source_id].get('class_type')}) has no output {output_index}; outputs: {list(outputs)}"
+            )
+        spec = _input_spec(self._info(self.workflow[node_id].get("class_type")), input_name)
+        if spec and not _types_compatible(outputs[output_index], spec[0]):
+            raise WorkflowPatchError(
+                index, f"Type mismatch: output {output_index} of node {source_id} is {outputs[output_index]}, input '{input_name}' of node {node_id} expects {spec[0]}"
+            )
+
+    def add_node(self, index: int, operation: Dict[str, Any]) -> None:
+        class_type = operation.get("class_type")
+        if not class_type:
+            raise WorkflowPatchError(index, "add_node requires class_type")
+        if self.node_info and self._info(class_type) is None:
+            raise WorkflowPatchError(index, f"Node class '{class_type}' not found")
+        node_id = str(operation.get("id") or _next_node_id(self.workflow))
+        if node_id in self.workflow:
+            raise WorkflowPatchError(index, f"Node {node_id} already exists")
+        node = {"inputs": {}, "class_type": class_type}
+        if operation.get("title"):
+            node["_meta"] = {"title": operation["title"]}
+        self.workflow[node_id] = node
+        if operation.get("ref"):
+            self.refs[str(operation["ref"])] = node_id
+        self.added[node_id] = class_type
+        # Inputs are set after the node exists so links between new nodes resolve
+        for input_name, value in (operation.get("inputs") or {}).items():
+            self._set(index, node_id, input_name, value, record=False)
+        self.changes.append({"action": "add_node", "node_id": node_id, "class_type": class_type})
+
+    def remove_node(self, index: int, operation: Dict[str, Any]) -> None:
+        node_id = self._existing(index, operation.get("node_id"))
+        removed = self.workflow.pop(node_id)
+        self.removed.append(node_id)
+        disconnected = []
+        for other_id, node in self.workflow.items():
+            inputs = node.get("inputs", {})
+            for input_name, value in list(inputs.items()):
+                if _is_link(value) and str(value[0]) == node_id:
+                    del inputs[input_name]
+                    disconnected.append({"node_id": other_id, "input": input_name})
+        self.changes.append({
+            "action": "remove_node", "node_id": node_id,
+            "class_type": removed.get("class_type"), "disconnected": disconnected
+        })
+
+    def _set(self, index: int, node_id: str, input_name: str, value: Any, record: bool = True) -> None:
+        if not input_name:
+            raise WorkflowPatchError(index, "Missing input name")
+        value = self._resolve_value(index, value)
+        if _is_link(value):
+            source_id = value[0]
+            if source_id not in self.workflow:
+                raise WorkflowPatchError(index, f"Linked node {source_id} not found")
+            self._check_link(index, source_id, value[1], node_id, input_name)
+        else:
+            self._check_input(index, node_id, input_name)
+        inputs = self.workflow[node_id].setdefault("inputs", {})
+        old_value = inputs.get(input_name)
+        inputs[input_name] = value
+        if record:
+            self.changes.append({
+                "action": "connect" if _is_link(value) else "set_input",
+                "node_id": node_id, "input": input_name, "old_value": old_value, "new_value": value
+            })
+
+    def set_input(self, index: int, operation: Dict[str, Any]) -> None:
+        if "value" not in operation:
+            raise WorkflowPatchError(index, "set_input requires value")
+        node_id = self._existing(index, operation.get("node_id"))
+        self._set(index, node_id, operation.get("input"), operation["value"])
+
+    def connect(self, index: int, operation: Dict[str, Any]) -> None:
+        source_id = self._existing(index, operation.get("from_node"))
+        node_id = self._existing(index, operation.get("to_node"))
+        try:
+            output_index = int(operation.get("from_output", 0))
+        except (TypeError, ValueError):
+            raise WorkflowPatchError(index, "from_output must be an integer")
+        self._set(index, node_id, operation.get("input"), [source_id, output_index])
+
+    def remove_input(self, index: int, operation: Dict[str, Any]) -> None:
+        node_id = self._existing(index, operation.get("node_id"))
+        inputs = self.workflow[node_id].get("inputs", {})
+        input_name = operation.get("input")
+        if input_name not in inputs:
+            raise WorkflowPatchError(index, f"Node {node_id} has no input '{input_name}'")
+        old_value = inputs.pop(input_name)
+        self.changes.append({"action": "remove_input", "node_id": node_id, "input": input_name, "old_value": old_value})
+
+
+OPERATIONS = ("add_node", "remove_node", "set_input", "connect", "remove_input")
+
+
+def apply_operations(workflow: Dict[str, Any], operations: List[Dict[str, Any]],
+                     node_info: Optional[NodeInfoGetter] = None) -> Dict[str, Any]:
+    """Apply operations to workflow in place.
+
+    node_info returns the object_info entry of a node class; when given, node
+    classes, output indexes and link types are checked as well.
+
+    Returns a summary: the changes made, added node ids (by ref when one was
+    given), removed node ids and warnings about undeclared inputs.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise WorkflowPatchError(0, "operations must be a non-empty list")
+    patcher = _Patcher(workflow, node_info)
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get("op") not in OPERATIONS:
+            raise WorkflowPatchError(index, f"Unknown operation, expected one of {', '.join(OPERATIONS)}")
+        getattr(patcher, operation["op"])(index, operation)
+    return {
+        "changes": patcher.changes,
+        "added_nodes": patcher.added,
+        "refs": patcher.refs,
+        "removed_nodes": patcher.removed,
+        "warnings": patcher.warnings,
+    }
@@ -0,0 +1,335 @@
+"""
+Replay recorded conversations through the Copilot agent stack and report latency.
+
+Run from the ComfyUI-Copilot directory, with ComfyUI importable (use the Python
+environment ComfyUI runs in):
+
+    python benchmarks/agent_replay_benchmark.py --runs 5
+    python benchmarks/agent_replay_benchmark.py --only rewrite_add_lora debug_missing_model \
+        --ttft-ms 300 --token-ms 15 --json replay_results.json
+
+Conversations (benchmarks/replay/conversations.json by default) are replayed
+through the real code paths: "chat" entries through comfyui_agent_invoke,
+"debug" entries through debug_workflow_errors. Only the services behind them
+are stubbed, by local servers from replay_stubs.py:
+
+* an OpenAI-compatible endpoint answering each model request with the next
+  recorded model turn (text or tool calls) of the conversation, with simulated
+  time to first token (--ttft-ms) and per-chunk latency (--token-ms);
+* an MCP SSE server serving the recorded MCP tools and their latencies;
+* ComfyUI's /api/object_info with the recorded node definitions.
+
+Local tools (workflow edits, parameter lookups, validation) really run, against
+a temporary workflow database. Validation uses the node registry of the ComfyUI
+install, so debug conversations exercise the same checks as in ComfyUI.
+
+Reported per conversation (median and p95 over --runs):
+
+* ttft: time to the first streamed text
+* total: time until the run's last output
+* model: number and total duration of model requests
+* tools: calls and duration of each tool, MCP tools prefixed with "mcp:"
+* db: time spent executing SQL statements in the workflow and expert stores
+* bytes: response bytes in the default full-text protocol and in the delta
+  protocol (stream_mode=delta)
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import types
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+COPILOT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_RECORDINGS = os.path.join(COPILOT_ROOT, "benchmarks", "replay", "conversations.json")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recordings", default=DEFAULT_RECORDINGS, help="Recorded conversations (JSON)")
+    parser.add_argument("--only", nargs="*", default=None, help="Replay only these conversations")
+    parser.add_argument("--runs", type=int, default=5, help="Replays per conversation")
+    parser.add_argument("--ttft-ms", type=float, default=250.0, help="Simulated model time to first token")
+    parser.add_argument("--token-ms", type=float, default=10.0, help="Simulated model time per streamed chunk")
+    parser.add_argument("--json", default=None, help="Write every run's measurements to this file")
+    parser.add_argument("--comfyui-root", default=None,
+                        help="ComfyUI directory to import from (defaults to the install containing this custom node)")
+    return parser.parse_args()
+
+
+def percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+class SpanCollector:
+    """Agents SDK trace processor timing model requests, tool calls and MCP list_tools."""
+
+    def __init__(self):
+        self._started: Dict[str, float] = {}
+        self.reset()
+
+    def reset(self) -> None:
+        self.spans: Dict[str, List[float]] = defaultdict(list)
+
+    @staticmethod
+    def _category(span) -> Optional[str]:
+        data = span.span_data
+        kind = data.type
+        if kind == "function":
+            return ("mcp:" if getattr(data, "mcp_data", None) else "") + data.name
+        if kind in ("generation", "response"):
+            return "model"
+        if kind == "mcp_tools":
+            return "mcp:list_tools"
+        if kind == "handoff":
+            return "handoff"
+        return None
+
+    def on_trace_start(self, trace) -> None:
+        pass
+
+    def on_trace_end(self, trace) -> None:
+        pass
+
+    def on_span_start(self, span) -> None:
+        self._started[span.span_id] = time.perf_counter()
+
+    def on_span_end(self, span) -> None:
+        started = self._started.pop(span.span_id, None)
+        category = self._category(span)
+        if started is not None and category:
+            self.spans[category].append((time.perf_counter() - started) * 1000.0)
+
+    def shutdown(self) -> None:
+        pass
+
+    def force_flush(self) -> None:
+        pass
+
+
+class SQLTimer:
+    """Total time spent executing SQL statements, across the store's worker threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.total_ms = 0.0
+        self.statements = 0
+
+    def attach(self, engine) -> None:
+        from sqlalchemy import event
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def before(conn, cursor, statement, parameters, context, executemany):
+            self._local.started = time.perf_counter()
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after(conn, cursor, statement, parameters, context, executemany):
+            elapsed = (time.perf_counter() - self._local.started) * 1000.0
+            with self._lock:
+                self.total_ms += elapsed
+                self.statements += 1
+
+    def snapshot(self) -> tuple:
+        with self._lock:
+            return self.total_ms, self.statements
+
+
+class CountingResponse:
+    """Stands in for the aiohttp response of a delta-mode request."""
+
+    def __init__(self):
+        self.bytes = 0
+
+    async def write(self, data: bytes) -> None:
+        self.bytes += len(data)
+
+
+def full_text_line(session_id: str, text: str, finished: bool, ext: Any = None) -> int:
+    # Same shape as ChatResponse in conversation_api.py
+    line = {"session_id": session_id, "text": text, "finished": finished, "type": "message", "format": "markdown", "ext": ext}
+    return len(json.dumps(line).encode()) + 1
+
+
+async def instrumented(producer, session_id: str, started_at: float, result: Dict[str, Any]):
+    """Pass the run's outputs through, recording TTFT, end time and full-text protocol bytes."""
+    last_text = ""
+    ext_data = None
+    async for item in producer:
+        now = time.perf_counter()
+        text, ext = item if isinstance(item, tuple) and len(item) == 2 else (item, None)
+        if text and result.get("ttft_ms") is None:
+            result["ttft_ms"] = (now - started_at) * 1000.0
+        if ext:
+            ext_data = ext.get("data") if isinstance(ext, dict) else ext
+        if text and text != last_text:
+            result["full_text_bytes"] += full_text_line(session_id, text, False)
+            last_text = text
+        result["outputs"] += 1
+        result["total_ms"] = (now - started_at) * 1000.0
+        yield item
+    result["full_text_bytes"] += full_text_line(session_id, last_text, True, ext_data)
+
+
+async def replay(conversation: Dict[str, Any], stubs, collector: SpanCollector, sql: SQLTimer) -> Dict[str, Any]:
+    from backend.dao.workflow_table import save_workflow_data_async
+    from backend.service.debug_agent import debug_workflow_errors
+    from backend.service.mcp_client import comfyui_agent_invoke
+    from backend.utils.chat_stream import chat_streams, write_deltas
+    from backend.utils.globals import set_comfyui_copilot_api_key, set_language
+    from backend.utils.request_context import set_request_context
+
+    base_url, state = stubs
+    session_id = f"replay-{conversation['name']}-{uuid.uuid4().hex[:8]}"
+    config = {
+        "session_id": session_id,
+        "workflow_checkpoint_id": None,
+        "openai_api_key": "replay",
+        "openai_base_url": base_url + "/v1",
+        "model_select": conversation.get("model", "replay-model"),
+    }
+    set_request_context(session_id, None, config)
+    set_language("en", session_id)
+    # Agents created without the request config use the Copilot API key
+    set_comfyui_copilot_api_key("replay", session_id)
+    state.begin(session_id, conversation["model_turns"])
+    collector.reset()
+
+    if conversation["entry"] == "chat" and conversation.get("workflow"):
+        # The frontend saves the canvas as a checkpoint before invoking the chat
+        await save_workflow_data_async(session_id, conversation["workflow"], attributes={"source": "replay"})
+
+    db_ms_before, statements_before = sql.snapshot()
+    result: Dict[str, Any] = {"name": conversation["name"], "ttft_ms": None, "total_ms": 0.0,
+                              "outputs": 0, "full_text_bytes": 0}
+    started_at = time.perf_counter()
+    if conversation["entry"] == "debug":
+        producer = debug_workflow_errors(conversation["workflow"])
+    else:
+        producer = comfyui_agent_invoke(conversation["messages"], None)
+    stream = chat_streams.start(session_id, instrumented(producer, session_id, started_at, result))
+    response = CountingResponse()
+    await write_deltas(response, stream)
+
+    db_ms, statements = sql.snapshot()
+    result.update({
+        "delta_bytes": response.bytes,
+        "db_ms": db_ms - db_ms_before,
+        "db_statements": statements - statements_before,
+        "spans": {name: list(samples) for name, samples in collector.spans.items()},
+        "unscripted_model_calls": state.unscripted.get(session_id, 0),
+        "unused_model_turns": state.finish(session_id),
+        "error": stream.format == "text",
+    })
+    return result
+
+
+def report(name: str, runs: List[Dict[str, Any]]) -> None:
+    def stat(values: List[float]) -> str:
+        return f"{statistics.median(values):8.1f} {percentile(values, 0.95):8.1f}" if values else f"{'-':>8} {'-':>8}"
+
+    ttft = [run["ttft_ms"] for run in runs if run["ttft_ms"] is not None]
+    print(f"\n{name}  ({len(runs)} runs, median / p95 ms)")
+    print(f"  {'ttft':<34}{stat(ttft)}")
+    print(f"  {'total':<34}{stat([run['total_ms'] for run in runs])}")
+    print(f"  {'db':<34}{stat([run['db_ms'] for run in runs])}   {statistics.median([run['db_statements'] for run in runs]):.0f} statements")
+    categories = sorted({category for run in runs for category in run["spans"]}, key=lambda c: (c != "model", c))
+    for category in categories:
+        totals = [sum(run["spans"].get(category, [])) for run in runs]
+        calls = statistics.median([len(run["spans"].get(category, [])) for run in runs])
+        print(f"  {category + f' x{calls:.0f}':<34}{stat(totals)}")
+    print(f"  bytes streamed: full-text {statistics.median([run['full_text_bytes'] for run in runs]):,.0f}, "
+          f"delta {statistics.median([run['delta_bytes'] for run in runs]):,.0f}")
+    drift = [run for run in runs if run["unscripted_model_calls"] or run["unused_model_turns"] or run["error"]]
+    if drift:
+        print(f"  warning: {len(drift)} runs did not follow the recording "
+              f"(errors, unscripted model calls or unused turns); the code under test may have changed")
+
+
+def install_comfyui_stand_in(base_url: str) -> None:
+    """Point ComfyGateway at the stubs.
+
+    Outside a running ComfyUI there is no PromptServer instance. A stand-in with
+    only an address and port makes the gateway fetch object_info from the stub
+    over HTTP, while validation still runs in-process on the node registry.
+    """
+    import server
+
+    host, port = base_url.rsplit("//", 1)[1].rsplit(":", 1)
+    if server.PromptServer.instance is None:
+        server.PromptServer.instance = types.SimpleNamespace(address=host, port=int(port))
+
+
+async def run_benchmark(options, recordings: Dict[str, Any], conversations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    from replay_stubs import start_stub_servers
+
+    runner, base_url, state, mcp = await start_stub_servers(recordings, options.ttft_ms, options.token_ms)
+    # Read at import time by the backend modules: LLM proxy (/v1) and MCP server are the stubs
+    os.environ["COPILOT_BACKEND_BASE_URL"] = base_url
+    install_comfyui_stand_in(base_url)
+
+    from agents.tracing import set_trace_processors, set_tracing_disabled
+    from backend.dao import expert_table, workflow_table
+    from backend.service import mcp_client  # noqa: F401  (imports the agent stack, which disables tracing)
+    from backend.service import debug_agent  # noqa: F401
+    from backend.service.mcp_pool import mcp_connection_pool
+
+    collector = SpanCollector()
+    set_trace_processors([collector])
+    set_tracing_disabled(False)
+    sql = SQLTimer()
+    sql.attach(workflow_table.db_manager.engine)
+    sql.attach(expert_table.db_manager.engine)
+
+    print(f"stubs at {base_url}, model ttft {options.ttft_ms:.0f} ms, {options.token_ms:.0f} ms per chunk")
+    results = []
+    try:
+        for conversation in conversations:
+            runs = []
+            for _ in range(options.runs):
+                runs.append(await replay(conversation, (base_url, state), collector, sql))
+            report(conversation["name"], runs)
+            results.extend(runs)
+        print(f"\nMCP tool calls served: {mcp.calls}, connection pool: {mcp_connection_pool.stats()}")
+    finally:
+        await mcp_connection_pool.close()
+        await runner.cleanup()
+    return results
+
+
+def main():
+    options = parse_args()
+    comfyui_root = options.comfyui_root or os.path.dirname(os.path.dirname(COPILOT_ROOT))
+    sys.path.insert(0, comfyui_root)
+    sys.path.insert(0, COPILOT_ROOT)
+
+    with open(options.recordings, "r", encoding="utf-8") as f:
+        recordings = json.load(f)
+    conversations = [c for c in recordings["conversations"] if not options.only or c["name"] in options.only]
+    if not conversations:
+        sys.exit(f"No conversations to replay in {options.recordings}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Replay sessions must not end up in the user's checkpoint history
+        os.environ["COPILOT_WORKFLOW_DB_PATH"] = os.path.join(tmp_dir, "workflow_replay.db")
+        results = asyncio.run(run_benchmark(options, recordings, conversations))
+        from backend.dao import workflow_table
+        workflow_table.db_manager.engine.dispose()
+
+    if options.json:
+        with open(options.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"wrote {len(results)} runs to {options.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Benchmark the workflow checkpoint store under concurrent sessions.
+
+Run from the ComfyUI-Copilot directory:
+
+    python benchmarks/checkpoint_store_benchmark.py --sessions 16 --rounds 20
+
+Every simulated session repeats what the agent tools do on each workflow edit:
+read the latest version, then save a new one. Two stores are compared on a
+fresh SQLite file each:
+
+* legacy: rollback journal, one connection per call, commit per write, called
+  synchronously on the event loop (the previous behaviour)
+* pooled: the current DatabaseManager (WAL, connection pool, reads on a thread
+  pool, writes batched on the writer thread, delta-encoded checkpoints) through
+  the *_async API
+
+Besides throughput the script reports event loop lag, measured by a ticker task
+that should wake up every millisecond; this is the stall every other request
+(websocket messages, streaming chat responses) sees while the store works, and
+the size of the database file afterwards.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+COPILOT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=16, help="Concurrent sessions")
+    parser.add_argument("--rounds", type=int, default=20, help="Read + save rounds per session")
+    parser.add_argument("--nodes", type=int, default=40, help="Nodes in the synthetic workflow")
+    return parser.parse_args()
+
+
+def make_workflow(node_count: int) -> dict:
+    workflow = {}
+    for i in range(node_count):
+        inputs = {"seed": i, "steps": 20, "cfg": 7.5, "text": "a photo of a cat " * 8}
+        if i > 0:
+            inputs["model"] = [str(i - 1), 0]
+        workflow[str(i)] = {"class_type": "KSampler", "inputs": inputs}
+    return workflow
+
+
+class LegacyStore:
+    """The store as it was before pooling: default journal, commit per call."""
+
+    def __init__(self, db_path: str):
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from backend.dao.workflow_table import Base, WorkflowVersion
+
+        self.model = WorkflowVersion
+        self.engine = create_engine(f"sqlite:///{db_path}", echo=False)
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        Base.metadata.create_all(bind=self.engine)
+
+    def save(self, session_id, workflow_data):
+        session = self.SessionLocal()
+        try:
+            version = self.model(session_id=session_id, workflow_data=json.dumps(workflow_data))
+            session.add(version)
+            session.commit()
+            session.refresh(version)
+            return version.id
+        finally:
+            session.close()
+
+    def latest(self, session_id):
+        session = self.SessionLocal()
+        try:
+            version = session.query(self.model).filter(self.model.session_id == session_id)\
+                .order_by(self.model.id.desc()).first()
+            return json.loads(version.workflow_data) if version else None
+        finally:
+            session.close()
+
+    async def save_async(self, session_id, workflow_data):
+        return self.save(session_id, workflow_data)
+
+    async def latest_async(self, session_id):
+        return self.latest(session_id)
+
+
+class PooledStore:
+    def __init__(self, db_path: str):
+        from backend.dao.workflow_table import DatabaseManager
+
+        self.manager = DatabaseManager(db_path)
+
+    async def save_async(self, session_id, workflow_data):
+        return await self.manager.save_workflow_version_async(session_id, workflow_data)
+
+    async def latest_async(self, session_id):
+        return await self.manager.run_read_async(self.manager.get_current_workflow_data, session_id)
+
+
+async def measure_loop_lag(stop: asyncio.Event, samples: list) -> None:
+    interval = 0.001
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append((time.perf_counter() - start - interval) * 1000.0)
+
+
+async def run_session(store, session_id: str, rounds: int, workflow: dict) -> None:
+    await store.save_async(session_id, workflow)
+    for i in range(rounds):
+        current = await store.latest_async(session_id)
+        current["0"]["inputs"]["seed"] = i
+        await store.save_async(session_id, current)
+
+
+async def run_store(store, sessions: int, rounds: int, workflow: dict) -> dict:
+    lag_samples = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(measure_loop_lag(stop, lag_samples))
+    start = time.perf_counter()
+    await asyncio.gather(*[run_session(store, f"bench_{i}", rounds, workflow) for i in range(sessions)])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await ticker
+
+    lag_samples.sort()
+    writes = sessions * (rounds + 1)
+    return {
+        "elapsed": elapsed,
+        "writes_per_s": writes / elapsed,
+        "lag_p50": statistics.median(lag_samples) if lag_samples else 0.0,
+        "lag_p99": lag_samples[int(0.99 * (len(lag_samples) - 1))] if lag_samples else 0.0,
+        "lag_max": lag_samples[-1] if lag_samples else 0.0,
+        "ticks": len(lag_samples),
+    }
+
+
+def main():
+    options = parse_args()
+    sys.path.insert(0, COPILOT_ROOT)
+    workflow = make_workflow(options.nodes)
+
+    print(f"{options.sessions} sessions x {options.rounds} rounds, {options.nodes}-node workflow "
+          f"({len(json.dumps(workflow)) / 1024:.1f} KiB)")
+    print(f"{'store':<8} {'total':>9} {'writes/s':>10} {'loop lag p50':>13} {'p99':>9} {'max':>9} {'ticks':>7} {'db size':>10}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Importing backend.dao.workflow_table creates its module level db_manager,
+        # which must not migrate the user's checkpoint database
+        os.environ["COPILOT_WORKFLOW_DB_PATH"] = os.path.join(tmp_dir, "workflow_module.db")
+        for name, store_cls in (("legacy", LegacyStore), ("pooled", PooledStore)):
+            db_path = os.path.join(tmp_dir, f"{name}.db")
+            store = store_cls(db_path)
+            result = asyncio.run(run_store(store, options.sessions, options.rounds, workflow))
+            # Closing the last connection checkpoints the WAL back into the main file
+            if isinstance(store, PooledStore):
+                store.manager.engine.dispose()
+            else:
+                store.engine.dispose()
+            db_size = sum(os.path.getsize(path) for path in (db_path, db_path + "-wal") if os.path.exists(path))
+            print(f"{name:<8} {result['elapsed']:8.2f}s {result['writes_per_s']:10.1f} "
+                  f"{result['lag_p50']:10.2f} ms {result['lag_p99']:6.2f} ms {result['lag_max']:6.2f} ms "
+                  f"{result['ticks']:7d} {db_size / 1024:7.0f} KiB")
+        from backend.dao import workflow_table
+        workflow_table.db_manager.engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Benchmark ComfyGateway in-process mode against loopback HTTP mode.
+
+Run from the ComfyUI root directory:
+
+    python custom_nodes/ComfyUI-Copilot/benchmarks/gateway_benchmark.py --iterations 20
+
+The script boots a headless ComfyUI server (CPU only, core nodes only) on a spare
+port and times the gateway calls used by the debug and link agents through both
+modes. The prompt used for run_prompt references a checkpoint that does not
+exist, so it always fails validation and never reaches the GPU queue.
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import sys
+import time
+
+COPILOT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+INVALID_PROMPT = {
+    "4": {
+        "class_type": "CheckpointLoaderSimple",
+        "inputs": {"ckpt_name": "__copilot_benchmark_missing__.safetensors"},
+    },
+    "9": {
+        "class_type": "SaveImage",
+        "inputs": {"filename_prefix": "copilot_benchmark", "images": ["4", 0]},
+    },
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20, help="Timed calls per operation and mode")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed calls per operation and mode")
+    parser.add_argument("--port", type=int, default=0, help="Port for the temporary ComfyUI server (0 = pick a free one)")
+    return parser.parse_args()
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_for_port(port: int, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"ComfyUI did not start listening on port {port}")
+
+
+async def time_calls(fn, iterations: int, warmup: int) -> list:
+    for _ in range(warmup):
+        await fn()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return samples
+
+
+def summarize(samples: list) -> str:
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return f"median {statistics.median(ordered):8.2f} ms   p95 {p95:8.2f} ms"
+
+
+async def run_benchmark(port: int, iterations: int, warmup: int) -> None:
+    from backend.utils.comfy_gateway import ComfyGateway
+
+    gateways = {
+        "http": ComfyGateway(base_url=f"http://127.0.0.1:{port}"),
+        "in-process": ComfyGateway(),
+    }
+    prompt_request = {"prompt": INVALID_PROMPT, "client_id": "copilot_benchmark"}
+
+    operations = {
+        "get_object_info": lambda gw: gw.get_object_info(),
+        "get_object_info(class)": lambda gw: gw.get_object_info("KSampler"),
+        "run_prompt(invalid)": lambda gw: gw.run_prompt(prompt_request),
+        "get_history": lambda gw: gw.get_history("copilot_benchmark_missing"),
+        "get_queue_status": lambda gw: gw.get_queue_status(),
+    }
+
+    print(f"{'operation':<24} {'mode':<11} timings")
+    for op_name, op in operations.items():
+        medians = {}
+        for mode, gateway in gateways.items():
+            samples = await time_calls(lambda: op(gateway), iterations, warmup)
+            medians[mode] = statistics.median(samples)
+            print(f"{op_name:<24} {mode:<11} {summarize(samples)}")
+        if medians["in-process"] > 0:
+            print(f"{'':<24} {'speedup':<11} {medians['http'] / medians['in-process']:8.1f}x")
+
+
+def main():
+    options = parse_args()
+    port = options.port or free_port()
+
+    # ComfyUI parses its CLI arguments at import time.
+    sys.argv = [sys.argv[0], "--cpu", "--disable-all-custom-nodes", "--dont-print-server",
+                "--listen", "127.0.0.1", "--port", str(port)]
+    sys.path.insert(0, os.getcwd())
+    sys.path.insert(0, COPILOT_ROOT)
+
+    import main as comfy_main
+
+    loop, _, start_all = comfy_main.start_comfyui()
+    server_task = loop.create_task(start_all())
+    try:
+        loop.run_until_complete(wait_for_port(port))
+        loop.run_until_complete(run_benchmark(port, options.iterations, options.warmup))
+    finally:
+        server_task.cancel()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Benchmark time-to-first-token of chat turns with and without the MCP connection pool.
+
+Run from the ComfyUI-Copilot directory:
+
+    python benchmarks/mcp_pool_benchmark.py --turns 10
+    python benchmarks/mcp_pool_benchmark.py --turns 10 \
+        --llm-base-url https://api.openai.com/v1 --llm-api-key sk-... --model gpt-4.1-mini
+
+Each turn does what comfyui_agent_invoke does before the model can answer:
+get a connected MCP server and list its tools. Without pooling that is a new
+SSE connection per turn (COPILOT_MCP_POOL_SIZE=0); with pooling the connection
+and the tools list are reused. When an LLM endpoint is given, every turn also
+runs a one-shot agent with the MCP tools attached and the time to the first
+streamed text delta is reported, which is the TTFT users see.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+COPILOT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=10, help="Chat turns per mode")
+    parser.add_argument("--url", default=None, help="MCP SSE endpoint (defaults to the Copilot backend)")
+    parser.add_argument("--llm-base-url", default=None, help="OpenAI-compatible endpoint for end-to-end TTFT")
+    parser.add_argument("--llm-api-key", default=None)
+    parser.add_argument("--model", default="gpt-4.1-mini")
+    return parser.parse_args()
+
+
+def summarize(samples: list) -> str:
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return f"first {samples[0]:8.1f} ms   median {statistics.median(ordered):8.1f} ms   p95 {p95:8.1f} ms"
+
+
+async def first_token_ms(server, options, started_at: float) -> float:
+    from agents import Agent, OpenAIChatCompletionsModel, Runner
+    from openai import AsyncOpenAI
+    from openai.types.responses import ResponseTextDeltaEvent
+
+    client = AsyncOpenAI(base_url=options.llm_base_url, api_key=options.llm_api_key)
+    agent = Agent(
+        name="ComfyUI-Copilot-Benchmark",
+        instructions="Answer in one short sentence.",
+        mcp_servers=[server],
+        model=OpenAIChatCompletionsModel(model=options.model, openai_client=client),
+    )
+    result = Runner.run_streamed(agent, input="Say hello.", max_turns=1)
+    try:
+        async for event in result.stream_events():
+            if event.type == "raw_response_event" and isinstance(event.data, ResponseTextDeltaEvent) and event.data.delta:
+                return (time.perf_counter() - started_at) * 1000.0
+    finally:
+        result.cancel()
+    return float("nan")
+
+
+async def run_turn(session_factory, options) -> tuple:
+    started_at = time.perf_counter()
+    async with session_factory() as server:
+        await server.list_tools()
+        ready_ms = (time.perf_counter() - started_at) * 1000.0
+        ttft_ms = await first_token_ms(server, options, started_at) if options.llm_base_url else None
+    return ready_ms, ttft_ms
+
+
+async def run_benchmark(options) -> None:
+    from backend.service import mcp_pool
+
+    url = options.url or mcp_pool.MCP_SERVER_URL
+    pool = mcp_pool.MCPConnectionPool(url, max_idle=max(mcp_pool.MCP_POOL_SIZE, 1))
+    modes = {
+        "no pool": lambda: mcp_pool.create_mcp_server(url),
+        "pool": pool.lease,
+    }
+
+    print(f"MCP server: {url}")
+    for mode, session_factory in modes.items():
+        ready, ttft = [], []
+        for _ in range(options.turns):
+            ready_ms, ttft_ms = await run_turn(session_factory, options)
+            ready.append(ready_ms)
+            if ttft_ms is not None:
+                ttft.append(ttft_ms)
+        print(f"{mode:<8} tools ready  {summarize(ready)}")
+        if ttft:
+            print(f"{mode:<8} first token  {summarize(ttft)}")
+    print(f"pool stats: {pool.stats()}")
+    await pool.close()
+
+
+def main():
+    options = parse_args()
+    sys.path.insert(0, COPILOT_ROOT)
+    asyncio.run(run_benchmark(options))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Local stub servers for agent_replay_benchmark.py, on one aiohttp app:
+
+* /v1/chat/completions - OpenAI-compatible chat completions (streaming and
+  not). Each session (X-Session-ID header) replays the model turns of the
+  conversation it was assigned, one turn per request, in order. Agents created
+  without the request config (rewrite and debug agents) send no session
+  header; their requests go to the conversation begun last, so conversations
+  are replayed one at a time.
+* /mcp-server/mcp - MCP over SSE. Serves the recorded tools, answering each
+  call with its recorded output after its recorded latency.
+* /api/object_info - the recorded ComfyUI node definitions.
+
+Model latency is simulated: a turn waits ttft_ms before its first chunk and
+token_ms between text chunks of CHUNK_CHARS characters.
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+CHUNK_CHARS = 4
+MCP_PATH = "/mcp-server/mcp"
+
+
+class ReplayState:
+    """Which conversation each session replays and how far it got."""
+
+    def __init__(self, ttft_ms: float, token_ms: float):
+        self.ttft_ms = ttft_ms
+        self.token_ms = token_ms
+        self._turns: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursors: Dict[str, int] = {}
+        self.unscripted: Dict[str, int] = {}
+        self.current: Optional[str] = None
+
+    def begin(self, session_id: str, model_turns: List[Dict[str, Any]]) -> None:
+        self._turns[session_id] = model_turns
+        self._cursors[session_id] = 0
+        self.unscripted[session_id] = 0
+        self.current = session_id
+
+    def next_turn(self, session_id: Optional[str]) -> Dict[str, Any]:
+        if session_id not in self._turns:
+            session_id = self.current
+        turns = self._turns.get(session_id, [])
+        cursor = self._cursors.get(session_id, 0)
+        self._cursors[session_id] = cursor + 1
+        if cursor < len(turns):
+            return turns[cursor]
+        # The code under test asked the model more often than the recording did
+        self.unscripted[session_id] = self.unscripted.get(session_id, 0) + 1
+        return {"text": "Done."}
+
+    def finish(self, session_id: str) -> int:
+        """Forget the session; returns how many recorded turns were not requested."""
+        turns = self._turns.pop(session_id, [])
+        return max(0, len(turns) - self._cursors.pop(session_id, 0))
+
+
+def _tool_calls(turn: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "id": f"call_{uuid.uuid4().hex[:12]}",
+            "type": "function",
+            "function": {"name": call["name"], "arguments": json.dumps(call.get("arguments", {}), ensure_ascii=False)},
+        }
+        for call in turn.get("tool_calls", [])
+    ]
+
+
+def _chunk(model: str, delta: Dict[str, Any], finish_reason: Optional[str] = None, **extra) -> bytes:
+    body = {
+        "id": "chatcmpl-replay",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        **extra,
+    }
+    return b"data: " + json.dumps(body, ensure_ascii=False).encode() + b"\n\n"
+
+
+def _usage(turn: Dict[str, Any]) -> Dict[str, int]:
+    completion_tokens = max(1, len(turn.get("text", "")) // CHUNK_CHARS) + 20 * len(turn.get("tool_calls", []))
+    return {"prompt_tokens": 1000, "completion_tokens": completion_tokens, "total_tokens": 1000 + completion_tokens}
+
+
+async def chat_completions(request: web.Request) -> web.StreamResponse:
+    state: ReplayState = request.app["replay"]
+    body = await request.json()
+    turn = state.next_turn(request.headers.get("X-Session-ID"))
+    model = body.get("model", "replay")
+    ttft_ms = turn.get("ttft_ms", state.ttft_ms)
+    token_ms = turn.get("token_ms", state.token_ms)
+    text = turn.get("text", "")
+    tool_calls = _tool_calls(turn)
+    finish_reason = "tool_calls" if tool_calls else "stop"
+    await asyncio.sleep(ttft_ms / 1000.0)
+
+    if not body.get("stream"):
+        message: Dict[str, Any] = {"role": "assistant", "content": text or None}
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+        await asyncio.sleep(token_ms * len(text) / CHUNK_CHARS / 1000.0)
+        return web.json_response({
+            "id": "chatcmpl-replay",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": _usage(turn),
+        })
+
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await response.prepare(request)
+    await response.write(_chunk(model, {"role": "assistant", "content": ""}))
+    for start in range(0, len(text), CHUNK_CHARS):
+        if start:
+            await asyncio.sleep(token_ms / 1000.0)
+        await response.write(_chunk(model, {"content": text[start:start + CHUNK_CHARS]}))
+    for index, call in enumerate(tool_calls):
+        await response.write(_chunk(model, {"tool_calls": [dict(call, index=index)]}))
+    await response.write(_chunk(model, {}, finish_reason))
+    await response.write(b"data: " + json.dumps({
+        "id": "chatcmpl-replay", "object": "chat.completion.chunk", "created": int(time.time()),
+        "model": model, "choices": [], "usage": _usage(turn),
+    }).encode() + b"\n\n")
+    await response.write(b"data: [DONE]\n\n")
+    await response.write_eof()
+    return response
+
+
+class MCPStub:
+    """Just enough of the MCP SSE transport for MCPServerSse: initialize, ping, tools/list and tools/call."""
+
+    def __init__(self, tools: Dict[str, Dict[str, Any]]):
+        self.tools = tools
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self.calls: Dict[str, int] = {}
+
+    async def sse(self, request: web.Request) -> web.StreamResponse:
+        connection_id = uuid.uuid4().hex
+        queue: asyncio.Queue = asyncio.Queue()
+        self._queues[connection_id] = queue
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        try:
+            await response.write(f"event: endpoint\ndata: {MCP_PATH}/messages?session_id={connection_id}\n\n".encode())
+            while True:
+                message = await queue.get()
+                await response.write(b"event: message\ndata: " + json.dumps(message, ensure_ascii=False).encode() + b"\n\n")
+        except (asyncio.CancelledError, ConnectionResetError):
+            pass
+        finally:
+            self._queues.pop(connection_id, None)
+        return response
+
+    async def message(self, request: web.Request) -> web.Response:
+        queue = self._queues.get(request.query.get("session_id", ""))
+        if queue is None:
+            return web.Response(status=404, text="Unknown MCP session")
+        message = await request.json()
+        if "id" in message and "method" in message:
+            asyncio.ensure_future(self._answer(queue, message))
+        return web.Response(status=202, text="Accepted")
+
+    async def _answer(self, queue: asyncio.Queue, message: Dict[str, Any]) -> None:
+        method, params = message["method"], message.get("params") or {}
+        result: Optional[Dict[str, Any]] = None
+        error: Optional[Dict[str, Any]] = None
+        if method == "initialize":
+            result = {
+                "protocolVersion": params.get("protocolVersion", "2024-11-05"),
+                "capabilities": {"tools": {"listChanged": False}},
+                "serverInfo": {"name": "copilot-replay-stub", "version": "1.0"},
+            }
+        elif method == "ping":
+            result = {}
+        elif method == "tools/list":
+            result = {"tools": [
+                {"name": name, "description": tool.get("description", ""),
+                 "inputSchema": tool.get("input_schema", {"type": "object", "properties": {}})}
+                for name, tool in self.tools.items()
+            ]}
+        elif method == "tools/call":
+            tool = self.tools.get(params.get("name"))
+            if tool is None:
+                error = {"code": -32602, "message": f"Unknown tool: {params.get('name')}"}
+            else:
+                self.calls[params["name"]] = self.calls.get(params["name"], 0) + 1
+                await asyncio.sleep(tool.get("latency_ms", 0) / 1000.0)
+                output = tool.get("output", "")
+                text = output if isinstance(output, str) else json.dumps(output, ensure_ascii=False)
+                result = {"content": [{"type": "text", "text": text}], "isError": False}
+        else:
+            error = {"code": -32601, "message": f"Method not found: {method}"}
+        reply = {"jsonrpc": "2.0", "id": message["id"]}
+        if error is not None:
+            reply["error"] = error
+        else:
+            reply["result"] = result
+        await queue.put(reply)
+
+
+async def start_stub_servers(recordings: Dict[str, Any], ttft_ms: float, token_ms: float,
+                             host: str = "127.0.0.1", port: int = 0):
+    """Start the stubs; returns (runner, base_url, replay_state, mcp_stub). Clean up with runner.cleanup()."""
+    app = web.Application()
+    state = ReplayState(ttft_ms, token_ms)
+    mcp = MCPStub(recordings.get("mcp_tools", {}))
+    object_info = recordings.get("object_info", {})
+    app["replay"] = state
+
+    async def get_object_info(request: web.Request) -> web.Response:
+        node_class = request.match_info.get("node_class")
+        if node_class:
+            return web.json_response({node_class: object_info[node_class]} if node_class in object_info else {})
+        return web.json_response(object_info)
+
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_get(MCP_PATH, mcp.sse)
+    app.router.add_post(MCP_PATH + "/messages", mcp.message)
+    app.router.add_get("/api/object_info", get_object_info)
+    app.router.add_get("/api/object_info/{node_class}", get_object_info)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{bound_port}", state, mcp
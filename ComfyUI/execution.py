@@ -6,6 +6,7 @@ import sys
 import threading
 import time
 import traceback
+import weakref
 from enum import Enum
 from typing import List, Literal, NamedTuple, Optional, Union
 import asyncio
@@ -21,6 +22,8 @@ from comfy_execution.caching import (
     DependencyAwareCache,
     HierarchicalCache,
     LRUCache,
+    MemoryBudgetCache,
+    storage_bytes,
 )
 from comfy_execution.graph import (
     DynamicPrompt,
@@ -29,8 +32,10 @@ from comfy_execution.graph import (
     get_input_info,
 )
 from comfy_execution.graph_utils import GraphBuilder, is_link
+from comfy_execution.lanes import ExecutionLanes, node_lane, run_in_lane
 from comfy_execution.validation import validate_node_input
 from comfy_execution.progress import get_progress_state, reset_progress_state, add_progress_handler, WebUIProgressHandler
+from comfy_execution.prompt_workers import PromptScheduler, current_worker
 from comfy_execution.utils import CurrentNodeContext
 from comfy_api.internal import _ComfyNodeInternal, _NodeOutputInternal, first_real_override, is_class, make_locked_method_func
 from comfy_api.latest import io
@@ -92,40 +97,76 @@ class CacheType(Enum):
     CLASSIC = 0
     LRU = 1
     DEPENDENCY_AWARE = 2
+    MEMORY_BUDGET = 3
+
+
+# Every live CacheSet, for the cache statistics
+cache_sets = weakref.WeakSet()
+
+def get_cache_stats():
+    return [cache_set.stats() for cache_set in list(cache_sets)]
 
 
 class CacheSet:
-    def __init__(self, cache_type=None, cache_size=None):
+    def __init__(self, cache_type=None, cache_size=None, disk_cache=None, ram_budget=None, vram_budget=None):
+        self.cache_type = cache_type
         if cache_type == CacheType.DEPENDENCY_AWARE:
             self.init_dependency_aware_cache()
             logging.info("Disabling intermediate node cache.")
+            if disk_cache is not None:
+                logging.warning("The disk cache is not used without intermediate node cache.")
         elif cache_type == CacheType.LRU:
             if cache_size is None:
                 cache_size = 0
-            self.init_lru_cache(cache_size)
+            self.init_lru_cache(cache_size, disk_cache)
             logging.info("Using LRU cache")
+        elif cache_type == CacheType.MEMORY_BUDGET:
+            self.init_memory_budget_cache(ram_budget, vram_budget, disk_cache)
+            logging.info("Using memory budget cache")
         else:
-            self.init_classic_cache()
+            self.init_classic_cache(disk_cache)
 
         self.all = [self.outputs, self.ui, self.objects]
+        # The prompt worker owning the caches, when there are several
+        self.worker = current_worker.get()
+        cache_sets.add(self)
 
     # Performs like the old cache -- dump data ASAP
-    def init_classic_cache(self):
-        self.outputs = HierarchicalCache(CacheKeySetInputSignature)
+    def init_classic_cache(self, disk_cache=None):
+        self.outputs = HierarchicalCache(CacheKeySetInputSignature, disk_cache=disk_cache)
         self.ui = HierarchicalCache(CacheKeySetInputSignature)
         self.objects = HierarchicalCache(CacheKeySetID)
 
-    def init_lru_cache(self, cache_size):
-        self.outputs = LRUCache(CacheKeySetInputSignature, max_size=cache_size)
+    def init_lru_cache(self, cache_size, disk_cache=None):
+        self.outputs = LRUCache(CacheKeySetInputSignature, max_size=cache_size, disk_cache=disk_cache)
         self.ui = LRUCache(CacheKeySetInputSignature, max_size=cache_size)
         self.objects = HierarchicalCache(CacheKeySetID)
 
+    # evict outputs by the RAM/VRAM their tensors use
+    def init_memory_budget_cache(self, ram_budget, vram_budget, disk_cache=None):
+        self.outputs = MemoryBudgetCache(CacheKeySetInputSignature, ram_budget=ram_budget, vram_budget=vram_budget, disk_cache=disk_cache)
+        # The ui of an output goes with it
+        self.ui = MemoryBudgetCache(CacheKeySetInputSignature)
+        self.outputs.linked_caches.append(self.ui)
+        self.objects = HierarchicalCache(CacheKeySetID)
+
     # only hold cached items while the decendents have not executed
     def init_dependency_aware_cache(self):
         self.outputs = DependencyAwareCache(CacheKeySetInputSignature)
         self.ui = DependencyAwareCache(CacheKeySetInputSignature)
         self.objects = DependencyAwareCache(CacheKeySetID)
 
+    def stats(self):
+        if isinstance(self.outputs, MemoryBudgetCache):
+            stats = self.outputs.stats()
+        else:
+            ram, vram = storage_bytes(self.outputs.memory_usage())
+            stats = {"entries": len(self.outputs.cache), "ram_bytes": ram, "vram_bytes": vram}
+        stats["cache_type"] = self.cache_type.name if isinstance(self.cache_type, CacheType) else CacheType.CLASSIC.name
+        stats["worker"] = self.worker.index if self.worker is not None else None
+        stats["device"] = self.worker.device if self.worker is not None else None
+        return stats
+
     def recursive_debug_dump(self):
         result = {
             "outputs": self.outputs.recursive_debug_dump(),
@@ -214,7 +255,7 @@ async def resolve_map_node_over_list_results(results):
                 raise exc
         return [x.result() if isinstance(x, asyncio.Task) else x for x in results]
 
-async def _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, func, allow_interrupt=False, execution_block_cb=None, pre_execute_cb=None, hidden_inputs=None):
+async def _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, func, allow_interrupt=False, execution_block_cb=None, pre_execute_cb=None, hidden_inputs=None, lane_executor=None):
     # check if node wants the lists
     input_is_list = getattr(obj, "INPUT_IS_LIST", False)
 
@@ -242,7 +283,7 @@ async def _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, f
                 execution_block = execution_block_cb(v) if execution_block_cb else v
                 break
         if execution_block is None:
-            if pre_execute_cb is not None and index is not None:
+            if pre_execute_cb is not None and index is not None and lane_executor is None:
                 pre_execute_cb(index)
             # V3
             if isinstance(obj, _ComfyNodeInternal) or (is_class(obj) and issubclass(obj, _ComfyNodeInternal)):
@@ -272,6 +313,14 @@ async def _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, f
                     results.append(result)
                 else:
                     results.append(task)
+            elif lane_executor is not None:
+                def lane_call(f=f, inputs=inputs, index=index):
+                    with CurrentNodeContext(prompt_id, unique_id, index):
+                        if pre_execute_cb is not None and index is not None:
+                            pre_execute_cb(index)
+                        return f(**inputs)
+                result = await run_in_lane(lane_executor, lane_call)
+                results.append(result)
             else:
                 with CurrentNodeContext(prompt_id, unique_id, index):
                     result = f(**inputs)
@@ -311,8 +360,8 @@ def merge_result_data(results, obj):
             output.append([o[i] for o in results])
     return output
 
-async def get_output_data(prompt_id, unique_id, obj, input_data_all, execution_block_cb=None, pre_execute_cb=None, hidden_inputs=None):
-    return_values = await _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, obj.FUNCTION, allow_interrupt=True, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb, hidden_inputs=hidden_inputs)
+async def get_output_data(prompt_id, unique_id, obj, input_data_all, execution_block_cb=None, pre_execute_cb=None, hidden_inputs=None, lane_executor=None):
+    return_values = await _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, obj.FUNCTION, allow_interrupt=True, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb, hidden_inputs=hidden_inputs, lane_executor=lane_executor)
     has_pending_task = any(isinstance(r, asyncio.Task) and not r.done() for r in return_values)
     if has_pending_task:
         return return_values, {}, False, has_pending_task
@@ -392,7 +441,7 @@ def format_value(x):
     else:
         return str(x)
 
-async def execute(server, dynprompt, caches, current_item, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, pending_async_nodes):
+async def execute(server, dynprompt, caches, current_item, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, pending_async_nodes, lane_executor=None):
     unique_id = current_item
     real_node_id = dynprompt.get_real_node_id(unique_id)
     display_node_id = dynprompt.get_display_node_id(unique_id)
@@ -408,6 +457,8 @@ async def execute(server, dynprompt, caches, current_item, extra_data, executed,
         return (ExecutionResult.SUCCESS, None, None)
 
     input_data_all = None
+    # The cost of computing the output again; for async nodes only their collection is timed
+    execution_start_time = time.perf_counter()
     try:
         if unique_id in pending_async_nodes:
             results = []
@@ -493,7 +544,7 @@ async def execute(server, dynprompt, caches, current_item, extra_data, executed,
             def pre_execute_cb(call_index):
                 # TODO - How to handle this with async functions without contextvars (which requires Python 3.12)?
                 GraphBuilder.set_default_prefix(unique_id, call_index, 0)
-            output_data, output_ui, has_subgraph, has_pending_tasks = await get_output_data(prompt_id, unique_id, obj, input_data_all, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb, hidden_inputs=hidden_inputs)
+            output_data, output_ui, has_subgraph, has_pending_tasks = await get_output_data(prompt_id, unique_id, obj, input_data_all, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb, hidden_inputs=hidden_inputs, lane_executor=lane_executor)
             if has_pending_tasks:
                 pending_async_nodes[unique_id] = output_data
                 unblock = execution_list.add_external_block(unique_id)
@@ -554,6 +605,7 @@ async def execute(server, dynprompt, caches, current_item, extra_data, executed,
             pending_subgraph_results[unique_id] = cached_outputs
             return (ExecutionResult.PENDING, None, None)
         caches.outputs.set(unique_id, output_data)
+        caches.outputs.set_cost(unique_id, time.perf_counter() - execution_start_time)
     except comfy.model_management.InterruptProcessingException as iex:
         logging.info("Processing interrupted")
 
@@ -597,14 +649,21 @@ async def execute(server, dynprompt, caches, current_item, extra_data, executed,
     return (ExecutionResult.SUCCESS, None, None)
 
 class PromptExecutor:
-    def __init__(self, server, cache_type=False, cache_size=None):
+    def __init__(self, server, cache_type=False, cache_size=None, disk_cache=None, ram_budget=None, vram_budget=None, parallel_nodes=0):
         self.cache_size = cache_size
         self.cache_type = cache_type
+        self.disk_cache = disk_cache
+        self.ram_budget = ram_budget
+        self.vram_budget = vram_budget
         self.server = server
+        # Lanes to execute independent nodes concurrently, None to execute one node at a time
+        self.lanes = None
+        if parallel_nodes > 0:
+            self.lanes = ExecutionLanes(parallel_nodes)
         self.reset()
 
     def reset(self):
-        self.caches = CacheSet(cache_type=self.cache_type, cache_size=self.cache_size)
+        self.caches = CacheSet(cache_type=self.cache_type, cache_size=self.cache_size, disk_cache=self.disk_cache, ram_budget=self.ram_budget, vram_budget=self.vram_budget)
         self.status_messages = []
         self.success = True
 
@@ -685,25 +744,29 @@ class PromptExecutor:
             for node_id in list(execute_outputs):
                 execution_list.add_node(node_id)
 
-            while not execution_list.is_empty():
-                node_id, error, ex = await execution_list.stage_node_execution()
-                if error is not None:
-                    self.handle_execution_error(prompt_id, dynamic_prompt.original_prompt, current_outputs, executed, error, ex)
-                    break
-
-                assert node_id is not None, "Node ID should not be None at this point"
-                result, error, ex = await execute(self.server, dynamic_prompt, self.caches, node_id, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, pending_async_nodes)
-                self.success = result != ExecutionResult.FAILURE
-                if result == ExecutionResult.FAILURE:
-                    self.handle_execution_error(prompt_id, dynamic_prompt.original_prompt, current_outputs, executed, error, ex)
-                    break
-                elif result == ExecutionResult.PENDING:
-                    execution_list.unstage_node_execution()
-                else: # result == ExecutionResult.SUCCESS:
-                    execution_list.complete_node_execution()
+            if self.lanes is not None:
+                if await self.execute_concurrently(prompt_id, dynamic_prompt, extra_data, executed, execution_list, current_outputs, pending_subgraph_results, pending_async_nodes):
+                    self.add_message("execution_success", { "prompt_id": prompt_id }, broadcast=False)
             else:
-                # Only execute when the while-loop ends without break
-                self.add_message("execution_success", { "prompt_id": prompt_id }, broadcast=False)
+                while not execution_list.is_empty():
+                    node_id, error, ex = await execution_list.stage_node_execution()
+                    if error is not None:
+                        self.handle_execution_error(prompt_id, dynamic_prompt.original_prompt, current_outputs, executed, error, ex)
+                        break
+
+                    assert node_id is not None, "Node ID should not be None at this point"
+                    result, error, ex = await execute(self.server, dynamic_prompt, self.caches, node_id, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, pending_async_nodes)
+                    self.success = result != ExecutionResult.FAILURE
+                    if result == ExecutionResult.FAILURE:
+                        self.handle_execution_error(prompt_id, dynamic_prompt.original_prompt, current_outputs, executed, error, ex)
+                        break
+                    elif result == ExecutionResult.PENDING:
+                        execution_list.unstage_node_execution()
+                    else: # result == ExecutionResult.SUCCESS:
+                        execution_list.complete_node_execution()
+                else:
+                    # Only execute when the while-loop ends without break
+                    self.add_message("execution_success", { "prompt_id": prompt_id }, broadcast=False)
 
             ui_outputs = {}
             meta_outputs = {}
@@ -721,6 +784,95 @@ class PromptExecutor:
             if comfy.model_management.DISABLE_SMART_MEMORY:
                 comfy.model_management.unload_all_models()
 
+    async def execute_concurrently(self, prompt_id, dynamic_prompt, extra_data, executed, execution_list, current_outputs, pending_subgraph_results, pending_async_nodes):
+        """
+        Execute the nodes of the prompt, running the ready ones concurrently in their lanes
+        (see comfy_execution.lanes). Returns whether every node executed successfully.
+        """
+        lanes = self.lanes
+        node_lanes = {}
+        # Task -> node id, in the order the nodes were staged
+        running = {}
+        failure = None
+
+        def can_stage(node_id):
+            class_def = nodes.NODE_CLASS_MAPPINGS[dynamic_prompt.get_node(node_id)["class_type"]]
+            lane = node_lane(class_def)
+            if not lanes.has_room(lane):
+                return False
+            lanes.acquire(lane)
+            node_lanes[node_id] = lane
+            return True
+
+        interrupted = False
+        try:
+            while True:
+                if failure is None:
+                    for node_id in execution_list.stage_ready_nodes(can_stage):
+                        lane_executor = lanes.executor(node_lanes[node_id])
+                        task = asyncio.create_task(execute(self.server, dynamic_prompt, self.caches, node_id, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, pending_async_nodes, lane_executor))
+                        running[task] = node_id
+
+                if len(running) == 0:
+                    if failure is not None or execution_list.is_empty():
+                        break
+                    if execution_list.externalBlocks > 0:
+                        # Only async nodes left, wait for one of them
+                        await execution_list.unblockedEvent.wait()
+                        execution_list.unblockedEvent.clear()
+                        continue
+                    failure = execution_list.get_cycle_error()
+                    break
+
+                if interrupted:
+                    # Interrupted nodes clear the flag, keep it set until all of them stopped
+                    nodes.interrupt_processing(True)
+                waiting = set(running)
+                unblocked = None
+                if failure is None and execution_list.externalBlocks > 0:
+                    unblocked = asyncio.create_task(execution_list.unblockedEvent.wait())
+                    waiting.add(unblocked)
+                done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                if unblocked is not None:
+                    if unblocked in done:
+                        execution_list.unblockedEvent.clear()
+                    else:
+                        unblocked.cancel()
+
+                # Handle finished nodes in the order they were staged, so the outcome doesn't depend on timing
+                for task in [task for task in running if task in done]:
+                    node_id = running.pop(task)
+                    lanes.release(node_lanes.pop(node_id))
+                    result, error, ex = task.result()
+                    if failure is None:
+                        self.success = result != ExecutionResult.FAILURE
+                    if result == ExecutionResult.FAILURE:
+                        execution_list.unstage_node(node_id)
+                        if failure is None:
+                            failure = (error, ex)
+                            # Interrupt the nodes still running too
+                            interrupted = isinstance(ex, comfy.model_management.InterruptProcessingException)
+                    elif result == ExecutionResult.PENDING:
+                        execution_list.unstage_node(node_id)
+                    else: # result == ExecutionResult.SUCCESS:
+                        execution_list.complete_node(node_id)
+        finally:
+            if len(running) > 0:
+                # Left behind by an unexpected error, don't let them run untracked
+                for task in running:
+                    task.cancel()
+                await asyncio.gather(*running, return_exceptions=True)
+                for node_id in running.values():
+                    lanes.release(node_lanes.pop(node_id))
+            if interrupted:
+                nodes.interrupt_processing(False)
+
+        if failure is not None:
+            error, ex = failure
+            self.handle_execution_error(prompt_id, dynamic_prompt.original_prompt, current_outputs, executed, error, ex)
+            return False
+        return True
+
 
 async def validate_inputs(prompt_id, prompt, item, validated):
     unique_id = item
@@ -1084,20 +1236,35 @@ class PromptQueue:
         self.currently_running = {}
         self.history = {}
         self.flags = {}
+        # Set when several prompt workers share the queue
+        self.scheduler: Optional[PromptScheduler] = None
+
+    def set_workers(self, workers):
+        with self.mutex:
+            self.scheduler = PromptScheduler(workers)
 
     def put(self, item):
         with self.mutex:
             heapq.heappush(self.queue, item)
             self.server.queue_updated()
-            self.not_empty.notify()
+            self.not_empty.notify_all()
 
-    def get(self, timeout=None):
+    def get(self, timeout=None, worker=None):
         with self.not_empty:
-            while len(self.queue) == 0:
-                self.not_empty.wait(timeout=timeout)
-                if timeout is not None and len(self.queue) == 0:
-                    return None
-            item = heapq.heappop(self.queue)
+            if worker is None:
+                while len(self.queue) == 0:
+                    self.not_empty.wait(timeout=timeout)
+                    if timeout is not None and len(self.queue) == 0:
+                        return None
+                item = heapq.heappop(self.queue)
+            else:
+                # Not every queued prompt suits every worker, see PromptScheduler
+                item = self.scheduler.select(self.queue, worker)
+                while item is None:
+                    self.not_empty.wait(timeout=timeout)
+                    item = self.scheduler.select(self.queue, worker)
+                    if timeout is not None and item is None:
+                        return None
             i = self.task_counter
             self.currently_running[i] = copy.deepcopy(item)
             self.task_counter += 1
@@ -1110,9 +1277,11 @@ class PromptQueue:
         messages: List[str]
 
     def task_done(self, item_id, history_result,
-                  status: Optional['PromptQueue.ExecutionStatus']):
+                  status: Optional['PromptQueue.ExecutionStatus'], worker=None):
         with self.mutex:
             prompt = self.currently_running.pop(item_id)
+            if worker is not None:
+                worker.finish_prompt()
             if len(self.history) > MAXIMUM_HISTORY_SIZE:
                 self.history.pop(next(iter(self.history)))
 
@@ -1152,9 +1321,38 @@ class PromptQueue:
         with self.mutex:
             return len(self.queue) + len(self.currently_running)
 
+    def interrupt(self, prompt_id=None, client_id=None):
+        """
+        Interrupt the running prompts with this prompt_id and/or queued by this client_id, or every
+        running prompt when neither is given. Returns the number of running prompts interrupted.
+        """
+        with self.mutex:
+            running = [item for item in self.currently_running.values()
+                       if (prompt_id is None or item[1] == prompt_id) and (client_id is None or item[3].get("client_id") == client_id)]
+            if prompt_id is None and client_id is None:
+                nodes.interrupt_processing()
+            elif len(running) > 0:
+                if self.scheduler is None:
+                    nodes.interrupt_processing()
+                else:
+                    # Only the workers running them, other users' prompts go on
+                    prompt_ids = set(item[1] for item in running)
+                    for worker in self.scheduler.workers:
+                        if worker.prompt_id in prompt_ids and worker.interrupt_flag is not None:
+                            comfy.model_management.interrupt_worker_processing(worker.interrupt_flag)
+            return len(running)
+
+    def get_worker_status(self):
+        with self.mutex:
+            if self.scheduler is None:
+                return None
+            return self.scheduler.status()
+
     def wipe_queue(self):
         with self.mutex:
             self.queue = []
+            if self.scheduler is not None:
+                self.scheduler.forget(self.queue)
             self.server.queue_updated()
 
     def delete_queue_item(self, function):
@@ -1166,6 +1364,8 @@ class PromptQueue:
                     else:
                         self.queue.pop(x)
                         heapq.heapify(self.queue)
+                        if self.scheduler is not None:
+                            self.scheduler.forget(self.queue)
                     self.server.queue_updated()
                     return True
         return False
@@ -1208,10 +1408,15 @@ class PromptQueue:
     def set_flag(self, name, data):
         with self.mutex:
             self.flags[name] = data
-            self.not_empty.notify()
+            if self.scheduler is not None:
+                self.scheduler.set_flag(name, data)
+            self.not_empty.notify_all()
 
-    def get_flags(self, reset=True):
+    def get_flags(self, reset=True, worker=None):
         with self.mutex:
+            if worker is not None:
+                # Every worker gets its own copy of the flags
+                return self.scheduler.take_flags(worker)
             if reset:
                 ret = self.flags
                 self.flags = {}
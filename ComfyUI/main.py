@@ -11,7 +11,8 @@ import itertools
 import utils.extra_config
 import logging
 import sys
-from comfy_execution.progress import get_progress_state
+from comfy_execution.progress import get_progress_state, use_worker_progress_state
+from comfy_execution.prompt_workers import create_workers, current_worker, default_worker_devices, get_executing_server
 from comfy_execution.utils import get_executing_context
 from comfy_api import feature_flags
 
@@ -146,6 +147,7 @@ import comfy.utils
 
 import execution
 import server
+from comfy_execution.disk_cache import DiskCache
 from protocol import BinaryEventTypes
 import nodes
 import comfy.model_management
@@ -165,15 +167,31 @@ def cuda_malloc_warning():
             logging.warning("\nWARNING: this card most likely does not support cuda-malloc, if you get \"CUDA error\" please run ComfyUI with: --disable-cuda-malloc\n")
 
 
-def prompt_worker(q, server_instance):
+def prompt_worker(q, server_instance, worker=None, disk_cache=None):
     current_time: float = 0.0
     cache_type = execution.CacheType.CLASSIC
     if args.cache_lru > 0:
         cache_type = execution.CacheType.LRU
     elif args.cache_none:
         cache_type = execution.CacheType.DEPENDENCY_AWARE
-
-    e = execution.PromptExecutor(server_instance, cache_type=cache_type, cache_size=args.cache_lru)
+    elif args.cache_ram > 0:
+        cache_type = execution.CacheType.MEMORY_BUDGET
+    vram_budget = None
+    if args.cache_vram is not None:
+        vram_budget = int(args.cache_vram * 1024 * 1024 * 1024)
+
+    if worker is not None:
+        # One of several workers: pinned to its device, with its own caches,
+        # progress and interrupt state, models in use, and its own view of the server
+        comfy.model_management.set_thread_device(worker.device)
+        worker.interrupt_flag = comfy.model_management.use_thread_interrupt_flag()
+        comfy.model_management.track_thread_models_in_use()
+        use_worker_progress_state()
+        current_worker.set(worker)
+        server_instance = worker.server
+
+    e = execution.PromptExecutor(server_instance, cache_type=cache_type, cache_size=args.cache_lru, disk_cache=disk_cache,
+                                 ram_budget=int(args.cache_ram * 1024 * 1024 * 1024), vram_budget=vram_budget, parallel_nodes=args.parallel_nodes)
     last_gc_collect = 0
     need_gc = False
     gc_collect_interval = 10.0
@@ -183,7 +201,7 @@ def prompt_worker(q, server_instance):
         if need_gc:
             timeout = max(gc_collect_interval - (current_time - last_gc_collect), 0.0)
 
-        queue_item = q.get(timeout=timeout)
+        queue_item = q.get(timeout=timeout, worker=worker)
         if queue_item is not None:
             item, item_id = queue_item
             execution_start_time = time.perf_counter()
@@ -191,13 +209,15 @@ def prompt_worker(q, server_instance):
             server_instance.last_prompt_id = prompt_id
 
             e.execute(item[2], prompt_id, item[3], item[4])
+            comfy.model_management.release_thread_models()
             need_gc = True
             q.task_done(item_id,
                         e.history_result,
                         status=execution.PromptQueue.ExecutionStatus(
                             status_str='success' if e.success else 'error',
                             completed=e.success,
-                            messages=e.status_messages))
+                            messages=e.status_messages),
+                        worker=worker)
             if server_instance.client_id is not None:
                 server_instance.send_sync("executing", {"node": None, "prompt_id": prompt_id}, server_instance.client_id)
 
@@ -211,7 +231,7 @@ def prompt_worker(q, server_instance):
             else:
                 logging.info("Prompt executed in {:.2f} seconds".format(execution_time))
 
-        flags = q.get_flags()
+        flags = q.get_flags(worker=worker)
         free_memory = flags.get("free_memory", False)
 
         if flags.get("unload_models", free_memory):
@@ -221,6 +241,8 @@ def prompt_worker(q, server_instance):
 
         if free_memory:
             e.reset()
+            if worker is not None:
+                worker.forget_caches()
             need_gc = True
             last_gc_collect = 0
 
@@ -234,6 +256,23 @@ def prompt_worker(q, server_instance):
                 hook_breaker_ac10a0.restore_functions()
 
 
+def prompt_worker_devices():
+    if args.prompt_worker_devices is not None:
+        return [d.strip() for d in args.prompt_worker_devices.split(",") if d.strip()]
+    accelerators = [str(d) for d in comfy.model_management.get_all_torch_devices() if d.type != "cpu"]
+    return default_worker_devices(args.prompt_workers, accelerators)
+
+
+def start_prompt_workers(q, server_instance, disk_cache=None):
+    # Workers with LRU or memory budget caches keep results of more than the last prompt
+    warm_prompts = 8 if args.cache_lru > 0 or args.cache_ram > 0 else 1
+    workers = create_workers(server_instance, prompt_worker_devices(), warm_prompts=warm_prompts)
+    q.set_workers(workers)
+    for worker in workers:
+        logging.info("Starting prompt worker {} on device {}".format(worker.index, worker.device))
+        threading.Thread(target=prompt_worker, daemon=True, args=(q, server_instance, worker, disk_cache)).start()
+
+
 async def run(server_instance, address='', port=8188, verbose=True, call_on_start=None):
     addresses = []
     for addr in address.split(","):
@@ -250,25 +289,27 @@ def hijack_progress(server_instance):
         if node_id is None and executing_context is not None:
             node_id = executing_context.node_id
         comfy.model_management.throw_exception_if_processing_interrupted()
+        # The view of the prompt worker running the node when several run in parallel
+        executing_server = get_executing_server(server_instance)
         if prompt_id is None:
-            prompt_id = server_instance.last_prompt_id
+            prompt_id = executing_server.last_prompt_id
         if node_id is None:
-            node_id = server_instance.last_node_id
+            node_id = executing_server.last_node_id
         progress = {"value": value, "max": total, "prompt_id": prompt_id, "node": node_id}
         get_progress_state().update_progress(node_id, value, total, preview_image)
 
-        server_instance.send_sync("progress", progress, server_instance.client_id)
+        executing_server.send_sync("progress", progress, executing_server.client_id)
         if preview_image is not None:
             # Only send old method if client doesn't support preview metadata
             if not feature_flags.supports_feature(
-                server_instance.sockets_metadata,
-                server_instance.client_id,
+                executing_server.sockets_metadata,
+                executing_server.client_id,
                 "supports_preview_metadata",
             ):
-                server_instance.send_sync(
+                executing_server.send_sync(
                     BinaryEventTypes.UNENCODED_PREVIEW_IMAGE,
                     preview_image,
-                    server_instance.client_id,
+                    executing_server.client_id,
                 )
 
     comfy.utils.set_progress_bar_global_hook(hook)
@@ -325,7 +366,18 @@ def start_comfyui(asyncio_loop=None):
     prompt_server.add_routes()
     hijack_progress(prompt_server)
 
-    threading.Thread(target=prompt_worker, daemon=True, args=(prompt_server.prompt_queue, prompt_server,)).start()
+    if args.cache_vram is not None and args.cache_ram <= 0:
+        logging.warning("--cache-vram only applies with --cache-ram, VRAM used by cached node results is not limited.")
+
+    # Shared by the caches of all prompt workers
+    disk_cache = None
+    if args.cache_disk is not None:
+        disk_cache = DiskCache(os.path.abspath(args.cache_disk), int(args.cache_disk_size * 1024 * 1024 * 1024))
+
+    if args.prompt_workers > 1 or args.prompt_worker_devices is not None:
+        start_prompt_workers(prompt_server.prompt_queue, prompt_server, disk_cache)
+    else:
+        threading.Thread(target=prompt_worker, daemon=True, args=(prompt_server.prompt_queue, prompt_server, None, disk_cache)).start()
 
     if args.quick_test_for_ci:
         exit(0)
@@ -1616,6 +1616,8 @@ class PreviewImage(SaveImage):
         self.prefix_append = "_temp_" + ''.join(random.choice("abcdefghijklmnopqrstupvxyz") for x in range(5))
         self.compress_level = 1
 
+    EXECUTION_LANE = "cpu"
+
     @classmethod
     def INPUT_TYPES(s):
         return {"required":
@@ -1637,6 +1639,7 @@ class LoadImage:
 
     RETURN_TYPES = ("IMAGE", "MASK")
     FUNCTION = "load_image"
+    EXECUTION_LANE = "cpu"
     def load_image(self, image):
         image_path = folder_paths.get_annotated_filepath(image)
 
@@ -1714,6 +1717,7 @@ class LoadImageMask:
 
     RETURN_TYPES = ("MASK",)
     FUNCTION = "load_image"
+    EXECUTION_LANE = "cpu"
     def load_image(self, image, channel):
         image_path = folder_paths.get_annotated_filepath(image)
         i = node_helpers.pillow(Image.open, image_path)
@@ -1783,6 +1787,7 @@ class ImageScale:
                               "crop": (s.crop_methods,)}}
     RETURN_TYPES = ("IMAGE",)
     FUNCTION = "upscale"
+    EXECUTION_LANE = "cpu"
 
     CATEGORY = "image/upscaling"
 
@@ -1810,6 +1815,7 @@ class ImageScaleBy:
                               "scale_by": ("FLOAT", {"default": 1.0, "min": 0.01, "max": 8.0, "step": 0.01}),}}
     RETURN_TYPES = ("IMAGE",)
     FUNCTION = "upscale"
+    EXECUTION_LANE = "cpu"
 
     CATEGORY = "image/upscaling"
 
@@ -1829,6 +1835,7 @@ class ImageInvert:
 
     RETURN_TYPES = ("IMAGE",)
     FUNCTION = "invert"
+    EXECUTION_LANE = "cpu"
 
     CATEGORY = "image"
 
@@ -1844,6 +1851,7 @@ class ImageBatch:
 
     RETURN_TYPES = ("IMAGE",)
     FUNCTION = "batch"
+    EXECUTION_LANE = "cpu"
 
     CATEGORY = "image"
 
@@ -1866,6 +1874,7 @@ class EmptyImage:
                               }}
     RETURN_TYPES = ("IMAGE",)
     FUNCTION = "generate"
+    EXECUTION_LANE = "cpu"
 
     CATEGORY = "image"
 
@@ -1892,6 +1901,7 @@ class ImagePadForOutpaint:
 
     RETURN_TYPES = ("IMAGE", "MASK")
     FUNCTION = "expand_image"
+    EXECUTION_LANE = "cpu"
 
     CATEGORY = "image"
 
@@ -210,8 +210,13 @@ class PromptServer():
                 # Send initial state to the new client
                 await self.send("status", {"status": self.get_queue_info(), "sid": sid}, sid)
                 # On reconnect if we are the currently executing client send the current node
-                if self.client_id == sid and self.last_node_id is not None:
-                    await self.send("executing", { "node": self.last_node_id }, sid)
+                if self.prompt_queue.scheduler is None:
+                    if self.client_id == sid and self.last_node_id is not None:
+                        await self.send("executing", { "node": self.last_node_id }, sid)
+                else:
+                    for worker in self.prompt_queue.scheduler.workers:
+                        if worker.running and worker.server.client_id == sid and worker.server.last_node_id is not None:
+                            await self.send("executing", { "node": worker.server.last_node_id, "prompt_id": worker.prompt_id }, sid)
 
                 # Flag to track if we've received the first message
                 first_message = True
@@ -582,6 +587,11 @@ class PromptServer():
             }
             return web.json_response(system_stats)
 
+        @routes.get("/cache_stats")
+        async def cache_stats(request):
+            # One entry per prompt worker
+            return web.json_response({"caches": execution.get_cache_stats()})
+
         @routes.get("/features")
         async def get_features(request):
             return web.json_response(feature_flags.get_server_features())
@@ -625,6 +635,8 @@ class PromptServer():
                 info['api_node'] = obj_class.API_NODE
             return info
 
+        self.node_info = node_info
+
         @routes.get("/object_info")
         async def get_object_info(request):
             with folder_paths.cache_helper:
@@ -669,49 +681,8 @@ class PromptServer():
         async def post_prompt(request):
             logging.info("got prompt")
             json_data =  await request.json()
-            json_data = self.trigger_on_prompt(json_data)
-
-            if "number" in json_data:
-                number = float(json_data['number'])
-            else:
-                number = self.number
-                if "front" in json_data:
-                    if json_data['front']:
-                        number = -number
-
-                self.number += 1
-
-            if "prompt" in json_data:
-                prompt = json_data["prompt"]
-                prompt_id = str(json_data.get("prompt_id", uuid.uuid4()))
-
-                partial_execution_targets = None
-                if "partial_execution_targets" in json_data:
-                    partial_execution_targets = json_data["partial_execution_targets"]
-
-                valid = await execution.validate_prompt(prompt_id, prompt, partial_execution_targets)
-                extra_data = {}
-                if "extra_data" in json_data:
-                    extra_data = json_data["extra_data"]
-
-                if "client_id" in json_data:
-                    extra_data["client_id"] = json_data["client_id"]
-                if valid[0]:
-                    outputs_to_execute = valid[2]
-                    self.prompt_queue.put((number, prompt_id, prompt, extra_data, outputs_to_execute))
-                    response = {"prompt_id": prompt_id, "number": number, "node_errors": valid[3]}
-                    return web.json_response(response)
-                else:
-                    logging.warning("invalid prompt: {}".format(valid[1]))
-                    return web.json_response({"error": valid[1], "node_errors": valid[3]}, status=400)
-            else:
-                error = {
-                    "type": "no_prompt",
-                    "message": "No prompt provided",
-                    "details": "No prompt provided",
-                    "extra_info": {}
-                }
-                return web.json_response({"error": error, "node_errors": {}}, status=400)
+            response, status = await self.queue_prompt(json_data)
+            return web.json_response(response, status=status)
 
         @routes.post("/queue")
         async def post_queue(request):
@@ -729,7 +700,22 @@ class PromptServer():
 
         @routes.post("/interrupt")
         async def post_interrupt(request):
-            nodes.interrupt_processing()
+            try:
+                json_data = await request.json()
+            except json.JSONDecodeError:
+                json_data = {}
+            if not isinstance(json_data, dict):
+                json_data = {}
+
+            # With a prompt_id or client_id, only that prompt or client's prompts are interrupted:
+            # prompt workers may be running other users' prompts meanwhile
+            prompt_id = json_data.get("prompt_id")
+            client_id = json_data.get("client_id")
+            if prompt_id is None and client_id is None:
+                logging.info("Global interrupt (no prompt_id or client_id specified)")
+            interrupted = self.prompt_queue.interrupt(prompt_id=prompt_id, client_id=client_id)
+            if interrupted == 0 and (prompt_id is not None or client_id is not None):
+                logging.info("No running prompt matches prompt_id {} client_id {}, skipping interrupt".format(prompt_id, client_id))
             return web.Response(status=200)
 
         @routes.post("/free")
@@ -805,6 +791,9 @@ class PromptServer():
         prompt_info = {}
         exec_info = {}
         exec_info['queue_remaining'] = self.prompt_queue.get_tasks_remaining()
+        workers = self.prompt_queue.get_worker_status()
+        if workers is not None:
+            exec_info['workers'] = workers
         prompt_info['exec_info'] = exec_info
         return prompt_info
 
@@ -972,6 +961,55 @@ class PromptServer():
 
         return json_data
 
+    async def queue_prompt(self, json_data):
+        """
+        Validate and queue the prompt of a /prompt request body. Also used by
+        custom nodes queueing prompts from inside the server.
+        Returns the response and its HTTP status.
+        """
+        json_data = self.trigger_on_prompt(json_data)
+
+        if "number" in json_data:
+            number = float(json_data['number'])
+        else:
+            number = self.number
+            if "front" in json_data:
+                if json_data['front']:
+                    number = -number
+
+            self.number += 1
+
+        if "prompt" in json_data:
+            prompt = json_data["prompt"]
+            prompt_id = str(json_data.get("prompt_id", uuid.uuid4()))
+
+            partial_execution_targets = None
+            if "partial_execution_targets" in json_data:
+                partial_execution_targets = json_data["partial_execution_targets"]
+
+            valid = await execution.validate_prompt(prompt_id, prompt, partial_execution_targets)
+            extra_data = {}
+            if "extra_data" in json_data:
+                extra_data = json_data["extra_data"]
+
+            if "client_id" in json_data:
+                extra_data["client_id"] = json_data["client_id"]
+            if valid[0]:
+                outputs_to_execute = valid[2]
+                self.prompt_queue.put((number, prompt_id, prompt, extra_data, outputs_to_execute))
+                return {"prompt_id": prompt_id, "number": number, "node_errors": valid[3]}, 200
+            else:
+                logging.warning("invalid prompt: {}".format(valid[1]))
+                return {"error": valid[1], "node_errors": valid[3]}, 400
+        else:
+            error = {
+                "type": "no_prompt",
+                "message": "No prompt provided",
+                "details": "No prompt provided",
+                "extra_info": {}
+            }
+            return {"error": error, "node_errors": {}}, 400
+
     def send_progress_text(
         self, text: Union[bytes, bytearray, str], node_id: str, sid=None
     ):
@@ -0,0 +1,145 @@
+import asyncio
+import copy
+from collections import OrderedDict
+
+import pytest
+
+from comfy_execution import caching
+from comfy_execution.caching import CacheKeySetInputSignature, Unhashable
+from comfy_execution.graph import DynamicPrompt
+
+
+class SignatureNode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {"required": {"value": ("INT", {})}, "optional": {"a": ("INT",), "b": ("INT",)}}
+
+    RETURN_TYPES = ("INT", "INT")
+    FUNCTION = "run"
+    CATEGORY = "_for_testing"
+
+
+class RandomNode(SignatureNode):
+    NOT_IDEMPOTENT = True
+
+
+class IsChanged:
+    def __init__(self, results=None):
+        self.results = results or {}
+
+    async def get(self, node_id):
+        return self.results.get(node_id, False)
+
+
+@pytest.fixture(autouse=True)
+def node_classes(register_nodes, monkeypatch):
+    register_nodes({"SignatureNode": SignatureNode, "SignatureRandomNode": RandomNode})
+    monkeypatch.setattr(CacheKeySetInputSignature, "signature_memo", OrderedDict())
+
+
+def node(value, class_type="SignatureNode", **links):
+    return {"class_type": class_type, "inputs": {"value": value, **links}}
+
+
+def signatures(prompt, is_changed=None):
+    key_set = CacheKeySetInputSignature(DynamicPrompt(prompt), prompt.keys(), IsChanged(is_changed))
+    asyncio.run(key_set.add_keys(prompt.keys()))
+    return {node_id: key_set.get_data_key(node_id) for node_id in prompt}
+
+
+PROMPT = {
+    "1": node(1),
+    "2": node(2, a=["1", 0]),
+    "3": node(3, a=["2", 0], b=["1", 1]),
+    "4": node(4),
+}
+
+
+def test_signatures_are_stable():
+    first = signatures(copy.deepcopy(PROMPT))
+    second = signatures(copy.deepcopy(PROMPT))
+    assert first == second
+    assert len(set(first.values())) == 4
+
+
+def test_changes_reach_descendants_only():
+    before = signatures(copy.deepcopy(PROMPT))
+    prompt = copy.deepcopy(PROMPT)
+    prompt["2"]["inputs"]["value"] = 20
+    after = signatures(prompt)
+
+    assert after["1"] == before["1"]
+    assert after["4"] == before["4"]
+    assert after["2"] != before["2"]
+    assert after["3"] != before["3"]
+
+
+def test_links_are_part_of_the_signature():
+    before = signatures(copy.deepcopy(PROMPT))
+    prompt = copy.deepcopy(PROMPT)
+    prompt["3"]["inputs"]["b"] = ["1", 0]
+    assert signatures(prompt)["3"] != before["3"]
+
+
+def test_node_ids_are_not_part_of_the_signature():
+    renumbered = {
+        "10": node(1),
+        "20": node(2, a=["10", 0]),
+        "30": node(3, a=["20", 0], b=["10", 1]),
+        "40": node(4),
+    }
+    before = signatures(copy.deepcopy(PROMPT))
+    after = signatures(renumbered)
+    assert [after[node_id] for node_id in ("10", "20", "30", "40")] == [before[node_id] for node_id in ("1", "2", "3", "4")]
+
+
+def test_not_idempotent_nodes_include_their_id():
+    prompt = {"1": node(1, "SignatureRandomNode"), "2": node(1, "SignatureRandomNode")}
+    keys = signatures(prompt)
+    assert keys["1"] != keys["2"]
+
+
+def test_always_changed_nodes_never_match():
+    prompt = copy.deepcopy(PROMPT)
+    first = signatures(prompt, is_changed={"2": float("NaN")})
+    second = signatures(copy.deepcopy(PROMPT), is_changed={"2": float("NaN")})
+
+    for node_id in ("2", "3"):
+        assert isinstance(first[node_id], Unhashable)
+        assert first[node_id] != second[node_id]
+    assert first["1"] == second["1"]
+
+
+def test_deep_graphs():
+    prompt = {"0": node(0)}
+    for i in range(1, 5000):
+        prompt[str(i)] = node(i, a=[str(i - 1), 0])
+    keys = signatures(prompt)
+    assert len(set(keys.values())) == 5000
+
+
+def test_unchanged_nodes_are_not_digested_again(monkeypatch):
+    signatures(copy.deepcopy(PROMPT))
+
+    digested = []
+    dumps = caching.json.dumps
+    def counting_dumps(obj, **kwargs):
+        digested.append(obj[0])
+        return dumps(obj, **kwargs)
+    monkeypatch.setattr(caching.json, "dumps", counting_dumps)
+
+    prompt = copy.deepcopy(PROMPT)
+    prompt["3"]["inputs"]["value"] = 30
+    signatures(prompt)
+    assert digested == ["SignatureNode"]
+
+
+def test_memo_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setattr(CacheKeySetInputSignature, "MAX_SIGNATURE_MEMO", 4)
+    signatures(copy.deepcopy(PROMPT))
+    signatures({"1": node(1)})
+    # A new node evicts the entry used least recently only, node 2's
+    signatures({"5": node(5)})
+
+    memo_ids = [key[1] for key in CacheKeySetInputSignature.signature_memo]
+    assert memo_ids == ["3", "4", "1", "5"]
@@ -0,0 +1,68 @@
+"""Helpers shared by the execution tests."""
+import threading
+
+import pytest
+
+import comfy.cli_args
+
+# The tests execute prompts on the CPU: comfy.model_management picks its device
+# when first imported (by nodes, execution...), which must not need a GPU
+comfy.cli_args.args.cpu = True
+
+import nodes  # noqa: E402
+
+
+class Concurrency:
+    """Counts the threads inside the block, and the most at the same time."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def __enter__(self):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+
+    def __exit__(self, *args):
+        with self.lock:
+            self.running -= 1
+
+
+class FakeServer:
+    """The parts of PromptServer used while executing prompts, recording the messages sent."""
+
+    def __init__(self):
+        self.client_id = None
+        self.last_node_id = None
+        self.last_prompt_id = None
+        self.sockets_metadata = {}
+        self.messages = []
+        self.statuses = []
+        self.prompt_queue = None
+        self.lock = threading.Lock()
+
+    def send_sync(self, event, data, sid=None):
+        with self.lock:
+            self.messages.append((event, data, sid))
+
+    def queue_updated(self):
+        if self.prompt_queue is not None:
+            self.statuses.append(self.prompt_queue.get_worker_status())
+
+
+class NotChanged:
+    """is_changed cache of a prompt whose nodes never changed."""
+
+    async def get(self, node_id):
+        return False
+
+
+@pytest.fixture
+def register_nodes(monkeypatch):
+    """Adds node classes (name -> class) to NODE_CLASS_MAPPINGS for the test."""
+    def register(node_classes):
+        for name, node_class in node_classes.items():
+            monkeypatch.setitem(nodes.NODE_CLASS_MAPPINGS, name, node_class)
+    return register
@@ -0,0 +1,187 @@
+import asyncio
+import os
+
+import pytest
+import torch
+
+from comfy_execution.caching import CacheKeySetInputSignature, HierarchicalCache, LRUCache, Unhashable, to_hashable
+from comfy_execution.disk_cache import DiskCache, signature_digest
+from comfy_execution.graph import DynamicPrompt
+
+from .conftest import NotChanged
+
+
+def entry_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(".safetensors"))
+
+
+@pytest.fixture
+def disk_cache(tmp_path):
+    return DiskCache(str(tmp_path), max_bytes=1024 * 1024)
+
+
+def test_signature_digest_is_stable():
+    signature = to_hashable([["CLIPTextEncode", False, ("text", "a photo of a cat")], ["CheckpointLoaderSimple", False, ("ckpt_name", "sd15.safetensors")]])
+    same = to_hashable([["CLIPTextEncode", False, ("text", "a photo of a cat")], ["CheckpointLoaderSimple", False, ("ckpt_name", "sd15.safetensors")]])
+    other = to_hashable([["CLIPTextEncode", False, ("text", "a photo of a dog")], ["CheckpointLoaderSimple", False, ("ckpt_name", "sd15.safetensors")]])
+
+    assert signature_digest(signature) == signature_digest(same)
+    assert signature_digest(signature) != signature_digest(other)
+    assert signature_digest(to_hashable([1])) != signature_digest(to_hashable([1.0]))
+
+
+def test_signatures_that_never_match_are_not_stored():
+    assert signature_digest(to_hashable(["KSampler", float("NaN")])) is None
+    assert signature_digest(to_hashable(["KSampler", Unhashable()])) is None
+
+
+def test_round_trip(disk_cache):
+    key = to_hashable(["CLIPTextEncode", ("text", "cat")])
+    cond = torch.randn(1, 77, 768)
+    pooled = torch.randn(1, 768).to(torch.bfloat16)
+    output = [[[[cond, {"pooled_output": pooled, "strength": 0.5}]]], [(3, "text", None)]]
+
+    assert disk_cache.set(key, output)
+    loaded = disk_cache.get(key)
+    assert torch.equal(loaded[0][0][0][0], cond)
+    assert torch.equal(loaded[0][0][0][1]["pooled_output"], pooled)
+    assert loaded[0][0][0][1]["strength"] == 0.5
+    assert loaded[1] == [(3, "text", None)]
+
+
+def test_shared_tensors_round_trip(disk_cache):
+    key = to_hashable(["VAEDecode"])
+    image = torch.rand(2, 8, 8, 3)
+    output = [[image, image[0], image]]
+
+    assert disk_cache.set(key, output)
+    loaded = disk_cache.get(key)
+    assert loaded[0][0] is loaded[0][2]
+    assert torch.equal(loaded[0][1], image[0])
+
+
+def test_objects_are_not_stored(disk_cache):
+    key = to_hashable(["CheckpointLoaderSimple"])
+    assert not disk_cache.set(key, [[object()]])
+    assert disk_cache.get(key) is None
+    assert entry_files(disk_cache.directory) == []
+
+
+def test_entries_survive_a_restart(tmp_path, disk_cache):
+    key = to_hashable(["EmptyLatentImage", ("width", 512)])
+    latent = {"samples": torch.zeros(1, 4, 64, 64)}
+    disk_cache.set(key, [[latent]])
+
+    restarted = DiskCache(str(tmp_path), max_bytes=1024 * 1024)
+    # The key of the new process has a different frozenset iteration order
+    key = to_hashable(["EmptyLatentImage", ("width", 512)])
+    assert torch.equal(restarted.get(key)[0][0]["samples"], latent["samples"])
+
+
+def test_corrupt_entries_are_discarded(disk_cache):
+    key = to_hashable(["VAEDecode"])
+    disk_cache.set(key, [[torch.ones(16, 16)]])
+    path = os.path.join(disk_cache.directory, entry_files(disk_cache.directory)[0])
+    with open(path, "r+b") as f:
+        f.seek(-4, os.SEEK_END)
+        f.write(b"\x00\x00\x80\x7f")
+
+    assert disk_cache.get(key) is None
+    assert entry_files(disk_cache.directory) == []
+    assert disk_cache.total_bytes == 0
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    disk_cache = DiskCache(str(tmp_path), max_bytes=3 * 4096 + 1024)
+    keys = [to_hashable(["Node", i]) for i in range(4)]
+    for key in keys[:3]:
+        assert disk_cache.set(key, [[torch.zeros(1024)]])
+    disk_cache.get(keys[0])
+    assert disk_cache.set(keys[3], [[torch.zeros(1024)]])
+
+    assert disk_cache.get(keys[1]) is None
+    for key in (keys[0], keys[2], keys[3]):
+        assert disk_cache.get(key) is not None
+    assert disk_cache.total_bytes <= disk_cache.max_bytes
+
+    # A lower budget applies on start
+    smaller = DiskCache(str(tmp_path), max_bytes=4096 + 1024)
+    assert len(entry_files(tmp_path)) == 1
+    assert len(smaller.entries) == 1
+
+
+def test_store_writes_in_the_background(disk_cache):
+    key = to_hashable(["EmptyLatentImage"])
+    latent = torch.zeros(1, 4, 8, 8)
+
+    assert disk_cache.store(key, [[latent]])
+    # Already queued
+    assert not disk_cache.store(key, [[latent]])
+    disk_cache.flush()
+    assert torch.equal(disk_cache.get(key)[0][0], latent)
+    assert disk_cache.writing == set()
+    # Already stored
+    assert not disk_cache.store(key, [[latent]])
+
+
+def test_store_skips_outputs_when_the_writer_falls_behind(disk_cache, monkeypatch):
+    monkeypatch.setattr(DiskCache, "MAX_PENDING_WRITES", 0)
+    assert not disk_cache.store(to_hashable(["Node"]), [[torch.zeros(4)]])
+    assert entry_files(disk_cache.directory) == []
+
+
+def test_entries_larger_than_the_budget_are_skipped(tmp_path):
+    disk_cache = DiskCache(str(tmp_path), max_bytes=1024)
+    assert not disk_cache.set(to_hashable(["Node"]), [[torch.zeros(1024)]])
+
+
+class ConstantNode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {"required": {"value": ("FLOAT", {})}}
+
+    RETURN_TYPES = ("FLOAT",)
+    FUNCTION = "run"
+    CATEGORY = "_for_testing"
+
+
+class PreviewNode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {"required": {"value": ("FLOAT", {})}}
+
+    RETURN_TYPES = ()
+    FUNCTION = "run"
+    OUTPUT_NODE = True
+    CATEGORY = "_for_testing"
+
+
+PROMPT = {
+    "1": {"class_type": "DiskCacheConstantNode", "inputs": {"value": 2.0}},
+    "2": {"class_type": "DiskCachePreviewNode", "inputs": {"value": ["1", 0]}},
+}
+
+
+@pytest.fixture
+def node_classes(register_nodes):
+    register_nodes({"DiskCacheConstantNode": ConstantNode, "DiskCachePreviewNode": PreviewNode})
+
+
+def new_cache(cache_class, disk_cache):
+    cache = cache_class(CacheKeySetInputSignature, disk_cache=disk_cache)
+    asyncio.run(cache.set_prompt(DynamicPrompt(PROMPT), PROMPT.keys(), NotChanged()))
+    return cache
+
+
+@pytest.mark.parametrize("cache_class", [HierarchicalCache, LRUCache])
+def test_outputs_cache_falls_back_to_disk(node_classes, disk_cache, cache_class):
+    cache = new_cache(cache_class, disk_cache)
+    cache.set("1", [[torch.full((4,), 2.0)]])
+    cache.set("2", [])
+    disk_cache.flush()
+
+    # A new process, or a new cache after switching cache modes
+    cache = new_cache(cache_class, disk_cache)
+    assert torch.equal(cache.get("1")[0][0], torch.full((4,), 2.0))
+    # Output nodes always execute
+    assert cache.get("2") is None
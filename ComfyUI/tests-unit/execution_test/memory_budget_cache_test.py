@@ -0,0 +1,172 @@
+import asyncio
+
+import pytest
+import torch
+
+import execution
+from comfy_execution.caching import CacheKeySetInputSignature, MemoryBudgetCache, output_storages, storage_bytes
+from comfy_execution.graph import DynamicPrompt
+from comfy_execution.prompt_workers import PromptWorker, current_worker
+
+from .conftest import NotChanged
+
+MB = 1024 * 1024
+
+
+class ConstantNode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {"required": {"value": ("INT", {})}}
+
+    RETURN_TYPES = ("LATENT",)
+    FUNCTION = "run"
+    CATEGORY = "_for_testing"
+
+
+@pytest.fixture(autouse=True)
+def node_classes(register_nodes):
+    register_nodes({"MemoryBudgetConstantNode": ConstantNode})
+
+
+def run_prompt(cache, values):
+    """Start a prompt of one node per value, node ids being the values."""
+    prompt = {str(v): {"class_type": "MemoryBudgetConstantNode", "inputs": {"value": v}} for v in values}
+    asyncio.run(cache.set_prompt(DynamicPrompt(prompt), prompt.keys(), NotChanged()))
+    cache.clean_unused()
+
+
+def latent(megabytes):
+    return [[{"samples": torch.zeros(megabytes * MB, dtype=torch.uint8)}]]
+
+
+def test_output_storages_counts_views_once():
+    image = torch.zeros(4, 64, 64, 3)
+    mask = torch.zeros(4, 64, 64)
+    storages = output_storages([[image, image[0]], [{"mask": mask, "batch": (image[1:], 3)}], ["text", None]])
+
+    assert len(storages) == 2
+    assert storage_bytes(storages) == ((4 * 64 * 64 * 3 + 4 * 64 * 64) * 4, 0)
+
+
+def test_outputs_over_budget_are_evicted():
+    cache = MemoryBudgetCache(CacheKeySetInputSignature, ram_budget=3 * MB + 4096)
+    run_prompt(cache, [1, 2])
+    cache.set("1", latent(1))
+    cache.set("2", latent(1))
+    assert cache.ram_bytes == 2 * MB + 2 * cache.ENTRY_BYTES
+
+    run_prompt(cache, [3])
+    cache.set("3", latent(2))
+    assert cache.ram_bytes <= cache.ram_budget
+    assert cache.evictions == 1
+
+    run_prompt(cache, [1, 2, 3])
+    assert [cache.get(node_id) is not None for node_id in ("1", "2", "3")].count(True) == 2
+
+
+def test_current_prompt_outputs_are_kept():
+    cache = MemoryBudgetCache(CacheKeySetInputSignature, ram_budget=1 * MB)
+    run_prompt(cache, [1, 2])
+    cache.set("1", latent(1))
+    cache.set("2", latent(1))
+
+    # Over budget, but the prompt still needs them
+    assert cache.get("1") is not None
+    assert cache.get("2") is not None
+    assert cache.evictions == 0
+
+    run_prompt(cache, [3])
+    assert len(cache.cache) == 0
+    assert cache.ram_bytes == 0
+
+
+def test_cheap_outputs_are_evicted_first():
+    cache = MemoryBudgetCache(CacheKeySetInputSignature, ram_budget=2 * MB + 4096)
+    run_prompt(cache, [1, 2])
+    cache.set("1", latent(1))
+    cache.set_cost("1", 10.0)
+    cache.set("2", latent(1))
+    cache.set_cost("2", 0.1)
+
+    run_prompt(cache, [3])
+    cache.set("3", latent(1))
+
+    run_prompt(cache, [1, 2])
+    assert cache.get("1") is not None
+    assert cache.get("2") is None
+
+
+def test_shared_tensors_are_counted_once():
+    cache = MemoryBudgetCache(CacheKeySetInputSignature, ram_budget=2 * MB)
+    run_prompt(cache, [1, 2])
+    samples = torch.zeros(MB, dtype=torch.uint8)
+    cache.set("1", [[{"samples": samples}]])
+    # A node passing its input through
+    cache.set("2", [[{"samples": samples}]])
+    assert cache.ram_bytes == MB + 2 * cache.ENTRY_BYTES
+
+    cache._drop(cache.cache_key_set.get_data_key("1"))
+    assert cache.ram_bytes == MB + cache.ENTRY_BYTES
+
+
+def test_ui_goes_with_its_output():
+    outputs = MemoryBudgetCache(CacheKeySetInputSignature, ram_budget=1 * MB)
+    ui = MemoryBudgetCache(CacheKeySetInputSignature)
+    outputs.linked_caches.append(ui)
+    for cache in (outputs, ui):
+        run_prompt(cache, [1])
+    outputs.set("1", latent(1))
+    ui.set("1", {"output": {"images": []}})
+
+    for cache in (outputs, ui):
+        run_prompt(cache, [2])
+    outputs.set("2", latent(1))
+    assert len(ui.cache) == 0
+
+
+def test_stats():
+    cache = MemoryBudgetCache(CacheKeySetInputSignature, ram_budget=8 * MB)
+    run_prompt(cache, [1, 2])
+    cache.set("1", latent(2))
+    cache.set_cost("1", 1.5)
+    cache.get("1")
+    cache.get("2")
+
+    stats = cache.stats()
+    assert stats["entries"] == 1
+    assert stats["ram_bytes"] == 2 * MB + cache.ENTRY_BYTES
+    assert stats["ram_budget"] == 8 * MB
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["largest"] == [{"class_type": "MemoryBudgetConstantNode", "ram_bytes": 2 * MB, "vram_bytes": 0, "cost_seconds": 1.5}]
+
+
+def test_stats_count_each_lookup_once_per_prompt():
+    cache = MemoryBudgetCache(CacheKeySetInputSignature, ram_budget=8 * MB)
+    run_prompt(cache, [1, 2])
+    # Looked up before executing the node, then by each of its children
+    cache.get("1")
+    cache.set("1", latent(1))
+    cache.get("1")
+    cache.get("1")
+    cache.get("2")
+    cache.get("2")
+    assert (cache.hits, cache.misses) == (0, 2)
+
+    run_prompt(cache, [1, 2])
+    cache.get("1")
+    cache.get("1")
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_cache_stats_name_their_worker():
+    single = execution.CacheSet(execution.CacheType.MEMORY_BUDGET, ram_budget=8 * MB)
+    worker = PromptWorker(1, "cuda:1", server=None)
+    token = current_worker.set(worker)
+    try:
+        of_worker = execution.CacheSet(execution.CacheType.MEMORY_BUDGET, ram_budget=8 * MB)
+    finally:
+        current_worker.reset(token)
+
+    assert (single.stats()["worker"], single.stats()["device"]) == (None, None)
+    assert (of_worker.stats()["worker"], of_worker.stats()["device"]) == (1, "cuda:1")
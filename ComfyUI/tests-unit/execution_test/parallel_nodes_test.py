@@ -0,0 +1,264 @@
+"""Independent branches of a prompt executing concurrently in resource lanes (--parallel-nodes)."""
+import asyncio
+import time
+
+import pytest
+
+import comfy.model_management
+import execution
+from comfy_execution.graph_utils import GraphBuilder
+from comfy_execution.lanes import LANE_CPU, LANE_GPU, LANE_IO, node_lane
+
+from .conftest import Concurrency, FakeServer
+
+concurrency = {LANE_GPU: Concurrency(), LANE_CPU: Concurrency(), LANE_IO: Concurrency(), "all": Concurrency()}
+expanded_prefixes = []
+interrupted_nodes = []
+
+
+class LaneGpuNode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {"required": {"value": ("INT", {}), "seconds": ("FLOAT", {})}, "optional": {"after": ("INT",)}}
+
+    RETURN_TYPES = ("INT",)
+    FUNCTION = "run"
+    CATEGORY = "_for_testing"
+    LANE = LANE_GPU
+
+    def run(self, value, seconds, after=0):
+        with concurrency[self.LANE], concurrency["all"]:
+            time.sleep(seconds)
+        return (value + after,)
+
+
+class LaneCpuNode(LaneGpuNode):
+    EXECUTION_LANE = "cpu"
+    LANE = LANE_CPU
+
+
+class LaneAsyncNode(LaneGpuNode):
+    LANE = LANE_IO
+
+    async def run(self, value, seconds, after=0):
+        with concurrency[self.LANE], concurrency["all"]:
+            await asyncio.sleep(seconds)
+        return (value + after,)
+
+
+class LaneFailingNode(LaneCpuNode):
+    def run(self, value, seconds, after=0):
+        time.sleep(seconds)
+        raise ValueError("failed on purpose")
+
+
+class LaneInterruptingNode(LaneCpuNode):
+    def run(self, value, seconds, after=0):
+        time.sleep(seconds)
+        raise comfy.model_management.InterruptProcessingException()
+
+
+class LaneInterruptibleNode(LaneCpuNode):
+    def run(self, value, seconds, after=0):
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            try:
+                comfy.model_management.throw_exception_if_processing_interrupted()
+            except comfy.model_management.InterruptProcessingException:
+                interrupted_nodes.append(value)
+                raise
+            time.sleep(0.01)
+        return (value,)
+
+
+class LaneExpandNode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {"required": {"value": ("INT", {})}}
+
+    RETURN_TYPES = ("INT",)
+    FUNCTION = "run"
+    CATEGORY = "_for_testing"
+    EXECUTION_LANE = "cpu"
+
+    def run(self, value):
+        time.sleep(0.05)
+        graph = GraphBuilder()
+        expanded_prefixes.append(graph.prefix)
+        node = graph.node("LaneCpuNode", value=value * 10, seconds=0.0)
+        return {"result": (node.out(0),), "expand": graph.finalize()}
+
+
+class LaneSumNode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {"required": {}, "optional": {"a": ("INT",), "b": ("INT",), "c": ("INT",), "d": ("INT",)}}
+
+    RETURN_TYPES = ()
+    FUNCTION = "run"
+    OUTPUT_NODE = True
+    CATEGORY = "_for_testing"
+
+    def run(self, **values):
+        return {"ui": {"sum": [sum(values.values())]}}
+
+
+@pytest.fixture(autouse=True)
+def node_classes(register_nodes):
+    register_nodes({node_class.__name__: node_class for node_class in (
+        LaneGpuNode, LaneCpuNode, LaneAsyncNode, LaneFailingNode, LaneInterruptingNode, LaneInterruptibleNode, LaneExpandNode, LaneSumNode)})
+    for c in concurrency.values():
+        c.max_running = 0
+    expanded_prefixes.clear()
+    interrupted_nodes.clear()
+
+
+def node(class_type, value=1, seconds=0.0, **links):
+    return {"class_type": class_type, "inputs": {"value": value, "seconds": seconds, **links}}
+
+
+def sum_of(*node_ids):
+    inputs = {name: [node_id, 0] for name, node_id in zip("abcd", node_ids)}
+    return {"class_type": "LaneSumNode", "inputs": inputs}
+
+
+def run(prompt, parallel_nodes):
+    server = FakeServer()
+    e = execution.PromptExecutor(server, cache_type=execution.CacheType.CLASSIC, parallel_nodes=parallel_nodes)
+    start = time.perf_counter()
+    e.execute(prompt, "prompt", {"client_id": "client"}, ["out"])
+    return e, server, time.perf_counter() - start
+
+
+def test_node_lanes():
+    assert node_lane(LaneGpuNode) == LANE_GPU
+    assert node_lane(LaneCpuNode) == LANE_CPU
+    assert node_lane(LaneAsyncNode) == LANE_IO
+
+
+def test_cpu_nodes_run_concurrently():
+    prompt = {str(i): node("LaneCpuNode", i, 0.2) for i in range(1, 4)}
+    prompt["out"] = sum_of("1", "2", "3")
+    e, _, elapsed = run(prompt, parallel_nodes=4)
+
+    assert e.success
+    assert e.history_result["outputs"]["out"] == {"sum": [6]}
+    assert concurrency[LANE_CPU].max_running == 3
+    assert elapsed < 0.5
+
+
+def test_cpu_lane_size_is_respected():
+    prompt = {str(i): node("LaneCpuNode", i, 0.05) for i in range(1, 5)}
+    prompt["out"] = sum_of("1", "2", "3", "4")
+    e, _, _ = run(prompt, parallel_nodes=2)
+
+    assert e.success
+    assert concurrency[LANE_CPU].max_running == 2
+
+
+def test_one_gpu_node_at_a_time():
+    prompt = {
+        "1": node("LaneGpuNode", 1, 0.1),
+        "2": node("LaneGpuNode", 2, 0.1),
+        "3": node("LaneCpuNode", 3, 0.1),
+        "4": node("LaneAsyncNode", 4, 0.1),
+        "out": sum_of("1", "2", "3", "4"),
+    }
+    e, _, _ = run(prompt, parallel_nodes=4)
+
+    assert e.success
+    assert e.history_result["outputs"]["out"] == {"sum": [10]}
+    assert concurrency[LANE_GPU].max_running == 1
+    # But alongside the other lanes
+    assert concurrency["all"].max_running == 3
+
+
+def test_same_results_and_messages_as_sequential():
+    prompt = {
+        "1": node("LaneCpuNode", 1, 0.01),
+        "2": node("LaneGpuNode", 2, 0.02, after=["1", 0]),
+        "3": node("LaneAsyncNode", 3, 0.01, after=["1", 0]),
+        "4": node("LaneCpuNode", 4, 0.0, after=["2", 0]),
+        "out": sum_of("2", "3", "4"),
+    }
+    sequential, sequential_server, _ = run(prompt, parallel_nodes=0)
+    parallel, parallel_server, _ = run(prompt, parallel_nodes=4)
+
+    assert parallel.success
+    assert parallel.history_result == sequential.history_result
+
+    def node_events(server):
+        return sorted((event, data["node"]) for event, data, _ in server.messages if event in ("executing", "executed") and data["node"] is not None)
+    assert node_events(parallel_server) == node_events(sequential_server)
+    assert [event for event, _ in parallel.status_messages] == [event for event, _ in sequential.status_messages]
+
+
+def test_expanded_graphs_get_the_same_ids():
+    prompt = {
+        "1": {"class_type": "LaneExpandNode", "inputs": {"value": 1}},
+        "2": {"class_type": "LaneExpandNode", "inputs": {"value": 2}},
+        "out": sum_of("1", "2"),
+    }
+    sequential, _, _ = run(prompt, parallel_nodes=0)
+    sequential_prefixes = sorted(expanded_prefixes)
+    expanded_prefixes.clear()
+    parallel, _, _ = run(prompt, parallel_nodes=4)
+
+    assert parallel.history_result["outputs"]["out"] == {"sum": [30]}
+    assert sorted(expanded_prefixes) == sequential_prefixes == ["1.0.0.", "2.0.0."]
+
+
+def test_failure_waits_for_running_nodes():
+    prompt = {
+        "1": node("LaneFailingNode", 1, 0.05),
+        "2": node("LaneCpuNode", 2, 0.2),
+        "3": node("LaneCpuNode", 3, 0.0, after=["2", 0]),
+        "out": sum_of("1", "3"),
+    }
+    e, server, _ = run(prompt, parallel_nodes=4)
+
+    assert not e.success
+    errors = [data for event, data in e.status_messages if event == "execution_error"]
+    assert len(errors) == 1
+    assert errors[0]["node_id"] == "1"
+    # The node running meanwhile completed, nothing started after the failure
+    assert "2" in errors[0]["executed"]
+    assert not any(event == "executing" and data["node"] == "3" for event, data, _ in server.messages)
+
+
+def test_interrupt_stops_every_running_node():
+    prompt = {
+        "1": node("LaneInterruptingNode", 1, 0.05),
+        "2": node("LaneInterruptibleNode", 2, 5.0),
+        "3": node("LaneInterruptibleNode", 3, 5.0),
+        "out": sum_of("1", "2", "3"),
+    }
+    e, _, elapsed = run(prompt, parallel_nodes=4)
+
+    assert not e.success
+    assert [event for event, _ in e.status_messages][-1] == "execution_interrupted"
+    assert sorted(interrupted_nodes) == [2, 3]
+    assert elapsed < 2.0
+    assert not comfy.model_management.processing_interrupted()
+
+
+def test_unexpected_error_stops_running_nodes(monkeypatch):
+    execute = execution.execute
+
+    async def failing_execute(server, dynprompt, caches, current_item, *args):
+        if current_item == "1":
+            await asyncio.sleep(0.05)
+            raise RuntimeError("executor bug")
+        return await execute(server, dynprompt, caches, current_item, *args)
+    monkeypatch.setattr(execution, "execute", failing_execute)
+
+    prompt = {
+        "1": node("LaneCpuNode", 1),
+        "2": node("LaneCpuNode", 2, 0.5),
+        "out": sum_of("1", "2"),
+    }
+    e = execution.PromptExecutor(FakeServer(), cache_type=execution.CacheType.CLASSIC, parallel_nodes=4)
+    with pytest.raises(RuntimeError):
+        e.execute(prompt, "prompt", {"client_id": "client"}, ["out"])
+    # The node still running was cancelled and its lane released
+    assert e.lanes.running == {LANE_GPU: 0, LANE_CPU: 0, LANE_IO: 0}
@@ -0,0 +1,200 @@
+import heapq
+
+from comfy_execution.prompt_workers import (
+    PromptScheduler,
+    WorkerServer,
+    create_workers,
+    default_worker_devices,
+    node_signature,
+)
+
+
+class FakeServer:
+    def __init__(self):
+        self.client_id = None
+        self.last_node_id = None
+        self.last_prompt_id = None
+        self.sockets_metadata = {"a": {}}
+
+
+def make_prompt(ckpt_name, seed=0):
+    return {
+        "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": ckpt_name}},
+        "2": {"class_type": "KSampler", "inputs": {"model": ["1", 0], "seed": seed}},
+    }
+
+
+def make_queue(*prompts):
+    queue = []
+    for number, (prompt_id, prompt, extra_data) in enumerate(prompts):
+        heapq.heappush(queue, (number, prompt_id, prompt, extra_data, ["2"]))
+    return queue
+
+
+def make_scheduler(devices, **kwargs):
+    workers = create_workers(FakeServer(), devices)
+    return PromptScheduler(workers, **kwargs), workers
+
+
+def test_queue_order_without_warmth():
+    scheduler, workers = make_scheduler(["cpu", "cpu"])
+    queue = make_queue(("a", make_prompt("x"), {}), ("b", make_prompt("y"), {}))
+
+    assert scheduler.select(queue, workers[0])[1] == "a"
+    assert scheduler.select(queue, workers[1])[1] == "b"
+    assert scheduler.select(queue, workers[0]) is None
+
+
+def test_select_marks_worker_running():
+    scheduler, workers = make_scheduler(["cpu"])
+    queue = make_queue(("a", make_prompt("x"), {}))
+
+    scheduler.select(queue, workers[0])
+    assert workers[0].running
+    assert workers[0].status() == {"worker": 0, "device": "cpu", "state": "running", "prompt_id": "a", "prompts_executed": 0}
+
+    workers[0].finish_prompt()
+    assert not workers[0].running
+    assert workers[0].status()["prompts_executed"] == 1
+
+
+def test_device_affinity():
+    scheduler, workers = make_scheduler(["cuda:0", "cuda:1"])
+    queue = make_queue(("a", make_prompt("x"), {"device": "cuda:1"}), ("b", make_prompt("y"), {}))
+
+    # The first prompt is pinned to the other worker's device
+    assert scheduler.select(queue, workers[0])[1] == "b"
+    assert scheduler.select(queue, workers[0]) is None
+    assert scheduler.select(queue, workers[1])[1] == "a"
+
+
+def test_unknown_device_runs_anywhere():
+    scheduler, workers = make_scheduler(["cuda:0"])
+    queue = make_queue(("a", make_prompt("x"), {"device": "cuda:7"}))
+
+    assert scheduler.select(queue, workers[0])[1] == "a"
+
+
+def test_warm_worker_takes_matching_prompt():
+    scheduler, workers = make_scheduler(["cpu", "cpu"])
+    queue = make_queue(("a", make_prompt("sdxl"), {}), ("b", make_prompt("flux"), {}))
+    scheduler.select(queue, workers[0])
+    workers[0].finish_prompt()
+    scheduler.select(queue, workers[1])
+    workers[1].finish_prompt()
+
+    queue = make_queue(("c", make_prompt("sdxl", seed=1), {}), ("d", make_prompt("flux", seed=1), {}))
+    # Worker 1 ran flux last, so it skips the sdxl prompt at the head of the queue
+    assert scheduler.select(queue, workers[1])[1] == "d"
+    assert scheduler.select(queue, workers[0])[1] == "c"
+
+
+def test_cold_worker_leaves_prompt_to_idle_warm_worker():
+    scheduler, workers = make_scheduler(["cpu", "cpu"])
+    queue = make_queue(("a", make_prompt("sdxl"), {}))
+    scheduler.select(queue, workers[0])
+    workers[0].finish_prompt()
+
+    queue = make_queue(("b", make_prompt("sdxl", seed=1), {}), ("c", make_prompt("flux", seed=99), {}))
+    assert scheduler.select(queue, workers[1])[1] == "c"
+    assert scheduler.select(queue, workers[0])[1] == "b"
+
+
+def test_cold_worker_waits_for_idle_warm_worker():
+    scheduler, workers = make_scheduler(["cpu", "cpu"], max_skips=2)
+    queue = make_queue(("a", make_prompt("sdxl"), {}))
+    scheduler.select(queue, workers[0])
+    workers[0].finish_prompt()
+
+    queue = make_queue(("b", make_prompt("sdxl", seed=1), {}))
+    # The only prompt is left to worker 0, which is idle and ran sdxl last
+    assert scheduler.select(queue, workers[1]) is None
+    assert scheduler.select(queue, workers[0])[1] == "b"
+    workers[0].finish_prompt()
+
+    # Unless the warm worker doesn't come for it
+    queue = make_queue(("c", make_prompt("sdxl", seed=2), {}))
+    assert scheduler.select(queue, workers[1]) is None
+    assert scheduler.select(queue, workers[1]) is None
+    assert scheduler.select(queue, workers[1])[1] == "c"
+
+
+def test_skipped_prompt_is_not_starved():
+    scheduler, workers = make_scheduler(["cpu"], max_skips=2)
+    queue = make_queue(("warm", make_prompt("sdxl"), {}))
+    scheduler.select(queue, workers[0])
+    workers[0].finish_prompt()
+
+    queue = make_queue(("cold", make_prompt("flux", seed=99), {}), *[("warm{}".format(i), make_prompt("sdxl", seed=i), {}) for i in range(5)])
+    taken = []
+    for _ in range(3):
+        taken.append(scheduler.select(queue, workers[0])[1])
+        workers[0].finish_prompt()
+    assert taken == ["warm0", "warm1", "cold"]
+
+
+def test_lookahead_limits_search():
+    scheduler, workers = make_scheduler(["cpu"], lookahead=1)
+    queue = make_queue(("warm", make_prompt("sdxl"), {}))
+    scheduler.select(queue, workers[0])
+    workers[0].finish_prompt()
+
+    queue = make_queue(("cold", make_prompt("flux"), {}), ("warm2", make_prompt("sdxl", seed=1), {}))
+    assert scheduler.select(queue, workers[0])[1] == "cold"
+
+
+def test_forget_caches_clears_warmth():
+    scheduler, workers = make_scheduler(["cpu"])
+    queue = make_queue(("a", make_prompt("sdxl"), {}))
+    scheduler.select(queue, workers[0])
+    workers[0].finish_prompt()
+    signatures = frozenset([node_signature("CheckpointLoaderSimple", {"ckpt_name": "sdxl"})])
+    assert workers[0].warmth(signatures) == 1
+
+    workers[0].forget_caches()
+    assert workers[0].warmth(signatures) == 0
+
+
+def test_node_signature_ignores_links():
+    assert node_signature("KSampler", {"model": ["1", 0], "seed": 3}) == node_signature("KSampler", {"model": ["5", 0], "seed": 3})
+    assert node_signature("KSampler", {"seed": 3}) != node_signature("KSampler", {"seed": 4})
+
+
+def test_flags_are_delivered_to_every_worker():
+    scheduler, workers = make_scheduler(["cuda:0", "cuda:1"])
+    scheduler.set_flag("free_memory", True)
+
+    assert scheduler.take_flags(workers[0]) == {"free_memory": True}
+    assert scheduler.take_flags(workers[1]) == {"free_memory": True}
+    assert scheduler.take_flags(workers[0]) == {}
+
+
+def test_unloading_waits_for_workers_sharing_the_device():
+    scheduler, workers = make_scheduler(["cuda:0", "cuda:0"])
+    queue = make_queue(("a", make_prompt("x"), {}))
+    scheduler.select(queue, workers[1])
+    scheduler.set_flag("unload_models", True)
+
+    assert scheduler.take_flags(workers[0]) == {"unload_models": False}
+    workers[1].finish_prompt()
+    assert scheduler.take_flags(workers[0]) == {"unload_models": True}
+
+
+def test_worker_server_keeps_execution_state_per_worker():
+    server = FakeServer()
+    first = WorkerServer(server)
+    second = WorkerServer(server)
+
+    first.client_id = "a"
+    second.client_id = "b"
+    assert first.client_id == "a"
+    assert second.client_id == "b"
+    # Mirrored for code reading the server directly
+    assert server.client_id == "b"
+    # Everything else is the server's
+    assert first.sockets_metadata is server.sockets_metadata
+
+
+def test_default_worker_devices():
+    assert default_worker_devices(3, []) == ["cpu", "cpu", "cpu"]
+    assert default_worker_devices(3, ["cuda:0", "cuda:1"]) == ["cuda:0", "cuda:1", "cuda:0"]
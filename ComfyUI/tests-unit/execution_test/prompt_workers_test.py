@@ -0,0 +1,189 @@
+"""Several prompt workers executing prompts in parallel on the CPU."""
+import threading
+import time
+
+import pytest
+
+import comfy.model_management
+import execution
+from comfy_execution.progress import use_worker_progress_state
+from comfy_execution.prompt_workers import create_workers, current_worker
+
+from .conftest import Concurrency, FakeServer
+
+concurrency = Concurrency()
+
+
+class WorkerSleepNode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {"required": {"value": ("INT", {"default": 0}), "seconds": ("FLOAT", {"default": 0.0})}}
+
+    RETURN_TYPES = ("INT",)
+    FUNCTION = "run"
+    OUTPUT_NODE = True
+    CATEGORY = "_for_testing"
+
+    def run(self, value, seconds):
+        with concurrency:
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                comfy.model_management.throw_exception_if_processing_interrupted()
+                time.sleep(0.01)
+        device = str(comfy.model_management.get_torch_device())
+        return {"ui": {"value": [value], "device": [device]}, "result": (value,)}
+
+
+def run_worker(q, worker, stop):
+    # What main.prompt_worker sets up for each worker
+    comfy.model_management.set_thread_device(worker.device)
+    worker.interrupt_flag = comfy.model_management.use_thread_interrupt_flag()
+    use_worker_progress_state()
+    current_worker.set(worker)
+    e = execution.PromptExecutor(worker.server, cache_type=execution.CacheType.CLASSIC)
+    while not stop.is_set():
+        queue_item = q.get(timeout=0.05, worker=worker)
+        if queue_item is None:
+            continue
+        item, item_id = queue_item
+        worker.server.last_prompt_id = item[1]
+        e.execute(item[2], item[1], item[3], item[4])
+        q.task_done(item_id,
+                    e.history_result,
+                    status=execution.PromptQueue.ExecutionStatus(
+                        status_str='success' if e.success else 'error',
+                        completed=e.success,
+                        messages=e.status_messages),
+                    worker=worker)
+
+
+@pytest.fixture
+def pool(monkeypatch, register_nodes):
+    register_nodes({"WorkerSleepNode": WorkerSleepNode})
+    # Interrupt flags of this test's workers must not outlive it
+    monkeypatch.setattr(comfy.model_management, "worker_interrupt_flags", [])
+    concurrency.max_running = 0
+
+    server = FakeServer()
+    q = execution.PromptQueue(server)
+    server.prompt_queue = q
+    workers = create_workers(server, ["cpu", "cpu"])
+    q.set_workers(workers)
+    stop = threading.Event()
+    threads = [threading.Thread(target=run_worker, args=(q, worker, stop), daemon=True) for worker in workers]
+    for thread in threads:
+        thread.start()
+    yield server, q, workers
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=5)
+
+
+def queue_prompt(q, number, prompt_id, value, seconds, client_id=None):
+    prompt = {"1": {"class_type": "WorkerSleepNode", "inputs": {"value": value, "seconds": seconds}}}
+    extra_data = {} if client_id is None else {"client_id": client_id}
+    q.put((number, prompt_id, prompt, extra_data, ["1"]))
+
+
+def wait_for_history(q, count, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        history = q.get_history()
+        if len(history) >= count:
+            return history
+        time.sleep(0.02)
+    raise AssertionError("Prompts did not finish in time: {}".format(list(q.get_history())))
+
+
+def test_prompts_run_in_parallel(pool):
+    server, q, workers = pool
+    for i in range(4):
+        queue_prompt(q, i, "p{}".format(i), i, 0.3)
+
+    history = wait_for_history(q, 4)
+    assert concurrency.max_running == 2
+    for i in range(4):
+        entry = history["p{}".format(i)]
+        assert entry["status"]["status_str"] == "success"
+        assert entry["outputs"]["1"]["value"] == [i]
+        assert entry["outputs"]["1"]["device"] == ["cpu"]
+    assert sum(worker.prompts_executed for worker in workers) == 4
+
+
+def test_messages_reach_each_prompts_client(pool):
+    server, q, workers = pool
+    queue_prompt(q, 0, "a", 1, 0.2, client_id="client-a")
+    queue_prompt(q, 1, "b", 2, 0.2, client_id="client-b")
+
+    wait_for_history(q, 2)
+    clients = {"a": "client-a", "b": "client-b"}
+    routed = [(data["prompt_id"], sid) for event, data, sid in server.messages if isinstance(data, dict) and event in ("execution_start", "executing", "executed", "execution_success")]
+    assert len(routed) > 0
+    for prompt_id, sid in routed:
+        assert sid == clients[prompt_id]
+
+
+def test_status_reports_each_worker(pool):
+    server, q, workers = pool
+    queue_prompt(q, 0, "a", 1, 0.2)
+    queue_prompt(q, 1, "b", 2, 0.2)
+
+    wait_for_history(q, 2)
+    running = set()
+    for status in server.statuses:
+        for worker in status:
+            if worker["state"] == "running":
+                running.add((worker["worker"], worker["prompt_id"]))
+    assert set(prompt_id for _, prompt_id in running) == {"a", "b"}
+    assert len(set(index for index, _ in running)) == 2
+    assert [worker["state"] for worker in q.get_worker_status()] == ["idle", "idle"]
+
+
+def wait_for_running(count, timeout=10):
+    deadline = time.monotonic() + timeout
+    while concurrency.running < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def was_interrupted(entry):
+    return any(event == "execution_interrupted" for event, _ in entry["status"]["messages"])
+
+
+@pytest.mark.parametrize("target", [{"prompt_id": "a"}, {"client_id": "client-a"}])
+def test_interrupt_stops_only_its_prompt(pool, target):
+    server, q, workers = pool
+    queue_prompt(q, 0, "a", 1, 10.0, client_id="client-a")
+    queue_prompt(q, 1, "b", 2, 1.0, client_id="client-b")
+
+    wait_for_running(2)
+    assert q.interrupt(**target) == 1
+
+    history = wait_for_history(q, 2)
+    assert history["a"]["status"]["status_str"] == "error"
+    assert was_interrupted(history["a"])
+    assert history["b"]["status"]["status_str"] == "success"
+
+
+def test_interrupt_of_a_finished_prompt_does_nothing(pool):
+    server, q, workers = pool
+    queue_prompt(q, 0, "a", 1, 1.0)
+
+    wait_for_running(1)
+    assert q.interrupt(prompt_id="other") == 0
+
+    history = wait_for_history(q, 1)
+    assert history["a"]["status"]["status_str"] == "success"
+
+
+def test_interrupt_without_target_stops_every_worker(pool):
+    server, q, workers = pool
+    queue_prompt(q, 0, "a", 1, 10.0)
+    queue_prompt(q, 1, "b", 2, 10.0)
+
+    wait_for_running(2)
+    assert q.interrupt() == 2
+
+    history = wait_for_history(q, 2)
+    for prompt_id in ("a", "b"):
+        assert history[prompt_id]["status"]["status_str"] == "error"
+        assert was_interrupted(history[prompt_id])
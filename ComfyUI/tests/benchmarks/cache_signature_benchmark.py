@@ -0,0 +1,134 @@
+"""
+Benchmark of the cache key pre-pass (CacheKeySetInputSignature.add_keys) on
+large generated graphs, against the previous signatures that walked each
+node's whole ancestry.
+
+Run from the ComfyUI directory:
+    python tests/benchmarks/cache_signature_benchmark.py --nodes 1000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+import nodes  # noqa: E402
+from comfy_execution.caching import CacheKeySetInputSignature, include_unique_id_in_input, to_hashable  # noqa: E402
+from comfy_execution.graph import DynamicPrompt  # noqa: E402
+from comfy_execution.graph_utils import is_link  # noqa: E402
+
+
+class BenchmarkNode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {"required": {"seed": ("INT", {}), "text": ("STRING", {})}}
+
+    RETURN_TYPES = ("LATENT",)
+    FUNCTION = "run"
+    CATEGORY = "_for_testing"
+
+
+class LegacyCacheKeySetInputSignature(CacheKeySetInputSignature):
+    """The signatures before they were digested incrementally: every node's ancestry, as to_hashable frozensets."""
+
+    async def get_node_signature(self, dynprompt, node_id):
+        signature = []
+        ancestors, order_mapping = self.get_legacy_ancestry(dynprompt, node_id)
+        signature.append(await self.get_legacy_immediate_signature(dynprompt, node_id, order_mapping))
+        for ancestor_id in ancestors:
+            signature.append(await self.get_legacy_immediate_signature(dynprompt, ancestor_id, order_mapping))
+        return to_hashable(signature)
+
+    async def get_legacy_immediate_signature(self, dynprompt, node_id, ancestor_order_mapping):
+        node = dynprompt.get_node(node_id)
+        class_type = node["class_type"]
+        class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
+        signature = [class_type, await self.is_changed_cache.get(node_id)]
+        if (hasattr(class_def, "NOT_IDEMPOTENT") and class_def.NOT_IDEMPOTENT) or include_unique_id_in_input(class_type):
+            signature.append(node_id)
+        inputs = node["inputs"]
+        for key in sorted(inputs.keys()):
+            if is_link(inputs[key]):
+                (ancestor_id, ancestor_socket) = inputs[key]
+                signature.append((key, ("ANCESTOR", ancestor_order_mapping[ancestor_id], ancestor_socket)))
+            else:
+                signature.append((key, inputs[key]))
+        return signature
+
+    def get_legacy_ancestry(self, dynprompt, node_id):
+        ancestors = []
+        order_mapping = {}
+        stack = [node_id]
+        while len(stack) > 0:
+            inputs = dynprompt.get_node(stack.pop())["inputs"]
+            for key in sorted(inputs.keys(), reverse=True):
+                if is_link(inputs[key]) and inputs[key][0] not in order_mapping:
+                    ancestors.append(inputs[key][0])
+                    order_mapping[inputs[key][0]] = len(ancestors) - 1
+                    stack.append(inputs[key][0])
+        return ancestors, order_mapping
+
+
+class NotChanged:
+    async def get(self, node_id):
+        return False
+
+
+def make_graph(shape, count, rng):
+    prompt = {}
+    for i in range(count):
+        inputs = {"seed": i, "text": "a photo of a cat, highly detailed, {}".format(i)}
+        if i > 0:
+            if shape == "chain":
+                parents = [i - 1]
+            elif shape == "ladder":
+                parents = [i - 1, max(0, i - 2)]
+            else:
+                parents = rng.sample(range(i), min(i, 3))
+            for n, parent in enumerate(parents):
+                inputs["input_{}".format(n)] = [str(parent), 0]
+        prompt[str(i)] = {"class_type": "BenchmarkNode", "inputs": inputs}
+    return prompt
+
+
+def copy_prompt(prompt):
+    return {node_id: {"class_type": node["class_type"], "inputs": dict(node["inputs"])} for node_id, node in prompt.items()}
+
+
+def time_add_keys(key_class, prompt):
+    key_set = key_class(DynamicPrompt(prompt), prompt.keys(), NotChanged())
+    start = time.perf_counter()
+    asyncio.run(key_set.add_keys(prompt.keys()))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3, help="Best of this many runs of the new signatures is reported")
+    parser.add_argument("--skip-legacy", action="store_true", help="Skip the previous signatures, which take tens of seconds at 1000 nodes")
+    args = parser.parse_args()
+
+    nodes.NODE_CLASS_MAPPINGS["BenchmarkNode"] = BenchmarkNode
+    rng = random.Random(0)
+    print("{:8} {:>12} {:>12} {:>12}".format("graph", "legacy ms", "cold ms", "warm ms"))  # noqa: T201
+    for shape in ("chain", "ladder", "random"):
+        prompt = make_graph(shape, args.nodes, rng)
+        legacy = float("nan")
+        if not args.skip_legacy:
+            legacy = time_add_keys(LegacyCacheKeySetInputSignature, copy_prompt(prompt))
+        cold = []
+        warm = []
+        for _ in range(args.repeat):
+            CacheKeySetInputSignature.signature_memo.clear()
+            cold.append(time_add_keys(CacheKeySetInputSignature, copy_prompt(prompt)))
+            # The same workflow queued again: a new prompt, unchanged nodes
+            warm.append(time_add_keys(CacheKeySetInputSignature, copy_prompt(prompt)))
+        print("{:8} {:12.1f} {:12.1f} {:12.1f}".format(shape, legacy * 1000, min(cold) * 1000, min(warm) * 1000))  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()